@@ -0,0 +1,61 @@
+# casa_comida_web/admision.py
+"""
+Control de admisión en memoria, por proceso: un cupo de peticiones simultáneas por clase de endpoint y una
+cubeta de tokens por cliente. Nada espera: si no hay lugar, la petición se rechaza enseguida en lugar de
+hacer fila ocupando un hilo del worker.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LimiteConcurrencia:
+    """Cupo de 'limite' peticiones a la vez. entrar() no bloquea: retorna False si el cupo está lleno."""
+
+    def __init__(self, limite):
+        self.limite = limite
+        self.en_curso = 0
+        self._lock = threading.Lock()
+
+    def entrar(self):
+        with self._lock:
+            if self.en_curso >= self.limite:
+                return False
+            self.en_curso += 1
+            return True
+
+    def salir(self):
+        with self._lock:
+            self.en_curso -= 1
+
+
+class CubetasTokens:
+    """
+    Una cubeta de tokens por clave: se llena a 'tasa' tokens por segundo hasta 'capacidad' (la ráfaga admitida)
+    y cada petición gasta uno. Se recuerdan las max_claves claves usadas más recientemente; una clave olvidada
+    vuelve con la cubeta llena, que es lo mismo que le habría pasado tras un rato sin pedir.
+    """
+
+    def __init__(self, tasa, capacidad, max_claves=10000):
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self.max_claves = max_claves
+        self._cubetas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def tomar(self, clave, ahora=None):
+        """Gasta un token de la clave. Retorna 0 si lo había o, si no, los segundos que faltan para el próximo."""
+        ahora = time.monotonic() if ahora is None else ahora
+        with self._lock:
+            tokens, instante = self._cubetas.pop(clave, (self.capacidad, ahora))
+            tokens = min(self.capacidad, tokens + (ahora - instante) * self.tasa)
+            if tokens >= 1:
+                tokens -= 1
+                espera = 0.0
+            else:
+                espera = (1 - tokens) / self.tasa
+            self._cubetas[clave] = (tokens, ahora)
+            if len(self._cubetas) > self.max_claves:
+                self._cubetas.popitem(last=False)
+            return espera
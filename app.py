@@ -1,25 +1,74 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, current_app
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, current_app, Response, get_template_attribute, has_request_context, g, send_file, abort
 import sqlite3
 from datetime import datetime, timedelta
 import math
+import calendar
+import hmac
 import requests
 import json
 import os
+import re
+import shutil
 import sys
+import time
+import click
+from urllib.parse import urlparse
+from urllib.request import pathname2url
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 # Importar Flask-Login y Werkzeug para autenticación
 from flask_login import LoginManager, UserMixin, login_user, logout_user, current_user, login_required
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.security import generate_password_hash, check_password_hash
 
 # Importar configuración
 from config import (
-    GOOGLE_MAPS_API_KEY, MAX_PEDIDOS_POR_FRANJA_HORARIA,
+    GOOGLE_MAPS_API_KEY, GOOGLE_MAPS_URL_BASE, MAX_PEDIDOS_POR_FRANJA_HORARIA,
     RADIO_ENVIO_CUADRAS, CUADRA_METROS, DB_NAME,
     SUCURSAL_LAT, SUCURSAL_LON, HORA_APERTURA, HORA_CIERRE, INTERVALO_FRANJAS_MINUTOS,
-    DEFAULT_COMPANY_FOR_ORDERS
+    DEFAULT_COMPANY_FOR_ORDERS, ARQUEO_MAX_MOVIMIENTOS_DETALLE,
+    PEDIDOS_POR_PAGINA, CONTEO_PEDIDOS_CACHE_SEGUNDOS, CONTEO_PEDIDOS_CACHE_MAX,
+    SSE_INTERVALO_LATIDO_SEGUNDOS, SSE_DURACION_MAXIMA_SEGUNDOS, SSE_SONDEO_SEGUNDOS,
+    TICKETS_CACHE_MAX, TICKET_ANCHO_COLUMNAS, IMPRESORA_COCINA_HOST, IMPRESORA_COCINA_PUERTO,
+    IMPRESION_LOTE_PROCESOS, IMPRESION_LOTE_TAMANO, IMPRESION_TRABAJOS_DIRECTORIO, IMPRESION_TRABAJOS_CONSERVAR_SEGUNDOS,
+    IMPRESION_TRABAJOS_VENCIMIENTO_SEGUNDOS, SQLITE_SENTENCIAS_CACHEADAS,
+    SQL_TRAZAS_ACTIVAS, SQL_CONSULTA_LENTA_MS, SQL_REPETICIONES_N_MAS_1, METRICAS_DIRECTORIO, LOG_NIVEL, LOG_NIVELES_POR_MODULO, LOG_MUESTREO,
+    PERFILADO_TASA_MUESTREO, PERFILADO_ENDPOINTS, PERFILADO_CABECERA, PERFILADO_TOKEN_VALIDEZ_SEGUNDOS,
+    PERFILADO_DIRECTORIO, PERFILADO_MAX_ARCHIVOS, ARCHIVO_DB_NAME, ARCHIVO_DIAS_ANTIGUEDAD, ARCHIVO_LOTE_PEDIDOS,
+    BASE_POR_EMPRESA, BASES_EMPRESAS_DIRECTORIO, BASES_EMPRESAS_HILOS, REPORTES_SNAPSHOT, REPORTES_SNAPSHOT_INTERVALO_SEGUNDOS,
+    REPORTES_SNAPSHOT_MAX_ANTIGUEDAD_SEGUNDOS, REPORTES_SNAPSHOT_PAGINAS_POR_PASO, REPORTES_SNAPSHOT_PAUSA_SEGUNDOS,
+    COPIA_MAX_REINICIOS,
+    PEDIDOS_ESCRITOR_UNICO, PEDIDOS_GRUPO_MAX, PEDIDOS_GRUPO_ESPERA_SEGUNDOS, PEDIDOS_ESPERA_MAXIMA_SEGUNDOS,
+    MANTENIMIENTO_AUTOMATICO, BACKUP_DIRECTORIO, BACKUP_INTERVALO_HORAS, BACKUP_CONSERVAR, BACKUP_PAGINAS_POR_PASO,
+    BACKUP_PAUSA_SEGUNDOS, BACKUP_LIMITE_SEGUNDOS, MANTENIMIENTO_MARGEN_MINUTOS, MANTENIMIENTO_ANALISIS_LIMITE, MANTENIMIENTO_VACUUM_PAGINAS_POR_PASO,
+    EVENTOS_PEDIDO_LOTE_LECTURA, EVENTOS_PEDIDO_RETENCION_DIAS, COLA_TRABAJOS, TRABAJOS_HILOS, TRABAJOS_ESPERA_SEGUNDOS,
+    TRABAJOS_ARRIENDO_SEGUNDOS, TRABAJOS_MAX_INTENTOS, TRABAJOS_REINTENTO_BASE_SEGUNDOS, TRABAJOS_REINTENTO_MAX_SEGUNDOS,
+    ADMISION_ACTIVA, ADMISION_CLASES, ADMISION_ENDPOINTS, ADMISION_REINTENTAR_SEGUNDOS, ADMISION_MAX_CLIENTES,
+    ADMISION_PROXIES, METRICAS_TOKEN, METRICAS_IPS_PERMITIDAS, METRICAS_COLA_CACHE_SEGUNDOS
 )
+from eventos import DifusorEventos
+from escpos import ticket_de_pedido, enviar_a_impresora
+import impresion_lote
+from escritura_agrupada import EscritorAgrupado, EscrituraDemorada
+from por_proceso import PorProceso
+import admision
+import models
+from consultas import repositorio, TODAS_LAS_EMPRESAS, lista_json
+import trazas_sql
+import metricas as metricas_mod
+import perfilado
+import bitacora
+from models import Plato
+
+# Logging JSON escrito desde un hilo aparte; antes de crear la app para que Flask no agregue su handler a stderr
+bitacora.configurar(LOG_NIVEL, LOG_NIVELES_POR_MODULO, LOG_MUESTREO)
 
 app = Flask(__name__)
+# Avisos de Google Maps (uno por llamada sin API key): muestreados con LOG_MUESTREO
+log_google_maps = app.logger.getChild('google_maps')
 app.secret_key = 'super_secreto_de_casa_comida_web_202024' # CAMBIA ESTO POR UNA CLAVE MÁS SEGURA EN PRODUCCIÓN
 
 # Inicializar Flask-Login
@@ -29,21 +78,669 @@ login_manager.login_view = 'login' # Define la vista a la que redirigir si se re
 login_manager.login_message = "Por favor, inicie sesión para acceder a esta página."
 login_manager.login_message_category = "warning"
 
+# Avisos a los tableros conectados por SSE en este proceso (los eventos se leen del registro pedido_eventos)
+difusor_eventos = DifusorEventos()
+
+# Métricas de Prometheus, sumadas entre los workers (ver metricas.py)
+metricas = metricas_mod.RegistroMetricas(METRICAS_DIRECTORIO)
+latencia_peticiones = metricas.histograma('casasdecomida_peticion_duracion_segundos',
+                                          "Latencia de las peticiones por endpoint.", ('endpoint', 'metodo', 'codigo'))
+pedidos_creados = metricas.contador('casasdecomida_pedidos_creados', "Pedidos creados.", ('tipo',))
+geocodificaciones = metricas.contador('casasdecomida_geocodificaciones',
+                                      "Llamadas a la API de Geocoding de Google por resultado.", ('resultado',))
+consultas_cache = metricas.contador('casasdecomida_cache_consultas',
+                                    "Consultas a las cachés en memoria (aciertos y fallos).", ('cache', 'resultado'))
+espera_bloqueo_db = metricas.histograma('casasdecomida_db_espera_bloqueo_segundos',
+                                        "Espera para obtener el bloqueo de escritura de SQLite (BEGIN IMMEDIATE).", ('endpoint',))
+bloqueos_db = metricas.contador('casasdecomida_db_bloqueos',
+                                "Transacciones de escritura que fallaron con 'database is locked'.", ('endpoint',))
+pedidos_por_commit = metricas.histograma('casasdecomida_pedidos_por_commit',
+                                         "Pedidos confirmados en cada commit del escritor único de pedidos.",
+                                         buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+trabajos_espera = metricas.histograma('casasdecomida_trabajos_espera_segundos',
+                                      "Desde que se encola un trabajo hasta que un trabajador lo toma por primera vez.", ('tarea',))
+peticiones_rechazadas = metricas.contador('casasdecomida_peticiones_rechazadas',
+                                        "Peticiones públicas rechazadas por el control de admisión.", ('clase', 'motivo'))
+trabajos_duracion = metricas.histograma('casasdecomida_trabajos_duracion_segundos',
+                                        "Duración de cada intento de un trabajo de la cola, por resultado.", ('tarea', 'resultado'))
+copias_en_un_paso = metricas.contador('casasdecomida_copias_en_un_paso',
+                                      "Copias en línea que se terminaron en un solo paso tras COPIA_MAX_REINICIOS reinicios.")
+
 # --- Constante para el costo de envío por defecto si no está en DB ---
 DEFAULT_ENVIO_COSTO = 500.00
 # --- Costo por envío al repartidor (valor por defecto, también configurable en DB) ---
 DEFAULT_PAGO_REPARTIDOR_POR_ENVIO = 300.00
 
 # --- Funciones de Base de Datos ---
+# --- Fechas como epoch ---
+# Las fechas se guardan como TEXT 'AAAA-MM-DD HH:MM:SS'. Cada una tiene además una columna generada
+# <columna>_epoch (segundos desde 1970, tomando la hora local como UTC) con índice: los filtros por
+# rango comparan enteros, y al leerla el conversor EPOCH la entrega directamente como datetime.
+_COLUMNAS_FECHA_EPOCH = (
+    ('pedidos', 'horario_entrega'),
+    ('pedidos', 'fecha_creacion'),
+    ('pedidos', 'fecha_pago'),
+    ('ingresos_egresos', 'fecha_hora'),
+)
+
+def _a_epoch(fecha_hora):
+    """datetime (naive) -> entero comparable con las columnas *_epoch."""
+    return calendar.timegm(fecha_hora.timetuple())
+
+def _desde_epoch(valor):
+    return datetime(1970, 1, 1) + timedelta(seconds=int(valor))
+
+sqlite3.register_converter('EPOCH', _desde_epoch)
+
+# Una conexión por hilo (y por proceso), reutilizada entre peticiones: la caché de sentencias
+# preparadas de sqlite3 es por conexión, y con las consultas fijas de consultas.py cada sentencia
+# se compila una sola vez. close() no cierra la conexión, sólo la libera.
+_conexion_hilo = threading.local()
+
+class _ConexionReutilizable(sqlite3.Connection):
+    """
+    Las funciones anidadas que abren y cierran su propia "conexión" comparten la del hilo;
+    close() descarta la transacción pendiente recién cuando se libera el último uso.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.usos = 0
+
+    def cursor(self, factory=trazas_sql.CursorMedido):
+        return super().cursor(factory)
+
+    def close(self):
+        self.usos = max(self.usos - 1, 0)
+        if self.usos == 0 and self.in_transaction:
+            self.rollback()
+
+    def liberar(self):
+        """Fin de la petición: descarta lo no confirmado aunque algún camino no haya llamado a close()."""
+        self.usos = 0
+        if self.in_transaction:
+            self.rollback()
+
 def conectar_db():
-    conn = sqlite3.connect(DB_NAME)
+    """
+    Conexión del hilo a la base de datos; con BASE_POR_EMPRESA, a la base de la empresa que elige el router.
+    Dentro de lectura_de_reportes(), a su snapshot de reportes si hay uno vigente.
+    """
+    id_empresa = _empresa_de_la_conexion() if BASE_POR_EMPRESA else None
+    lectura = getattr(_conexion_hilo, 'lectura_reportes', None)
+    if lectura is not None:
+        conn = _conexion_snapshot(id_empresa, lectura)
+        if conn is not None:
+            return conn
+    return _conexion_del_hilo(id_empresa)
+
+def _conexiones_del_hilo():
+    conexiones = getattr(_conexion_hilo, 'conexiones', None)
+    if conexiones is None or _conexion_hilo.pid != os.getpid():
+        conexiones = _conexion_hilo.conexiones = {}
+        _conexion_hilo.pid = os.getpid()
+    return conexiones
+
+def _rutas_base(id_empresa):
+    """(ruta, ruta del archivo histórico) de la base general (id_empresa None) o de la base de la empresa."""
+    if id_empresa is None:
+        return DB_NAME, ARCHIVO_DB_NAME
+    return _preparar_base_empresa(id_empresa)
+
+def _abrir_conexion(ruta, ruta_archivo, id_empresa, solo_lectura=False):
+    if solo_lectura:
+        conn = sqlite3.connect(_uri_solo_lectura(ruta), uri=True, detect_types=sqlite3.PARSE_DECLTYPES,
+                               factory=_ConexionReutilizable, cached_statements=SQLITE_SENTENCIAS_CACHEADAS)
+        ruta_archivo = _uri_solo_lectura(ruta_archivo)
+    else:
+        conn = sqlite3.connect(ruta, detect_types=sqlite3.PARSE_DECLTYPES, factory=_ConexionReutilizable,
+                               cached_statements=SQLITE_SENTENCIAS_CACHEADAS)
     conn.row_factory = sqlite3.Row # Permite acceder a las columnas por nombre
+    if SQL_TRAZAS_ACTIVAS:
+        conn.set_trace_callback(trazas_sql.trazar_sentencia)
+    _adjuntar_archivo(conn, ruta_archivo)
+    if id_empresa is not None:
+        # Usuarios, roles, empresas y configuración no existen en la base de la empresa: se resuelven en la general
+        conn.execute("ATTACH DATABASE ? AS general", (DB_NAME,))
+    return conn
+
+def _conexion_del_hilo(id_empresa):
+    conexiones = _conexiones_del_hilo()
+    conn = conexiones.get(id_empresa)
+    if conn is None:
+        conn = conexiones[id_empresa] = _abrir_conexion(*_rutas_base(id_empresa), id_empresa)
+    return _usar_conexion(conn)
+
+def _usar_conexion(conn):
+    conn.usos += 1
     return conn
 
-def crear_tablas():
-    """Crea las tablas de la base de datos si no existen y añade columnas si faltan."""
-    conn = sqlite3.connect(DB_NAME)
+@app.teardown_request
+def _liberar_conexion_db(exc=None):
+    for conn in getattr(_conexion_hilo, 'conexiones', {}).values():
+        conn.liberar()
+
+
+# --- Una base por empresa (BASE_POR_EMPRESA) ---
+# La base general (DB_NAME) guarda usuarios, roles, empresas y configuración; cada empresa tiene su base con
+# carta, repartidores, pedidos y caja, y la general adjunta como 'general'. El router elige la base por la
+# empresa del usuario logueado o, sin usuario (clientes, comandos), la de DEFAULT_COMPANY_FOR_ORDERS.
+
+_bases_empresa_preparadas = set()
+_bases_empresa_lock = threading.Lock()
+# Los hilos no sobreviven a un fork (workers de gunicorn con --preload): un pool por proceso
+_pool_bases_empresa = PorProceso(lambda: ThreadPoolExecutor(BASES_EMPRESAS_HILOS, thread_name_prefix='bases-empresa'))
+
+def _ruta_base_empresa(id_empresa):
+    return os.path.join(BASES_EMPRESAS_DIRECTORIO, f"empresa_{int(id_empresa)}.db")
+
+def _preparar_base_empresa(id_empresa):
+    """Crea (una vez por proceso) las tablas de la base de la empresa. Retorna (ruta, ruta del archivo histórico)."""
+    ruta = _ruta_base_empresa(id_empresa)
+    ruta_archivo = f"{os.path.splitext(ruta)[0]}_archivo.db"
+    with _bases_empresa_lock:
+        if (os.getpid(), ruta) not in _bases_empresa_preparadas:
+            os.makedirs(BASES_EMPRESAS_DIRECTORIO, exist_ok=True)
+            crear_tablas(ruta, ruta_archivo, generales=False)
+            _bases_empresa_preparadas.add((os.getpid(), ruta))
+    return ruta, ruta_archivo
+
+def _empresa_de_la_conexion():
+    """Router: la empresa fijada con base_de_empresa(), la del usuario logueado o la de los pedidos de clientes."""
+    fijada = getattr(_conexion_hilo, 'empresa_fijada', None)
+    if fijada is not None:
+        return fijada
+    if has_request_context():
+        # Cargar el usuario también consulta la base: mientras tanto se usa la base por defecto
+        if '_login_user' not in g and not getattr(_conexion_hilo, 'cargando_usuario', False):
+            _conexion_hilo.cargando_usuario = True
+            try:
+                current_user._get_current_object()
+            finally:
+                _conexion_hilo.cargando_usuario = False
+        id_empresa = getattr(g.get('_login_user'), 'id_empresa', None)
+        if id_empresa:
+            return int(id_empresa)
+    return DEFAULT_COMPANY_FOR_ORDERS
+
+@contextmanager
+def base_de_empresa(id_empresa):
+    """Dentro del bloque, conectar_db() usa la base de id_empresa (comandos y consultas repartidas)."""
+    anterior = getattr(_conexion_hilo, 'empresa_fijada', None)
+    _conexion_hilo.empresa_fijada = id_empresa
+    try:
+        yield
+    finally:
+        _conexion_hilo.empresa_fijada = anterior
+
+def _ids_empresas():
+    conn = conectar_db()
+    cursor = conn.cursor()
+    ids = [row['id_empresa'] for row in repositorio.todos(cursor, 'empresas.listado')]
+    conn.close()
+    return ids
+
+def _en_cada_base_empresa(funcion):
+    """
+    Ejecuta funcion(id_empresa) en la base de cada empresa, en paralelo, y retorna [(id_empresa, resultado)].
+    Sin BASE_POR_EMPRESA no hay nada que repartir: retorna [(None, funcion(None))].
+    """
+    if not BASE_POR_EMPRESA:
+        return [(None, funcion(None))]
+
+    # Una consulta repartida dentro de lectura_de_reportes() también lee los snapshots en los hilos del pool
+    lectura = getattr(_conexion_hilo, 'lectura_reportes', None)
+
+    def en_su_base(id_empresa):
+        _conexion_hilo.lectura_reportes = lectura
+        with base_de_empresa(id_empresa):
+            try:
+                return funcion(id_empresa)
+            finally:
+                _liberar_conexion_db()
+                _conexion_hilo.lectura_reportes = None
+
+    ids = _ids_empresas()
+    return list(zip(ids, _pool_bases_empresa.obtener().map(en_su_base, ids)))
+
+
+# --- Copias en línea y tareas de fondo ---
+# El snapshot de reportes y los backups copian las bases con la API de backup de SQLite: la copia avanza de a unas
+# cuantas páginas y suelta el bloqueo de lectura entre pasos, así los pedidos siguen escribiendo (si la base cambia
+# en medio, el backup vuelve a empezar solo; tras COPIA_MAX_REINICIOS reinicios se copia de una vez).
+
+_hilos_de_fondo = {}
+_hilos_de_fondo_lock = threading.Lock()
+
+def _asegurar_hilo_de_fondo(nombre, objetivo):
+    """Arranca (una vez por proceso) un hilo daemon con objetivo(): los hilos no sobreviven a un fork."""
+    hilo = _hilos_de_fondo.get(nombre)
+    if hilo is None:
+        with _hilos_de_fondo_lock:
+            if nombre not in _hilos_de_fondo:
+                _hilos_de_fondo[nombre] = PorProceso(lambda: _arrancar_hilo_de_fondo(nombre, objetivo))
+            hilo = _hilos_de_fondo[nombre]
+    hilo.obtener()
+
+def _arrancar_hilo_de_fondo(nombre, objetivo):
+    hilo = threading.Thread(target=objetivo, name=nombre, daemon=True)
+    hilo.start()
+    return hilo
+
+def _contador_cambios(ruta):
+    """Contador de cambios del encabezado de SQLite: con journal de rollback aumenta en cada commit. None si no existe."""
+    try:
+        with open(ruta, 'rb') as archivo:
+            archivo.seek(24)
+            return int.from_bytes(archivo.read(4), 'big')
+    except FileNotFoundError:
+        return None
+
+def _tomar_bloqueo_archivo(ruta_bloqueo, vencimiento_segundos):
+    """Crea el archivo de bloqueo si no existe; uno abandonado (más viejo que el vencimiento) se descarta."""
+    for _ in range(2):
+        try:
+            os.close(os.open(ruta_bloqueo, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(ruta_bloqueo) < vencimiento_segundos:
+                    return False
+                os.remove(ruta_bloqueo)
+            except FileNotFoundError:
+                pass
+    return False
+
+class _CopiaReiniciada(Exception):
+    """La base cambió durante la copia por pasos más de COPIA_MAX_REINICIOS veces."""
+
+def _copiar_base(ruta_origen, ruta_destino, paginas, pausa, al_avanzar=None):
+    """
+    Backup en línea de a 'paginas' páginas, con 'pausa' segundos entre pasos (el 'sleep' de backup() sólo se aplica
+    cuando la base está ocupada). Un commit de otra conexión hace volver a empezar la copia; con pedidos entrando
+    seguido eso puede no terminar nunca, así que tras COPIA_MAX_REINICIOS reinicios se copia todo en un solo paso
+    (los pedidos esperan ese rato dentro de su busy_timeout). al_avanzar() se llama tras cada paso y puede cortar la
+    copia lanzando una excepción.
+    """
+    restantes_antes, reinicios = None, 0
+
+    def progreso(estado, restantes, total):
+        nonlocal restantes_antes, reinicios
+        if estado == sqlite3.SQLITE_DONE:
+            return
+        if al_avanzar:
+            al_avanzar()
+        if estado != sqlite3.SQLITE_OK:
+            return  # base ocupada: backup() espera 'sleep' y reintenta el paso sin avanzar
+        if restantes_antes is not None and restantes >= restantes_antes:
+            reinicios += 1
+            if reinicios > COPIA_MAX_REINICIOS:
+                raise _CopiaReiniciada()
+        restantes_antes = restantes
+        time.sleep(pausa)
+
+    origen, destino = sqlite3.connect(ruta_origen), sqlite3.connect(ruta_destino)
+    try:
+        try:
+            origen.backup(destino, pages=paginas, progress=progreso, sleep=pausa)
+        except _CopiaReiniciada:
+            app.logger.warning("La copia de %s se reinició %d veces: se copia en un solo paso.", ruta_origen, reinicios)
+            copias_en_un_paso.inc()
+            if al_avanzar:
+                al_avanzar()
+            origen.backup(destino, pages=-1, sleep=pausa)
+    finally:
+        destino.close()
+        origen.close()
+
+def _copia_consistente(ruta, ruta_archivo, destino, destino_archivo, paginas, pausa, contador_copiado=None, intentos=3,
+                       al_avanzar=None):
+    """
+    Copia la base a 'destino' y su archivo histórico a destino_archivo(contador de cambios del histórico). Archivar
+    pedidos cambia las dos bases en una misma transacción: si el histórico no cambió mientras se copiaba la base, las
+    dos copias corresponden al mismo momento; si cambió, se vuelve a intentar. El histórico no se copia si su contador
+    es contador_copiado (ya hay una copia de ese estado). al_avanzar se pasa a _copiar_base.
+    Retorna (momento de la copia, contador del histórico) o None si el histórico cambió en todos los intentos.
+    """
+    for _ in range(intentos):
+        contador_archivo = _contador_cambios(ruta_archivo)
+        tomado_en = datetime.now().replace(microsecond=0)
+        _copiar_base(ruta, destino, paginas, pausa, al_avanzar)
+        if contador_archivo != contador_copiado:
+            _copiar_base(ruta_archivo, destino_archivo(contador_archivo), paginas, pausa, al_avanzar)
+        if _contador_cambios(ruta_archivo) == contador_archivo:
+            return tomado_en, contador_archivo
+    app.logger.warning("No se pudo copiar %s: el archivo histórico cambió en cada intento.", ruta)
+    return None
+
+
+# --- Snapshot de reportes (REPORTES_SNAPSHOT) ---
+# Los reportes pesados leen una copia de cada base (<base>_reportes.db) refrescada con la API de backup de a
+# REPORTES_SNAPSHOT_PAGINAS_POR_PASO páginas. Se escribe en un archivo temporal que reemplaza al snapshot con
+# os.replace(): las conexiones de sólo lectura abiertas terminan con el anterior y se reabren al notar el cambio.
+# El archivo histórico se copia aparte, sólo cuando cambió, con un nombre por generación (su contador de cambios)
+# que el snapshot registra en su tabla snapshot_reportes.
+
+def _uri_solo_lectura(ruta):
+    return f"file:{pathname2url(os.path.abspath(ruta))}?mode=ro"
+
+def _ruta_snapshot(ruta):
+    return f"{os.path.splitext(ruta)[0]}_reportes.db"
+
+def _datos_snapshot(conn):
+    """(tomado_en, nombre del archivo histórico copiado, contador de cambios del histórico copiado) o None."""
+    try:
+        fila = conn.execute("SELECT tomado_en, archivo, contador_archivo FROM main.snapshot_reportes").fetchone()
+    except sqlite3.Error:
+        return None
+    return (datetime.strptime(fila[0], '%Y-%m-%d %H:%M:%S'), fila[1], fila[2]) if fila else None
+
+def _leer_snapshot(ruta_snapshot):
+    if not os.path.exists(ruta_snapshot):
+        return None
+    conn = sqlite3.connect(_uri_solo_lectura(ruta_snapshot), uri=True)
+    try:
+        return _datos_snapshot(conn)
+    finally:
+        conn.close()
+
+def refrescar_snapshot_reportes(id_empresa=None, forzar=False):
+    """
+    Rehace el snapshot de reportes de la base general (id_empresa None) o de la empresa si tiene al menos
+    REPORTES_SNAPSHOT_INTERVALO_SEGUNDOS, o siempre con forzar. Retorna la fecha del snapshot nuevo, o None si no
+    hizo falta, si otro proceso lo está refrescando o si el archivo histórico cambió durante todos los intentos.
+    """
+    ruta, ruta_archivo = _rutas_base(id_empresa)
+    ruta_snapshot = _ruta_snapshot(ruta)
+    actual = _leer_snapshot(ruta_snapshot)
+    if actual and not forzar and (datetime.now() - actual[0]).total_seconds() < REPORTES_SNAPSHOT_INTERVALO_SEGUNDOS:
+        return None
+    ruta_bloqueo = f"{ruta_snapshot}.lock"
+    if not _tomar_bloqueo_archivo(ruta_bloqueo, REPORTES_SNAPSHOT_MAX_ANTIGUEDAD_SEGUNDOS):
+        return None
+    temporal = f"{ruta_snapshot}.{os.getpid()}.tmp"
+    prefijo = f"{os.path.splitext(os.path.basename(ruta_snapshot))[0]}_archivo_"
+    directorio = os.path.dirname(os.path.abspath(ruta_snapshot))
+    try:
+        copia = _copia_consistente(ruta, ruta_archivo, temporal,
+                                   lambda contador: os.path.join(directorio, f"{prefijo}{contador}.db"),
+                                   REPORTES_SNAPSHOT_PAGINAS_POR_PASO, REPORTES_SNAPSHOT_PAUSA_SEGUNDOS,
+                                   contador_copiado=actual[2] if actual else None)
+        if copia is None:
+            return None
+        tomado_en, contador_archivo = copia
+        nombre_archivo = f"{prefijo}{contador_archivo}.db"
+
+        conn = sqlite3.connect(temporal)
+        with conn:
+            conn.execute("CREATE TABLE snapshot_reportes (tomado_en TEXT NOT NULL, archivo TEXT NOT NULL, contador_archivo INTEGER)")
+            conn.execute("INSERT INTO snapshot_reportes VALUES (?, ?, ?)",
+                         (tomado_en.strftime('%Y-%m-%d %H:%M:%S'), nombre_archivo, contador_archivo))
+        conn.close()
+        os.replace(temporal, ruta_snapshot)
+    finally:
+        for ruta_sobrante in (temporal, f"{temporal}-journal", ruta_bloqueo):
+            if os.path.exists(ruta_sobrante):
+                os.remove(ruta_sobrante)
+
+    # Se conservan el histórico copiado vigente y el anterior (una conexión puede estar abriendo el snapshot viejo)
+    conservar = {nombre_archivo, actual[1] if actual else None}
+    for nombre in os.listdir(directorio):
+        if nombre.startswith(prefijo) and nombre.endswith('.db') and nombre not in conservar:
+            os.remove(os.path.join(directorio, nombre))
+    app.logger.info("Snapshot de reportes de %s tomado a las %s.", ruta, tomado_en.strftime('%H:%M:%S'))
+    return tomado_en
+
+def refrescar_snapshots_reportes(forzar=False):
+    """Refresca el snapshot de cada base (la general o, con BASE_POR_EMPRESA, la de cada empresa)."""
+    return _en_cada_base_empresa(lambda id_empresa: refrescar_snapshot_reportes(id_empresa, forzar))
+
+def _bucle_refresco_snapshot():
+    while True:
+        try:
+            refrescar_snapshots_reportes()
+        except Exception:
+            app.logger.exception("Error al refrescar el snapshot de reportes.")
+        time.sleep(REPORTES_SNAPSHOT_INTERVALO_SEGUNDOS / 4)
+
+@contextmanager
+def lectura_de_reportes():
+    """
+    Dentro del bloque, conectar_db() lee del snapshot de reportes si REPORTES_SNAPSHOT está activo y el snapshot
+    tiene menos de REPORTES_SNAPSHOT_MAX_ANTIGUEDAD_SEGUNDOS; si no, de la base en vivo. Produce un dict con
+    'tomado_en' (el snapshot más viejo que se leyó, None si no se leyó ninguno) y 'en_vivo' (si se leyó en vivo),
+    para mostrar en la página la fecha de los datos. No debe escribirse dentro del bloque.
+    """
+    estado = {'tomado_en': None, 'en_vivo': False}
+    anterior = getattr(_conexion_hilo, 'lectura_reportes', None)
+    if REPORTES_SNAPSHOT:
+        _asegurar_hilo_de_fondo('snapshot-reportes', _bucle_refresco_snapshot)
+        _conexion_hilo.lectura_reportes = estado
+    try:
+        yield estado
+    finally:
+        _conexion_hilo.lectura_reportes = anterior
+
+def _conexion_snapshot(id_empresa, lectura):
+    """Conexión de sólo lectura del hilo al snapshot de la base; None si no hay uno vigente (se lee en vivo)."""
+    ruta_snapshot = _ruta_snapshot(_rutas_base(id_empresa)[0])
+    conexiones = _conexiones_del_hilo()
+    clave = ('snapshot', id_empresa)
+    conn = conexiones.get(clave)
+    try:
+        inodo = os.stat(ruta_snapshot).st_ino
+    except FileNotFoundError:
+        inodo = None
+    if conn is not None and conn.inodo != inodo and conn.usos == 0:
+        # Hay un snapshot nuevo: la conexión al anterior se cierra de verdad
+        sqlite3.Connection.close(conexiones.pop(clave))
+        conn = None
+    if conn is None and inodo is not None:
+        datos = _leer_snapshot(ruta_snapshot)
+        if datos is not None:
+            ruta_archivo = os.path.join(os.path.dirname(ruta_snapshot), datos[1])
+            conn = _abrir_conexion(ruta_snapshot, ruta_archivo, id_empresa, solo_lectura=True)
+            if _datos_snapshot(conn) == datos:
+                conn.inodo, conn.tomado_en = inodo, datos[0]
+                conexiones[clave] = conn
+            else:
+                # Se reemplazó mientras se abría: por esta vez se lee en vivo
+                sqlite3.Connection.close(conn)
+                conn = None
+    if conn is None or (datetime.now() - conn.tomado_en).total_seconds() > REPORTES_SNAPSHOT_MAX_ANTIGUEDAD_SEGUNDOS:
+        lectura['en_vivo'] = True
+        return None
+    lectura['tomado_en'] = min(filter(None, (lectura['tomado_en'], conn.tomado_en)))
+    return _usar_conexion(conn)
+
+def _fecha_datos_reporte(lectura):
+    """Texto 'dd/mm/aaaa hh:mm:ss' del snapshot que se leyó, para la página; None si los datos son en vivo."""
+    return lectura['tomado_en'].strftime('%d/%m/%Y %H:%M:%S') if lectura['tomado_en'] else None
+
+# --- Trazas de SQL por petición (ver trazas_sql.py) ---
+
+def _texto_sql(sql):
+    return ' '.join(sql.split())
+
+@app.before_request
+def _iniciar_trazas_sql():
+    if SQL_TRAZAS_ACTIVAS:
+        trazas_sql.iniciar_registro()
+
+@app.after_request
+def _cabecera_tiempo_sql(response):
+    """Agrega Server-Timing con el tiempo de SQL de la petición (visible en las herramientas del navegador)."""
+    registro = trazas_sql.registro_actual()
+    if registro is not None:
+        response.headers.add('Server-Timing', f'sql;dur={registro.tiempo_total * 1000:.2f};desc="{registro.sentencias} sentencias"')
+    return response
+
+@app.teardown_request
+def _registrar_trazas_sql(exc=None):
+    """
+    Registra cantidad de sentencias, tiempo total y la más lenta de la petición. Las que superan
+    SQL_CONSULTA_LENTA_MS se registran con su EXPLAIN QUERY PLAN, marcando los recorridos completos
+    de tabla; en modo debug, además, se avisa de las sentencias repetidas (posible N+1).
+    """
+    registro = trazas_sql.terminar_registro()
+    if registro is None or not registro.ejecuciones:
+        return
+    ruta = request.endpoint or request.path
+    mas_lenta = registro.mas_lenta
+    app.logger.debug("SQL %s: %d sentencias, %.2f ms en total, la más lenta %.2f ms: %s",
+                     ruta, registro.sentencias, registro.tiempo_total * 1000,
+                     mas_lenta.duracion * 1000, _texto_sql(mas_lenta.sql))
+
+    for ejecucion in registro.ejecuciones:
+        if ejecucion.duracion * 1000 < SQL_CONSULTA_LENTA_MS:
+            continue
+        plan = trazas_sql.plan_de_consulta(ejecucion.conexion, ejecucion.sql, ejecucion.params)
+        recorridos = trazas_sql.tablas_recorridas_completas(plan)
+        app.logger.warning("Consulta lenta en %s (%.1f ms)%s: %s\n  Plan: %s",
+                           ruta, ejecucion.duracion * 1000,
+                           f" con recorrido completo de {', '.join(recorridos)}" if recorridos else "",
+                           _texto_sql(ejecucion.sql), " | ".join(plan) or "(sin plan)")
+
+    if app.debug:
+        for sql, veces in registro.repetidas(SQL_REPETICIONES_N_MAS_1):
+            app.logger.warning("Posible N+1 en %s: la misma sentencia se ejecutó %d veces: %s",
+                               ruta, veces, _texto_sql(sql))
+
+# --- Latencia por endpoint ---
+
+@app.before_request
+def _iniciar_medicion_peticion():
+    g.inicio_peticion = time.perf_counter()
+
+def _observar_latencia(codigo):
+    inicio = g.pop('inicio_peticion', None)
+    if inicio is not None:
+        latencia_peticiones.observar(time.perf_counter() - inicio, endpoint=request.endpoint or 'desconocido',
+                                     metodo=request.method, codigo=codigo)
+
+@app.after_request
+def _registrar_latencia_peticion(response):
+    _observar_latencia(response.status_code)
+    return response
+
+@app.teardown_request
+def _registrar_latencia_peticion_fallida(exc=None):
+    # Excepciones no manejadas: after_request no se ejecuta
+    if exc is not None:
+        _observar_latencia(500)
+
+# --- Control de admisión (ADMISION_ACTIVA) ---
+# Con una promoción, el alta de pedidos y el carrito pueden ocupar todos los hilos del worker y dejar sin atender a las
+# pantallas de /gestion. Cada clase pública de ADMISION_ENDPOINTS tiene un cupo de peticiones simultáneas y una cubeta
+# de tokens por cliente; el personal logueado no pasa por el control. Lo que no entra se rechaza en el momento.
+
+if ADMISION_ACTIVA and ADMISION_PROXIES is None:
+    # Detrás de un proxy sin configurar, todos los clientes serían la IP del proxy y compartirían una cubeta
+    raise RuntimeError("ADMISION_ACTIVA=1 requiere ADMISION_PROXIES: la cantidad de proxies delante de la app (0 si no hay).")
+if ADMISION_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=ADMISION_PROXIES)
+
+_cupos_admision = {clase: admision.LimiteConcurrencia(limites['concurrencia']) for clase, limites in ADMISION_CLASES.items()}
+_cubetas_admision = {clase: admision.CubetasTokens(limites['tasa_por_segundo'], limites['rafaga'], ADMISION_MAX_CLIENTES)
+                     for clase, limites in ADMISION_CLASES.items()}
+
+def _cliente_de_la_peticion():
+    # Con ADMISION_PROXIES, ProxyFix ya puso en remote_addr la IP que vio el primer proxy
+    return request.remote_addr or 'desconocido'
+
+def _rechazar_por_admision(clase, motivo, reintentar_segundos):
+    """503 (clase llena) o 429 (cliente sobre su tasa) con Retry-After: JSON para /api, una página mínima si no."""
+    peticiones_rechazadas.inc(clase=clase, motivo=motivo)
+    reintentar_segundos = max(1, math.ceil(reintentar_segundos))
+    if motivo == 'saturado':
+        codigo, mensaje = 503, "Hay mucha demanda en este momento. Intente de nuevo en unos segundos."
+    else:
+        codigo, mensaje = 429, "Demasiadas solicitudes seguidas. Intente de nuevo en unos segundos."
+    if request.path.startswith('/api/'):
+        respuesta = jsonify({"success": False, "message": mensaje})
+    else:
+        respuesta = Response(render_template('sobrecarga.html', mensaje=mensaje, reintentar_segundos=reintentar_segundos))
+    respuesta.status_code = codigo
+    respuesta.headers['Retry-After'] = str(reintentar_segundos)
+    return respuesta
+
+@app.before_request
+def _admitir_peticion():
+    clase = ADMISION_ENDPOINTS.get(request.endpoint) if ADMISION_ACTIVA else None
+    if clase is None or current_user.is_authenticated:
+        return None
+    metodos = ADMISION_CLASES[clase].get('metodos')
+    if metodos and request.method not in metodos:
+        return None
+    espera = _cubetas_admision[clase].tomar(_cliente_de_la_peticion())
+    if espera:
+        return _rechazar_por_admision(clase, 'tasa_cliente', espera)
+    if not _cupos_admision[clase].entrar():
+        return _rechazar_por_admision(clase, 'saturado', ADMISION_REINTENTAR_SEGUNDOS)
+    g.clase_admitida = clase
+    return None
+
+@app.teardown_request
+def _liberar_cupo_admision(exc=None):
+    clase = g.pop('clase_admitida', None)
+    if clase is not None:
+        _cupos_admision[clase].salir()
+
+# --- Perfilado de peticiones (cProfile) ---
+
+@app.before_request
+def _iniciar_perfilado():
+    """Perfila la petición si sale en el muestreo de PERFILADO_ENDPOINTS o trae un token de perfilado válido."""
+    token = request.headers.get(PERFILADO_CABECERA)
+    if token:
+        perfilar = perfilado.token_valido(app.secret_key, token, PERFILADO_TOKEN_VALIDEZ_SEGUNDOS)
+    else:
+        perfilar = request.endpoint in PERFILADO_ENDPOINTS and perfilado.debe_muestrear(PERFILADO_TASA_MUESTREO)
+    if perfilar:
+        g.perfil = perfilado.iniciar()
+        g.inicio_perfil = time.perf_counter()
+
+@app.teardown_request
+def _guardar_perfilado(exc=None):
+    perfil = g.pop('perfil', None)
+    if perfil is None:
+        return
+    duracion = time.perf_counter() - g.pop('inicio_perfil')
+    try:
+        archivo = perfilado.guardar(perfil, PERFILADO_DIRECTORIO, request.endpoint or 'desconocido',
+                                    duracion, PERFILADO_MAX_ARCHIVOS)
+        app.logger.info("Perfil de %s guardado: %s", request.path, archivo)
+    except OSError as e:
+        app.logger.error("No se pudo guardar el perfil de %s: %s", request.path, e)
+
+def _iniciar_escritura(cursor):
+    """BEGIN IMMEDIATE, midiendo la espera por el bloqueo de escritura y contando los 'database is locked'."""
+    endpoint = (request.endpoint if has_request_context() else None) or 'sin_peticion'
+    inicio = time.perf_counter()
+    try:
+        if BASE_POR_EMPRESA:
+            # BEGIN IMMEDIATE reservaría todas las bases adjuntas, también la general, y volvería a poner a
+            # todas las empresas en fila: una escritura vacía sobre main reserva sólo la base de la empresa.
+            cursor.execute("BEGIN")
+            cursor.execute("UPDATE main.cierres_caja_diarios SET fecha = fecha WHERE 0")
+        else:
+            cursor.execute("BEGIN IMMEDIATE")
+    except sqlite3.OperationalError as e:
+        if 'locked' in str(e):
+            bloqueos_db.inc(endpoint=endpoint)
+        raise
+    finally:
+        espera_bloqueo_db.observar(time.perf_counter() - inicio, endpoint=endpoint)
+
+def crear_tablas(ruta=DB_NAME, ruta_archivo=ARCHIVO_DB_NAME, generales=True):
+    """
+    Crea las tablas de la base de datos si no existen y añade columnas si faltan.
+    generales=False (base de una empresa) omite usuarios, roles, empresas y configuración.
+    """
+    conn = sqlite3.connect(ruta)
     cursor = conn.cursor()
+    # Sólo tiene efecto en una base nueva: permite devolver de a poco las páginas libres (ver vacuum_incremental)
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
 
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS platos (
@@ -88,6 +785,7 @@ def crear_tablas():
             lon_cliente REAL,
             id_repartidor INTEGER,
             id_empresa INTEGER,
+            version_ticket INTEGER NOT NULL DEFAULT 0,
             FOREIGN KEY(id_repartidor) REFERENCES repartidores(id_repartidor),
             FOREIGN KEY(id_empresa) REFERENCES empresas(id_empresa)
         )
@@ -121,100 +819,192 @@ def crear_tablas():
         )
     """)
 
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS configuracion (
-            clave TEXT PRIMARY KEY,
-            valor TEXT,
-            id_empresa INTEGER,
-            FOREIGN KEY(id_empresa) REFERENCES empresas(id_empresa)
-        )
-    """)
+    # Tablas de la base general: en la base de una empresa se resuelven en la general adjunta
+    if generales:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS configuracion (
+                clave TEXT PRIMARY KEY,
+                valor TEXT,
+                id_empresa INTEGER,
+                FOREIGN KEY(id_empresa) REFERENCES empresas(id_empresa)
+            )
+        """)
 
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS empresas (
-            id_empresa INTEGER PRIMARY KEY AUTOINCREMENT,
-            nombre TEXT NOT NULL UNIQUE,
-            telefono TEXT,  
-            direccion TEXT, 
-            activo INTEGER DEFAULT 1
-        )
-    """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS empresas (
+                id_empresa INTEGER PRIMARY KEY AUTOINCREMENT,
+                nombre TEXT NOT NULL UNIQUE,
+                telefono TEXT,  
+                direccion TEXT, 
+                activo INTEGER DEFAULT 1
+            )
+        """)
 
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS roles (
-            id_rol INTEGER PRIMARY KEY AUTOINCREMENT,
-            nombre_rol TEXT NOT NULL UNIQUE
-        )
-    """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS roles (
+                id_rol INTEGER PRIMARY KEY AUTOINCREMENT,
+                nombre_rol TEXT NOT NULL UNIQUE
+            )
+        """)
 
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS usuarios (
-            id_usuario INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT NOT NULL UNIQUE,
-            password TEXT NOT NULL,
-            nombre TEXT NOT NULL,
-            apellido TEXT NOT NULL,
-            id_rol INTEGER NOT NULL,
-            id_empresa INTEGER,
-            activo INTEGER DEFAULT 1,
-            primer_login_requerido INTEGER DEFAULT 1,
-            FOREIGN KEY(id_rol) REFERENCES roles(id_rol),
-            FOREIGN KEY(id_empresa) REFERENCES empresas(id_empresa)
-        )
-    """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS usuarios (
+                id_usuario INTEGER PRIMARY KEY AUTOINCREMENT,
+                email TEXT NOT NULL UNIQUE,
+                password TEXT NOT NULL,
+                nombre TEXT NOT NULL,
+                apellido TEXT NOT NULL,
+                id_rol INTEGER NOT NULL,
+                id_empresa INTEGER,
+                activo INTEGER DEFAULT 1,
+                primer_login_requerido INTEGER DEFAULT 1,
+                FOREIGN KEY(id_rol) REFERENCES roles(id_rol),
+                FOREIGN KEY(id_empresa) REFERENCES empresas(id_empresa)
+            )
+        """)
+
+        # Cola de trabajos en segundo plano (ver encolar_trabajo). disponible_desde (epoch) es, para un trabajo
+        # 'pendiente', cuándo puede tomarse y, para uno 'en_curso', cuándo vence su arriendo.
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS trabajos (
+                id_trabajo INTEGER PRIMARY KEY AUTOINCREMENT,
+                tarea TEXT NOT NULL,
+                argumentos TEXT NOT NULL,
+                estado TEXT NOT NULL DEFAULT 'pendiente',
+                intentos INTEGER NOT NULL DEFAULT 0,
+                max_intentos INTEGER NOT NULL,
+                disponible_desde REAL NOT NULL,
+                creado_en REAL NOT NULL,
+                trabajador TEXT,
+                ultimo_error TEXT
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_trabajos_estado_disponible ON trabajos (estado, disponible_desde)")
 
     # --- Comprobar y añadir columnas si faltan (para migraciones sin borrar DB) ---
     cursor.execute("PRAGMA table_info(pedidos)")
     columns = [col[1] for col in cursor.fetchall()]
     if 'id_repartidor' not in columns:
         cursor.execute("ALTER TABLE pedidos ADD COLUMN id_repartidor INTEGER REFERENCES repartidores(id_repartidor)")
-        print("Columna 'id_repartidor' añadida a la tabla 'pedidos'.")
+        app.logger.info("Columna 'id_repartidor' añadida a la tabla 'pedidos'.")
     if 'id_empresa' not in columns:
         cursor.execute("ALTER TABLE pedidos ADD COLUMN id_empresa INTEGER REFERENCES empresas(id_empresa)")
-        print("Columna 'id_empresa' añadida a la tabla 'pedidos'.")
+        app.logger.info("Columna 'id_empresa' añadida a la tabla 'pedidos'.")
+    if 'version_ticket' not in columns:
+        cursor.execute("ALTER TABLE pedidos ADD COLUMN version_ticket INTEGER NOT NULL DEFAULT 0")
+        app.logger.info("Columna 'version_ticket' añadida a la tabla 'pedidos'.")
+
+    # Columnas generadas virtuales (no ocupan espacio en la fila): se calculan desde el TEXT, así que
+    # ningún INSERT/UPDATE tiene que mantenerlas. table_xinfo es necesario porque table_info las oculta.
+    for tabla, columna in _COLUMNAS_FECHA_EPOCH:
+        cursor.execute(f"PRAGMA table_xinfo({tabla})")
+        if f"{columna}_epoch" not in [col[1] for col in cursor.fetchall()]:
+            cursor.execute(f"""
+                ALTER TABLE {tabla} ADD COLUMN {columna}_epoch EPOCH
+                GENERATED ALWAYS AS (CAST(strftime('%s', {columna}) AS INTEGER)) VIRTUAL
+            """)
+            app.logger.info("Columna '%s_epoch' añadida a la tabla '%s'.", columna, tabla)
 
     cursor.execute("PRAGMA table_info(ingresos_egresos)")
     columns = [col[1] for col in cursor.fetchall()]
     if 'id_repartidor_origen' not in columns:
         cursor.execute("ALTER TABLE ingresos_egresos ADD COLUMN id_repartidor_origen INTEGER REFERENCES repartidores(id_repartidor)")
-        print("Columna 'id_repartidor_origen' añadida a la tabla 'ingresos_egresos'.")
+        app.logger.info("Columna 'id_repartidor_origen' añadida a la tabla 'ingresos_egresos'.")
     if 'id_empresa' not in columns:
         cursor.execute("ALTER TABLE ingresos_egresos ADD COLUMN id_empresa INTEGER REFERENCES empresas(id_empresa)")
-        print("Columna 'id_empresa' añadida a la tabla 'ingresos_egresos'.")
+        app.logger.info("Columna 'id_empresa' añadida a la tabla 'ingresos_egresos'.")
 
     cursor.execute("PRAGMA table_info(platos)")
     columns = [col[1] for col in cursor.fetchall()]
     if 'id_empresa' not in columns:
         cursor.execute("ALTER TABLE platos ADD COLUMN id_empresa INTEGER REFERENCES empresas(id_empresa)")
-        print("Columna 'id_empresa' añadida a la tabla 'platos'.")
+        app.logger.info("Columna 'id_empresa' añadida a la tabla 'platos'.")
     if 'rubro' not in columns:
         cursor.execute("ALTER TABLE platos ADD COLUMN rubro TEXT")
-        print("Columna 'rubro' añadida a la tabla 'platos'.")
+        app.logger.info("Columna 'rubro' añadida a la tabla 'platos'.")
 
     cursor.execute("PRAGMA table_info(repartidores)")
     columns = [col[1] for col in cursor.fetchall()]
     if 'id_empresa' not in columns:
         cursor.execute("ALTER TABLE repartidores ADD COLUMN id_empresa INTEGER REFERENCES empresas(id_empresa)")
-        print("Columna 'id_empresa' añadida a la tabla 'repartidores'.")
-
-    cursor.execute("PRAGMA table_info(configuracion)")
-    columns = [col[1] for col in cursor.fetchall()]
-    if 'id_empresa' not in columns:
-        cursor.execute("ALTER TABLE configuracion ADD COLUMN id_empresa INTEGER REFERENCES empresas(id_empresa)")
-        print("Columna 'id_empresa' añadida a la tabla 'configuracion'.")
+        app.logger.info("Columna 'id_empresa' añadida a la tabla 'repartidores'.")
+
+    if generales:
+        cursor.execute("PRAGMA table_info(configuracion)")
+        columns = [col[1] for col in cursor.fetchall()]
+        if 'id_empresa' not in columns:
+            cursor.execute("ALTER TABLE configuracion ADD COLUMN id_empresa INTEGER REFERENCES empresas(id_empresa)")
+            app.logger.info("Columna 'id_empresa' añadida a la tabla 'configuracion'.")
     
-    cursor.execute("PRAGMA table_info(empresas)")
-    columns = [col[1] for col in cursor.fetchall()]
-    if 'telefono' not in columns:
-        cursor.execute("ALTER TABLE empresas ADD COLUMN telefono TEXT")
-        print("Columna 'telefono' añadida a la tabla 'empresas'.")
-    if 'direccion' not in columns:
-        cursor.execute("ALTER TABLE empresas ADD COLUMN direccion TEXT")
-        print("Columna 'direccion' añadida a la tabla 'empresas'.")
+        cursor.execute("PRAGMA table_info(empresas)")
+        columns = [col[1] for col in cursor.fetchall()]
+        if 'telefono' not in columns:
+            cursor.execute("ALTER TABLE empresas ADD COLUMN telefono TEXT")
+            app.logger.info("Columna 'telefono' añadida a la tabla 'empresas'.")
+        if 'direccion' not in columns:
+            cursor.execute("ALTER TABLE empresas ADD COLUMN direccion TEXT")
+            app.logger.info("Columna 'direccion' añadida a la tabla 'empresas'.")
+
+    # --- Libro de caja: cierres diarios materializados por empresa ---
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'cierres_caja_diarios'")
+    cierres_existia = cursor.fetchone() is not None
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS cierres_caja_diarios (
+            id_empresa INTEGER NOT NULL,
+            fecha TEXT NOT NULL,
+            total_ingresos REAL NOT NULL DEFAULT 0,
+            total_egresos REAL NOT NULL DEFAULT 0,
+            total_pagos_repartidor REAL NOT NULL DEFAULT 0,
+            cantidad_movimientos INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (id_empresa, fecha)
+        )
+    """)
+    # Los índices de fecha usan las columnas *_epoch; se eliminan los anteriores sobre el TEXT.
+    for indice in ('idx_ingresos_egresos_empresa_fecha', 'idx_pedidos_empresa_estado_horario',
+                   'idx_pedidos_empresa_horario', 'idx_pedidos_horario'):
+        cursor.execute(f"DROP INDEX IF EXISTS {indice}")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ingresos_egresos_empresa_fecha_epoch ON ingresos_egresos (id_empresa, fecha_hora_epoch)")
+
+    # Índices para el tablero de pedidos (filtro por empresa/estado y orden por horario), las franjas ocupadas y los reportes
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_empresa_estado_horario_epoch ON pedidos (id_empresa, estado_pago, horario_entrega_epoch)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_empresa_horario_epoch ON pedidos (id_empresa, horario_entrega_epoch)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_horario_epoch ON pedidos (horario_entrega_epoch)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_empresa_creacion_epoch ON pedidos (id_empresa, fecha_creacion_epoch)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_items_pedido_pedido ON items_pedido (id_pedido)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ingresos_egresos_pedido_origen ON ingresos_egresos (id_pedido_origen)")
+
+    # --- Registro de eventos de pedidos y posición de cada consumidor (ver leer_eventos_pedido) ---
+    # AUTOINCREMENT: un id_evento nunca se reutiliza después de purgar, así una posición guardada sigue siendo válida
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS pedido_eventos (
+            id_evento INTEGER PRIMARY KEY AUTOINCREMENT,
+            tipo TEXT NOT NULL,
+            id_pedido INTEGER,
+            id_empresa INTEGER,
+            datos TEXT,
+            fecha_hora TEXT NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS consumidores_eventos (
+            consumidor TEXT PRIMARY KEY,
+            ultimo_id_evento INTEGER NOT NULL DEFAULT 0,
+            actualizado_en TEXT
+        )
+    """)
+
+    # --- Archivo histórico: mismas tablas e índices en la base adjunta ---
+    _adjuntar_archivo(conn, ruta_archivo)
+    cursor.execute("PRAGMA archivo.auto_vacuum = INCREMENTAL")
+    _crear_tablas_archivo(cursor)
+    if not cierres_existia:
+        _reconstruir_cierres_caja(cursor)
+        app.logger.info("Tabla 'cierres_caja_diarios' creada y reconstruida desde 'ingresos_egresos'.")
 
-    cursor.execute("INSERT OR IGNORE INTO roles (id_rol, nombre_rol) VALUES (1, 'super_admin')")
-    cursor.execute("INSERT OR IGNORE INTO roles (id_rol, nombre_rol) VALUES (2, 'admin_empresa')")
-    cursor.execute("INSERT OR IGNORE INTO roles (id_rol, nombre_rol) VALUES (3, 'empleado')")
+    if generales:
+        cursor.execute("INSERT OR IGNORE INTO roles (id_rol, nombre_rol) VALUES (1, 'super_admin')")
+        cursor.execute("INSERT OR IGNORE INTO roles (id_rol, nombre_rol) VALUES (2, 'admin_empresa')")
+        cursor.execute("INSERT OR IGNORE INTO roles (id_rol, nombre_rol) VALUES (3, 'empleado')")
 
     conn.commit()
     conn.close()
@@ -223,10 +1013,7 @@ def guardar_configuracion(clave, valor, id_empresa=None):
     """Guarda un par clave-valor en la tabla de configuración, opcionalmente por empresa."""
     conn = conectar_db()
     cursor = conn.cursor()
-    if id_empresa:
-        cursor.execute("REPLACE INTO configuracion (clave, valor, id_empresa) VALUES (?, ?, ?)", (clave, str(valor), id_empresa))
-    else:
-        cursor.execute("REPLACE INTO configuracion (clave, valor, id_empresa) VALUES (?, ?, NULL)", (clave, str(valor)))
+    repositorio.ejecutar(cursor, 'configuracion.guardar', clave=clave, valor=str(valor), id_empresa=id_empresa or None)
     conn.commit()
     conn.close()
 
@@ -235,11 +1022,9 @@ def cargar_configuracion(clave, valor_defecto=None, id_empresa=None):
     conn = conectar_db()
     cursor = conn.cursor()
     if id_empresa:
-        cursor.execute("SELECT valor FROM configuracion WHERE clave = ? AND id_empresa = ?", (clave, id_empresa))
+        resultado = repositorio.uno(cursor, 'configuracion.valor_empresa', id_empresa, clave=clave)
     else:
-        cursor.execute("SELECT valor FROM configuracion WHERE clave = ? AND id_empresa IS NULL", (clave,))
-
-    resultado = cursor.fetchone()
+        resultado = repositorio.uno(cursor, 'configuracion.valor_global', clave=clave)
     conn.close()
     if resultado:
         return resultado['valor']
@@ -281,13 +1066,13 @@ def _agregar_super_admin_inicial():
             VALUES (?, ?, ?, ?, (SELECT id_rol FROM roles WHERE nombre_rol = 'super_admin'), NULL, 1, 0)
         """, ("admin@tudominio.com", hashed_password, "Super", "Admin",))
         conn.commit()
-        print("Usuario 'super_admin' inicial creado: admin@tudominio.com con la contraseña 'admin_password_inicial_segura' (¡CÁMBIALA!)")
+        app.logger.info("Usuario 'super_admin' inicial creado: admin@tudominio.com con la contraseña 'admin_password_inicial_segura' (¡CÁMBIALA!)")
 
     default_company_id = DEFAULT_COMPANY_FOR_ORDERS
     cursor.execute("INSERT OR IGNORE INTO empresas (id_empresa, nombre, telefono, direccion, activo) VALUES (?, ?, NULL, NULL, 1)",
                    (default_company_id, "Empresa Principal por Defecto"))
     conn.commit()
-    print(f"Empresa por defecto (ID: {default_company_id}, Nombre: Empresa Principal por Defecto) asegurada.")
+    app.logger.info("Empresa por defecto (ID: %s, Nombre: Empresa Principal por Defecto) asegurada.", default_company_id)
 
     cursor.execute("SELECT COUNT(*) FROM usuarios WHERE id_rol = (SELECT id_rol FROM roles WHERE nombre_rol = 'admin_empresa') AND id_empresa = ?", (default_company_id,))
     if cursor.fetchone()[0] == 0:
@@ -297,7 +1082,7 @@ def _agregar_super_admin_inicial():
             VALUES (?, ?, ?, ?, (SELECT id_rol FROM roles WHERE nombre_rol = 'admin_empresa'), ?, 1, 1)
         """, ("admin_empresa@empresa.com", hashed_password, "Admin", "Empresa", default_company_id))
         conn.commit()
-        print(f"Usuario 'admin_empresa' inicial creado para Empresa Principal (ID: {default_company_id}): admin_empresa@empresa.com con la contraseña 'empresa_password_segura' (¡CÁMBIALA!)")
+        app.logger.info("Usuario 'admin_empresa' inicial creado para Empresa Principal (ID: %s): admin_empresa@empresa.com con la contraseña 'empresa_password_segura' (¡CÁMBIALA!)", default_company_id)
 
     conn.close()
 
@@ -324,7 +1109,7 @@ def _agregar_platos_ejemplo_a_db():
             cursor.execute("INSERT INTO platos (nombre, descripcion, precio, activo, id_empresa, rubro) VALUES (?, ?, ?, 1, ?, ?)",
                            (nombre, desc, precio, default_company_id, rubro))
         conn.commit()
-        print(f"Platos de ejemplo agregados a la base de datos para la empresa ID {default_company_id}.")
+        app.logger.info("Platos de ejemplo agregados a la base de datos para la empresa ID %s.", default_company_id)
     conn.close()
 
 def _agregar_repartidor_ejemplo_a_db():
@@ -340,118 +1125,781 @@ def _agregar_repartidor_ejemplo_a_db():
         cursor.execute("INSERT INTO repartidores (nombre, apellido, telefono, activo, id_empresa) VALUES (?, ?, ?, 1, ?)",
                        ("Maria", "Gomez", "1198765432", default_company_id))
         conn.commit()
-        print(f"Repartidores de ejemplo agregados a la base de datos para la empresa ID {default_company_id}.")
+        app.logger.info("Repartidores de ejemplo agregados a la base de datos para la empresa ID %s.", default_company_id)
     conn.close()
 
 
-# --- Clases de Modelo ---
-class Plato:
-    def __init__(self, id_plato, nombre, descripcion, precio, activo=1, id_empresa=None, rubro=None):
-        self.id_plato = id_plato
-        self.nombre = nombre
-        self.descripcion = descripcion
-        self.precio = precio
-        self.activo = activo
-        self.id_empresa = id_empresa
-        self.rubro = rubro 
+# --- Libro de Caja (cierres diarios) ---
+# Cada movimiento de ingresos_egresos se acumula, en la misma transacción, en el cierre
+# del día de su empresa. Así un arqueo de N días lee N filas en lugar de todos los movimientos.
+# Los movimientos sin empresa se acumulan bajo id_empresa = 0.
+
+_COLUMNA_CIERRE_POR_TIPO = {
+    'Ingreso': 'total_ingresos',
+    'Egreso': 'total_egresos',
+    'Pago a Repartidor': 'total_pagos_repartidor',
+}
+
+_SQL_AGREGADO_CIERRES = """
+    SELECT IFNULL(id_empresa, 0) AS id_empresa, substr(fecha_hora, 1, 10) AS fecha,
+           SUM(CASE WHEN tipo = 'Ingreso' THEN monto ELSE 0 END) AS total_ingresos,
+           SUM(CASE WHEN tipo NOT IN ('Ingreso', 'Pago a Repartidor') THEN monto ELSE 0 END) AS total_egresos,
+           SUM(CASE WHEN tipo = 'Pago a Repartidor' THEN monto ELSE 0 END) AS total_pagos_repartidor,
+           COUNT(*) AS cantidad_movimientos
+    FROM ingresos_egresos_historico
+    GROUP BY IFNULL(id_empresa, 0), substr(fecha_hora, 1, 10)
+"""
+
+def _registrar_movimiento_caja(cursor, tipo, monto, descripcion, fecha_hora_str,
+                               id_pedido_origen=None, id_repartidor_origen=None, id_empresa=None):
+    """
+    Inserta un movimiento en ingresos_egresos y actualiza el cierre diario correspondiente.
+    No hace commit: el llamador decide la transacción, de modo que ambos cambios se confirman juntos.
+    """
+    _registrar_movimientos_caja(cursor, [(tipo, monto, descripcion, fecha_hora_str,
+                                          id_pedido_origen, id_repartidor_origen, id_empresa)])
 
-class Repartidor:
-    def __init__(self, id_repartidor, nombre, apellido, telefono, activo=1, id_empresa=None):
-        self.id_repartidor = id_repartidor
-        self.nombre = nombre
-        self.apellido = apellido
-        self.telefono = telefono
-        self.activo = activo
-        self.id_empresa = id_empresa
+def _registrar_movimientos_caja(cursor, movimientos):
+    """
+    Versión por lotes de _registrar_movimiento_caja. Cada movimiento es una tupla
+    (tipo, monto, descripcion, fecha_hora, id_pedido_origen, id_repartidor_origen, id_empresa).
+    """
+    repositorio.ejecutar_muchos(cursor, 'caja.insertar_movimiento', (
+        {'tipo': tipo, 'monto': monto, 'descripcion': descripcion, 'fecha_hora': fecha_hora_str,
+         'id_pedido_origen': id_pedido_origen, 'id_repartidor_origen': id_repartidor_origen,
+         'id_empresa_movimiento': id_empresa}
+        for tipo, monto, descripcion, fecha_hora_str, id_pedido_origen, id_repartidor_origen, id_empresa in movimientos
+    ))
+
+    filas_cierre = []
+    for tipo, monto, _, fecha_hora_str, _, _, id_empresa in movimientos:
+        columna = _COLUMNA_CIERRE_POR_TIPO.get(tipo, 'total_egresos')
+        filas_cierre.append({
+            'id_empresa_cierre': id_empresa or 0, 'fecha': fecha_hora_str[:10],
+            'ingresos': monto if columna == 'total_ingresos' else 0.0,
+            'egresos': monto if columna == 'total_egresos' else 0.0,
+            'pagos_repartidor': monto if columna == 'total_pagos_repartidor' else 0.0,
+        })
+    repositorio.ejecutar_muchos(cursor, 'caja.acumular_cierre', filas_cierre)
+    _registrar_eventos_pedido(cursor, [
+        ('movimiento_caja', id_pedido_origen, id_empresa,
+         {'tipo': tipo, 'monto': monto, 'fecha_hora': fecha_hora_str, 'id_repartidor': id_repartidor_origen})
+        for tipo, monto, _, fecha_hora_str, id_pedido_origen, id_repartidor_origen, id_empresa in movimientos
+    ])
+
+def _reconstruir_cierres_caja(cursor):
+    """Regenera por completo la tabla de cierres diarios a partir de ingresos_egresos, activos y archivados (sin commit)."""
+    cursor.execute("DELETE FROM cierres_caja_diarios")
+    cursor.execute(f"""
+        INSERT INTO cierres_caja_diarios (id_empresa, fecha, total_ingresos, total_egresos, total_pagos_repartidor, cantidad_movimientos)
+        {_SQL_AGREGADO_CIERRES}
+    """)
 
-    @property
-    def nombre_completo(self):
-        return f"{self.nombre} {self.apellido}"
+def verificar_cierres_caja(reconstruir=False):
+    """
+    Compara los cierres diarios materializados con la suma real de ingresos_egresos.
+    Retorna una lista de diferencias (id_empresa, fecha, esperado, materializado).
+    Si reconstruir=True y hay diferencias, regenera la tabla en una única transacción.
+    """
+    conn = conectar_db()
+    cursor = conn.cursor()
+    campos = ('total_ingresos', 'total_egresos', 'total_pagos_repartidor', 'cantidad_movimientos')
+
+    cursor.execute(_SQL_AGREGADO_CIERRES)
+    esperados = {(row['id_empresa'], row['fecha']): tuple(row[c] for c in campos) for row in cursor.fetchall()}
+    cursor.execute(f"SELECT id_empresa, fecha, {', '.join(campos)} FROM cierres_caja_diarios")
+    materializados = {(row['id_empresa'], row['fecha']): tuple(row[c] for c in campos) for row in cursor.fetchall()}
+
+    vacio = (0.0, 0.0, 0.0, 0)
+    diferencias = []
+    for clave in sorted(set(esperados) | set(materializados), key=lambda k: (k[0], k[1])):
+        esperado = esperados.get(clave, vacio)
+        materializado = materializados.get(clave, vacio)
+        if any(abs(a - b) > 0.005 for a, b in zip(esperado, materializado)):
+            diferencias.append((clave[0], clave[1], esperado, materializado))
+
+    if reconstruir and diferencias:
+        try:
+            _reconstruir_cierres_caja(cursor)
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+    conn.close()
+    return diferencias
 
-class Pedido:
-    def __init__(self, id_pedido, cliente_nombre, cliente_apellido, direccion_entrega, es_envio,
-                 horario_entrega, costo_envio, costo_total, forma_pago, estado_pago, fecha_creacion,
-                 lat_cliente, lon_cliente, fecha_pago=None, id_repartidor=None, id_empresa=None):
-        self.id_pedido = id_pedido
-        self.cliente_nombre = cliente_nombre
-        self.cliente_apellido = cliente_apellido
-        self.direccion_entrega = direccion_entrega
-        self.es_envio = bool(es_envio)
-        self.horario_entrega = datetime.strptime(horario_entrega, '%Y-%m-%d %H:%M:%S') if isinstance(horario_entrega, str) else horario_entrega
-        self.costo_envio = costo_envio
-        self.costo_total = costo_total
-        self.forma_pago = forma_pago
-        self.estado_pago = estado_pago
-        self.fecha_creacion = datetime.strptime(fecha_creacion, '%Y-%m-%d %H:%M:%S') if isinstance(fecha_creacion, str) else fecha_creacion
-        self.fecha_pago = datetime.strptime(fecha_pago, '%Y-%m-%d %H:%M:%S') if fecha_pago else None
-        self.lat_cliente = lat_cliente
-        self.lon_cliente = lon_cliente
-        self.id_repartidor = id_repartidor
-        self.id_empresa = id_empresa
-        self.repartidor = None
-        self.items = []
+def _totales_caja_rango(cursor, fecha_inicio, fecha_fin, alcance):
+    """
+    Calcula los totales por tipo de movimiento entre dos datetimes (ambos inclusive).
+    Los días completos se leen de cierres_caja_diarios; sólo los días parciales de los
+    extremos se suman desde ingresos_egresos.
+    Retorna {'Ingreso': x, 'Egreso': y, 'Pago a Repartidor': z}.
+    """
+    totales = {tipo: 0.0 for tipo in _COLUMNA_CIERRE_POR_TIPO}
+
+    def sumar_movimientos(desde, hasta_exclusive):
+        for row in repositorio.todos(cursor, _consulta_con_archivo('caja.totales_movimientos', _a_epoch(desde)), alcance,
+                                     desde=_a_epoch(desde), hasta=_a_epoch(hasta_exclusive)):
+            tipo = row['tipo'] if row['tipo'] in totales else 'Egreso'
+            totales[tipo] += row['total'] or 0.0
+
+    primer_dia_completo = fecha_inicio.date()
+    if fecha_inicio.time() != datetime.min.time():
+        primer_dia_completo += timedelta(days=1)
+    ultimo_dia_completo = fecha_fin.date()
+    if fecha_fin.time() < datetime.max.time().replace(microsecond=0):
+        ultimo_dia_completo -= timedelta(days=1)
+
+    # Las fechas tienen resolución de segundos: "hasta fecha_fin inclusive" es "antes de fecha_fin + 1s"
+    fin_exclusivo = fecha_fin + timedelta(seconds=1)
+    if primer_dia_completo > ultimo_dia_completo:
+        sumar_movimientos(fecha_inicio, fin_exclusivo)
+        return totales
+
+    row = repositorio.uno(cursor, 'caja.totales_cierres', alcance,
+                          desde=primer_dia_completo.isoformat(), hasta=ultimo_dia_completo.isoformat())
+    totales['Ingreso'] += row['ingresos'] or 0.0
+    totales['Egreso'] += row['egresos'] or 0.0
+    totales['Pago a Repartidor'] += row['pagos'] or 0.0
+
+    inicio_dias_completos = datetime.combine(primer_dia_completo, datetime.min.time())
+    fin_dias_completos = datetime.combine(ultimo_dia_completo + timedelta(days=1), datetime.min.time())
+    if fecha_inicio < inicio_dias_completos:
+        sumar_movimientos(fecha_inicio, inicio_dias_completos)
+    if fecha_fin >= fin_dias_completos:
+        sumar_movimientos(fin_dias_completos, fin_exclusivo)
+    return totales
+
+def _datos_arqueo(fecha_inicio, fecha_fin, alcance):
+    """
+    (movimientos, totales) del arqueo. El detalle se limita a ARQUEO_MAX_MOVIMIENTOS_DETALLE + 1 movimientos para
+    no desbordar la sesión; los totales salen de los cierres diarios. Con BASE_POR_EMPRESA y todas las empresas
+    se calcula en cada base en paralelo y se combina.
+    """
+    if BASE_POR_EMPRESA and alcance is TODAS_LAS_EMPRESAS:
+        partes = [datos for _, datos in _en_cada_base_empresa(
+            lambda id_empresa: _datos_arqueo(fecha_inicio, fecha_fin, id_empresa))]
+        movimientos = sorted((m for movimientos, _ in partes for m in movimientos), key=lambda m: m['fecha_hora_epoch'])
+        totales = {tipo: sum(totales[tipo] for _, totales in partes) for tipo in _COLUMNA_CIERRE_POR_TIPO}
+        return movimientos[:ARQUEO_MAX_MOVIMIENTOS_DETALLE + 1], totales
+
+    conn = conectar_db()
+    cursor = conn.cursor()
+    movimientos = repositorio.todos(cursor, _consulta_con_archivo('caja.movimientos_detalle', _a_epoch(fecha_inicio)), alcance,
+                                    desde=_a_epoch(fecha_inicio), hasta=_a_epoch(fecha_fin),
+                                    limite=ARQUEO_MAX_MOVIMIENTOS_DETALLE + 1)
+    totales = _totales_caja_rango(cursor, fecha_inicio, fecha_fin, alcance)
+    conn.close()
+    return movimientos, totales
+
+
+# --- Registro de eventos de pedidos (outbox) ---
+# Cada alta de pedido, asignación de repartidor, cobro y movimiento de caja agrega una fila a pedido_eventos en la misma
+# transacción que el cambio: no hay evento sin cambio ni cambio sin evento. Los consumidores (acumulados, tableros,
+# cachés) leen desde la última posición que confirmaron en lugar de recorrer pedidos o ingresos_egresos; la entrega es
+# al menos una vez. Con BASE_POR_EMPRESA cada base tiene su registro y sus posiciones: se consume dentro de
+# base_de_empresa(id_empresa), y dividir-por-empresa no copia los eventos anteriores.
+
+def _registrar_eventos_pedido(cursor, eventos):
+    """
+    Agrega los eventos [(tipo, id_pedido, id_empresa, datos)] al registro. No hace commit: se confirman junto
+    con el cambio que describen.
+    """
+    fecha_hora_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    repositorio.ejecutar_muchos(cursor, 'eventos.insertar', (
+        {'tipo': tipo, 'id_pedido': id_pedido, 'id_empresa_evento': id_empresa,
+         'datos': json.dumps(datos, ensure_ascii=False), 'fecha_hora': fecha_hora_str}
+        for tipo, id_pedido, id_empresa, datos in eventos
+    ))
+
+def leer_eventos_pedido(consumidor, limite=EVENTOS_PEDIDO_LOTE_LECTURA):
+    """
+    Hasta 'limite' eventos posteriores a la última posición confirmada por el consumidor (todos, si nunca confirmó),
+    como dicts con 'datos' decodificado. No mueve la posición: ver confirmar_eventos_pedido.
+    """
+    conn = conectar_db()
+    try:
+        cursor = conn.cursor()
+        posicion = repositorio.uno(cursor, 'eventos.posicion', consumidor=consumidor)
+        filas = repositorio.todos(cursor, 'eventos.desde', desde=posicion['ultimo_id_evento'] if posicion else 0,
+                                  limite=limite)
+    finally:
+        conn.close()
+    return [dict(fila, datos=json.loads(fila['datos'])) for fila in filas]
 
-    def agregar_item(self, plato, cantidad, precio_unitario):
-        self.items.append({"plato": plato, "cantidad": cantidad, "precio_unitario": precio_unitario})
+def confirmar_eventos_pedido(consumidor, id_evento, cursor=None):
+    """
+    Guarda que el consumidor procesó hasta id_evento inclusive. Con un cursor no hace commit: un consumidor que
+    escribe su resultado en la misma base confirma la posición en esa transacción y procesa cada evento una sola vez.
+    """
+    params = {'consumidor': consumidor, 'id_evento': id_evento,
+              'actualizado_en': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+    if cursor is not None:
+        repositorio.ejecutar(cursor, 'eventos.confirmar', **params)
+        return
+    conn = conectar_db()
+    try:
+        repositorio.ejecutar(conn.cursor(), 'eventos.confirmar', **params)
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def consumir_eventos_pedido(consumidor, procesar, limite=EVENTOS_PEDIDO_LOTE_LECTURA):
+    """
+    Entrega los eventos pendientes con procesar(eventos), de a 'limite', y confirma cada lote después de procesarlo:
+    si procesar lanza, ese lote se vuelve a entregar en la próxima llamada. Retorna la cantidad entregada.
+    """
+    entregados = 0
+    while True:
+        eventos = leer_eventos_pedido(consumidor, limite)
+        if not eventos:
+            return entregados
+        procesar(eventos)
+        confirmar_eventos_pedido(consumidor, eventos[-1]['id_evento'])
+        entregados += len(eventos)
+        if len(eventos) < limite:
+            return entregados
+
+def purgar_eventos_pedido(conn, dias=EVENTOS_PEDIDO_RETENCION_DIAS, ahora=None):
+    """Borra los eventos con más de 'dias' que todos los consumidores ya confirmaron. Retorna cuántos borró."""
+    corte = ((ahora or datetime.now()) - timedelta(days=dias)).strftime('%Y-%m-%d %H:%M:%S')
+    cursor = conn.cursor()
+    _iniciar_escritura(cursor)
+    try:
+        borrados = repositorio.ejecutar(cursor, 'eventos.purgar', corte=corte).rowcount
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    return borrados
+
+
+# --- Archivo histórico ---
+# Los pedidos pagados antiguos, con sus ítems y movimientos de caja, se mueven a otra base (ARCHIVO_DB_NAME)
+# adjunta en cada conexión como 'archivo'. Las tablas activas y sus índices quedan chicos; los nombres sin
+# calificar siguen resolviendo a main. Las vistas temporales *_historico unen activas + archivo y sólo las
+# usan las consultas '.historico' de consultas.py, cuando el rango empieza antes de ARCHIVO_LIMITE_EPOCH:
+# todo lo archivado es anterior a ese límite.
+
+_TABLAS_ARCHIVABLES = ('pedidos', 'items_pedido', 'ingresos_egresos')
+
+_SQL_VISTAS_HISTORICO = (
+    "CREATE TEMP VIEW IF NOT EXISTS pedidos_historico AS "
+    "SELECT * FROM main.pedidos UNION ALL SELECT * FROM archivo.pedidos",
+    "CREATE TEMP VIEW IF NOT EXISTS ingresos_egresos_historico AS "
+    "SELECT * FROM main.ingresos_egresos UNION ALL SELECT * FROM archivo.ingresos_egresos",
+    # Cada ítem con la empresa y la fecha de su pedido, que está siempre en la misma base
+    """CREATE TEMP VIEW IF NOT EXISTS items_pedido_historico AS
+       SELECT ip.id, ip.id_pedido, ip.id_plato, ip.cantidad, ip.precio_unitario, p.id_empresa, p.fecha_creacion_epoch
+       FROM main.items_pedido ip JOIN main.pedidos p ON p.id_pedido = ip.id_pedido
+       UNION ALL
+       SELECT ip.id, ip.id_pedido, ip.id_plato, ip.cantidad, ip.precio_unitario, p.id_empresa, p.fecha_creacion_epoch
+       FROM archivo.items_pedido ip JOIN archivo.pedidos p ON p.id_pedido = ip.id_pedido""",
+)
+
+def _adjuntar_archivo(conn, ruta_archivo=ARCHIVO_DB_NAME):
+    """ATTACH de la base de archivo y vistas temporales *_historico (son por conexión)."""
+    conn.execute("ATTACH DATABASE ? AS archivo", (ruta_archivo,))
+    for sql in _SQL_VISTAS_HISTORICO:
+        conn.execute(sql)
+
+def _crear_tablas_archivo(cursor):
+    """
+    Crea en el archivo las tablas archivables y sus índices con la misma definición que en main (ya migrada),
+    para que las vistas puedan unir con SELECT *. Una tabla ya existente en el archivo no se modifica.
+    """
+    marcadores = ', '.join('?' * len(_TABLAS_ARCHIVABLES))
+    cursor.execute(f"SELECT type, name, sql FROM main.sqlite_master WHERE tbl_name IN ({marcadores}) AND sql IS NOT NULL "
+                   "ORDER BY type = 'index'", _TABLAS_ARCHIVABLES)
+    for tipo, nombre, sql in cursor.fetchall():
+        if tipo == 'table':
+            sql = re.sub(r'^CREATE TABLE\s+(IF NOT EXISTS\s+)?', 'CREATE TABLE IF NOT EXISTS archivo.', sql, flags=re.IGNORECASE)
+        else:
+            sql = re.sub(r'^CREATE INDEX\s+(IF NOT EXISTS\s+)?', 'CREATE INDEX IF NOT EXISTS archivo.', sql, flags=re.IGNORECASE)
+        cursor.execute(sql)
+
+def _limite_archivo():
+    """Epoch antes del cual puede haber filas archivadas (None si nunca se archivó)."""
+    limite = cargar_configuracion('ARCHIVO_LIMITE_EPOCH')
+    return int(limite) if limite is not None else None
+
+def _rango_archivado(desde_epoch):
+    """True si un rango que empieza en desde_epoch puede incluir filas archivadas."""
+    limite = _limite_archivo()
+    return limite is not None and desde_epoch < limite
+
+def _consulta_con_archivo(nombre, desde_epoch):
+    """La consulta '<nombre>.historico' si el rango que empieza en desde_epoch llega a lo archivado."""
+    return f"{nombre}.historico" if _rango_archivado(desde_epoch) else nombre
+
+def _archivar_por_lotes(conn, consulta_ids, pasos, corte_epoch, lote):
+    """Repite, una transacción corta por lote: leer ids con consulta_ids, ejecutar cada consulta de 'pasos' con ellos."""
+    cursor = conn.cursor()
+    total, ultimo_id = 0, 0
+    while True:
+        _iniciar_escritura(cursor)
+        try:
+            ids = [row[0] for row in repositorio.todos(cursor, consulta_ids, corte=corte_epoch, ultimo_id=ultimo_id, lote=lote)]
+            for paso in pasos if ids else ():
+                repositorio.ejecutar(cursor, paso, ids=lista_json(ids))
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        if not ids:
+            return total
+        total += len(ids)
+        ultimo_id = ids[-1]
+
+def archivar_pedidos(dias=ARCHIVO_DIAS_ANTIGUEDAD, lote=ARCHIVO_LOTE_PEDIDOS, ahora=None):
+    """
+    Mueve al archivo los pedidos pagados antes de la medianoche de hace 'dias' días, con sus ítems y
+    movimientos, y después los movimientos sueltos anteriores a ese corte. Cada lote se copia y se borra
+    en una transacción que abarca las dos bases (con journal de rollback el commit es atómico en ambas).
+    Retorna (pedidos, movimientos sueltos) archivados.
+    """
+    corte = datetime.combine((ahora or datetime.now()).date() - timedelta(days=dias), datetime.min.time())
+    corte_epoch = _a_epoch(corte)
+    # El límite se publica antes de mover: mientras dure el archivado, los rangos afectados ya leen ambas bases
+    limite = _limite_archivo()
+    if limite is None or corte_epoch > limite:
+        guardar_configuracion('ARCHIVO_LIMITE_EPOCH', str(corte_epoch))
+
+    conn = conectar_db()
+    try:
+        pedidos = _archivar_por_lotes(conn, 'archivo.pedidos_a_archivar', (
+            'archivo.copiar_pedidos', 'archivo.copiar_items', 'archivo.copiar_movimientos_de_pedidos',
+            'archivo.borrar_items', 'archivo.borrar_movimientos_de_pedidos', 'archivo.borrar_pedidos',
+        ), corte_epoch, lote)
+        movimientos = _archivar_por_lotes(conn, 'archivo.movimientos_sueltos_a_archivar', (
+            'archivo.copiar_movimientos', 'archivo.borrar_movimientos',
+        ), corte_epoch, lote)
+        if pedidos or movimientos:
+            actualizar_estadisticas(conn)
+    finally:
+        conn.close()
+    if pedidos or movimientos:
+        _invalidar_conteo_pedidos()
+    app.logger.info("Archivados %d pedidos y %d movimientos sueltos anteriores a %s.", pedidos, movimientos, corte)
+    return pedidos, movimientos
+
+
+# --- Mantenimiento: backups, estadísticas y vacuum ---
+# Los backups son en línea, con la API de backup de a BACKUP_PAGINAS_POR_PASO páginas (ver _copia_consistente): los
+# pedidos no esperan. Cada backup es un directorio BACKUP_DIRECTORIO/<AAAAmmdd-HHMMSS>/ con todas las bases, que se
+# arma como '<nombre>.tmp' y se renombra al terminar: un directorio sin '.tmp' siempre está completo. ANALYZE y el
+# vacuum incremental sí toman el bloqueo de escritura, y se dejan para después del cierre.
+
+_PATRON_DIRECTORIO_BACKUP = re.compile(r'^\d{8}-\d{6}$')
+_MANTENIMIENTO_REVISION_SEGUNDOS = 300
+# El proceso que mantiene las bases renueva el archivo de bloqueo mientras trabaja: uno sin renovar hace más del
+# vencimiento quedó de un proceso que murió.
+_MANTENIMIENTO_BLOQUEO_RENOVAR_SEGUNDOS = 60
+_MANTENIMIENTO_BLOQUEO_VENCIMIENTO_SEGUNDOS = 600
+
+class _BackupVencido(Exception):
+    """El backup lleva más de BACKUP_LIMITE_SEGUNDOS."""
+
+@contextmanager
+def _renovando_bloqueo(ruta_bloqueo, cada_segundos):
+    """Mientras dura el bloque, un hilo actualiza la fecha de modificación del archivo de bloqueo cada_segundos."""
+    terminado = threading.Event()
+
+    def renovar():
+        while not terminado.wait(cada_segundos):
+            try:
+                os.utime(ruta_bloqueo)
+            except FileNotFoundError:
+                return
+
+    hilo = threading.Thread(target=renovar, name='renovar-bloqueo', daemon=True)
+    hilo.start()
+    try:
+        yield
+    finally:
+        terminado.set()
+        hilo.join()
+
+def _bases_a_mantener():
+    """[(id_empresa, ruta, ruta del archivo histórico)]: la base general y, con BASE_POR_EMPRESA, la de cada empresa."""
+    bases = [(None, DB_NAME, ARCHIVO_DB_NAME)]
+    if BASE_POR_EMPRESA:
+        bases += [(id_empresa, *_rutas_base(id_empresa)) for id_empresa in _ids_empresas()]
+    return bases
+
+def _directorios_backup():
+    if not os.path.isdir(BACKUP_DIRECTORIO):
+        return []
+    return sorted(nombre for nombre in os.listdir(BACKUP_DIRECTORIO) if _PATRON_DIRECTORIO_BACKUP.match(nombre))
+
+def hacer_backup(ahora=None):
+    """
+    Backup en línea de todas las bases, cada una con su archivo histórico, en BACKUP_DIRECTORIO/<AAAAmmdd-HHMMSS>/
+    (las de empresa en empresas/), y retención de los últimos BACKUP_CONSERVAR. Retorna la ruta del backup, o None
+    si un archivo histórico cambió durante todos los intentos de copiarlo o si se pasó de BACKUP_LIMITE_SEGUNDOS.
+    """
+    destino = os.path.join(BACKUP_DIRECTORIO, f"{ahora or datetime.now():%Y%m%d-%H%M%S}")
+    temporal = f"{destino}.tmp"
+    limite = time.monotonic() + BACKUP_LIMITE_SEGUNDOS
+
+    def al_avanzar():
+        if time.monotonic() > limite:
+            raise _BackupVencido()
+
+    os.makedirs(temporal)
+    try:
+        for id_empresa, ruta, ruta_archivo in _bases_a_mantener():
+            carpeta = temporal if id_empresa is None else os.path.join(temporal, 'empresas')
+            os.makedirs(carpeta, exist_ok=True)
+            destino_archivo = os.path.join(carpeta, os.path.basename(ruta_archivo))
+            if _copia_consistente(ruta, ruta_archivo, os.path.join(carpeta, os.path.basename(ruta)),
+                                  lambda _: destino_archivo, BACKUP_PAGINAS_POR_PASO, BACKUP_PAUSA_SEGUNDOS,
+                                  al_avanzar=al_avanzar) is None:
+                shutil.rmtree(temporal)
+                return None
+        os.rename(temporal, destino)
+    except _BackupVencido:
+        shutil.rmtree(temporal, ignore_errors=True)
+        app.logger.warning("Backup abandonado: llevaba más de %d segundos.", BACKUP_LIMITE_SEGUNDOS)
+        return None
+    except Exception:
+        shutil.rmtree(temporal, ignore_errors=True)
+        raise
+    for anterior in _directorios_backup()[:-BACKUP_CONSERVAR]:
+        shutil.rmtree(os.path.join(BACKUP_DIRECTORIO, anterior))
+    app.logger.info("Backup de %d base(s) en %s.", len(_bases_a_mantener()), destino)
+    return destino
+
+def actualizar_estadisticas(conn):
+    """
+    ANALYZE de la base y su archivo histórico con PRAGMA analysis_limit: estadísticas aproximadas para el
+    planificador sin recorrer las tablas enteras. (PRAGMA optimize no alcanza: antes de SQLite 3.46 sólo
+    analiza las tablas que consultó la misma conexión.)
+    """
+    conn.execute(f"PRAGMA analysis_limit = {int(MANTENIMIENTO_ANALISIS_LIMITE)}")
+    for esquema in ('main', 'archivo'):
+        conn.execute(f"ANALYZE {esquema}")
+    conn.commit()
+
+def vacuum_incremental(conn):
+    """
+    Devuelve al sistema de archivos las páginas libres de la base y su archivo histórico (las deja sobre todo el
+    archivado), de a MANTENIMIENTO_VACUUM_PAGINAS_POR_PASO páginas por transacción. Una base creada antes de activar
+    auto_vacuum incremental se omite (mantenimiento --convertir-vacuum). Retorna las páginas liberadas.
+    """
+    cursor = conn.cursor()
+    liberadas = 0
+    for esquema in ('main', 'archivo'):
+        if cursor.execute(f"PRAGMA {esquema}.auto_vacuum").fetchone()[0] != 2:
+            app.logger.info("La base %s no tiene auto_vacuum incremental: se omite el vacuum.",
+                            cursor.execute("SELECT file FROM pragma_database_list WHERE name = ?", (esquema,)).fetchone()[0])
+            continue
+        libres = cursor.execute(f"PRAGMA {esquema}.freelist_count").fetchone()[0]
+        while libres:
+            _iniciar_escritura(cursor)
+            try:
+                # incremental_vacuum libera una página por paso de la sentencia: hay que consumirla entera
+                cursor.execute(f"PRAGMA {esquema}.incremental_vacuum({int(MANTENIMIENTO_VACUUM_PAGINAS_POR_PASO)})").fetchall()
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+            quedan = cursor.execute(f"PRAGMA {esquema}.freelist_count").fetchone()[0]
+            if quedan >= libres:
+                break
+            liberadas += libres - quedan
+            libres = quedan
+    return liberadas
+
+def convertir_a_vacuum_incremental(conn):
+    """Activa auto_vacuum incremental en la base y su archivo: requiere un VACUUM completo, que bloquea las escrituras."""
+    for esquema in ('main', 'archivo'):
+        if conn.execute(f"PRAGMA {esquema}.auto_vacuum").fetchone()[0] != 2:
+            conn.execute(f"PRAGMA {esquema}.auto_vacuum = INCREMENTAL")
+            conn.execute(f"VACUUM {esquema}")
+
+def mantener_bases(estadisticas=True, vacuum=True):
+    """
+    Vacuum incremental (antes, la purga de los eventos de pedidos ya consumidos) y estadísticas de cada base.
+    Retorna las páginas liberadas.
+    """
+    liberadas = 0
+    for id_empresa, _, _ in _bases_a_mantener():
+        conn = _conexion_del_hilo(id_empresa)
+        try:
+            if vacuum:
+                purgar_eventos_pedido(conn)
+                liberadas += vacuum_incremental(conn)
+            if estadisticas:
+                actualizar_estadisticas(conn)
+        finally:
+            conn.close()
+    return liberadas
+
+def _minutos_del_dia(hora_str):
+    horas, minutos = map(int, hora_str.split(':'))
+    return horas * 60 + minutos
+
+def en_horario_de_mantenimiento(ahora=None):
+    """True entre HORA_CIERRE + MANTENIMIENTO_MARGEN_MINUTOS y HORA_APERTURA (la ventana puede pasar la medianoche)."""
+    ahora = ahora or datetime.now()
+    cierre, apertura = _minutos_del_dia(HORA_CIERRE), _minutos_del_dia(HORA_APERTURA)
+    inicio = cierre + MANTENIMIENTO_MARGEN_MINUTOS
+    fin = apertura + 24 * 60 if apertura <= cierre else apertura
+    minuto = ahora.hour * 60 + ahora.minute
+    return any(inicio <= m < fin for m in (minuto, minuto + 24 * 60))
+
+def mantenimiento_programado(ahora=None):
+    """
+    Lo que corresponde según el reloj: un backup si el último tiene BACKUP_INTERVALO_HORAS y, en horario de
+    mantenimiento, vacuum y estadísticas una vez por noche. Un archivo de bloqueo, renovado mientras se trabaja,
+    evita que dos procesos lo hagan a la vez. Retorna las tareas hechas.
+    """
+    ahora = ahora or datetime.now()
+    os.makedirs(BACKUP_DIRECTORIO, exist_ok=True)
+    ruta_bloqueo = os.path.join(BACKUP_DIRECTORIO, 'mantenimiento.lock')
+    if not _tomar_bloqueo_archivo(ruta_bloqueo, _MANTENIMIENTO_BLOQUEO_VENCIMIENTO_SEGUNDOS):
+        return []
+    hechas = []
+    try:
+        with _renovando_bloqueo(ruta_bloqueo, _MANTENIMIENTO_BLOQUEO_RENOVAR_SEGUNDOS):
+            backups = _directorios_backup()
+            if not backups or ahora - datetime.strptime(backups[-1], '%Y%m%d-%H%M%S') >= timedelta(hours=BACKUP_INTERVALO_HORAS):
+                if hacer_backup(ahora):
+                    hechas.append('backup')
+            # La ventana dura menos de un día: 12 horas desde la última vez separan una noche de la siguiente
+            ultimo = cargar_configuracion('MANTENIMIENTO_ULTIMO_EPOCH')
+            if en_horario_de_mantenimiento(ahora) and (ultimo is None or _a_epoch(ahora) - int(ultimo) >= 12 * 3600):
+                liberadas = mantener_bases()
+                guardar_configuracion('MANTENIMIENTO_ULTIMO_EPOCH', _a_epoch(ahora))
+                hechas += ['vacuum', 'estadisticas']
+                app.logger.info("Mantenimiento nocturno: %d página(s) liberadas y estadísticas actualizadas.", liberadas)
+    finally:
+        os.remove(ruta_bloqueo)
+    return hechas
+
+def _bucle_mantenimiento():
+    while True:
+        try:
+            mantenimiento_programado()
+        except Exception:
+            app.logger.exception("Error en el mantenimiento programado.")
+        time.sleep(_MANTENIMIENTO_REVISION_SEGUNDOS)
+
+@app.before_request
+def _iniciar_mantenimiento_automatico():
+    if MANTENIMIENTO_AUTOMATICO:
+        _asegurar_hilo_de_fondo('mantenimiento', _bucle_mantenimiento)
+
+
+# --- Cola de trabajos en segundo plano ---
+# Las tareas lentas o que dependen de otro equipo (por ahora, la impresión en la cocina) se guardan como trabajos en la
+# base general y las corren hilos trabajadores: en cada worker de la app (COLA_TRABAJOS='app') o en procesos aparte
+# (flask --app app trabajador). Un trabajo tomado queda arrendado por TRABAJOS_ARRIENDO_SEGUNDOS y se borra al
+# terminar bien. La entrega es al menos una vez: una tarea puede repetirse si su trabajador muere a mitad.
+
+_tareas_cola = {}
+_aviso_trabajos = threading.Event()
+
+def tarea_de_cola(nombre):
+    """Registra la función como la tarea 'nombre'; recibe los argumentos del trabajo como keywords."""
+    def registrar_tarea(funcion):
+        _tareas_cola[nombre] = funcion
+        return funcion
+    return registrar_tarea
+
+def _conexion_cola():
+    # La cola vive en la base general, también con BASE_POR_EMPRESA
+    return _conexion_del_hilo(None)
+
+def encolar_trabajo(tarea, argumentos=None, demora_segundos=0, max_intentos=TRABAJOS_MAX_INTENTOS):
+    """
+    Guarda un trabajo de la tarea con sus argumentos (un dict serializable a JSON) y retorna su id_trabajo.
+    Hace commit: no llamarla con una transacción abierta en la base general.
+    """
+    if tarea not in _tareas_cola:
+        raise ValueError(f"Tarea de cola desconocida: {tarea}")
+    ahora = time.time()
+    conn = _conexion_cola()
+    try:
+        id_trabajo = repositorio.ejecutar(conn.cursor(), 'trabajos.insertar', tarea=tarea,
+                                          argumentos=json.dumps(argumentos or {}), max_intentos=max_intentos,
+                                          disponible_desde=ahora + demora_segundos, creado_en=ahora).lastrowid
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    # Despierta a los trabajadores de este proceso; los de otros procesos lo ven en su próxima revisión
+    _aviso_trabajos.set()
+    return id_trabajo
+
+def _tomar_trabajo(trabajador):
+    """Arrienda el trabajo disponible más antiguo al trabajador. Retorna su fila, o None si no hay."""
+    ahora = time.time()
+    conn = _conexion_cola()
+    cursor = conn.cursor()
+    try:
+        # Sólo se pide el bloqueo de escritura si hay algo para tomar
+        if not repositorio.uno(cursor, 'trabajos.hay_disponibles', ahora=ahora)[0]:
+            return None
+        _iniciar_escritura(cursor)
+        repositorio.ejecutar(cursor, 'trabajos.vencer_agotados', ahora=ahora)
+        filas = repositorio.todos(cursor, 'trabajos.tomar', ahora=ahora,
+                                  arriendo_hasta=ahora + TRABAJOS_ARRIENDO_SEGUNDOS, trabajador=trabajador)
+        conn.commit()
+        return filas[0] if filas else None
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def _actualizar_trabajo(consulta, trabajo, **params):
+    conn = _conexion_cola()
+    try:
+        repositorio.ejecutar(conn.cursor(), consulta, id_trabajo=trabajo['id_trabajo'], intentos=trabajo['intentos'], **params)
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def _ejecutar_trabajo(trabajo):
+    """
+    Corre la tarea del trabajo y lo borra; si lanza, lo reprograma con espera exponencial o, agotados los
+    intentos, lo deja 'fallido'. Retorna 'hecho', 'reintento' o 'fallido'.
+    """
+    if trabajo['intentos'] == 1:
+        trabajos_espera.observar(time.time() - trabajo['creado_en'], tarea=trabajo['tarea'])
+    inicio = time.perf_counter()
+    try:
+        funcion = _tareas_cola.get(trabajo['tarea'])
+        if funcion is None:
+            raise LookupError(f"Tarea de cola desconocida: {trabajo['tarea']}")
+        funcion(**json.loads(trabajo['argumentos']))
+    except Exception as e:
+        # Lo que la tarea dejó sin confirmar no debe entrar en el commit que registra el fallo
+        _liberar_conexion_db()
+        resultado = 'fallido' if trabajo['intentos'] >= trabajo['max_intentos'] else 'reintento'
+        espera = min(TRABAJOS_REINTENTO_BASE_SEGUNDOS * 2 ** (trabajo['intentos'] - 1), TRABAJOS_REINTENTO_MAX_SEGUNDOS)
+        _actualizar_trabajo('trabajos.fallar', trabajo, reintentar_desde=time.time() + espera,
+                            error=f"{type(e).__name__}: {e}")
+        registrar_log = app.logger.error if resultado == 'fallido' else app.logger.warning
+        registrar_log("Trabajo %d (%s) falló en el intento %d de %d: %s", trabajo['id_trabajo'], trabajo['tarea'],
+                      trabajo['intentos'], trabajo['max_intentos'], e)
+    else:
+        _liberar_conexion_db()
+        resultado = 'hecho'
+        _actualizar_trabajo('trabajos.terminar', trabajo)
+    trabajos_duracion.observar(time.perf_counter() - inicio, tarea=trabajo['tarea'], resultado=resultado)
+    return resultado
+
+def _bucle_trabajador(numero):
+    trabajador = f"{os.getpid()}-{numero}"
+    while True:
+        try:
+            trabajo = _tomar_trabajo(trabajador)
+            if trabajo is not None:
+                _ejecutar_trabajo(trabajo)
+                continue
+        except Exception:
+            app.logger.exception("Error en el trabajador %s de la cola de trabajos.", trabajador)
+        _aviso_trabajos.wait(TRABAJOS_ESPERA_SEGUNDOS)
+        _aviso_trabajos.clear()
+
+def iniciar_trabajadores(hilos=TRABAJOS_HILOS):
+    """Arranca (una vez por proceso) 'hilos' trabajadores de la cola."""
+    for numero in range(1, hilos + 1):
+        _asegurar_hilo_de_fondo(f"trabajos-{numero}", lambda numero=numero: _bucle_trabajador(numero))
+
+@app.before_request
+def _iniciar_trabajadores_en_la_app():
+    if COLA_TRABAJOS == 'app':
+        iniciar_trabajadores()
+
+_metricas_cola_cacheadas = (0.0, '')
+
+def _metricas_cola_trabajos():
+    """
+    Profundidad de la cola y antigüedad del trabajo más viejo, por tarea y estado, leídas de la tabla a lo sumo una
+    vez cada METRICAS_COLA_CACHE_SEGUNDOS. Sin COLA_TRABAJOS no hay cola y no se lee nada.
+    """
+    global _metricas_cola_cacheadas
+    if not COLA_TRABAJOS:
+        return ''
+    leidas_en, texto = _metricas_cola_cacheadas
+    if time.monotonic() - leidas_en < METRICAS_COLA_CACHE_SEGUNDOS:
+        return texto
+    conn = _conexion_cola()
+    try:
+        filas = repositorio.todos(conn.cursor(), 'trabajos.resumen')
+    finally:
+        conn.close()
+    ahora = time.time()
+    etiquetas = [({'tarea': fila['tarea'], 'estado': fila['estado']}, fila) for fila in filas]
+    texto = (metricas_mod.exportar_medidor('casasdecomida_trabajos_en_cola', "Trabajos en la cola por tarea y estado.",
+                                           [(e, fila['cantidad']) for e, fila in etiquetas])
+             + metricas_mod.exportar_medidor('casasdecomida_trabajos_antiguedad_segundos',
+                                             "Antigüedad del trabajo más viejo de cada tarea y estado.",
+                                             [(e, ahora - fila['creado_mas_antiguo']) for e, fila in etiquetas]))
+    _metricas_cola_cacheadas = (time.monotonic(), texto)
+    return texto
+
+
+# --- Caché de tickets ---
+# Los tickets se reimprimen varias veces en hora pico; se guardan por (id_empresa, id_pedido, version_ticket, formato):
+# con BASE_POR_EMPRESA cada empresa numera sus pedidos desde 1.
+# Toda actualización que cambia el contenido del ticket (pago, repartidor) incrementa version_ticket.
+
+_cache_tickets = OrderedDict()
+_cache_tickets_lock = threading.Lock()
+
+def _obtener_ticket_cacheado(pedido, formato, renderizar):
+    if pedido.id_pedido is None:
+        return renderizar()
+    clave = (pedido.id_empresa, pedido.id_pedido, pedido.version_ticket, formato)
+    with _cache_tickets_lock:
+        if clave in _cache_tickets:
+            _cache_tickets.move_to_end(clave)
+            consultas_cache.inc(cache='tickets', resultado='acierto')
+            return _cache_tickets[clave]
+
+    consultas_cache.inc(cache='tickets', resultado='fallo')
+    contenido = renderizar()
+    with _cache_tickets_lock:
+        _cache_tickets[clave] = contenido
+        while len(_cache_tickets) > TICKETS_CACHE_MAX:
+            _cache_tickets.popitem(last=False)
+    return contenido
+
+
+# --- Clases de Modelo ---
+# Plato, Repartidor, Empresa, Rol y los datos de Pedido viven en models.py (compartidos con tu_script.py).
+# Aquí Pedido solo agrega la generación de tickets, que depende de la app (plantillas y caché).
+
+class Pedido(models.Pedido):
+    __slots__ = ()
 
     def generar_ticket(self):
-        ticket_html = f"""
-        <div class="ticket">
-            <h4 class="text-center">TICKET DE PEDIDO #{self.id_pedido}</h4>
-            <hr>
-            <p><strong>Cliente:</strong> {self.cliente_nombre} {self.cliente_apellido}</p>
-            <p><strong>Dirección:</strong> {self.direccion_entrega}</p>
-            <p><strong>Tipo:</strong> {'Envío' if self.es_envio else 'Retiro en Sucursal'}</p>
-            <p><strong>Horario:</strong> {self.horario_entrega.strftime('%H:%M')} ({self.horario_entrega.strftime('%d/%m')})</p>
-        """
-        if self.es_envio and self.repartidor:
-            ticket_html += f"<p><strong>Repartidor:</strong> {self.repartidor.nombre_completo}</p>"
-
-        ticket_html += """<hr>
-            <h6>Detalle del Pedido:</h6>
-            <ul class="list-unstyled">
-        """
-        for item in self.items:
-            plato_nombre = item["plato"].nombre if isinstance(item["plato"], Plato) else item["plato"]
-            cantidad = item["cantidad"]
-            precio_unitario = item["precio_unitario"]
-            ticket_html += f"<li>{cantidad} x {plato_nombre} @ ${precio_unitario:,.2f} = ${cantidad * precio_unitario:,.2f}</li>"
-
-        ticket_html += "</ul>"
-        if self.es_envio:
-            ticket_html += f"<p><strong>Costo de Envío:</strong> ${self.costo_envio:,.2f}</p>"
-
-        ticket_html += f"""
-            <hr>
-            <p><strong>TOTAL: ${self.costo_total:,.2f}</strong></p>
-            <hr>
-            <p><strong>Forma de Pago:</strong> {self.forma_pago}</p>
-            <p><strong>Estado del Pago:</strong> {self.estado_pago}</p>
-        """
-        if self.fecha_pago:
-            ticket_html += f"<p><strong>Fecha de Pago:</strong> {self.fecha_pago.strftime('%d/%m/%Y %H:%M')}</p>"
-
-        ticket_html += f"""
-            <hr>
-            <p class="text-center">¡Gracias por su compra!</p>
-        </div>
-        """
-        return ticket_html
-
-class Empresa:
-    def __init__(self, id_empresa, nombre, telefono=None, direccion=None, activo=1):
-        self.id_empresa = id_empresa
-        self.nombre = nombre
-        self.telefono = telefono
-        self.direccion = direccion
-        self.activo = activo
+        """HTML del ticket (plantilla _ticket.html), cacheado por (id_pedido, version_ticket)."""
+        return _obtener_ticket_cacheado(self, 'html', lambda: app.jinja_env.get_template('_ticket.html').render(
+            pedido=self, lineas=self._lineas_ticket()))
 
-class Rol:
-    def __init__(self, id_rol, nombre_rol):
-        self.id_rol = id_rol
-        self.nombre_rol = nombre_rol
+    def generar_ticket_escpos(self, ancho=None):
+        """Ticket en bytes ESC/POS para las impresoras térmicas de cocina, cacheado igual que el HTML."""
+        ancho = ancho or TICKET_ANCHO_COLUMNAS
+        return _obtener_ticket_cacheado(self, f'escpos-{ancho}', lambda: ticket_de_pedido(self, ancho))
 
 class Usuario(UserMixin):
+    __slots__ = ('id', 'email', 'password', 'nombre', 'apellido', 'id_rol', 'id_empresa', 'activo',
+                 'primer_login_requerido', 'nombre_rol')
+
     def __init__(self, id_usuario, email, password, nombre, apellido, id_rol, id_empresa, activo=1, primer_login_requerido=1, nombre_rol=None):
         self.id = id_usuario
         self.email = email
@@ -464,6 +1912,12 @@ class Usuario(UserMixin):
         self.primer_login_requerido = primer_login_requerido
         self.nombre_rol = nombre_rol
 
+    @classmethod
+    def desde_fila(cls, row):
+        return cls(row['id_usuario'], row['email'], row['password'], row['nombre'], row['apellido'],
+                   row['id_rol'], row['id_empresa'], row['activo'], row['primer_login_requerido'],
+                   row['nombre_rol'])
+
     def get_id(self):
         return str(self.id)
 
@@ -480,30 +1934,11 @@ class Usuario(UserMixin):
 def load_user(user_id):
     conn = conectar_db()
     cursor = conn.cursor()
-    cursor.execute("""
-        SELECT u.id_usuario, u.email, u.password, u.nombre, u.apellido,
-               u.id_rol, u.id_empresa, u.activo, u.primer_login_requerido,
-               r.nombre_rol
-        FROM usuarios u
-        JOIN roles r ON u.id_rol = r.id_rol
-        WHERE u.id_usuario = ?
-    """, (user_id,))
-    user_data = cursor.fetchone()
+    user_data = repositorio.uno(cursor, 'usuarios.sesion_por_id', id_usuario=user_id)
     conn.close()
 
     if user_data:
-        return Usuario(
-            user_data['id_usuario'],
-            user_data['email'],
-            user_data['password'],
-            user_data['nombre'],
-            user_data['apellido'],
-            user_data['id_rol'],
-            user_data['id_empresa'],
-            user_data['activo'],
-            user_data['primer_login_requerido'],
-            user_data['nombre_rol']
-        )
+        return Usuario.desde_fila(user_data)
     return None
 
 # --- Funciones de Google Maps y Geocodificación ---
@@ -513,10 +1948,12 @@ _info_restaurante = None
 def obtener_info_restaurante_google_maps_cached(nombre_restaurante):
     global _info_restaurante, SUCURSAL_LAT, SUCURSAL_LON
     if _info_restaurante:
+        consultas_cache.inc(cache='info_restaurante', resultado='acierto')
         return _info_restaurante
+    consultas_cache.inc(cache='info_restaurante', resultado='fallo')
 
     if not GOOGLE_MAPS_API_KEY or GOOGLE_MAPS_API_KEY == "YOUR_GOOGLE_MAPS_API_KEY":
-        print("Advertencia: API Key de Google Maps no configurada. Usando datos de ejemplo para el restaurante.")
+        log_google_maps.warning("API Key de Google Maps no configurada. Usando datos de ejemplo para el restaurante.")
         _info_restaurante = {
             "nombre": nombre_restaurante,
             "direccion": "Dirección de ejemplo, 1234, Ciudad Ficticia",
@@ -527,7 +1964,7 @@ def obtener_info_restaurante_google_maps_cached(nombre_restaurante):
         }
         return _info_restaurante
 
-    search_url = "https://maps.googleapis.com/maps/api/place/findplacefromtext/json"
+    search_url = f"{GOOGLE_MAPS_URL_BASE}/maps/api/place/findplacefromtext/json"
     params_search = { "input": nombre_restaurante, "inputtype": "textquery", "fields": "place_id", "key": GOOGLE_MAPS_API_KEY, "language": "es" }
     try:
         response_search = requests.get(search_url, params=params_search, timeout=5)
@@ -536,16 +1973,17 @@ def obtener_info_restaurante_google_maps_cached(nombre_restaurante):
         if data_search["status"] == "OK" and data_search["candidates"]:
             place_id = data_search["candidates"][0]["place_id"]
         else:
-            print(f"Error al buscar Place ID para '{nombre_restaurante}'. Status: {data_search.get('status')}. Error: {data_search.get('error_message')}")
+            log_google_maps.error("Error al buscar Place ID para '%s'. Status: %s. Error: %s",
+                                  nombre_restaurante, data_search.get('status'), data_search.get('error_message'))
             return None
     except requests.exceptions.RequestException as e:
-        print(f"Error de red con Google Places (Search): {e}")
+        log_google_maps.error("Error de red con Google Places (Search): %s", e)
         return None
     except json.JSONDecodeError:
-        print("Error al procesar respuesta JSON de Google Places (Search).")
+        log_google_maps.error("Error al procesar respuesta JSON de Google Places (Search).")
         return None
 
-    details_url = "https://maps.googleapis.com/maps/api/place/details/json"
+    details_url = f"{GOOGLE_MAPS_URL_BASE}/maps/api/place/details/json"
     params_details = { "place_id": place_id, "fields": "name,formatted_address,geometry,opening_hours,url", "key": GOOGLE_MAPS_API_KEY, "language": "es" }
     try:
         response_details = requests.get(details_url, params=params_details, timeout=5)
@@ -565,13 +2003,14 @@ def obtener_info_restaurante_google_maps_cached(nombre_restaurante):
             SUCURSAL_LON = _info_restaurante['lon']
             return _info_restaurante
         else:
-            print(f"Error al obtener detalles del restaurante: {data_details.get('status')}. Error: {data_details.get('error_message')}")
+            log_google_maps.error("Error al obtener detalles del restaurante: %s. Error: %s",
+                                  data_details.get('status'), data_details.get('error_message'))
             return None
     except requests.exceptions.RequestException as e:
-        print(f"Error de red con Google Places (Details): {e}")
+        log_google_maps.error("Error de red con Google Places (Details): %s", e)
         return None
     except json.JSONDecodeError:
-        print("Error al procesar respuesta JSON de Google Places (Details).")
+        log_google_maps.error("Error al procesar respuesta JSON de Google Places (Details).")
         return None
 
 def obtener_coordenadas_desde_direccion(direccion):
@@ -580,13 +2019,14 @@ def obtener_coordenadas_desde_direccion(direccion):
     Si la API Key no es válida o hay un error, retorna coordenadas de ejemplo.
     """
     if not GOOGLE_MAPS_API_KEY or GOOGLE_MAPS_API_KEY == "YOUR_GOOGLE_MAPS_API_KEY":
-        print("Advertencia: API Key de Google Maps no configurada. Usando coordenadas de ejemplo para la dirección.")
+        log_google_maps.warning("API Key de Google Maps no configurada. Usando coordenadas de ejemplo para la dirección.")
+        geocodificaciones.inc(resultado='sin_api_key')
         if "calle falsa 123" in direccion.lower(): return -34.6000, -58.4000
         elif "avenida siempreviva 742" in direccion.lower(): return -34.6050, -58.3850
         else: return -34.6100, -58.3900
 
 
-    geocoding_url = "https://maps.googleapis.com/maps/api/geocode/json"
+    geocoding_url = f"{GOOGLE_MAPS_URL_BASE}/maps/api/geocode/json"
     params = { "address": direccion, "key": GOOGLE_MAPS_API_KEY, "language": "es" }
     try:
         response = requests.get(geocoding_url, params=params, timeout=5)
@@ -594,15 +2034,20 @@ def obtener_coordenadas_desde_direccion(direccion):
         data = response.json()
         if data["status"] == "OK" and data["results"]:
             location = data["results"][0]["geometry"]["location"]
+            geocodificaciones.inc(resultado='ok')
             return location["lat"], location["lng"]
         else:
-            print(f"No se pudieron obtener coordenadas para la dirección: {data.get('status')}. Error: {data.get('error_message')}")
+            log_google_maps.warning("No se pudieron obtener coordenadas para la dirección: %s. Error: %s",
+                                    data.get('status'), data.get('error_message'))
+            geocodificaciones.inc(resultado='sin_resultado')
             return None
     except requests.exceptions.RequestException as e:
-        print(f"Error de red con Google Geocoding: {e}")
+        log_google_maps.error("Error de red con Google Geocoding: %s", e)
+        geocodificaciones.inc(resultado='error')
         return None
     except json.JSONDecodeError:
-        print("Error al procesar respuesta JSON de Google Geocoding.")
+        log_google_maps.error("Error al procesar respuesta JSON de Google Geocoding.")
+        geocodificaciones.inc(resultado='error')
         return None
 
 def calcular_distancia_cuadras(lat1, lon1, lat2, lon2):
@@ -626,25 +2071,15 @@ def calcular_distancia_cuadras(lat1, lon1, lat2, lon2):
 
 # --- Lógica de Negocio y Utilidades para la App Web ---
 
-def get_company_filter_conditions_and_params(table_alias=''):
+def alcance_empresa():
     """
-    Genera una lista de condiciones y los parámetros para filtrar por empresa para el usuario actual.
-    Si el usuario es super_admin, no añade condiciones de empresa.
-    Retorna (list_of_conditions, list_of_params).
+    Alcance de las consultas del repositorio (consultas.py) para el usuario actual:
+    TODAS_LAS_EMPRESAS para super_admin y fuera de una petición (comandos de línea, trabajos
+    en segundo plano); si no, el id_empresa del usuario (None no coincide con ninguna fila).
     """
-    conditions = []
-    params = []
-
-    if current_user.is_authenticated and not current_user.has_role('super_admin'):
-        if current_user.id_empresa:
-            if table_alias:
-                conditions.append(f"{table_alias}.id_empresa = ?")
-            else:
-                conditions.append("id_empresa = ?")
-            params.append(current_user.id_empresa)
-        else:
-            conditions.append("1 = 0") # Asegura que no se muestre nada si el admin_empresa no tiene id_empresa
-    return conditions, params
+    if not has_request_context() or not current_user.is_authenticated or current_user.has_role('super_admin'):
+        return TODAS_LAS_EMPRESAS
+    return current_user.id_empresa
 
 def get_company_id_for_frontend_context():
     """
@@ -668,7 +2103,7 @@ def _generar_franjas_horarias_disponibles(company_id_for_franjas):
         inicio_hora, inicio_min = map(int, HORA_APERTURA.split(':'))
         fin_hora, fin_min = map(int, HORA_CIERRE.split(':'))
     except ValueError:
-        print("Error en formato de HORA_APERTURA o HORA_CIERRE en config.py")
+        app.logger.error("Error en formato de HORA_APERTURA o HORA_CIERRE en config.py")
         return []
 
     inicio_turno_hoy = datetime.combine(hoy, datetime.min.time()).replace(hour=inicio_hora, minute=inicio_min)
@@ -701,102 +2136,54 @@ def _cargar_franjas_ocupadas_desde_db_interna(company_id):
     filtrando por la empresa proporcionada.
     Retorna un diccionario {datetime_obj: count}
     """
-    franjas_ocupadas = {}
     conn = conectar_db()
     cursor = conn.cursor()
 
-    hoy_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-    query_conditions = ["estado_pago = 'Pendiente'", "horario_entrega >= ?"]
-    query_params = [hoy_str]
+    filas = repositorio.todos(cursor, 'pedidos.franjas_ocupadas', company_id, desde=_a_epoch(datetime.now()))
+    franjas_ocupadas = {row['horario_entrega_epoch']: row['num_pedidos'] for row in filas}
+    conn.close()
+    return franjas_ocupadas
 
-    company_conditions, company_params = get_company_filter_conditions_and_params(table_alias='p')
-    query_conditions.extend(company_conditions)
-    query_params.extend(company_params)
+def _obtener_pedidos_completos_por_ids(ids_pedido):
+    """
+    Recupera varios objetos Pedido completos (con sus ítems y datos de repartidor) con
+    dos consultas en total (cabeceras e ítems), en lugar de dos por pedido.
+    Aplica el mismo filtro de empresa que _obtener_pedido_completo_por_id.
+    Retorna una lista de Pedido en el orden de ids_pedido, omitiendo los no encontrados.
+    """
+    ids = list(dict.fromkeys(ids_pedido))
+    pedidos = {}
+    if not ids:
+        return []
 
+    conn = conectar_db()
+    cursor = conn.cursor()
+    for pedido_data in repositorio.todos(cursor, 'pedidos.completos', alcance_empresa(), ids=lista_json(ids)):
+        pedidos[pedido_data['id_pedido']] = Pedido.desde_fila(pedido_data)
 
-    final_query = f"""
-        SELECT horario_entrega, COUNT(*) AS num_pedidos
-        FROM pedidos p
-        WHERE {' AND '.join(query_conditions)}
-        GROUP BY horario_entrega
-    """
-    cursor.execute(final_query, query_params)
+    if pedidos:
+        for item_row in repositorio.todos(cursor, 'pedidos.items', ids=lista_json(pedidos)):
+            pedido = pedidos[item_row['id_pedido']]
+            plato = Plato(item_row['id_plato'], item_row['nombre'], item_row['descripcion'], item_row['precio_unitario'], id_empresa=pedido.id_empresa, rubro=item_row['rubro'])
+            pedido.agregar_item(plato, item_row['cantidad'], item_row['precio_unitario'])
 
-    resultados = cursor.fetchall()
-    for row in resultados:
-        dt_obj = datetime.strptime(row['horario_entrega'], '%Y-%m-%d %H:%M:%S')
-        franjas_ocupadas[dt_obj] = row['num_pedidos']
     conn.close()
-    return franjas_ocupadas
+    return [pedidos[id_pedido] for id_pedido in ids if id_pedido in pedidos]
 
 def _obtener_pedido_completo_por_id(id_pedido):
     """
     Recupera un objeto Pedido completo (con sus ítems y datos de repartidor si aplica)
     de la base de datos, aplicando filtro de empresa para usuarios no super_admin.
     """
-    conn = conectar_db()
-    cursor = conn.cursor()
-
-    base_query = """
-        SELECT p.*, r.nombre AS repartidor_nombre, r.apellido AS repartidor_apellido, r.telefono AS repartidor_telefono
-        FROM pedidos p
-        LEFT JOIN repartidores r ON p.id_repartidor = r.id_repartidor
-    """
-    where_conditions = ["p.id_pedido = ?"]
-    query_params = [id_pedido]
-
-    company_conditions, company_params = get_company_filter_conditions_and_params(table_alias='p')
-    where_conditions.extend(company_conditions)
-    query_params.extend(company_params)
-    
-    final_query = base_query + " WHERE " + " AND ".join(where_conditions)
-
-    cursor.execute(final_query, query_params)
-    pedido_data = cursor.fetchone()
-
-    if not pedido_data:
-        conn.close()
-        return None
-
-    pedido = Pedido(
-        pedido_data['id_pedido'], pedido_data['cliente_nombre'], pedido_data['cliente_apellido'],
-        pedido_data['direccion_entrega'], pedido_data['es_envio'], pedido_data['horario_entrega'],
-        pedido_data['costo_envio'], pedido_data['costo_total'], pedido_data['forma_pago'],
-        pedido_data['estado_pago'], pedido_data['fecha_creacion'],
-        pedido_data['lat_cliente'], pedido_data['lon_cliente'],
-        pedido_data['fecha_pago'], pedido_data['id_repartidor'], pedido_data['id_empresa']
-    )
-
-    if pedido_data['id_repartidor']:
-        pedido.repartidor = Repartidor(
-            pedido_data['id_repartidor'],
-            pedido_data['repartidor_nombre'],
-            pedido_data['repartidor_apellido'],
-            pedido_data['repartidor_telefono']
-        )
-
-    cursor.execute("""
-        SELECT ip.cantidad, ip.precio_unitario, p.id_plato, p.nombre, p.descripcion, p.rubro
-        FROM items_pedido ip
-        JOIN platos p ON ip.id_plato = p.id_plato
-        WHERE ip.id_pedido = ?
-    """, (id_pedido,))
-
-    items_data = cursor.fetchall()
-    for item_row in items_data:
-        plato = Plato(item_row['id_plato'], item_row['nombre'], item_row['descripcion'], item_row['precio_unitario'], id_empresa=pedido.id_empresa, rubro=item_row['rubro'])
-        pedido.agregar_item(plato, item_row['cantidad'], item_row['precio_unitario'])
-
-    conn.close()
-    return pedido
+    pedidos = _obtener_pedidos_completos_por_ids([id_pedido])
+    return pedidos[0] if pedidos else None
 
 def init_app():
     """
     Función de inicialización que se ejecuta al inicio de la aplicación.
     Crea tablas si no existen, añade platos de ejemplo y carga la información del restaurante.
     """
-    print("Inicializando la aplicación...")
+    app.logger.info("Inicializando la aplicación...")
     crear_tablas()
     _agregar_super_admin_inicial()
     _agregar_platos_ejemplo_a_db()
@@ -805,13 +2192,13 @@ def init_app():
 
     if cargar_configuracion('ENVIO_COSTO', id_empresa=None) is None:
         guardar_configuracion('ENVIO_COSTO', DEFAULT_ENVIO_COSTO, id_empresa=None)
-        print(f"Costo de envío inicial '{DEFAULT_ENVIO_COSTO}' guardado como configuración global.")
+        app.logger.info("Costo de envío inicial '%s' guardado como configuración global.", DEFAULT_ENVIO_COSTO)
 
     if cargar_configuracion('PAGO_REPARTIDOR_POR_ENVIO', id_empresa=None) is None:
         guardar_configuracion('PAGO_REPARTIDOR_POR_ENVIO', DEFAULT_PAGO_REPARTIDOR_POR_ENVIO, id_empresa=None)
-        print(f"Costo de pago a repartidor inicial '{DEFAULT_PAGO_REPARTIDOR_POR_ENVIO}' guardado como configuración global.")
+        app.logger.info("Costo de pago a repartidor inicial '%s' guardado como configuración global.", DEFAULT_PAGO_REPARTIDOR_POR_ENVIO)
 
-    print("Aplicación inicializada.")
+    app.logger.info("Aplicación inicializada.")
 
 # --- Rutas de la Aplicación (Views) ---
 
@@ -833,30 +2220,11 @@ def login():
 
         conn = conectar_db()
         cursor = conn.cursor()
-        cursor.execute("""
-            SELECT u.id_usuario, u.email, u.password, u.nombre, u.apellido,
-                   u.id_rol, u.id_empresa, u.activo, u.primer_login_requerido,
-                   r.nombre_rol
-            FROM usuarios u
-            JOIN roles r ON u.id_rol = r.id_rol
-            WHERE u.email = ?
-        """, (email,))
-        user_data = cursor.fetchone()
+        user_data = repositorio.uno(cursor, 'usuarios.sesion_por_email', email=email)
         conn.close()
 
         if user_data:
-            user = Usuario(
-                user_data['id_usuario'],
-                user_data['email'],
-                user_data['password'],
-                user_data['nombre'],
-                user_data['apellido'],
-                user_data['id_rol'],
-                user_data['id_empresa'],
-                user_data['activo'],
-                user_data['primer_login_requerido'],
-                user_data['nombre_rol']
-            )
+            user = Usuario.desde_fila(user_data)
             if check_password_hash(user.password, password) and user.is_active():
                 login_user(user)
                 flash(f"Bienvenido, {user.nombre}!", "success")
@@ -900,10 +2268,7 @@ def cambiar_clave_inicial():
             cursor = conn.cursor()
             try:
                 hashed_password = generate_password_hash(nueva_clave, method='pbkdf2:sha256')
-                cursor.execute("""
-                    UPDATE usuarios SET password = ?, primer_login_requerido = 0
-                    WHERE id_usuario = ?
-                """, (hashed_password, current_user.id))
+                repositorio.ejecutar(cursor, 'usuarios.cambiar_clave_inicial', password=hashed_password, id_usuario=current_user.id)
                 conn.commit()
                 current_user.password = hashed_password
                 current_user.primer_login_requerido = 0
@@ -918,6 +2283,78 @@ def cambiar_clave_inicial():
 
     return render_template('cambiar_clave_inicial.html')
 
+# --- Alta de pedidos ---
+# Con PEDIDOS_ESCRITOR_UNICO los pedidos nuevos no se guardan en el hilo de la petición: se entregan al escritor
+# agrupado, que confirma en un solo commit los que llegaron a la vez (ver escritura_agrupada.py).
+
+def _guardar_grupo_pedidos(pedidos):
+    """
+    Guarda los pedidos (parámetros de 'pedidos.insertar' más 'items') en una transacción, con los ítems de
+    todos en un solo executemany. Retorna sus id_pedido, en el mismo orden.
+    """
+    conn = conectar_db()
+    cursor = conn.cursor()
+    try:
+        _iniciar_escritura(cursor)
+        ids_pedido, items, eventos = [], [], []
+        for pedido in pedidos:
+            repositorio.ejecutar(cursor, 'pedidos.insertar', **{k: v for k, v in pedido.items() if k != 'items'})
+            ids_pedido.append(cursor.lastrowid)
+            items.extend({'id_pedido': cursor.lastrowid, **item} for item in pedido['items'])
+            eventos.append(('pedido_creado', cursor.lastrowid, pedido['id_empresa_pedido'],
+                            {'horario_entrega': pedido['horario_entrega'], 'es_envio': pedido['es_envio'],
+                             'estado_pago': 'Pendiente', 'costo_total': pedido['costo_total'],
+                             'forma_pago': pedido['forma_pago']}))
+        repositorio.ejecutar_muchos(cursor, 'pedidos.insertar_item', items)
+        _registrar_eventos_pedido(cursor, eventos)
+        conn.commit()
+        return ids_pedido
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def _aplicar_grupo_pedidos(pedidos):
+    """
+    Hilo del escritor: guarda el grupo (con BASE_POR_EMPRESA, un grupo por base). Si el grupo falla se reintenta
+    pedido por pedido, para que uno inválido no rechace a los demás; salvo con la base bloqueada, que los
+    rechazaría a todos después de esperar uno por uno.
+    """
+    resultados = [None] * len(pedidos)
+    por_base = {}
+    for i, pedido in enumerate(pedidos):
+        por_base.setdefault(pedido['id_empresa_pedido'] if BASE_POR_EMPRESA else None, []).append(i)
+    for id_empresa, indices in por_base.items():
+        with base_de_empresa(id_empresa):
+            try:
+                for i, id_pedido in zip(indices, _guardar_grupo_pedidos([pedidos[i] for i in indices])):
+                    resultados[i] = id_pedido
+                pedidos_por_commit.observar(len(indices))
+            except sqlite3.Error as e:
+                if len(indices) == 1 or 'locked' in str(e):
+                    for i in indices:
+                        resultados[i] = e
+                    continue
+                for i in indices:
+                    try:
+                        resultados[i] = _guardar_grupo_pedidos([pedidos[i]])[0]
+                    except sqlite3.Error as e_pedido:
+                        resultados[i] = e_pedido
+    return resultados
+
+escritor_pedidos = EscritorAgrupado(_aplicar_grupo_pedidos, PEDIDOS_GRUPO_MAX, PEDIDOS_GRUPO_ESPERA_SEGUNDOS,
+                                    nombre='escritor-pedidos')
+
+def _guardar_pedido(pedido):
+    """
+    Guarda un pedido nuevo y retorna su id_pedido; con PEDIDOS_ESCRITOR_UNICO, a través del escritor agrupado
+    (lanza EscrituraDemorada si no se confirma en PEDIDOS_ESPERA_MAXIMA_SEGUNDOS).
+    """
+    if PEDIDOS_ESCRITOR_UNICO:
+        return escritor_pedidos.escribir(pedido, PEDIDOS_ESPERA_MAXIMA_SEGUNDOS)
+    return _guardar_grupo_pedidos([pedido])[0]
+
 @app.route('/hacer_pedido', methods=['GET', 'POST'])
 def hacer_pedido():
     """
@@ -929,9 +2366,7 @@ def hacer_pedido():
 
     conn = conectar_db()
     cursor = conn.cursor()
-    cursor.execute("SELECT id_plato, nombre, descripcion, precio, rubro FROM platos WHERE activo = 1 AND id_empresa = ? ORDER BY id_plato ASC",
-                   (company_id_for_frontend,))
-    platos_db = cursor.fetchall()
+    platos_db = repositorio.todos(cursor, 'platos.carta', company_id_for_frontend)
     conn.close()
 
     if request.method == 'POST':
@@ -1044,40 +2479,23 @@ def hacer_pedido():
                 session.pop('carrito', None)
                 return redirect(url_for('hacer_pedido'))
 
-        conn = conectar_db()
-        cursor = conn.cursor()
+        horario_entrega_iso = horario_entrega_completo.strftime('%Y-%m-%d %H:%M:%S')
         try:
-            fecha_creacion_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            horario_entrega_iso = horario_entrega_completo.strftime('%Y-%m-%d %H:%M:%S')
-
-            cursor.execute("""
-                INSERT INTO pedidos (
-                    cliente_nombre, cliente_apellido, direccion_entrega, es_envio,
-                    horario_entrega, costo_envio, costo_total, forma_pago, estado_pago,
-                    fecha_creacion, lat_cliente, lon_cliente, id_repartidor, id_empresa
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                cliente_nombre, cliente_apellido, direccion_entrega, int(es_envio),
-                horario_entrega_iso, costo_envio_aplicado,
-                costo_total_pedido, forma_pago, "Pendiente",
-                fecha_creacion_str, lat_cliente, lon_cliente,
-                None, pedido_id_empresa
+            id_nuevo_pedido = _guardar_pedido(dict(
+                cliente_nombre=cliente_nombre, cliente_apellido=cliente_apellido,
+                direccion_entrega=direccion_entrega, es_envio=int(es_envio),
+                horario_entrega=horario_entrega_iso, costo_envio=costo_envio_aplicado,
+                costo_total=costo_total_pedido, forma_pago=forma_pago,
+                fecha_creacion=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                lat_cliente=lat_cliente, lon_cliente=lon_cliente, id_empresa_pedido=pedido_id_empresa,
+                items=[{'id_plato': item["plato_id"], 'cantidad': item["cantidad"], 'precio_unitario': item["precio_unitario"]}
+                       for item in items_pedido_para_db]
             ))
-            id_nuevo_pedido = cursor.lastrowid
-
-            for item in items_pedido_para_db:
-                cursor.execute("""
-                    INSERT INTO items_pedido (id_pedido, id_plato, cantidad, precio_unitario)
-                    VALUES (?, ?, ?, ?)
-                """, (id_nuevo_pedido, item["plato_id"], item["cantidad"], item["precio_unitario"]))
-
-            conn.commit()
-            flash(f"Pedido #{id_nuevo_pedido} realizado con éxito!", "success")
-            session.pop('carrito', None)
-            return redirect(url_for('pedido_confirmacion', id_pedido=id_nuevo_pedido))
-
+        except EscrituraDemorada as e:
+            # El escritor de pedidos está saturado: igual que una clase de admisión llena (el carrito se conserva)
+            app.logger.warning("Pedido no confirmado por el escritor de pedidos: %s", e)
+            return _rechazar_por_admision('pedido', 'saturado', ADMISION_REINTENTAR_SEGUNDOS)
         except sqlite3.Error as e:
-            conn.rollback()
             flash(f"Error al guardar el pedido: {e}", "danger")
             return render_template('hacer_pedido.html',
                                    platos=platos_db,
@@ -1087,8 +2505,13 @@ def hacer_pedido():
                                    costo_envio=get_costo_envio(),
                                    request_form=form_data_on_error,
                                    carrito=session.get('carrito', {}))
-        finally:
-            conn.close()
+
+        pedidos_creados.inc(tipo='envio' if es_envio else 'retiro')
+        _invalidar_conteo_pedidos()
+        _avisar_tableros(pedido_id_empresa)
+        flash(f"Pedido #{id_nuevo_pedido} realizado con éxito!", "success")
+        session.pop('carrito', None)
+        return redirect(url_for('pedido_confirmacion', id_pedido=id_nuevo_pedido))
 
     franjas_horarias = _generar_franjas_horarias_disponibles(company_id_for_frontend)
 
@@ -1158,9 +2581,7 @@ def add_to_cart(plato_id):
 
     conn = conectar_db()
     cursor = conn.cursor()
-    cursor.execute("SELECT id_plato, nombre, precio, rubro FROM platos WHERE id_plato = ? AND activo = 1 AND id_empresa = ?",
-                   (plato_id, company_id_for_frontend))
-    plato = cursor.fetchone()
+    plato = repositorio.uno(cursor, 'platos.activo_por_id', company_id_for_frontend, id_plato=plato_id)
     conn.close()
 
     if plato:
@@ -1250,9 +2671,7 @@ def update_cart_quantity(plato_id):
         try:
             conn = conectar_db()
             cursor = conn.cursor()
-            cursor.execute("SELECT id_plato, nombre, precio, rubro FROM platos WHERE id_plato = ? AND activo = 1 AND id_empresa = ?",
-                           (plato_id, company_id_for_frontend))
-            plato_data = cursor.fetchone()
+            plato_data = repositorio.uno(cursor, 'platos.activo_por_id', company_id_for_frontend, id_plato=plato_id)
             
             if plato_data:
                 session['carrito'][plato_id_str] = {
@@ -1293,83 +2712,427 @@ def clear_cart():
     return jsonify({"success": True, "message": "Carrito vaciado.", "total_items": 0})
 
 
-# --- Rutas de Administración/Gestión ---
+# --- Rutas de Administración/Gestión ---
+
+# --- Tablero de pedidos: filtros, paginación por clave y conteo cacheado ---
+
+# Cada conteo guarda el contador de cambios de su base (ver _contador_cambios): los otros workers no ven las
+# invalidaciones de este proceso, pero sus commits cambian el contador y el conteo deja de servir.
+
+_conteo_pedidos_cache = OrderedDict()
+_conteo_pedidos_lock = threading.Lock()
+
+def _invalidar_conteo_pedidos():
+    """Descarta los conteos cacheados del tablero (se llama tras crear o modificar pedidos)."""
+    with _conteo_pedidos_lock:
+        _conteo_pedidos_cache.clear()
+
+def _leer_filtros_tablero_pedidos(args):
+    """
+    Lee los filtros del tablero desde la query string.
+    Sin parámetros (primera carga) muestra sólo los pedidos pendientes de hoy.
+    """
+    filtros = {
+        'estado_pago': args.get('estado_pago', 'Pendiente'),
+        'fecha': args.get('fecha', datetime.now().strftime('%Y-%m-%d')).strip(),
+        'es_envio': args.get('es_envio', ''),
+        'id_repartidor': args.get('id_repartidor', ''),
+    }
+    if filtros['estado_pago'] not in ('Pendiente', 'Pagado', 'todos'):
+        filtros['estado_pago'] = 'Pendiente'
+    if filtros['fecha']:
+        try:
+            datetime.strptime(filtros['fecha'], '%Y-%m-%d')
+        except ValueError:
+            filtros['fecha'] = datetime.now().strftime('%Y-%m-%d')
+    if filtros['es_envio'] not in ('', '0', '1'):
+        filtros['es_envio'] = ''
+    if filtros['id_repartidor'] not in ('', 'sin') and not filtros['id_repartidor'].isdigit():
+        filtros['id_repartidor'] = ''
+    return filtros
+
+def _condiciones_tablero_pedidos(filtros):
+    """
+    Traduce los filtros del tablero a los filtros opcionales de las consultas 'pedidos.tablero_*'.
+    Retorna (filtros_activos, params).
+    """
+    activos, params = [], {}
+    if filtros['estado_pago'] != 'todos':
+        activos.append('estado_pago')
+        params['estado_pago'] = filtros['estado_pago']
+    if filtros['fecha']:
+        inicio_dia = _a_epoch(datetime.strptime(filtros['fecha'], '%Y-%m-%d'))
+        activos.append('fecha')
+        params.update(desde=inicio_dia, hasta=inicio_dia + 86399)
+    if filtros['es_envio']:
+        activos.append('es_envio')
+        params['es_envio'] = int(filtros['es_envio'])
+    if filtros['id_repartidor'] == 'sin':
+        activos.append('sin_repartidor')
+    elif filtros['id_repartidor']:
+        activos.append('id_repartidor')
+        params['id_repartidor'] = int(filtros['id_repartidor'])
+    return activos, params
+
+def _contar_pedidos_cacheado(alcance, activos, params):
+    """
+    Cuenta los pedidos que cumplen los filtros, reutilizando el resultado durante CONTEO_PEDIDOS_CACHE_SEGUNDOS
+    mientras la base no cambie.
+    """
+    id_base = _empresa_de_la_conexion() if BASE_POR_EMPRESA else None
+    clave = (id_base, alcance, tuple(activos), tuple(sorted(params.items())))
+    ahora = time.monotonic()
+    # Se lee antes de contar: un commit en medio deja un conteo que ya no coincide con el contador
+    version = _contador_cambios(_rutas_base(id_base)[0])
+    with _conteo_pedidos_lock:
+        en_cache = _conteo_pedidos_cache.get(clave)
+        if en_cache and ahora - en_cache[0] < CONTEO_PEDIDOS_CACHE_SEGUNDOS and en_cache[1] == version:
+            _conteo_pedidos_cache.move_to_end(clave)
+            consultas_cache.inc(cache='conteo_pedidos', resultado='acierto')
+            return en_cache[2]
+    consultas_cache.inc(cache='conteo_pedidos', resultado='fallo')
+
+    conn = conectar_db()
+    cursor = conn.cursor()
+    total = repositorio.uno(cursor, 'pedidos.tablero_conteo', alcance, activos, **params)[0]
+    conn.close()
+
+    with _conteo_pedidos_lock:
+        _conteo_pedidos_cache[clave] = (ahora, version, total)
+        _conteo_pedidos_cache.move_to_end(clave)
+        while len(_conteo_pedidos_cache) > CONTEO_PEDIDOS_CACHE_MAX:
+            _conteo_pedidos_cache.popitem(last=False)
+    return total
+
+def _parsear_cursor_pedidos(valor):
+    """Convierte el cursor 'horario_entrega|id_pedido' de la query string en parámetros, o None si es inválido."""
+    if not valor or '|' not in valor:
+        return None
+    horario, id_pedido = valor.rsplit('|', 1)
+    if not id_pedido.isdigit():
+        return None
+    try:
+        return {'cursor_horario': _a_epoch(datetime.fromisoformat(horario)), 'cursor_id': int(id_pedido)}
+    except ValueError:
+        return None
+
+def _procesar_fila_tablero(row):
+    """Convierte una fila del tablero en dict y agrega el horario formateado para la plantilla."""
+    p_dict = dict(row)
+    h = p_dict['horario_entrega'] # 'AAAA-MM-DD HH:MM:SS'
+    p_dict['horario_entrega_formateado'] = f"{h[8:10]}/{h[5:7]} {h[11:16]}"
+    return p_dict
+
+def _obtener_repartidores_tablero():
+    """Repartidores visibles para el usuario actual, para los selectores del tablero."""
+    conn = conectar_db()
+    cursor = conn.cursor()
+    repartidores = repositorio.todos(cursor, 'repartidores.tablero', alcance_empresa())
+    conn.close()
+
+    app.logger.debug("Repartidores cargados para gestión: %d", len(repartidores))
+    return repartidores
+
+@app.route('/gestion/pedidos')
+@login_required
+def gestion_pedidos():
+    if not (current_user.has_role('super_admin') or current_user.has_role('admin_empresa') or current_user.has_role('empleado')):
+        flash("No tienes permiso para acceder a esta página.", "danger")
+        return redirect(url_for('index'))
+
+    filtros = _leer_filtros_tablero_pedidos(request.args)
+    alcance = alcance_empresa()
+    activos, params = _condiciones_tablero_pedidos(filtros)
+    total_pedidos = _contar_pedidos_cacheado(alcance, activos, params)
+
+    cursor_pagina = _parsear_cursor_pedidos(request.args.get('despues'))
+    if cursor_pagina:
+        activos.append('despues')
+        params.update(cursor_pagina)
+
+    conn = conectar_db()
+    cursor = conn.cursor()
+    pedidos = repositorio.todos(cursor, 'pedidos.tablero_pagina', alcance, activos,
+                                limite=PEDIDOS_POR_PAGINA + 1, **params)
+    conn.close()
+
+    siguiente_cursor = None
+    if len(pedidos) > PEDIDOS_POR_PAGINA:
+        pedidos = pedidos[:PEDIDOS_POR_PAGINA]
+        ultimo = pedidos[-1]
+        siguiente_cursor = f"{ultimo['horario_entrega']}|{ultimo['id_pedido']}"
+
+    pedidos_procesados = [_procesar_fila_tablero(p) for p in pedidos]
+    repartidores = _obtener_repartidores_tablero()
+
+    return render_template('gestion_pedidos.html',
+                           pedidos=pedidos_procesados,
+                           repartidores=repartidores,
+                           filtros=filtros,
+                           total_pedidos=total_pedidos,
+                           siguiente_cursor=siguiente_cursor,
+                           es_primera_pagina=cursor_pagina is None)
+
+
+# --- Actualizaciones en vivo del tablero (SSE) ---
+# Cada stream lee el registro de eventos (pedido_eventos) desde su posición, así ve los cambios hechos por cualquier
+# worker; el Last-Event-ID es esa posición y el navegador retoma desde ahí al reconectar. Con BASE_POR_EMPRESA cada
+# base numera sus eventos, y la posición es el último id_evento leído de cada una ('2:15,3:40').
+
+_EVENTOS_TABLERO = ('pedido_creado', 'repartidor_asignado', 'pedido_pagado')
+
+def _avisar_tableros(id_empresa):
+    """Despierta a los tableros de este proceso para que lean ya el registro. Sólo se llama después del commit."""
+    difusor_eventos.avisar(id_empresa)
+
+def _bases_eventos_tablero(id_empresa):
+    """Bases cuyo registro lee el tablero: la general o, con BASE_POR_EMPRESA, la de la empresa (todas para super_admin)."""
+    if not BASE_POR_EMPRESA:
+        return [None]
+    return _ids_empresas() if id_empresa is None else [id_empresa]
+
+def _texto_posicion_eventos(posicion):
+    if list(posicion) == [None]:
+        return str(posicion[None])
+    return ','.join(f"{base}:{id_evento}" for base, id_evento in posicion.items())
+
+def _posicion_inicial_eventos(ultimo_id, bases):
+    """
+    {base: id_evento} desde donde sigue el stream: la del Last-Event-ID para las bases que nombra; para el resto
+    (o si no hay uno válido), el último evento de la base, es decir, sólo los cambios desde ahora.
+    """
+    posicion = {}
+    try:
+        if ultimo_id and bases == [None]:
+            posicion[None] = int(ultimo_id)
+        elif ultimo_id:
+            posicion = {int(base): int(id_evento) for base, id_evento in (par.split(':') for par in ultimo_id.split(','))}
+    except ValueError:
+        posicion = {}
+    for base in bases:
+        if base not in posicion:
+            conn = _conexion_del_hilo(base)
+            try:
+                posicion[base] = repositorio.uno(conn.cursor(), 'eventos.ultimo')['ultimo']
+            finally:
+                conn.close()
+    return {base: posicion[base] for base in bases}
+
+def _leer_eventos_tablero(id_empresa, posicion):
+    """
+    Eventos del tablero posteriores a 'posicion', como [(Last-Event-ID, tipo, datos)], y la posición nueva. La
+    posición avanza también sobre los eventos que no son para este tablero (otra empresa, movimientos de caja).
+    """
+    posicion, eventos = dict(posicion), []
+    for base in posicion:
+        conn = _conexion_del_hilo(base)
+        try:
+            filas = repositorio.todos(conn.cursor(), 'eventos.desde', desde=posicion[base], limite=EVENTOS_PEDIDO_LOTE_LECTURA)
+        except sqlite3.Error as e:
+            # Se reintenta en el próximo sondeo desde la misma posición
+            app.logger.warning("No se pudo leer el registro de eventos para el tablero: %s", e)
+            continue
+        finally:
+            conn.close()
+        for fila in filas:
+            posicion[base] = fila['id_evento']
+            if fila['tipo'] in _EVENTOS_TABLERO and (id_empresa is None or fila['id_empresa'] == id_empresa):
+                # Con BASE_POR_EMPRESA cada base numera sus pedidos: la fila se pide por empresa e id
+                datos = dict(json.loads(fila['datos']), id_pedido=fila['id_pedido'], id_empresa=fila['id_empresa'])
+                eventos.append((_texto_posicion_eventos(posicion), fila['tipo'], datos))
+    return eventos, posicion
+
+@app.route('/gestion/pedidos/eventos')
+@login_required
+def eventos_pedidos():
+    """Stream SSE con los cambios de pedidos de la empresa del usuario (todas para super_admin)."""
+    if not (current_user.has_role('super_admin') or current_user.has_role('admin_empresa') or current_user.has_role('empleado')):
+        return jsonify({"success": False, "message": "No autorizado."}), 403
+
+    if current_user.has_role('super_admin'):
+        id_empresa = None
+    elif current_user.id_empresa:
+        id_empresa = current_user.id_empresa
+    else:
+        return jsonify({"success": False, "message": "Tu usuario no tiene una empresa asignada."}), 403
+
+    posicion = _posicion_inicial_eventos(request.headers.get('Last-Event-ID'), _bases_eventos_tablero(id_empresa))
+    suscripcion = difusor_eventos.suscribir(id_empresa)
+    stream = difusor_eventos.escuchar(suscripcion, lambda desde: _leer_eventos_tablero(id_empresa, desde), posicion,
+                                      intervalo_sondeo=SSE_SONDEO_SEGUNDOS,
+                                      intervalo_latido=SSE_INTERVALO_LATIDO_SEGUNDOS,
+                                      duracion_maxima=SSE_DURACION_MAXIMA_SEGUNDOS)
+    return Response(stream, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/gestion/pedidos/<int:id_empresa>/<int:id_pedido>/fila')
+@login_required
+def fila_pedido_tablero(id_empresa, id_pedido):
+    """
+    Devuelve el HTML de una fila del tablero, para que la página la reemplace o inserte sin recargar.
+    Con BASE_POR_EMPRESA el id_pedido sólo es único dentro de la base de su empresa.
+    """
+    if not (current_user.has_role('super_admin') or current_user.has_role('admin_empresa') or current_user.has_role('empleado')):
+        return "", 403
+    # Otra empresa, o una que no existe (no se abre una base nueva para ella)
+    if alcance_empresa() not in (TODAS_LAS_EMPRESAS, id_empresa) or (BASE_POR_EMPRESA and id_empresa not in _ids_empresas()):
+        return "", 404
+
+    with base_de_empresa(id_empresa):
+        conn = conectar_db()
+        cursor = conn.cursor()
+        pedido = repositorio.uno(cursor, 'pedidos.tablero_fila', alcance_empresa(), id_pedido=id_pedido)
+        conn.close()
+        if not pedido:
+            return "", 404
+        repartidores = _obtener_repartidores_tablero()
+
+    fila_pedido = get_template_attribute('_fila_pedido.html', 'fila_pedido')
+    return fila_pedido(_procesar_fila_tablero(pedido), repartidores)
+
+@app.route('/gestion/pedido/<int:id_pedido>/detalle')
+@login_required
+def detalle_pedido(id_pedido):
+    if not (current_user.has_role('super_admin') or current_user.has_role('admin_empresa') or current_user.has_role('empleado')):
+        flash("No tienes permiso para acceder a esta página.", "danger")
+        return redirect(url_for('index'))
+
+    pedido = _obtener_pedido_completo_por_id(id_pedido)
+    if not pedido:
+        flash("Pedido no encontrado.", "danger")
+        return redirect(url_for('gestion_pedidos'))
+
+    ticket_html = pedido.generar_ticket()
+    return render_template('pedido_confirmacion.html', pedido=pedido, ticket_html=ticket_html, admin_view=True)
+
+@app.route('/gestion/pedido/<int:id_pedido>/ticket.escpos')
+@login_required
+def ticket_escpos(id_pedido):
+    """Descarga el ticket en formato ESC/POS, para agentes de impresión locales."""
+    if not (current_user.has_role('super_admin') or current_user.has_role('admin_empresa') or current_user.has_role('empleado')):
+        return "", 403
+
+    pedido = _obtener_pedido_completo_por_id(id_pedido)
+    if not pedido:
+        return "", 404
+    return Response(pedido.generar_ticket_escpos(), mimetype='application/octet-stream',
+                    headers={'Content-Disposition': f'attachment; filename=ticket_{id_pedido}.bin'})
 
-@app.route('/gestion/pedidos')
+@app.route('/gestion/pedido/<int:id_pedido>/imprimir_cocina', methods=['POST'])
 @login_required
-def gestion_pedidos():
+def imprimir_ticket_cocina(id_pedido):
+    """Envía el ticket ESC/POS directamente a la impresora térmica de cocina configurada."""
     if not (current_user.has_role('super_admin') or current_user.has_role('admin_empresa') or current_user.has_role('empleado')):
-        flash("No tienes permiso para acceder a esta página.", "danger")
+        flash("No tienes permiso para realizar esta acción.", "danger")
         return redirect(url_for('index'))
 
-    conn = conectar_db()
-    cursor = conn.cursor()
+    if not IMPRESORA_COCINA_HOST:
+        flash("No hay una impresora de cocina configurada (IMPRESORA_COCINA_HOST en config.py).", "warning")
+        return redirect(url_for('detalle_pedido', id_pedido=id_pedido))
 
-    base_query = """
-        SELECT p.id_pedido, p.cliente_nombre, p.cliente_apellido, p.direccion_entrega, p.horario_entrega,
-               p.forma_pago, p.costo_total, p.estado_pago, p.es_envio,
-               r.nombre AS repartidor_nombre, r.apellido AS repartidor_apellido,
-               e.nombre AS nombre_empresa
-        FROM pedidos p
-        LEFT JOIN repartidores r ON p.id_repartidor = r.id_repartidor
-        LEFT JOIN empresas e ON p.id_empresa = e.id_empresa
-    """
-    where_conditions, query_params = get_company_filter_conditions_and_params(table_alias='p')
-    
-    final_query_parts = [base_query]
-    if where_conditions:
-        final_query_parts.append("WHERE " + " AND ".join(where_conditions))
-    
-    final_query_parts.append("ORDER BY p.horario_entrega DESC")
-    
-    final_query = " ".join(final_query_parts)
+    pedido = _obtener_pedido_completo_por_id(id_pedido)
+    if not pedido:
+        flash("Pedido no encontrado.", "danger")
+        return redirect(url_for('gestion_pedidos'))
 
-    cursor.execute(final_query, query_params)
-    pedidos = cursor.fetchall()
-    conn.close()
+    if COLA_TRABAJOS:
+        # La impresora puede estar apagada o tardar: la cola reintenta sin hacer esperar a la petición
+        encolar_trabajo('imprimir_ticket_cocina', {'id_pedido': id_pedido, 'id_empresa': pedido.id_empresa})
+        flash(f"Ticket del pedido #{id_pedido} enviado a la cola de impresión de la cocina.", "success")
+        return redirect(url_for('detalle_pedido', id_pedido=id_pedido))
+    try:
+        enviar_a_impresora(pedido.generar_ticket_escpos(), IMPRESORA_COCINA_HOST, IMPRESORA_COCINA_PUERTO)
+        flash(f"Ticket del pedido #{id_pedido} enviado a la impresora de cocina.", "success")
+    except OSError as e:
+        flash(f"No se pudo imprimir en la impresora de cocina: {e}", "danger")
+    return redirect(url_for('detalle_pedido', id_pedido=id_pedido))
+
+@tarea_de_cola('imprimir_ticket_cocina')
+def _tarea_imprimir_ticket_cocina(id_pedido, id_empresa=None):
+    """Tarea de la cola: envía el ticket a la impresora de cocina (si no responde, lanza y la cola reintenta)."""
+    with base_de_empresa(id_empresa):
+        pedido = _obtener_pedido_completo_por_id(id_pedido)
+    if not pedido:
+        raise LookupError(f"Pedido #{id_pedido} no encontrado.")
+    enviar_a_impresora(pedido.generar_ticket_escpos(), IMPRESORA_COCINA_HOST, IMPRESORA_COCINA_PUERTO)
+
+# --- Impresión por lote de los tickets de una franja horaria ---
 
-    pedidos_procesados = []
-    for p in pedidos:
-        p_dict = dict(p)
-        p_dict['horario_entrega_dt'] = datetime.strptime(p_dict['horario_entrega'], '%Y-%m-%d %H:%M:%S')
-        pedidos_procesados.append(p_dict)
+def _inicio_proxima_franja(ahora=None):
+    """Inicio de la próxima franja de INTERVALO_FRANJAS_MINUTOS a partir de ahora."""
+    ahora = ahora or datetime.now()
+    inicio = ahora + timedelta(minutes=(INTERVALO_FRANJAS_MINUTOS - ahora.minute % INTERVALO_FRANJAS_MINUTOS) % INTERVALO_FRANJAS_MINUTOS)
+    return inicio.replace(second=0, microsecond=0)
 
+def _obtener_pedidos_de_franja(inicio_franja, id_empresa=None):
+    """
+    Pedidos completos con entrega dentro de [inicio_franja, inicio_franja + INTERVALO_FRANJAS_MINUTOS), por horario.
+    Sin id_empresa, los de la empresa del usuario actual (ver alcance_empresa).
+    """
+    fin_franja = inicio_franja + timedelta(minutes=INTERVALO_FRANJAS_MINUTOS)
     conn = conectar_db()
     cursor = conn.cursor()
-    base_repartidores_query = "SELECT id_repartidor, nombre, apellido, activo FROM repartidores"
-    where_rep_conditions, query_rep_params = get_company_filter_conditions_and_params() # No table_alias for repartidores directly
-    
-    final_rep_query_parts = [base_repartidores_query]
-    if where_rep_conditions:
-        final_rep_query_parts.append("WHERE " + " AND ".join(where_rep_conditions))
-    
-    final_rep_query_parts.append("ORDER BY nombre, apellido")
-    final_rep_query = " ".join(final_rep_query_parts)
-
-    cursor.execute(final_rep_query, query_rep_params)
-    repartidores = cursor.fetchall()
+    filas = repositorio.todos(cursor, 'pedidos.ids_de_franja', alcance_empresa() if id_empresa is None else id_empresa,
+                              desde=_a_epoch(inicio_franja), hasta=_a_epoch(fin_franja))
+    ids_pedido = [row['id_pedido'] for row in filas]
     conn.close()
+    return _obtener_pedidos_completos_por_ids(ids_pedido)
 
-    print(f"Repartidores cargados para gestión: {repartidores}")
-
-    return render_template('gestion_pedidos.html',
-                           pedidos=pedidos_procesados,
-                           repartidores=repartidores)
+def _leer_inicio_franja(fecha_str, hora_str):
+    """Interpreta fecha (AAAA-MM-DD) y hora (HH:MM) opcionales; sin hora se usa la próxima franja. Lanza ValueError si son inválidas."""
+    if not hora_str:
+        return _inicio_proxima_franja()
+    fecha = datetime.strptime(fecha_str, '%Y-%m-%d').date() if fecha_str else datetime.now().date()
+    return datetime.combine(fecha, datetime.strptime(hora_str, '%H:%M').time())
 
-@app.route('/gestion/pedido/<int:id_pedido>/detalle')
+@app.route('/gestion/impresion/franja', methods=['POST'])
 @login_required
-def detalle_pedido(id_pedido):
+def imprimir_tickets_franja():
+    """Lanza en segundo plano el renderizado de todos los tickets de una franja y redirige a la página del trabajo."""
     if not (current_user.has_role('super_admin') or current_user.has_role('admin_empresa') or current_user.has_role('empleado')):
-        flash("No tienes permiso para acceder a esta página.", "danger")
+        flash("No tienes permiso para realizar esta acción.", "danger")
         return redirect(url_for('index'))
 
-    pedido = _obtener_pedido_completo_por_id(id_pedido)
-    if not pedido:
-        flash("Pedido no encontrado.", "danger")
+    formato = request.form.get('formato', 'html')
+    if formato not in ('html', 'escpos'):
+        formato = 'html'
+    try:
+        inicio_franja = _leer_inicio_franja(request.form.get('fecha', '').strip(), request.form.get('hora', '').strip())
+    except ValueError:
+        flash("Fecha u hora de franja inválida.", "danger")
+        return redirect(_url_tablero_pedidos())
+
+    pedidos = _obtener_pedidos_de_franja(inicio_franja)
+    if not pedidos:
+        flash(f"No hay pedidos para la franja de las {inicio_franja.strftime('%H:%M')}.", "info")
+        return redirect(_url_tablero_pedidos())
+
+    descripcion = f"Franja {inicio_franja.strftime('%d/%m %H:%M')}"
+    id_trabajo = impresion_lote.iniciar_trabajo(pedidos, formato, descripcion, current_user.id, IMPRESION_TRABAJOS_DIRECTORIO,
+                                                procesos=IMPRESION_LOTE_PROCESOS, tamano_lote=IMPRESION_LOTE_TAMANO,
+                                                ancho=TICKET_ANCHO_COLUMNAS,
+                                                conservar_segundos=IMPRESION_TRABAJOS_CONSERVAR_SEGUNDOS)
+    return redirect(url_for('trabajo_impresion', id_trabajo=id_trabajo))
+
+@app.route('/gestion/impresion/trabajo/<id_trabajo>')
+@login_required
+def trabajo_impresion(id_trabajo):
+    """Muestra el avance de un trabajo de impresión y, cuando termina, el documento combinado."""
+    trabajo = impresion_lote.estado_trabajo(id_trabajo, IMPRESION_TRABAJOS_DIRECTORIO, IMPRESION_TRABAJOS_VENCIMIENTO_SEGUNDOS)
+    if not trabajo or trabajo['id_usuario'] != current_user.id:
+        flash("Trabajo de impresión no encontrado.", "danger")
         return redirect(url_for('gestion_pedidos'))
 
-    ticket_html = pedido.generar_ticket()
-    return render_template('pedido_confirmacion.html', pedido=pedido, ticket_html=ticket_html, admin_view=True)
+    if trabajo['estado'] == 'en_proceso':
+        return render_template('trabajo_impresion.html', trabajo=trabajo)
+    if trabajo['estado'] == 'error':
+        flash(f"Error al generar los tickets: {trabajo['error']}", "danger")
+        return redirect(url_for('gestion_pedidos'))
+
+    if trabajo['formato'] == 'escpos':
+        return Response(b''.join(trabajo['tickets']), mimetype='application/octet-stream',
+                        headers={'Content-Disposition': f'attachment; filename=tickets_{id_trabajo[:8]}.bin'})
+    return render_template('_documento_tickets.html', titulo=trabajo['descripcion'], tickets=trabajo['tickets'])
 
 @app.route('/gestion/pedido/<int:id_pedido>/asignar_repartidor', methods=['POST'])
 @login_required
@@ -1386,24 +3149,22 @@ def asignar_repartidor(id_pedido):
     conn = conectar_db()
     cursor = conn.cursor()
     try:
-        update_query_base = "UPDATE pedidos SET id_repartidor = ?"
-        update_where_conditions = ["id_pedido = ?"]
-        update_params = [id_repartidor, id_pedido]
-
-        company_conditions, company_params = get_company_filter_conditions_and_params()
-        update_where_conditions.extend(company_conditions)
-        update_params.extend(company_params)
-
-        final_update_query = update_query_base + " WHERE " + " AND ".join(update_where_conditions)
-
-        cursor.execute(final_update_query, update_params)
+        repositorio.ejecutar(cursor, 'pedidos.asignar_repartidor', alcance_empresa(),
+                             id_repartidor=id_repartidor, id_pedido=id_pedido)
 
         if cursor.rowcount == 0 and not current_user.has_role('super_admin'):
              flash("Pedido no encontrado o no tienes permiso para asignarle un repartidor.", "danger")
              conn.rollback()
              return redirect(url_for('gestion_pedidos'))
 
+        pedido_row = repositorio.uno(cursor, 'pedidos.empresa', id_pedido=id_pedido)
+        if pedido_row:
+            _registrar_eventos_pedido(cursor, [('repartidor_asignado', id_pedido, pedido_row['id_empresa'],
+                                                {'id_repartidor': int(id_repartidor)})])
         conn.commit()
+        _invalidar_conteo_pedidos()
+        if pedido_row:
+            _avisar_tableros(pedido_row['id_empresa'])
         flash(f"Repartidor asignado al pedido #{id_pedido} con éxito.", "success")
     except sqlite3.Error as e:
         conn.rollback()
@@ -1438,37 +3199,29 @@ def marcar_pedido_pagado(id_pedido):
     try:
         fecha_pago_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-        update_query_base = "UPDATE pedidos SET estado_pago = 'Pagado', fecha_pago = ?"
-        update_where_conditions = ["id_pedido = ?"]
-        update_params_pedido = [fecha_pago_str, id_pedido]
-        
-        company_conditions, company_params = get_company_filter_conditions_and_params()
-        update_where_conditions.extend(company_conditions)
-        update_params_pedido.extend(company_params)
-
-        final_update_query = update_query_base + " WHERE " + " AND ".join(update_where_conditions)
-        cursor.execute(final_update_query, update_params_pedido)
-
+        repositorio.ejecutar(cursor, 'pedidos.marcar_pagado', alcance_empresa(),
+                             fecha_pago=fecha_pago_str, id_pedido=id_pedido)
 
         if cursor.rowcount == 0 and not current_user.has_role('super_admin'):
             flash("Pedido no encontrado o no tienes permiso para marcarlo como pagado.", "danger")
             conn.rollback()
             return redirect(url_for('gestion_pedidos'))
 
-        cursor.execute("""
-            INSERT INTO ingresos_egresos (tipo, monto, descripcion, fecha_hora, id_pedido_origen, id_repartidor_origen, id_empresa)
-            VALUES (?, ?, ?, ?, ?, NULL, ?)
-        """, ('Ingreso', pedido.costo_total, f"Pago de Pedido #{id_pedido} ({pedido.forma_pago})", fecha_pago_str, pedido.id_pedido, pedido.id_empresa))
+        _registrar_movimiento_caja(cursor, 'Ingreso', pedido.costo_total, f"Pago de Pedido #{id_pedido} ({pedido.forma_pago})",
+                                   fecha_pago_str, id_pedido_origen=pedido.id_pedido, id_empresa=pedido.id_empresa)
 
         if pedido.es_envio and pedido.id_repartidor:
             pago_repartidor = get_pago_repartidor_por_envio()
-            cursor.execute("""
-                INSERT INTO ingresos_egresos (tipo, monto, descripcion, fecha_hora, id_pedido_origen, id_repartidor_origen, id_empresa)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, ('Pago a Repartidor', pago_repartidor, f"Pago por envío Pedido #{id_pedido}", fecha_pago_str, pedido.id_pedido, pedido.id_repartidor, pedido.id_empresa))
+            _registrar_movimiento_caja(cursor, 'Pago a Repartidor', pago_repartidor, f"Pago por envío Pedido #{id_pedido}",
+                                       fecha_pago_str, id_pedido_origen=pedido.id_pedido,
+                                       id_repartidor_origen=pedido.id_repartidor, id_empresa=pedido.id_empresa)
             flash(f"Se registró un pago de ${pago_repartidor:,.2f} al repartidor por este envío.", "info")
 
+        _registrar_eventos_pedido(cursor, [('pedido_pagado', id_pedido, pedido.id_empresa,
+                                            {'fecha_pago': fecha_pago_str, 'costo_total': pedido.costo_total})])
         conn.commit()
+        _invalidar_conteo_pedidos()
+        _avisar_tableros(pedido.id_empresa)
         flash(f"Pedido #{id_pedido} marcado como pagado y registrado como ingreso.", "success")
 
     except sqlite3.Error as e:
@@ -1478,6 +3231,195 @@ def marcar_pedido_pagado(id_pedido):
         conn.close()
     return redirect(url_for('gestion_pedidos'))
 
+# --- Operaciones por lote sobre pedidos (despacho y cobro de varios pedidos a la vez) ---
+
+_ETIQUETAS_RESULTADO_LOTE = {
+    'asignado': "asignado(s)",
+    'pagado': "marcado(s) como pagado(s)",
+    'ya_pagado': "ya estaba(n) pagado(s)",
+    'no_es_envio': "no es/son envío(s)",
+    'empresa_distinta': "de otra empresa que el repartidor",
+    'no_encontrado': "no encontrado(s) o sin permiso",
+    'error': "con error",
+}
+
+def _es_peticion_json():
+    return request.is_json or request.accept_mimetypes.best == 'application/json'
+
+def _leer_ids_pedido_lote():
+    """Lee los ids de pedido del formulario (ids_pedido repetido) o de un cuerpo JSON {"ids_pedido": [...]}, sin duplicados."""
+    if request.is_json:
+        valores = (request.get_json(silent=True) or {}).get('ids_pedido', [])
+    else:
+        valores = request.form.getlist('ids_pedido')
+    ids = []
+    for valor in valores:
+        try:
+            ids.append(int(valor))
+        except (TypeError, ValueError):
+            continue
+    return list(dict.fromkeys(ids))
+
+def _cargar_cabeceras_pedidos(cursor, ids_pedido):
+    """Lee los datos de cabecera de varios pedidos aplicando el filtro de empresa. Retorna {id_pedido: Row}."""
+    filas = repositorio.todos(cursor, 'pedidos.cabeceras', alcance_empresa(), ids=lista_json(ids_pedido))
+    return {row['id_pedido']: row for row in filas}
+
+def _url_tablero_pedidos():
+    """URL del tablero a la que volver, conservando los filtros si la petición vino desde él."""
+    referrer = request.referrer
+    if referrer and referrer.startswith(request.host_url) and urlparse(referrer).path == url_for('gestion_pedidos'):
+        return referrer
+    return url_for('gestion_pedidos')
+
+def _responder_operacion_lote(resultados, error=None):
+    """Responde con el resumen por pedido: JSON para llamadas AJAX/API, o flash y vuelta al tablero para formularios."""
+    resumen = {}
+    for resultado in resultados:
+        resumen[resultado['resultado']] = resumen.get(resultado['resultado'], 0) + 1
+
+    if _es_peticion_json():
+        cuerpo = {"success": error is None, "resultados": resultados, "resumen": resumen}
+        if error:
+            cuerpo["message"] = error
+        return jsonify(cuerpo), (500 if error else 200)
+
+    if error:
+        flash(error, "danger")
+    else:
+        partes = [f"{cantidad} {_ETIQUETAS_RESULTADO_LOTE.get(estado, estado)}" for estado, cantidad in resumen.items()]
+        flash("Pedidos procesados: " + ", ".join(partes) + ".", "success" if set(resumen) <= {'asignado', 'pagado'} else "warning")
+    return redirect(_url_tablero_pedidos())
+
+def _rechazar_operacion_lote(mensaje, codigo=400):
+    if _es_peticion_json():
+        return jsonify({"success": False, "message": mensaje}), codigo
+    flash(mensaje, "danger")
+    return redirect(_url_tablero_pedidos())
+
+@app.route('/gestion/pedidos/asignar_repartidor', methods=['POST'])
+@login_required
+def asignar_repartidor_lote():
+    """Asigna el mismo repartidor a varios pedidos de envío en una única transacción."""
+    if not (current_user.has_role('super_admin') or current_user.has_role('admin_empresa')):
+        return _rechazar_operacion_lote("No tienes permiso para realizar esta acción.", 403)
+
+    ids_pedido = _leer_ids_pedido_lote()
+    id_repartidor = (request.get_json(silent=True) or {}).get('id_repartidor') if request.is_json else request.form.get('id_repartidor')
+    if not ids_pedido:
+        return _rechazar_operacion_lote("Debe seleccionar al menos un pedido.")
+    try:
+        id_repartidor = int(id_repartidor)
+    except (TypeError, ValueError):
+        return _rechazar_operacion_lote("Debe seleccionar un repartidor.")
+
+    conn = conectar_db()
+    cursor = conn.cursor()
+    resultados = []
+    asignados = []
+    try:
+        _iniciar_escritura(cursor)
+
+        repartidor = repositorio.uno(cursor, 'repartidores.empresa_si_activo', alcance_empresa(), id_repartidor=id_repartidor)
+        if not repartidor:
+            conn.rollback()
+            return _rechazar_operacion_lote("Repartidor no encontrado, inactivo o no tienes permiso para asignarlo.", 404)
+
+        cabeceras = _cargar_cabeceras_pedidos(cursor, ids_pedido)
+        for id_pedido in ids_pedido:
+            cabecera = cabeceras.get(id_pedido)
+            if not cabecera:
+                resultados.append({"id_pedido": id_pedido, "resultado": "no_encontrado"})
+            elif not cabecera['es_envio']:
+                resultados.append({"id_pedido": id_pedido, "resultado": "no_es_envio"})
+            elif cabecera['id_empresa'] != repartidor['id_empresa']:
+                resultados.append({"id_pedido": id_pedido, "resultado": "empresa_distinta"})
+            else:
+                asignados.append((id_pedido, cabecera['id_empresa']))
+                resultados.append({"id_pedido": id_pedido, "resultado": "asignado"})
+
+        repositorio.ejecutar_muchos(cursor, 'pedidos.asignar_repartidor_por_id',
+                                    [{'id_repartidor': id_repartidor, 'id_pedido': id_pedido} for id_pedido, _ in asignados])
+        _registrar_eventos_pedido(cursor, [('repartidor_asignado', id_pedido, id_empresa, {'id_repartidor': id_repartidor})
+                                           for id_pedido, id_empresa in asignados])
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        return _responder_operacion_lote([{"id_pedido": i, "resultado": "error"} for i in ids_pedido],
+                                         error=f"Error al asignar repartidor: {e}")
+    finally:
+        conn.close()
+
+    if asignados:
+        _invalidar_conteo_pedidos()
+    for id_empresa in {id_empresa for _, id_empresa in asignados}:
+        _avisar_tableros(id_empresa)
+    return _responder_operacion_lote(resultados)
+
+@app.route('/gestion/pedidos/marcar_pagados', methods=['POST'])
+@login_required
+def marcar_pedidos_pagados_lote():
+    """
+    Marca varios pedidos como pagados en una única transacción: actualiza los pedidos y
+    registra los ingresos (y pagos a repartidores de los envíos) con executemany.
+    """
+    if not (current_user.has_role('super_admin') or current_user.has_role('admin_empresa') or current_user.has_role('empleado')):
+        return _rechazar_operacion_lote("No tienes permiso para realizar esta acción.", 403)
+
+    ids_pedido = _leer_ids_pedido_lote()
+    if not ids_pedido:
+        return _rechazar_operacion_lote("Debe seleccionar al menos un pedido.")
+
+    pago_repartidor = get_pago_repartidor_por_envio()
+    conn = conectar_db()
+    cursor = conn.cursor()
+    resultados = []
+    pagados = []
+    try:
+        _iniciar_escritura(cursor)
+        cabeceras = _cargar_cabeceras_pedidos(cursor, ids_pedido)
+        fecha_pago_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        movimientos = []
+        for id_pedido in ids_pedido:
+            cabecera = cabeceras.get(id_pedido)
+            if not cabecera:
+                resultados.append({"id_pedido": id_pedido, "resultado": "no_encontrado"})
+                continue
+            if cabecera['estado_pago'] == 'Pagado':
+                resultados.append({"id_pedido": id_pedido, "resultado": "ya_pagado"})
+                continue
+
+            resultado = {"id_pedido": id_pedido, "resultado": "pagado", "monto": cabecera['costo_total']}
+            movimientos.append(('Ingreso', cabecera['costo_total'], f"Pago de Pedido #{id_pedido} ({cabecera['forma_pago']})",
+                                fecha_pago_str, id_pedido, None, cabecera['id_empresa']))
+            if cabecera['es_envio'] and cabecera['id_repartidor']:
+                movimientos.append(('Pago a Repartidor', pago_repartidor, f"Pago por envío Pedido #{id_pedido}",
+                                    fecha_pago_str, id_pedido, cabecera['id_repartidor'], cabecera['id_empresa']))
+                resultado['pago_repartidor'] = pago_repartidor
+            pagados.append((id_pedido, cabecera['id_empresa']))
+            resultados.append(resultado)
+
+        repositorio.ejecutar_muchos(cursor, 'pedidos.marcar_pagado_por_id',
+                                    [{'fecha_pago': fecha_pago_str, 'id_pedido': id_pedido} for id_pedido, _ in pagados])
+        _registrar_movimientos_caja(cursor, movimientos)
+        _registrar_eventos_pedido(cursor, [('pedido_pagado', id_pedido, id_empresa,
+                                            {'fecha_pago': fecha_pago_str, 'costo_total': cabeceras[id_pedido]['costo_total']})
+                                           for id_pedido, id_empresa in pagados])
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        return _responder_operacion_lote([{"id_pedido": i, "resultado": "error"} for i in ids_pedido],
+                                         error=f"Error al marcar los pedidos como pagados: {e}")
+    finally:
+        conn.close()
+
+    if pagados:
+        _invalidar_conteo_pedidos()
+    for id_empresa in {id_empresa for _, id_empresa in pagados}:
+        _avisar_tableros(id_empresa)
+    return _responder_operacion_lote(resultados)
+
 @app.route('/gestion/catalogo')
 @login_required
 def gestion_catalogo():
@@ -1488,18 +3430,7 @@ def gestion_catalogo():
     conn = conectar_db()
     cursor = conn.cursor()
 
-    base_query = "SELECT id_plato, nombre, descripcion, precio, activo, id_empresa, rubro FROM platos"
-    where_conditions, query_params = get_company_filter_conditions_and_params()
-    
-    final_query_parts = [base_query]
-    if where_conditions:
-        final_query_parts.append("WHERE " + " AND ".join(where_conditions))
-    
-    final_query_parts.append("ORDER BY id_plato ASC")
-    final_query = " ".join(final_query_parts)
-
-    cursor.execute(final_query, query_params)
-    platos = cursor.fetchall()
+    platos = repositorio.todos(cursor, 'platos.listado', alcance_empresa())
     conn.close()
     return render_template('gestion_catalogo.html', platos=platos)
 
@@ -1523,37 +3454,38 @@ def agregar_plato():
             flash("Precio inválido. Ingrese un número.", "danger")
             return render_template('agregar_plato.html', request_form=request.form.to_dict())
 
-        conn = conectar_db()
-        cursor = conn.cursor()
-        try:
-            plato_id_empresa = current_user.id_empresa
-            if current_user.has_role('super_admin'):
-                plato_id_empresa = request.form.get('id_empresa_asignar')
-                if not plato_id_empresa:
-                    plato_id_empresa = DEFAULT_COMPANY_FOR_ORDERS
-                else:
-                    plato_id_empresa = int(plato_id_empresa)
-                flash(f"Como Super Admin, el plato se ha asignado a la Empresa ID {plato_id_empresa}.", "info")
-            elif not plato_id_empresa:
-                 flash("Tu usuario no tiene una empresa asignada para agregar platos.", "danger")
-                 return redirect(url_for('gestion_catalogo'))
+        plato_id_empresa = current_user.id_empresa
+        if current_user.has_role('super_admin'):
+            plato_id_empresa = request.form.get('id_empresa_asignar')
+            if not plato_id_empresa:
+                plato_id_empresa = DEFAULT_COMPANY_FOR_ORDERS
+            else:
+                plato_id_empresa = int(plato_id_empresa)
+            flash(f"Como Super Admin, el plato se ha asignado a la Empresa ID {plato_id_empresa}.", "info")
+        elif not plato_id_empresa:
+             flash("Tu usuario no tiene una empresa asignada para agregar platos.", "danger")
+             return redirect(url_for('gestion_catalogo'))
 
-            cursor.execute("INSERT INTO platos (nombre, descripcion, precio, activo, id_empresa, rubro) VALUES (?, ?, ?, 1, ?, ?)",
-                           (nombre, descripcion, precio, plato_id_empresa, rubro))
-            conn.commit()
-            flash(f"Plato '{nombre}' agregado con éxito.", "success")
-        except sqlite3.Error as e:
-            flash(f"Error al agregar plato: {e}", "danger")
-        finally:
-            conn.close()
+        # Con BASE_POR_EMPRESA el plato va a la base de la empresa elegida, no a la del usuario
+        with base_de_empresa(plato_id_empresa):
+            conn = conectar_db()
+            cursor = conn.cursor()
+            try:
+                repositorio.ejecutar(cursor, 'platos.insertar', nombre=nombre, descripcion=descripcion, precio=precio,
+                                     id_empresa_plato=plato_id_empresa, rubro=rubro)
+                conn.commit()
+                flash(f"Plato '{nombre}' agregado con éxito.", "success")
+            except sqlite3.Error as e:
+                flash(f"Error al agregar plato: {e}", "danger")
+            finally:
+                conn.close()
         return redirect(url_for('gestion_catalogo'))
 
     empresas_disponibles = []
     if current_user.has_role('super_admin'):
         conn = conectar_db()
         cursor = conn.cursor()
-        cursor.execute("SELECT id_empresa, nombre FROM empresas WHERE activo = 1 ORDER BY nombre")
-        empresas_disponibles = cursor.fetchall()
+        empresas_disponibles = repositorio.todos(cursor, 'empresas.activas')
         conn.close()
 
     return render_template('agregar_plato.html', empresas_disponibles=empresas_disponibles, request_form={})
@@ -1567,18 +3499,7 @@ def editar_plato(id_plato):
 
     conn = conectar_db()
     cursor = conn.cursor()
-    base_query = "SELECT id_plato, nombre, descripcion, precio, activo, id_empresa, rubro FROM platos"
-    where_conditions = ["id_plato = ?"]
-    query_params = [id_plato]
-
-    company_conditions, company_params = get_company_filter_conditions_and_params()
-    where_conditions.extend(company_conditions)
-    query_params.extend(company_params)
-
-    final_query = base_query + " WHERE " + " AND ".join(where_conditions)
-
-    cursor.execute(final_query, query_params)
-    plato = cursor.fetchone()
+    plato = repositorio.uno(cursor, 'platos.por_id', alcance_empresa(), id_plato=id_plato)
     conn.close()
 
     if not plato:
@@ -1602,24 +3523,8 @@ def editar_plato(id_plato):
         conn = conectar_db()
         cursor = conn.cursor()
         try:
-            update_query_base = """
-                UPDATE platos SET
-                    nombre = ?,
-                    descripcion = ?,
-                    precio = ?,
-                    activo = ?,
-                    rubro = ?
-            """
-            update_where_conditions = ["id_plato = ?"]
-            update_params = [nombre, descripcion, precio, activo, rubro, id_plato]
-
-            company_conditions, company_params = get_company_filter_conditions_and_params()
-            update_where_conditions.extend(company_conditions)
-            update_params.extend(company_params)
-
-            final_update_query = update_query_base + " WHERE " + " AND ".join(update_where_conditions)
-
-            cursor.execute(final_update_query, update_params)
+            repositorio.ejecutar(cursor, 'platos.actualizar', alcance_empresa(), nombre=nombre, descripcion=descripcion,
+                                 precio=precio, activo=activo, rubro=rubro, id_plato=id_plato)
             if cursor.rowcount == 0 and not current_user.has_role('super_admin'):
                  flash("Plato no encontrado o no tienes permiso para editarlo.", "danger")
                  conn.rollback()
@@ -1645,17 +3550,7 @@ def eliminar_plato(id_plato):
     conn = conectar_db()
     cursor = conn.cursor()
     try:
-        update_query_base = "UPDATE platos SET activo = 0"
-        update_where_conditions = ["id_plato = ?"]
-        update_params = [id_plato]
-
-        company_conditions, company_params = get_company_filter_conditions_and_params()
-        update_where_conditions.extend(company_conditions)
-        update_params.extend(company_params)
-
-        final_update_query = update_query_base + " WHERE " + " AND ".join(update_where_conditions)
-
-        cursor.execute(final_update_query, update_params)
+        repositorio.ejecutar(cursor, 'platos.inactivar', alcance_empresa(), id_plato=id_plato)
         if cursor.rowcount == 0 and not current_user.has_role('super_admin'):
              flash("Plato no encontrado o no tienes permiso para inactivarlo.", "danger")
              conn.rollback()
@@ -1688,32 +3583,32 @@ def arqueo_caja():
                     flash("La descripción del egreso no puede estar vacía.", "danger")
                     return redirect(url_for('arqueo_caja'))
 
-                conn = conectar_db()
-                cursor = conn.cursor()
-                try:
-                    fecha_hora_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    egreso_id_empresa = current_user.id_empresa
-                    if current_user.has_role('super_admin'):
-                        egreso_id_empresa = request.form.get('id_empresa_asignar_egreso')
-                        if not egreso_id_empresa:
-                            egreso_id_empresa = DEFAULT_COMPANY_FOR_ORDERS
-                        else:
-                            egreso_id_empresa = int(egreso_id_empresa)
-                        flash(f"Como Super Admin, el egreso se ha asignado a la Empresa ID {egreso_id_empresa}.", "info")
-                    elif not egreso_id_empresa:
-                        flash("Tu usuario no tiene una empresa asignada para registrar egresos.", "danger")
-                        return redirect(url_for('arqueo_caja'))
-
-                    cursor.execute("""
-                        INSERT INTO ingresos_egresos (tipo, monto, descripcion, fecha_hora, id_pedido_origen, id_repartidor_origen, id_empresa)
-                        VALUES ('Egreso', ?, ?, ?, NULL, NULL, ?)
-                    """, (monto, descripcion, fecha_hora_str, egreso_id_empresa))
-                    conn.commit()
-                    flash(f"Egreso de ${monto:,.2f} registrado con éxito.", "success")
-                except sqlite3.Error as e:
-                    flash(f"Error al registrar egreso: {e}", "danger")
-                finally:
-                    conn.close()
+                egreso_id_empresa = current_user.id_empresa
+                if current_user.has_role('super_admin'):
+                    egreso_id_empresa = request.form.get('id_empresa_asignar_egreso')
+                    if not egreso_id_empresa:
+                        egreso_id_empresa = DEFAULT_COMPANY_FOR_ORDERS
+                    else:
+                        egreso_id_empresa = int(egreso_id_empresa)
+                    flash(f"Como Super Admin, el egreso se ha asignado a la Empresa ID {egreso_id_empresa}.", "info")
+                elif not egreso_id_empresa:
+                    flash("Tu usuario no tiene una empresa asignada para registrar egresos.", "danger")
+                    return redirect(url_for('arqueo_caja'))
+
+                # Con BASE_POR_EMPRESA el egreso va a la base de la empresa elegida, no a la del usuario
+                with base_de_empresa(egreso_id_empresa):
+                    conn = conectar_db()
+                    cursor = conn.cursor()
+                    try:
+                        fecha_hora_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                        _registrar_movimiento_caja(cursor, 'Egreso', monto, descripcion, fecha_hora_str, id_empresa=egreso_id_empresa)
+                        conn.commit()
+                        flash(f"Egreso de ${monto:,.2f} registrado con éxito.", "success")
+                    except sqlite3.Error as e:
+                        conn.rollback()
+                        flash(f"Error al registrar egreso: {e}", "danger")
+                    finally:
+                        conn.close()
             except ValueError:
                 flash("Monto inválido. Ingrese un número.", "danger")
             return redirect(url_for('arqueo_caja'))
@@ -1730,42 +3625,20 @@ def arqueo_caja():
                     flash("La fecha de inicio no puede ser posterior a la fecha de fin.", "danger")
                     return redirect(url_for('arqueo_caja'))
 
-                conn = conectar_db()
-                cursor = conn.cursor()
-
-                fecha_inicio_iso = fecha_inicio.strftime('%Y-%m-%d %H:%M:%S')
-                fecha_fin_iso = fecha_fin.strftime('%Y-%m-%d %H:%M:%S')
-
-                base_query = """
-                    SELECT ie.tipo, ie.monto, ie.descripcion, ie.fecha_hora, ie.id_pedido_origen,
-                           r.nombre AS repartidor_nombre, r.apellido AS repartidor_apellido,
-                           e.nombre AS nombre_empresa
-                    FROM ingresos_egresos ie
-                    LEFT JOIN repartidores r ON ie.id_repartidor_origen = r.id_repartidor
-                    LEFT JOIN empresas e ON ie.id_empresa = e.id_empresa
-                """
-                where_conditions = ["ie.fecha_hora BETWEEN ? AND ?"]
-                query_params = [fecha_inicio_iso, fecha_fin_iso]
-
-                company_conditions, company_params = get_company_filter_conditions_and_params(table_alias='ie')
-                where_conditions.extend(company_conditions)
-                query_params.extend(company_params)
-
-                final_query = base_query + " WHERE " + " AND ".join(where_conditions) + " ORDER BY ie.fecha_hora ASC"
-                
-                cursor.execute(final_query, query_params)
-                movimientos = cursor.fetchall()
-                conn.close()
+                with lectura_de_reportes() as lectura:
+                    movimientos, totales = _datos_arqueo(fecha_inicio, fecha_fin, alcance_empresa())
+                movimientos_truncados = len(movimientos) > ARQUEO_MAX_MOVIMIENTOS_DETALLE
+                movimientos = movimientos[:ARQUEO_MAX_MOVIMIENTOS_DETALLE]
 
-                total_ingresos = sum(m['monto'] for m in movimientos if m['tipo'] == 'Ingreso')
-                total_egresos = sum(m['monto'] for m in movimientos if m['tipo'] != 'Ingreso')
+                total_ingresos = totales['Ingreso']
+                total_pagos_repartidor = totales['Pago a Repartidor']
+                total_egresos = totales['Egreso'] + total_pagos_repartidor
                 balance = total_ingresos - total_egresos
 
                 movimientos_procesados = []
                 for m in movimientos:
                     m_dict = dict(m)
-                    fecha_dt = datetime.strptime(m_dict['fecha_hora'], '%Y-%m-%d %H:%M:%S')
-                    m_dict['fecha_hora_formateada'] = fecha_dt.strftime('%d/%m/%Y %H:%M')
+                    m_dict['fecha_hora_formateada'] = m_dict.pop('fecha_hora_epoch').strftime('%d/%m/%Y %H:%M')
 
                     if m_dict['repartidor_nombre'] and m_dict['repartidor_apellido']:
                         m_dict['repartidor_nombre_completo'] = f"{m_dict['repartidor_nombre']} {m_dict['repartidor_apellido']}"
@@ -1778,9 +3651,12 @@ def arqueo_caja():
                     'fecha_inicio': fecha_inicio.strftime('%d/%m/%Y'),
                     'fecha_fin': fecha_fin.strftime('%d/%m/%Y'),
                     'movimientos': movimientos_procesados,
+                    'movimientos_truncados': movimientos_truncados,
                     'total_ingresos': total_ingresos,
                     'total_egresos': total_egresos,
-                    'balance': balance
+                    'total_pagos_repartidor': total_pagos_repartidor,
+                    'balance': balance,
+                    'datos_al': _fecha_datos_reporte(lectura)
                 }
                 return redirect(url_for('arqueo_caja'))
 
@@ -1794,8 +3670,7 @@ def arqueo_caja():
     if current_user.has_role('super_admin'):
         conn = conectar_db()
         cursor = conn.cursor()
-        cursor.execute("SELECT id_empresa, nombre FROM empresas WHERE activo = 1 ORDER BY nombre")
-        empresas_para_egreso = cursor.fetchall()
+        empresas_para_egreso = repositorio.todos(cursor, 'empresas.activas')
         conn.close()
 
     return render_template('arqueo_caja.html',
@@ -1851,8 +3726,7 @@ def gestion_configuracion():
     if current_user.has_role('super_admin'):
         conn = conectar_db()
         cursor = conn.cursor()
-        cursor.execute("SELECT id_empresa, nombre FROM empresas WHERE activo = 1 ORDER BY nombre")
-        empresas_para_config = cursor.fetchall()
+        empresas_para_config = repositorio.todos(cursor, 'empresas.activas')
         conn.close()
 
     return render_template('gestion_configuracion.html',
@@ -1872,19 +3746,7 @@ def gestion_repartidores():
     conn = conectar_db()
     cursor = conn.cursor()
 
-    base_query = "SELECT id_repartidor, nombre, apellido, telefono, activo, id_empresa FROM repartidores"
-    where_conditions, query_params = get_company_filter_conditions_and_params()
-    
-    final_query_parts = [base_query]
-    if where_conditions:
-        final_query_parts.append("WHERE " + " AND ".join(where_conditions))
-    
-    final_query_parts.append("ORDER BY apellido, nombre")
-    
-    final_query = " ".join(final_query_parts)
-
-    cursor.execute(final_query, query_params)
-    repartidores = cursor.fetchall()
+    repartidores = repositorio.todos(cursor, 'repartidores.listado', alcance_empresa())
     conn.close()
     return render_template('gestion_repartidores.html', repartidores=repartidores)
 
@@ -1904,37 +3766,38 @@ def agregar_repartidor():
             flash("Nombre y apellido del repartidor son obligatorios.", "danger")
             return redirect(url_for('agregar_repartidor'))
 
-        conn = conectar_db()
-        cursor = conn.cursor()
-        try:
-            repartidor_id_empresa = current_user.id_empresa
-            if current_user.has_role('super_admin'):
-                repartidor_id_empresa = request.form.get('id_empresa_asignar')
-                if not repartidor_id_empresa:
-                    repartidor_id_empresa = DEFAULT_COMPANY_FOR_ORDERS
-                else:
-                    repartidor_id_empresa = int(repartidor_id_empresa)
-                flash(f"Como Super Admin, el repartidor se ha asignado a la Empresa ID {repartidor_id_empresa}.", "info")
-            elif not repartidor_id_empresa:
-                flash("Tu usuario no tiene una empresa asignada para agregar repartidores.", "danger")
-                return redirect(url_for('gestion_repartidores'))
-
-            cursor.execute("INSERT INTO repartidores (nombre, apellido, telefono, activo, id_empresa) VALUES (?, ?, ?, 1, ?)",
-                           (nombre, apellido, telefono, repartidor_id_empresa))
-            conn.commit()
-            flash(f"Repartidor '{nombre} {apellido}' agregado con éxito.", "success")
-        except sqlite3.Error as e:
-            flash(f"Error al agregar repartidor: {e}", "danger")
-        finally:
-            conn.close()
+        repartidor_id_empresa = current_user.id_empresa
+        if current_user.has_role('super_admin'):
+            repartidor_id_empresa = request.form.get('id_empresa_asignar')
+            if not repartidor_id_empresa:
+                repartidor_id_empresa = DEFAULT_COMPANY_FOR_ORDERS
+            else:
+                repartidor_id_empresa = int(repartidor_id_empresa)
+            flash(f"Como Super Admin, el repartidor se ha asignado a la Empresa ID {repartidor_id_empresa}.", "info")
+        elif not repartidor_id_empresa:
+            flash("Tu usuario no tiene una empresa asignada para agregar repartidores.", "danger")
+            return redirect(url_for('gestion_repartidores'))
+
+        # Con BASE_POR_EMPRESA el repartidor va a la base de la empresa elegida, no a la del usuario
+        with base_de_empresa(repartidor_id_empresa):
+            conn = conectar_db()
+            cursor = conn.cursor()
+            try:
+                repositorio.ejecutar(cursor, 'repartidores.insertar', nombre=nombre, apellido=apellido, telefono=telefono,
+                                     id_empresa_repartidor=repartidor_id_empresa)
+                conn.commit()
+                flash(f"Repartidor '{nombre} {apellido}' agregado con éxito.", "success")
+            except sqlite3.Error as e:
+                flash(f"Error al agregar repartidor: {e}", "danger")
+            finally:
+                conn.close()
         return redirect(url_for('gestion_repartidores'))
 
     empresas_disponibles = []
     if current_user.has_role('super_admin'):
         conn = conectar_db()
         cursor = conn.cursor()
-        cursor.execute("SELECT id_empresa, nombre FROM empresas WHERE activo = 1 ORDER BY nombre")
-        empresas_disponibles = cursor.fetchall()
+        empresas_disponibles = repositorio.todos(cursor, 'empresas.activas')
         conn.close()
 
     return render_template('agregar_repartidor.html', empresas_disponibles=empresas_disponibles)
@@ -1948,18 +3811,7 @@ def editar_repartidor(id_repartidor):
 
     conn = conectar_db()
     cursor = conn.cursor()
-    base_query = "SELECT id_repartidor, nombre, apellido, telefono, activo, id_empresa FROM repartidores"
-    where_conditions = ["id_repartidor = ?"]
-    query_params = [id_repartidor]
-
-    company_conditions, company_params = get_company_filter_conditions_and_params()
-    where_conditions.extend(company_conditions)
-    query_params.extend(company_params)
-
-    final_query = base_query + " WHERE " + " AND ".join(where_conditions)
-
-    cursor.execute(final_query, query_params)
-    repartidor = cursor.fetchone()
+    repartidor = repositorio.uno(cursor, 'repartidores.por_id', alcance_empresa(), id_repartidor=id_repartidor)
     conn.close()
 
     if not repartidor:
@@ -1979,23 +3831,8 @@ def editar_repartidor(id_repartidor):
         conn = conectar_db()
         cursor = conn.cursor()
         try:
-            update_query_base = """
-                UPDATE repartidores SET
-                    nombre = ?,
-                    apellido = ?,
-                    telefono = ?,
-                    activo = ?
-            """
-            update_where_conditions = ["id_repartidor = ?"]
-            update_params = [nombre, apellido, telefono, activo, id_repartidor]
-
-            company_conditions, company_params = get_company_filter_conditions_and_params()
-            update_where_conditions.extend(company_conditions)
-            update_params.extend(company_params)
-
-            final_update_query = update_query_base + " WHERE " + " AND ".join(update_where_conditions)
-
-            cursor.execute(final_update_query, update_params)
+            repositorio.ejecutar(cursor, 'repartidores.actualizar', alcance_empresa(), nombre=nombre, apellido=apellido,
+                                 telefono=telefono, activo=activo, id_repartidor=id_repartidor)
             if cursor.rowcount == 0 and not current_user.has_role('super_admin'):
                  flash("Repartidor no encontrado o no tienes permiso para editarlo.", "danger")
                  conn.rollback()
@@ -2021,17 +3858,7 @@ def eliminar_repartidor(id_repartidor):
     conn = conectar_db()
     cursor = conn.cursor()
     try:
-        update_query_base = "UPDATE repartidores SET activo = 0"
-        update_where_conditions = ["id_repartidor = ?"]
-        update_params = [id_repartidor]
-        
-        company_conditions, company_params = get_company_filter_conditions_and_params()
-        update_where_conditions.extend(company_conditions)
-        update_params.extend(company_params)
-
-        final_update_query = update_query_base + " WHERE " + " AND ".join(update_where_conditions)
-
-        cursor.execute(final_update_query, update_params)
+        repositorio.ejecutar(cursor, 'repartidores.inactivar', alcance_empresa(), id_repartidor=id_repartidor)
         if cursor.rowcount == 0 and not current_user.has_role('super_admin'):
             flash("Repartidor no encontrado o no tienes permiso para inactivarlo.", "danger")
             conn.rollback()
@@ -2045,6 +3872,36 @@ def eliminar_repartidor(id_repartidor):
         conn.close()
     return redirect(url_for('gestion_repartidores'))
 
+def _repartidores_activos(alcance):
+    """Repartidores activos del alcance. Con BASE_POR_EMPRESA y todas las empresas se leen todas las bases."""
+    if BASE_POR_EMPRESA and alcance is TODAS_LAS_EMPRESAS:
+        return [rep for _, repartidores in _en_cada_base_empresa(_repartidores_activos) for rep in repartidores]
+
+    conn = conectar_db()
+    cursor = conn.cursor()
+    repartidores = repositorio.todos(cursor, 'repartidores.activos', alcance)
+    conn.close()
+    return repartidores
+
+def _pagos_repartidores(fecha_inicio, fecha_fin, alcance, id_repartidor=None):
+    """
+    Pagos a repartidores del rango (sólo los de id_repartidor si se indica). Con BASE_POR_EMPRESA y todas las
+    empresas se calcula en cada base en paralelo y se combina por fecha; con una empresa, se lee su base.
+    """
+    if BASE_POR_EMPRESA and alcance is TODAS_LAS_EMPRESAS:
+        partes = [pagos for _, pagos in _en_cada_base_empresa(
+            lambda id_empresa: _pagos_repartidores(fecha_inicio, fecha_fin, id_empresa, id_repartidor))]
+        return sorted((p for pagos in partes for p in pagos), key=lambda p: p['fecha_hora_epoch'])
+
+    filtros, params = ((), {}) if id_repartidor is None else (('id_repartidor',), {'id_repartidor': id_repartidor})
+    with base_de_empresa(None if alcance is TODAS_LAS_EMPRESAS else alcance):
+        conn = conectar_db()
+        cursor = conn.cursor()
+        pagos = repositorio.todos(cursor, _consulta_con_archivo('caja.pagos_repartidor', _a_epoch(fecha_inicio)),
+                                  alcance, filtros, desde=_a_epoch(fecha_inicio), hasta=_a_epoch(fecha_fin), **params)
+        conn.close()
+    return pagos
+
 @app.route('/gestion/reporte_repartidores', methods=['GET', 'POST'])
 @login_required
 def reporte_repartidores():
@@ -2052,21 +3909,7 @@ def reporte_repartidores():
         flash("No tienes permiso para acceder a esta página.", "danger")
         return redirect(url_for('index'))
 
-    conn = conectar_db()
-    cursor = conn.cursor()
-    base_repartidores_query = "SELECT id_repartidor, nombre, apellido FROM repartidores WHERE activo = 1"
-    where_rep_conditions, query_rep_params = get_company_filter_conditions_and_params()
-    
-    final_rep_query_parts = [base_repartidores_query]
-    if where_rep_conditions:
-        final_rep_query_parts.append(" AND " + " AND ".join(where_rep_conditions)) # Note the ' AND ' here for filtering within an existing WHERE
-    
-    final_rep_query_parts.append("ORDER BY apellido, nombre")
-    final_rep_query = " ".join(final_rep_query_parts)
-
-    cursor.execute(final_rep_query, query_rep_params)
-    repartidores_activos = cursor.fetchall()
-    conn.close()
+    repartidores_activos = _repartidores_activos(alcance_empresa())
 
     reporte_generado = None
     if request.method == 'POST':
@@ -2082,47 +3925,31 @@ def reporte_repartidores():
                 flash("La fecha de inicio no puede ser posterior a la fecha de fin.", "danger")
                 return redirect(url_for('reporte_repartidores'))
 
-            conn = conectar_db()
-            cursor = conn.cursor()
-
-            base_query = """
-                SELECT ie.fecha_hora, ie.monto, ie.id_pedido_origen,
-                       r.nombre AS repartidor_nombre, r.apellido AS repartidor_apellido,
-                       e.nombre AS nombre_empresa
-                FROM ingresos_egresos ie
-                JOIN repartidores r ON ie.id_repartidor_origen = r.id_repartidor
-                LEFT JOIN empresas e ON ie.id_empresa = e.id_empresa
-            """
-            where_conditions = ["ie.tipo = 'Pago a Repartidor'", "ie.fecha_hora BETWEEN ? AND ?"]
-            query_params = [fecha_inicio.strftime('%Y-%m-%d %H:%M:%S'), fecha_fin.strftime('%Y-%m-%d %H:%M:%S')]
-
+            # El repartidor se elige por empresa e id (con BASE_POR_EMPRESA los ids se repiten entre bases)
+            seleccionado = None
             if id_repartidor_seleccionado and id_repartidor_seleccionado != 'todos':
-                where_conditions.append("ie.id_repartidor_origen = ?")
-                query_params.append(id_repartidor_seleccionado)
-
-            company_conditions, company_params = get_company_filter_conditions_and_params(table_alias='ie')
-            where_conditions.extend(company_conditions)
-            query_params.extend(company_params)
-
-            final_query = base_query + " WHERE " + " AND ".join(where_conditions) + " ORDER BY ie.fecha_hora ASC"
-            
-            cursor.execute(final_query, query_params)
-            pagos = cursor.fetchall()
-            conn.close()
+                seleccionado = next((rep for rep in repartidores_activos
+                                     if f"{rep['id_empresa']}-{rep['id_repartidor']}" == id_repartidor_seleccionado), None)
+                if seleccionado is None:
+                    flash("Repartidor inválido.", "danger")
+                    return redirect(url_for('reporte_repartidores'))
+
+            with lectura_de_reportes() as lectura:
+                if seleccionado:
+                    pagos = _pagos_repartidores(fecha_inicio, fecha_fin, seleccionado['id_empresa'], seleccionado['id_repartidor'])
+                else:
+                    pagos = _pagos_repartidores(fecha_inicio, fecha_fin, alcance_empresa())
 
             total_pagado = sum(p['monto'] for p in pagos)
 
             repartidor_nombre_reporte = "Todos los Repartidores"
-            if id_repartidor_seleccionado and id_repartidor_seleccionado != 'todos':
-                for rep in repartidores_activos:
-                    if str(rep['id_repartidor']) == id_repartidor_seleccionado:
-                        repartidor_nombre_reporte = f"{rep['nombre']} {rep['apellido']}"
-                        break
+            if seleccionado:
+                repartidor_nombre_reporte = f"{seleccionado['nombre']} {seleccionado['apellido']}"
 
             pagos_procesados = []
             for p in pagos:
                 p_dict = dict(p)
-                p_dict['fecha_hora_formateada'] = datetime.strptime(p_dict['fecha_hora'], '%Y-%m-%d %H:%M:%S').strftime('%d/%m/%Y %H:%M')
+                p_dict['fecha_hora_formateada'] = p_dict.pop('fecha_hora_epoch').strftime('%d/%m/%Y %H:%M')
                 pagos_procesados.append(p_dict)
 
 
@@ -2131,7 +3958,8 @@ def reporte_repartidores():
                 'fecha_fin': fecha_fin.strftime('%d/%m/%Y'),
                 'repartidor_nombre': repartidor_nombre_reporte,
                 'pagos': pagos_procesados,
-                'total_pagado': total_pagado
+                'total_pagado': total_pagado,
+                'datos_al': _fecha_datos_reporte(lectura)
             }
 
         except ValueError:
@@ -2155,8 +3983,7 @@ def gestion_empresas():
 
     conn = conectar_db()
     cursor = conn.cursor()
-    cursor.execute("SELECT id_empresa, nombre, telefono, direccion, activo FROM empresas ORDER BY nombre")
-    empresas = cursor.fetchall()
+    empresas = repositorio.todos(cursor, 'empresas.listado')
     conn.close()
     return render_template('gestion_empresas.html', empresas=empresas)
 
@@ -2179,8 +4006,7 @@ def agregar_empresa():
         conn = conectar_db()
         cursor = conn.cursor()
         try:
-            cursor.execute("INSERT INTO empresas (nombre, telefono, direccion, activo) VALUES (?, ?, ?, 1)",
-                           (nombre, telefono, direccion))
+            repositorio.ejecutar(cursor, 'empresas.insertar', nombre=nombre, telefono=telefono, direccion=direccion)
             conn.commit()
             flash(f"Empresa '{nombre}' agregada con éxito.", "success")
         except sqlite3.IntegrityError:
@@ -2203,8 +4029,7 @@ def edita_empresa(id_empresa):
 
     conn = conectar_db()
     cursor = conn.cursor()
-    cursor.execute("SELECT id_empresa, nombre, telefono, direccion, activo FROM empresas WHERE id_empresa = ?", (id_empresa,))
-    empresa = cursor.fetchone()
+    empresa = repositorio.uno(cursor, 'empresas.por_id', id_empresa_buscada=id_empresa)
     conn.close()
 
     if not empresa:
@@ -2224,8 +4049,8 @@ def edita_empresa(id_empresa):
         conn = conectar_db()
         cursor = conn.cursor()
         try:
-            cursor.execute("UPDATE empresas SET nombre = ?, telefono = ?, direccion = ?, activo = ? WHERE id_empresa = ?",
-                           (nombre, telefono, direccion, activo, id_empresa))
+            repositorio.ejecutar(cursor, 'empresas.actualizar', nombre=nombre, telefono=telefono, direccion=direccion,
+                                 activo=activo, id_empresa_buscada=id_empresa)
             conn.commit()
             flash(f"Empresa '{nombre}' actualizada con éxito.", "success")
         except sqlite3.IntegrityError:
@@ -2250,8 +4075,8 @@ def eliminar_empresa(id_empresa):
     conn = conectar_db()
     cursor = conn.cursor()
     try:
-        cursor.execute("UPDATE empresas SET activo = 0 WHERE id_empresa = ?", (id_empresa,))
-        cursor.execute("UPDATE usuarios SET activo = 0 WHERE id_empresa = ?", (id_empresa,))
+        repositorio.ejecutar(cursor, 'empresas.inactivar', id_empresa_buscada=id_empresa)
+        repositorio.ejecutar(cursor, 'usuarios.inactivar_de_empresa', id_empresa_inactivar=id_empresa)
 
         conn.commit()
         flash(f"Empresa con ID {id_empresa} marcada como inactiva y sus usuarios asociados inactivados.", "success")
@@ -2272,15 +4097,7 @@ def gestion_usuarios():
 
     conn = conectar_db()
     cursor = conn.cursor()
-    cursor.execute("""
-        SELECT u.id_usuario, u.email, u.nombre, u.apellido, u.activo, u.primer_login_requerido,
-               r.nombre_rol, e.nombre AS nombre_empresa
-        FROM usuarios u
-        JOIN roles r ON u.id_rol = r.id_rol
-        LEFT JOIN empresas e ON u.id_empresa = e.id_empresa
-        ORDER BY u.apellido, u.nombre
-    """)
-    usuarios = cursor.fetchall()
+    usuarios = repositorio.todos(cursor, 'usuarios.listado')
     conn.close()
     return render_template('gestion_usuarios.html', usuarios=usuarios)
 
@@ -2294,10 +4111,8 @@ def agregar_usuario():
 
     conn = conectar_db()
     cursor = conn.cursor()
-    cursor.execute("SELECT id_rol, nombre_rol FROM roles ORDER BY nombre_rol")
-    roles = cursor.fetchall()
-    cursor.execute("SELECT id_empresa, nombre FROM empresas WHERE activo = 1 ORDER BY nombre")
-    empresas = cursor.fetchall()
+    roles = repositorio.todos(cursor, 'roles.listado')
+    empresas = repositorio.todos(cursor, 'empresas.activas')
     conn.close()
 
     if request.method == 'POST':
@@ -2322,10 +4137,9 @@ def agregar_usuario():
         cursor = conn.cursor()
         try:
             hashed_password = generate_password_hash(password_inicial, method='pbkdf2:sha256')
-            cursor.execute("""
-                INSERT INTO usuarios (email, password, nombre, apellido, id_rol, id_empresa, activo, primer_login_requerido)
-                VALUES (?, ?, ?, ?, ?, ?, 1, ?)
-            """, (email, hashed_password, nombre, apellido, id_rol, id_empresa, primer_login_requerido))
+            repositorio.ejecutar(cursor, 'usuarios.insertar', email=email, password=hashed_password, nombre=nombre,
+                                 apellido=apellido, id_rol=id_rol, id_empresa=id_empresa,
+                                 primer_login_requerido=primer_login_requerido)
             conn.commit()
             flash(f"Usuario '{email}' agregado con éxito. Contraseña inicial: {password_inicial}", "success")
         except sqlite3.IntegrityError:
@@ -2349,23 +4163,15 @@ def editar_usuario(id_usuario):
 
     conn = conectar_db()
     cursor = conn.cursor()
-    cursor.execute("""
-        SELECT u.id_usuario, u.email, u.nombre, u.apellido, u.activo, u.primer_login_requerido,
-               u.id_rol, u.id_empresa
-        FROM usuarios u
-        WHERE u.id_usuario = ?
-    """, (id_usuario,))
-    usuario = cursor.fetchone()
+    usuario = repositorio.uno(cursor, 'usuarios.por_id', id_usuario=id_usuario)
 
     if not usuario:
         flash("Usuario no encontrado.", "danger")
         conn.close()
         return redirect(url_for('gestion_usuarios'))
 
-    cursor.execute("SELECT id_rol, nombre_rol FROM roles ORDER BY nombre_rol")
-    roles = cursor.fetchall()
-    cursor.execute("SELECT id_empresa, nombre FROM empresas WHERE activo = 1 ORDER BY nombre")
-    empresas = cursor.fetchall()
+    roles = repositorio.todos(cursor, 'roles.listado')
+    empresas = repositorio.todos(cursor, 'empresas.activas')
     conn.close()
 
     if request.method == 'POST':
@@ -2390,22 +4196,14 @@ def editar_usuario(id_usuario):
         conn = conectar_db()
         cursor = conn.cursor()
         try:
-            update_query = """
-                UPDATE usuarios SET email = ?, nombre = ?, apellido = ?, id_rol = ?,
-                id_empresa = ?, activo = ?, primer_login_requerido = ?
-            """
-            update_params = [email, nombre, apellido, id_rol, id_empresa, activo, primer_login_requerido]
-
+            datos_usuario = dict(email=email, nombre=nombre, apellido=apellido, id_rol=id_rol, id_empresa=id_empresa,
+                                 activo=activo, primer_login_requerido=primer_login_requerido, id_usuario=id_usuario)
             if nueva_password:
                 hashed_password = generate_password_hash(nueva_password, method='pbkdf2:sha256')
-                update_query += ", password = ?"
-                update_params.append(hashed_password)
+                repositorio.ejecutar(cursor, 'usuarios.actualizar_con_clave', password=hashed_password, **datos_usuario)
                 flash("Contraseña actualizada.", "info")
-
-            update_query += " WHERE id_usuario = ?"
-            update_params.append(id_usuario)
-
-            cursor.execute(update_query, tuple(update_params))
+            else:
+                repositorio.ejecutar(cursor, 'usuarios.actualizar', **datos_usuario)
             conn.commit()
             flash(f"Usuario '{email}' actualizado con éxito.", "success")
         except sqlite3.IntegrityError:
@@ -2434,7 +4232,7 @@ def eliminar_usuario(id_usuario):
     conn = conectar_db()
     cursor = conn.cursor()
     try:
-        cursor.execute("UPDATE usuarios SET activo = 0 WHERE id_usuario = ?", (id_usuario,))
+        repositorio.ejecutar(cursor, 'usuarios.inactivar', id_usuario=id_usuario)
         conn.commit()
         flash(f"Usuario con ID {id_usuario} marcado como inactivo.", "success")
     except sqlite3.Error as e:
@@ -2476,60 +4274,54 @@ def _fetch_report_data(start_date_str, end_date_str, company_id):
         current_app.logger.error(f"Error de formato de fecha en reporte: {start_date_str} - {end_date_str}")
         return report_data
 
+    # company_id es la empresa elegida por el super_admin (None = todas) o la del usuario
+    alcance = alcance_empresa() if company_id is None else company_id
+    if BASE_POR_EMPRESA and alcance is TODAS_LAS_EMPRESAS:
+        # Cada empresa está en su base: se consultan todas en paralelo y se combinan los resultados
+        return _combinar_reportes([datos for _, datos in _en_cada_base_empresa(
+            lambda id_empresa: _fetch_report_data(start_date_str, end_date_str, id_empresa))])
+
     conn = conectar_db()
     cursor = conn.cursor()
-
-    params_base_dates = [start_date.strftime('%Y-%m-%d %H:%M:%S'), end_date.strftime('%Y-%m-%d %H:%M:%S')]
-    
-    # Obtener condiciones de filtro de empresa una sola vez para 'pedidos' (p)
-    company_conditions_p, company_params_p = get_company_filter_conditions_and_params(table_alias='p')
-
-    # Combinar condiciones base de fecha con las de empresa
-    base_where_conditions = ["p.fecha_creacion BETWEEN ? AND ?"] + company_conditions_p
-    base_query_params = params_base_dates + company_params_p
-
+    rango = dict(desde=_a_epoch(start_date), hasta=_a_epoch(end_date))
+    # Si el rango llega a lo archivado, las tres consultas leen activas + archivo
+    sufijo = '.historico' if _rango_archivado(rango['desde']) else ''
 
     # 1. Productos más vendidos por rubro (SUMADO por rubro)
-    query_by_rubro = f"""
-        SELECT pl.rubro, SUM(ip.cantidad) AS total_cantidad_vendida
-        FROM items_pedido ip
-        JOIN platos pl ON ip.id_plato = pl.id_plato
-        JOIN pedidos p ON ip.id_pedido = p.id_pedido
-        WHERE {' AND '.join(base_where_conditions)}
-        GROUP BY pl.rubro
-        ORDER BY total_cantidad_vendida DESC
-    """
-    cursor.execute(query_by_rubro, base_query_params)
-    report_data['top_selling_by_rubro'] = cursor.fetchall()
+    report_data['top_selling_by_rubro'] = repositorio.todos(cursor, 'reportes.ventas_por_rubro' + sufijo, alcance, **rango)
 
     # 2. Productos más vendidos en total (general) / Cantidad total vendida de cada producto
-    query_overall_products = f"""
-        SELECT pl.nombre, pl.rubro, SUM(ip.cantidad) AS total_cantidad_vendida
-        FROM items_pedido ip
-        JOIN platos pl ON ip.id_plato = pl.id_plato
-        JOIN pedidos p ON ip.id_pedido = p.id_pedido
-        WHERE {' AND '.join(base_where_conditions)}
-        GROUP BY pl.id_plato, pl.nombre, pl.rubro
-        ORDER BY total_cantidad_vendida DESC
-    """
-    cursor.execute(query_overall_products, base_query_params)
-    report_data['top_selling_overall'] = cursor.fetchall()
+    report_data['top_selling_overall'] = repositorio.todos(cursor, 'reportes.productos_mas_vendidos' + sufijo, alcance, **rango)
     report_data['total_quantity_per_product_overall'] = report_data['top_selling_overall'] # Reutiliza los datos
 
     # 3. Medios de pago más usados
-    query_payment_methods = f"""
-        SELECT forma_pago, COUNT(*) AS total_usos, SUM(costo_total) AS total_monto
-        FROM pedidos p
-        WHERE {' AND '.join(base_where_conditions)}
-        GROUP BY forma_pago
-        ORDER BY total_usos DESC
-    """
-    cursor.execute(query_payment_methods, base_query_params)
-    report_data['most_used_payment_methods'] = cursor.fetchall()
+    report_data['most_used_payment_methods'] = repositorio.todos(cursor, 'reportes.medios_de_pago' + sufijo, alcance, **rango)
 
     conn.close()
     return report_data
 
+def _sumar_filas(listas_de_filas, claves, campos):
+    """Suma los 'campos' de las filas de varias bases que comparten las 'claves'; ordena por el primer campo, de mayor a menor."""
+    acumulado = {}
+    for filas in listas_de_filas:
+        for fila in filas:
+            clave = tuple(fila[c] for c in claves)
+            destino = acumulado.setdefault(clave, {**dict(zip(claves, clave)), **{c: 0 for c in campos}})
+            for c in campos:
+                destino[c] += fila[c] or 0
+    return sorted(acumulado.values(), key=lambda fila: fila[campos[0]], reverse=True)
+
+def _combinar_reportes(partes):
+    """Combina los reportes de ventas de cada base de empresa (los platos se identifican por nombre y rubro)."""
+    productos = _sumar_filas([p['top_selling_overall'] for p in partes], ('nombre', 'rubro'), ('total_cantidad_vendida',))
+    return {
+        'top_selling_by_rubro': _sumar_filas([p['top_selling_by_rubro'] for p in partes], ('rubro',), ('total_cantidad_vendida',)),
+        'top_selling_overall': productos,
+        'most_used_payment_methods': _sumar_filas([p['most_used_payment_methods'] for p in partes],
+                                                  ('forma_pago',), ('total_usos', 'total_monto')),
+        'total_quantity_per_product_overall': productos,
+    }
+
 @app.route('/gestion/reportes/ventas', methods=['GET', 'POST'])
 @login_required
 def reportes_ventas():
@@ -2547,8 +4339,7 @@ def reportes_ventas():
     if current_user.has_role('super_admin'):
         conn = conectar_db()
         cursor = conn.cursor()
-        cursor.execute("SELECT id_empresa, nombre FROM empresas WHERE activo = 1 ORDER BY nombre")
-        empresas_disponibles = cursor.fetchall()
+        empresas_disponibles = repositorio.todos(cursor, 'empresas.activas')
         conn.close()
         
         if selected_company_id_str and selected_company_id_str != 'all':
@@ -2567,6 +4358,7 @@ def reportes_ventas():
 
 
     reportes_generados = None
+    datos_al = None
     if request.method == 'POST':
         if not start_date or not end_date:
             flash("Debe seleccionar ambas fechas (inicio y fin) para generar el reporte.", "danger")
@@ -2575,7 +4367,9 @@ def reportes_ventas():
                 datetime.strptime(start_date, '%Y-%m-%d')
                 datetime.strptime(end_date, '%Y-%m-%d')
 
-                reportes_generados = _fetch_report_data(start_date, end_date, selected_company_id)
+                with lectura_de_reportes() as lectura:
+                    reportes_generados = _fetch_report_data(start_date, end_date, selected_company_id)
+                datos_al = _fecha_datos_reporte(lectura)
                 if not any(reportes_generados.values()):
                     flash("No se encontraron datos para el período y empresa seleccionados.", "info")
             except ValueError:
@@ -2588,17 +4382,319 @@ def reportes_ventas():
                            start_date=start_date,
                            end_date=end_date,
                            reportes=reportes_generados,
+                           datos_al=datos_al,
                            empresas_disponibles=empresas_disponibles,
                            selected_company_id=selected_company_id_str)
 
 
+# --- Diagnóstico ---
+
+@app.route('/gestion/diagnostico/consultas')
+@login_required
+def diagnostico_consultas():
+    """Tiempos acumulados por consulta del repositorio en este proceso (ejecuciones, total y máximo en ms)."""
+    if not current_user.has_role('super_admin'):
+        return jsonify({"success": False, "message": "No autorizado."}), 403
+    consultas = [
+        {"consulta": nombre, "ejecuciones": cantidad,
+         "total_ms": round(total * 1000, 3), "maximo_ms": round(maximo * 1000, 3),
+         "promedio_ms": round(total * 1000 / cantidad, 3)}
+        for nombre, cantidad, total, maximo in repositorio.estadisticas()
+    ]
+    return jsonify({"success": True, "pid": os.getpid(), "consultas": consultas})
+
+
+@app.route('/gestion/diagnostico/perfiles')
+@login_required
+def diagnostico_perfiles():
+    """Perfiles de peticiones capturados, del más lento al más rápido, y un token para pedir uno a demanda."""
+    if not current_user.has_role('super_admin'):
+        flash("No tienes permiso para acceder a esta página.", "danger")
+        return redirect(url_for('index'))
+    return render_template('diagnostico_perfiles.html',
+                           perfiles=perfilado.listar(PERFILADO_DIRECTORIO),
+                           token=perfilado.generar_token(app.secret_key),
+                           cabecera=PERFILADO_CABECERA,
+                           validez_minutos=PERFILADO_TOKEN_VALIDEZ_SEGUNDOS // 60,
+                           tasa_muestreo=PERFILADO_TASA_MUESTREO,
+                           endpoints_muestreados=PERFILADO_ENDPOINTS)
+
+@app.route('/gestion/diagnostico/perfiles/<archivo>')
+@login_required
+def diagnostico_perfil(archivo):
+    """Resumen de pstats de un perfil (?orden=cumulative|tottime|calls) o el .pstats con ?descargar=1."""
+    if not current_user.has_role('super_admin'):
+        flash("No tienes permiso para acceder a esta página.", "danger")
+        return redirect(url_for('index'))
+    ruta = perfilado.ruta_de(PERFILADO_DIRECTORIO, archivo)
+    if ruta is None:
+        abort(404)
+    if request.args.get('descargar'):
+        return send_file(ruta, as_attachment=True, download_name=archivo)
+    orden = request.args.get('orden', 'cumulative')
+    if orden not in ('cumulative', 'tottime', 'calls'):
+        orden = 'cumulative'
+    return render_template('diagnostico_perfil.html', archivo=archivo, orden=orden,
+                           resumen=perfilado.resumen(ruta, orden))
+
+def _puede_ver_metricas():
+    if request.remote_addr in METRICAS_IPS_PERMITIDAS:
+        return True
+    autorizacion = request.headers.get('Authorization', '')
+    if METRICAS_TOKEN and autorizacion.startswith('Bearer '):
+        return hmac.compare_digest(autorizacion[len('Bearer '):].encode(), METRICAS_TOKEN.encode())
+    return current_user.is_authenticated and current_user.has_role('super_admin')
+
+@app.route('/metrics')
+def metrics():
+    """Métricas en formato de texto de Prometheus, sumadas entre todos los workers (ver METRICAS_TOKEN)."""
+    if not _puede_ver_metricas():
+        return Response("No autorizado.\n", status=403, mimetype='text/plain')
+    return Response(metricas.exportar() + _metricas_cola_trabajos(), mimetype='text/plain; version=0.0.4')
+
+# --- Comandos de Línea (flask --app app <comando>) ---
+
+@app.cli.command('verificar-caja')
+@click.option('--reconstruir', is_flag=True, help="Regenera los cierres diarios si se encuentran diferencias.")
+def verificar_caja_command(reconstruir):
+    """Verifica que los cierres diarios de caja coincidan con ingresos_egresos (en cada base, con BASE_POR_EMPRESA)."""
+    diferencias = [diferencia for _, diferencias_base in _en_cada_base_empresa(
+        lambda _: verificar_cierres_caja(reconstruir=reconstruir)) for diferencia in diferencias_base]
+    if not diferencias:
+        click.echo("Cierres de caja consistentes con ingresos_egresos.")
+        return
+    for id_empresa, fecha, esperado, materializado in diferencias:
+        click.echo(f"Empresa {id_empresa} - {fecha}: esperado {esperado}, materializado {materializado}")
+    if reconstruir:
+        click.echo(f"Cierres de caja reconstruidos ({len(diferencias)} días con diferencias).")
+    else:
+        click.echo(f"{len(diferencias)} días con diferencias. Ejecute con --reconstruir para regenerarlos.")
+
+
+@app.cli.command('archivar-pedidos')
+@click.option('--dias', type=int, default=ARCHIVO_DIAS_ANTIGUEDAD, show_default=True,
+              help="Se archivan los pedidos pagados antes de la medianoche de hace esta cantidad de días.")
+@click.option('--lote', type=int, default=ARCHIVO_LOTE_PEDIDOS, show_default=True, help="Pedidos por transacción.")
+def archivar_pedidos_command(dias, lote):
+    """Mueve los pedidos pagados antiguos, con sus ítems y movimientos de caja, a la base de archivo."""
+    inicio = time.perf_counter()
+    resultados = _en_cada_base_empresa(lambda _: archivar_pedidos(dias=dias, lote=lote))
+    pedidos = sum(pedidos for _, (pedidos, _) in resultados)
+    movimientos = sum(movimientos for _, (_, movimientos) in resultados)
+    destino = f"{len(resultados)} base(s) de empresa" if BASE_POR_EMPRESA else ARCHIVO_DB_NAME
+    click.echo(f"{pedidos} pedido(s) y {movimientos} movimiento(s) suelto(s) archivados en {destino} "
+               f"en {time.perf_counter() - inicio:.1f}s.")
+
+
+
+@app.cli.command('refrescar-reportes')
+def refrescar_reportes_command():
+    """Rehace ya el snapshot de reportes de cada base (para cron, o al activar REPORTES_SNAPSHOT)."""
+    inicio = time.perf_counter()
+    resultados = refrescar_snapshots_reportes(forzar=True)
+    tomados = sum(1 for _, tomado_en in resultados if tomado_en)
+    click.echo(f"{tomados} de {len(resultados)} snapshot(s) de reportes refrescados en {time.perf_counter() - inicio:.1f}s.")
+
+
+@app.cli.command('mantenimiento')
+@click.option('--backup', is_flag=True, help="Backup en línea de todas las bases.")
+@click.option('--estadisticas', is_flag=True, help="ANALYZE acotado de todas las bases.")
+@click.option('--vacuum', is_flag=True, help="Purga de eventos de pedidos ya consumidos y vacuum incremental de todas las bases.")
+@click.option('--convertir-vacuum', is_flag=True,
+              help="Activa auto_vacuum incremental en bases creadas antes (VACUUM completo: bloquea las escrituras mientras dura).")
+def mantenimiento_command(backup, estadisticas, vacuum, convertir_vacuum):
+    """
+    Backup, vacuum incremental y estadísticas de las bases (sin opciones, las tres). Para cron, después del cierre;
+    no combinar con MANTENIMIENTO_AUTOMATICO=1.
+    """
+    if not (backup or estadisticas or vacuum or convertir_vacuum):
+        backup = estadisticas = vacuum = True
+    if convertir_vacuum:
+        for id_empresa, ruta, _ in _bases_a_mantener():
+            inicio = time.perf_counter()
+            conn = _conexion_del_hilo(id_empresa)
+            try:
+                convertir_a_vacuum_incremental(conn)
+            finally:
+                conn.close()
+            click.echo(f"{ruta}: auto_vacuum incremental activado en {time.perf_counter() - inicio:.1f}s.")
+    if backup:
+        inicio = time.perf_counter()
+        destino = hacer_backup()
+        if destino is None:
+            raise click.ClickException("No se pudo hacer el backup: el archivo histórico cambió en cada intento "
+                                       "o se pasó de BACKUP_LIMITE_SEGUNDOS.")
+        click.echo(f"Backup en {destino} en {time.perf_counter() - inicio:.1f}s.")
+    if estadisticas or vacuum:
+        inicio = time.perf_counter()
+        liberadas = mantener_bases(estadisticas, vacuum)
+        click.echo(f"{liberadas} página(s) liberadas{', estadísticas actualizadas' if estadisticas else ''} "
+                   f"en {time.perf_counter() - inicio:.1f}s.")
+
+
+@app.cli.command('eventos-consumidores')
+def eventos_consumidores_command():
+    """Muestra la posición confirmada y los eventos pendientes de cada consumidor del registro de eventos de pedidos."""
+    def consumidores(id_empresa):
+        conn = conectar_db()
+        try:
+            return repositorio.todos(conn.cursor(), 'eventos.consumidores')
+        finally:
+            conn.close()
+
+    for id_empresa, filas in _en_cada_base_empresa(consumidores):
+        prefijo = f"Empresa {id_empresa}: " if id_empresa is not None else ""
+        if not filas:
+            click.echo(f"{prefijo}sin consumidores.")
+        for fila in filas:
+            click.echo(f"{prefijo}{fila['consumidor']}: hasta el evento {fila['ultimo_id_evento']} "
+                       f"({fila['actualizado_en']}), {fila['pendientes']} pendiente(s).")
+
+
+@app.cli.command('trabajador')
+@click.option('--hilos', type=int, default=TRABAJOS_HILOS, show_default=True, help="Hilos trabajadores de este proceso.")
+def trabajador_command(hilos):
+    """
+    Corre trabajadores de la cola de trabajos hasta que se interrumpa, para COLA_TRABAJOS='externa'. Pueden correr
+    varios procesos a la vez: cada trabajo lo toma uno solo.
+    """
+    iniciar_trabajadores(hilos)
+    click.echo(f"{hilos} trabajador(es) de la cola en el proceso {os.getpid()}. Ctrl+C para detener.")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        # Un trabajo a medias vuelve a la cola cuando vence su arriendo
+        click.echo("Trabajadores detenidos.")
+
+
+@app.cli.command('trabajos')
+@click.option('--reintentar-fallidos', is_flag=True, help="Vuelve a encolar los trabajos fallidos con los intentos en cero.")
+def trabajos_command(reintentar_fallidos):
+    """Resumen de la cola de trabajos por tarea y estado, y los trabajos fallidos."""
+    conn = _conexion_cola()
+    cursor = conn.cursor()
+    try:
+        if reintentar_fallidos:
+            reintentados = repositorio.ejecutar(cursor, 'trabajos.reintentar_fallidos', ahora=time.time()).rowcount
+            conn.commit()
+            click.echo(f"{reintentados} trabajo(s) fallido(s) vueltos a encolar.")
+        filas = repositorio.todos(cursor, 'trabajos.resumen')
+        fallidos = repositorio.todos(cursor, 'trabajos.fallidos', limite=20)
+    finally:
+        conn.close()
+    if not filas:
+        click.echo("La cola de trabajos está vacía.")
+    for fila in filas:
+        click.echo(f"{fila['tarea']} {fila['estado']}: {fila['cantidad']} "
+                   f"(el más viejo de hace {time.time() - fila['creado_mas_antiguo']:.0f}s)")
+    for fila in fallidos:
+        click.echo(f"  #{fila['id_trabajo']} {fila['tarea']} {fila['argumentos']} tras {fila['intentos']} intento(s): "
+                   f"{fila['ultimo_error']}")
+
+
+@app.cli.command('dividir-por-empresa')
+def dividir_por_empresa_command():
+    """
+    Paso a BASE_POR_EMPRESA: copia la carta, los repartidores, los pedidos y la caja de cada empresa desde
+    la base única (que pasa a ser la general) a la base de la empresa. Las bases de empresa deben estar vacías.
+    """
+    if not BASE_POR_EMPRESA:
+        raise click.UsageError("Defina BASE_POR_EMPRESA=1 para dividir la base por empresa.")
+
+    def copiar(id_empresa):
+        conn = conectar_db()
+        cursor = conn.cursor()
+        if cursor.execute("SELECT EXISTS (SELECT 1 FROM main.pedidos) OR EXISTS (SELECT 1 FROM main.platos)").fetchone()[0]:
+            conn.close()
+            return None
+        copiados = {}
+        try:
+            _iniciar_escritura(cursor)
+            for tabla, condicion in (
+                ('platos', "id_empresa = :id_empresa"),
+                ('repartidores', "id_empresa = :id_empresa"),
+                ('pedidos', "id_empresa = :id_empresa"),
+                ('items_pedido', "id_pedido IN (SELECT id_pedido FROM general.pedidos WHERE id_empresa = :id_empresa)"),
+                ('ingresos_egresos', "id_empresa = :id_empresa"),
+            ):
+                # Sin las columnas generadas (*_epoch), que no admiten INSERT
+                columnas = ', '.join(col[1] for col in cursor.execute(f"PRAGMA main.table_xinfo({tabla})") if col[6] == 0)
+                cursor.execute(f"INSERT INTO main.{tabla} ({columnas}) SELECT {columnas} FROM general.{tabla} WHERE {condicion}",
+                               {'id_empresa': id_empresa})
+                copiados[tabla] = cursor.rowcount
+            _reconstruir_cierres_caja(cursor)
+            conn.commit()
+            actualizar_estadisticas(conn)
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return copiados
+
+    for id_empresa, copiados in _en_cada_base_empresa(copiar):
+        if copiados is None:
+            click.echo(f"Empresa {id_empresa}: su base ya tiene datos, se omite.")
+        else:
+            click.echo(f"Empresa {id_empresa}: " + ", ".join(f"{cantidad} {tabla}" for tabla, cantidad in copiados.items()))
+
+
+@app.cli.command('imprimir-franja')
+@click.option('--empresa', type=int, required=True, help="Empresa cuyos tickets se imprimen.")
+@click.option('--fecha', default='', help="Fecha de la franja (AAAA-MM-DD). Por defecto, hoy.")
+@click.option('--hora', default='', help="Inicio de la franja (HH:MM). Por defecto, la próxima franja.")
+@click.option('--formato', type=click.Choice(['html', 'escpos']), default='html')
+@click.option('--salida', type=click.Path(dir_okay=False), help="Archivo donde guardar el documento combinado.")
+@click.option('--impresora', is_flag=True, help="Enviar el resultado ESC/POS a la impresora de cocina configurada.")
+def imprimir_franja_command(empresa, fecha, hora, formato, salida, impresora):
+    """Renderiza en el pool de procesos los tickets de una franja de una empresa en un único documento."""
+    try:
+        inicio_franja = _leer_inicio_franja(fecha, hora)
+    except ValueError:
+        raise click.BadParameter("Fecha u hora de franja inválida.")
+    if empresa not in _ids_empresas():
+        raise click.BadParameter(f"No existe la empresa {empresa}.", param_hint='--empresa')
+
+    # Fuera de una petición alcance_empresa() abarca todas las empresas: la franja se filtra por la elegida
+    with base_de_empresa(empresa):
+        pedidos = _obtener_pedidos_de_franja(inicio_franja, empresa)
+    inicio = time.perf_counter()
+    tickets = impresion_lote.recolectar(impresion_lote.renderizar_en_pool(
+        pedidos, formato, procesos=IMPRESION_LOTE_PROCESOS, tamano_lote=IMPRESION_LOTE_TAMANO, ancho=TICKET_ANCHO_COLUMNAS))
+    duracion = time.perf_counter() - inicio
+    click.echo(f"{len(tickets)} ticket(s) de la franja {inicio_franja.strftime('%d/%m %H:%M')} renderizados en {duracion:.2f}s.")
+
+    if formato == 'escpos':
+        documento = b''.join(tickets)
+        if impresora:
+            if not IMPRESORA_COCINA_HOST:
+                raise click.ClickException("No hay una impresora de cocina configurada (IMPRESORA_COCINA_HOST).")
+            enviar_a_impresora(documento, IMPRESORA_COCINA_HOST, IMPRESORA_COCINA_PUERTO)
+            click.echo("Tickets enviados a la impresora de cocina.")
+    else:
+        documento = app.jinja_env.get_template('_documento_tickets.html').render(
+            titulo=f"Franja {inicio_franja.strftime('%d/%m %H:%M')}", tickets=tickets).encode('utf-8')
+
+    if salida:
+        with open(salida, 'wb') as archivo:
+            archivo.write(documento)
+        click.echo(f"Documento guardado en {salida}.")
+
+
+@app.cli.command('limpiar-metricas')
+def limpiar_metricas_command():
+    """Vacía el directorio de métricas (ejecutar antes de arrancar gunicorn)."""
+    metricas_mod.limpiar_directorio(METRICAS_DIRECTORIO)
+    click.echo(f"Directorio de métricas vaciado: {METRICAS_DIRECTORIO}")
+
+
 if __name__ == '__main__':
     # --- SUGERENCIA: Descomenta las siguientes líneas si quieres forzar la recreación de la DB
     # --- Esto es útil para desarrollo cuando se hacen cambios en las tablas.
     # --- ADVERTENCIA: ¡Esto borrará todos tus datos actuales de la base de datos!
     # if os.path.exists(DB_NAME):
     #     os.remove(DB_NAME)
-    #     print(f"Base de datos '{DB_NAME}' eliminada para recreación.")
+    #     app.logger.info("Base de datos '%s' eliminada para recreación.", DB_NAME)
 
     init_app()
     app.run(debug=True)
\ No newline at end of file
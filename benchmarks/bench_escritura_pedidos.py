@@ -0,0 +1,87 @@
+# casa_comida_web/benchmarks/bench_escritura_pedidos.py
+"""
+Mide el alta de pedidos (pedidos/s y latencia por pedido) con varios hilos escribiendo a la vez:
+un commit por pedido desde cada hilo (como hoy) versus el escritor único con commit agrupado.
+
+Cada hilo guarda sus pedidos uno tras otro con _guardar_pedido, igual que las peticiones de
+/hacer_pedido en un worker con hilos. Se usa una base nueva en un directorio temporal.
+
+Uso (desde la raíz del proyecto):
+    python benchmarks/bench_escritura_pedidos.py --pedidos 2000 --hilos 1 8 32
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+DIRECTORIO = tempfile.mkdtemp(prefix='casasdecomida_escritura_')
+os.environ['DB_NAME'] = os.path.join(DIRECTORIO, 'restaurante.db')
+os.environ.setdefault('LOG_NIVEL', 'WARNING')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_mod  # noqa: E402
+
+
+def pedido_de_prueba(i, items_por_pedido=3):
+    ahora = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return dict(
+        cliente_nombre="Cliente", cliente_apellido=f"Prueba {i}", direccion_entrega=f"Calle Falsa {i}",
+        es_envio=i % 2, horario_entrega=ahora, costo_envio=0.0, costo_total=4500.0, forma_pago='Efectivo',
+        fecha_creacion=ahora, lat_cliente=None, lon_cliente=None, id_empresa_pedido=app_mod.DEFAULT_COMPANY_FOR_ORDERS,
+        items=[{'id_plato': 1, 'cantidad': 1, 'precio_unitario': 1500.0} for _ in range(items_por_pedido)],
+    )
+
+
+def medir(descripcion, pedidos, hilos, escritor_unico):
+    """Reparte los pedidos entre los hilos y mide el total y la latencia de cada _guardar_pedido."""
+    app_mod.PEDIDOS_ESCRITOR_UNICO = escritor_unico
+    latencias, lock = [], threading.Lock()
+
+    def trabajar(cantidad):
+        propias = []
+        for i in range(cantidad):
+            inicio = time.perf_counter()
+            app_mod._guardar_pedido(pedido_de_prueba(i))
+            propias.append(time.perf_counter() - inicio)
+        app_mod._liberar_conexion_db()
+        with lock:
+            latencias.extend(propias)
+
+    por_hilo = pedidos // hilos
+    trabajadores = [threading.Thread(target=trabajar, args=(por_hilo,)) for _ in range(hilos)]
+    inicio = time.perf_counter()
+    for trabajador in trabajadores:
+        trabajador.start()
+    for trabajador in trabajadores:
+        trabajador.join()
+    duracion = time.perf_counter() - inicio
+    latencias.sort()
+    p99 = latencias[int(len(latencias) * 0.99) - 1]
+    print(f"{descripcion:<22} {hilos:>5} {len(latencias) / duracion:10.0f} {statistics.median(latencias) * 1e3:10.2f} "
+          f"{p99 * 1e3:10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pedidos', type=int, default=2000, help="Pedidos por medición.")
+    parser.add_argument('--hilos', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--espera-ms', type=float, default=app_mod.PEDIDOS_GRUPO_ESPERA_SEGUNDOS * 1000,
+                        help="Espera máxima del escritor para juntar un grupo.")
+    args = parser.parse_args()
+    app_mod.escritor_pedidos.espera_maxima = args.espera_ms / 1000
+
+    app_mod.crear_tablas()
+    print(f"Base de prueba: {app_mod.DB_NAME}")
+    print(f"{'modo':<22} {'hilos':>5} {'pedidos/s':>10} {'p50 ms':>10} {'p99 ms':>10}")
+    for hilos in args.hilos:
+        medir("commit por pedido", args.pedidos, hilos, escritor_unico=False)
+        medir("escritor agrupado", args.pedidos, hilos, escritor_unico=True)
+
+
+if __name__ == '__main__':
+    main()
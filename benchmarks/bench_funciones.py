@@ -0,0 +1,293 @@
+# casa_comida_web/benchmarks/bench_funciones.py
+"""
+Micro-benchmarks de las funciones calientes de app.py contra una base sintética, con
+comparación contra una línea base guardada: termina con código 1 si alguna función
+empeoró más que la tolerancia, y con código 2 si no hay línea base para ese tamaño.
+
+Cada función se mide con timeit: se calibra la cantidad de llamadas para que cada tanda
+dure al menos ~0,2 s y se toman varias tandas, cada una seguida de una tanda de un trabajo
+de referencia fijo. Se compara la mediana de la relación entre ambos, que no cambia si la
+máquina se pone lenta un rato (en una máquina virtual compartida los tiempos solos varían
+más de un 50% entre corridas). Para que el ruido no dispare la alarma, un empeoramiento
+cuenta sólo si supera la tolerancia y dos desvíos combinados de las dos mediciones, si el
+tiempo por llamada creció más de --piso segundos (funciones de pocos microsegundos) y si se
+repite al volver a medir la función (--confirmaciones; se queda la mejor medición). La línea
+base se guarda del mismo modo: la mejor de 1 + --confirmaciones mediciones. La base
+sintética (generar_db.py) se crea la primera vez y se reutiliza.
+
+Hay líneas base (lineas_base/funciones_<pedidos>.json, medidas en la máquina de referencia)
+para 10000 y 1000000 pedidos; para otro tamaño hay que guardar una antes de comparar.
+
+Uso (desde la raíz del proyecto):
+    python benchmarks/bench_funciones.py --pedidos 10000                       # todas
+    python benchmarks/bench_funciones.py calcular_distancia_cuadras load_user  # sólo esas
+    python benchmarks/bench_funciones.py --pedidos 1000000 --guardar-linea-base
+    python benchmarks/bench_funciones.py --listar
+"""
+
+import argparse
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import timeit
+from datetime import datetime, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DIRECTORIO_LINEAS_BASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lineas_base')
+sys.path.insert(0, RAIZ)
+
+import generar_db  # noqa: E402
+
+
+def preparar_entorno(db_path):
+    """Apunta la app a la base sintética, abre el horario todo el día y baja el logging, antes de importar app."""
+    os.environ['DB_NAME'] = db_path
+    os.environ['HORA_APERTURA'] = '00:00'
+    os.environ['HORA_CIERRE'] = '23:59'
+    os.environ.setdefault('LOG_NIVEL', 'WARNING')
+
+
+# --- Benchmarks: cada uno recibe la app y retorna la función sin argumentos a medir ---
+
+def bench_calcular_distancia_cuadras(app_mod):
+    puntos = itertools.cycle([(-34.60 + i / 1000, -58.38 - i / 1000) for i in range(100)])
+    return lambda: app_mod.calcular_distancia_cuadras(app_mod.SUCURSAL_LAT, app_mod.SUCURSAL_LON, *next(puntos))
+
+
+def bench_generar_franjas_horarias_disponibles(app_mod):
+    return lambda: app_mod._generar_franjas_horarias_disponibles(app_mod.DEFAULT_COMPANY_FOR_ORDERS)
+
+
+def bench_cargar_franjas_ocupadas_desde_db_interna(app_mod):
+    return lambda: app_mod._cargar_franjas_ocupadas_desde_db_interna(app_mod.DEFAULT_COMPANY_FOR_ORDERS)
+
+
+def bench_get_carrito_detalle(app_mod):
+    conn = app_mod.conectar_db()
+    platos = app_mod.repositorio.todos(conn.cursor(), 'platos.carta', app_mod.DEFAULT_COMPANY_FOR_ORDERS)
+    conn.close()
+    app_mod.session['carrito'] = {str(plato['id_plato']): {'nombre': plato['nombre'], 'precio': plato['precio'],
+                                                           'cantidad': 2, 'rubro': plato['rubro']}
+                                  for plato in platos}
+    return lambda: app_mod._get_carrito_detalle(platos)
+
+
+def bench_generar_ticket(app_mod):
+    pedido = app_mod._obtener_pedido_completo_por_id(_ids_pedidos(app_mod, 1)[0])
+
+    def generar():
+        # Sin caché: se mide el renderizado
+        app_mod._cache_tickets.clear()
+        return pedido.generar_ticket()
+    return generar
+
+
+def bench_obtener_pedido_completo_por_id(app_mod):
+    ids = itertools.cycle(_ids_pedidos(app_mod, 1000))
+    return lambda: app_mod._obtener_pedido_completo_por_id(next(ids))
+
+
+def bench_fetch_report_data(app_mod):
+    hoy = datetime.now()
+    desde, hasta = (hoy - timedelta(days=30)).strftime('%Y-%m-%d'), hoy.strftime('%Y-%m-%d')
+    return lambda: app_mod._fetch_report_data(desde, hasta, app_mod.DEFAULT_COMPANY_FOR_ORDERS)
+
+
+def bench_load_user(app_mod):
+    return lambda: app_mod.load_user('1')
+
+
+def _ids_pedidos(app_mod, cantidad):
+    conn = app_mod.conectar_db()
+    maximo = conn.execute("SELECT MAX(id_pedido) FROM pedidos").fetchone()[0] or 1
+    conn.close()
+    aleatorio = random.Random(42)
+    return [aleatorio.randint(1, maximo) for _ in range(cantidad)]
+
+
+BENCHMARKS = {
+    'calcular_distancia_cuadras': bench_calcular_distancia_cuadras,
+    '_generar_franjas_horarias_disponibles': bench_generar_franjas_horarias_disponibles,
+    '_cargar_franjas_ocupadas_desde_db_interna': bench_cargar_franjas_ocupadas_desde_db_interna,
+    '_get_carrito_detalle': bench_get_carrito_detalle,
+    'Pedido.generar_ticket': bench_generar_ticket,
+    '_obtener_pedido_completo_por_id': bench_obtener_pedido_completo_por_id,
+    '_fetch_report_data': bench_fetch_report_data,
+    'load_user': bench_load_user,
+}
+
+
+_CONEXION_REFERENCIA = sqlite3.connect(':memory:')
+_CONEXION_REFERENCIA.execute("CREATE TABLE t (a INTEGER, b TEXT)")
+_CONEXION_REFERENCIA.executemany("INSERT INTO t VALUES (?, ?)", ((i, str(i)) for i in range(200)))
+
+
+def _trabajo_de_referencia():
+    """Trabajo fijo (Python y SQLite en memoria) que se mide junto a cada tanda para descontar la velocidad de la máquina."""
+    filas = _CONEXION_REFERENCIA.execute("SELECT a, b FROM t WHERE a % 3 = 0").fetchall()
+    return sum(a for a, b in filas if b) + sum(i * i for i in range(200))
+
+
+def medir(funcion, repeticiones):
+    """
+    Segundos por llamada de cada tanda (timeit calibra las llamadas por tanda) y, tanda a tanda, su relación con el
+    trabajo de referencia medido a continuación: una máquina que se pone lenta un rato afecta a ambos por igual.
+    """
+    temporizador = timeit.Timer(funcion)
+    llamadas, _ = temporizador.autorange()
+    llamadas = max(1, llamadas)
+    referencia = timeit.Timer(_trabajo_de_referencia)
+    llamadas_referencia, _ = referencia.autorange()
+    tiempos, relativos = [], []
+    for _ in range(repeticiones):
+        tiempo = temporizador.timeit(llamadas) / llamadas
+        tiempos.append(tiempo)
+        relativos.append(tiempo / (referencia.timeit(llamadas_referencia) / llamadas_referencia))
+    return {
+        'minimo_s': min(tiempos),
+        'mediana_s': statistics.median(tiempos),
+        'desvio_s': statistics.stdev(tiempos) if len(tiempos) > 1 else 0.0,
+        'relativo_mediana': statistics.median(relativos),
+        'relativo_desvio': statistics.stdev(relativos) if len(relativos) > 1 else 0.0,
+        'llamadas_por_tanda': llamadas,
+        'tandas': repeticiones,
+    }
+
+
+def comparar(resultados, linea_base, tolerancia, piso):
+    """
+    [(nombre, actual, base, cambio, cambio_relativo, es_regresion)] con las medianas por llamada, y si hubo alguna
+    regresión: un empeoramiento relativo al trabajo de referencia por encima de la tolerancia y del ruido de las
+    mediciones, que además supere 'piso' segundos por llamada.
+    """
+    filas, regresion = [], False
+    for nombre, medicion in resultados.items():
+        referencia = linea_base.get(nombre, {})
+        base = referencia.get('mediana_s')
+        actual = medicion['mediana_s']
+        cambio = actual / base - 1 if base else None
+        cambio_relativo, es_regresion = None, False
+        if 'relativo_mediana' in referencia:
+            cambio_relativo = medicion['relativo_mediana'] / referencia['relativo_mediana'] - 1
+            ruido = 2 * math.hypot(medicion['relativo_desvio'], referencia['relativo_desvio']) / referencia['relativo_mediana']
+            es_regresion = cambio_relativo > max(tolerancia, ruido) and actual - base > piso
+        regresion = regresion or es_regresion
+        filas.append((nombre, actual, base, cambio, cambio_relativo, es_regresion))
+    return filas, regresion
+
+
+def _formatear_tiempo(segundos):
+    if segundos is None:
+        return "-"
+    if segundos < 1e-3:
+        return f"{segundos * 1e6:.1f} µs"
+    return f"{segundos * 1e3:.2f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('funciones', nargs='*', help="Benchmarks a correr (por defecto, todos).")
+    parser.add_argument('--pedidos', type=int, default=10000, help="Pedidos de la base sintética (10000, 1000000, 10000000).")
+    parser.add_argument('--directorio-datos', default=os.path.join(tempfile.gettempdir(), 'casasdecomida_bench'))
+    parser.add_argument('--repeticiones', type=int, default=9, help="Tandas por función (se compara la mediana).")
+    parser.add_argument('--resultado', help="Archivo JSON de salida (por defecto, bench_funciones_<pedidos>.json).")
+    parser.add_argument('--linea-base', help="JSON de referencia (por defecto, lineas_base/funciones_<pedidos>.json).")
+    parser.add_argument('--tolerancia', type=float, default=0.25, help="Empeoramiento admitido (0.25 = 25%%).")
+    parser.add_argument('--confirmaciones', type=int, default=3,
+                        help="Veces que se vuelve a medir una función marcada como regresión antes de darla por buena.")
+    parser.add_argument('--piso', type=float, default=1e-6,
+                        help="Empeoramiento por llamada (s) que no cuenta como regresión aunque supere la tolerancia.")
+    parser.add_argument('--guardar-linea-base', action='store_true', help="Guarda este resultado como nueva línea base.")
+    parser.add_argument('--listar', action='store_true')
+    args = parser.parse_args()
+
+    if args.listar:
+        print("\n".join(BENCHMARKS))
+        return 0
+    desconocidos = [nombre for nombre in args.funciones if nombre not in BENCHMARKS]
+    if desconocidos:
+        parser.error(f"Benchmarks desconocidos: {', '.join(desconocidos)} (ver --listar)")
+    nombres = args.funciones or list(BENCHMARKS)
+
+    os.makedirs(args.directorio_datos, exist_ok=True)
+    db_path = os.path.join(args.directorio_datos, f"restaurante_{args.pedidos}.db")
+    existia = os.path.exists(db_path)
+    preparar_entorno(db_path)
+    import app as app_mod
+    if not existia:
+        print(f"Creando base sintética con {args.pedidos} pedidos en {db_path}...")
+        generar_db.generar(app_mod, args.pedidos)
+
+    ruta_linea_base = args.linea_base or os.path.join(DIRECTORIO_LINEAS_BASE, f"funciones_{args.pedidos}.json")
+    linea_base = {}
+    if os.path.exists(ruta_linea_base):
+        with open(ruta_linea_base, encoding='utf-8') as archivo:
+            linea_base = json.load(archivo)['resultados']
+
+    resultados = {}
+    with app_mod.app.test_request_context('/'):
+        for nombre in nombres:
+            resultados[nombre] = medir(BENCHMARKS[nombre](app_mod), args.repeticiones)
+        for _ in range(args.confirmaciones):
+            # Una medición lenta puede ser ruido de la máquina: una regresión real se repite al volver a medir.
+            # La línea base también se queda con la mejor de varias mediciones, para no guardar una lenta.
+            if args.guardar_linea_base:
+                pendientes = nombres
+            else:
+                filas, _ = comparar(resultados, linea_base, args.tolerancia, args.piso)
+                pendientes = [nombre for nombre, *_, es_regresion in filas if es_regresion]
+            if not pendientes:
+                break
+            for nombre in pendientes:
+                medicion = medir(BENCHMARKS[nombre](app_mod), args.repeticiones)
+                if medicion['relativo_mediana'] < resultados[nombre]['relativo_mediana']:
+                    resultados[nombre] = medicion
+
+    salida = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'pedidos': args.pedidos,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'maquina': platform.node(),
+        'resultados': resultados,
+    }
+    ruta_resultado = args.resultado or f"bench_funciones_{args.pedidos}.json"
+    with open(ruta_resultado, 'w', encoding='utf-8') as archivo:
+        json.dump(salida, archivo, ensure_ascii=False, indent=2)
+
+    filas, regresion = comparar(resultados, linea_base, args.tolerancia, args.piso)
+
+    print(f"{args.pedidos} pedidos, línea base: {ruta_linea_base if linea_base else 'ninguna'}")
+    # 'cambio' compara los tiempos; 'relativo', los tiempos sobre el trabajo de referencia (lo que decide la regresión)
+    print(f"{'Función (mediana por llamada)':<45} {'actual':>12} {'base':>12} {'cambio':>8} {'relativo':>9}")
+    for nombre, actual, base, cambio, cambio_relativo, es_regresion in filas:
+        marca = "  REGRESIÓN" if es_regresion else ""
+        cambio_texto = f"{cambio:+.1%}" if cambio is not None else "-"
+        relativo_texto = f"{cambio_relativo:+.1%}" if cambio_relativo is not None else "-"
+        print(f"{nombre:<45} {_formatear_tiempo(actual):>12} {_formatear_tiempo(base):>12} {cambio_texto:>8} {relativo_texto:>9}{marca}")
+    print(f"Resultado en {ruta_resultado}")
+
+    if args.guardar_linea_base:
+        os.makedirs(DIRECTORIO_LINEAS_BASE, exist_ok=True)
+        if linea_base and args.funciones:
+            # Guardando sólo algunas funciones: se conservan las demás de la línea base anterior
+            salida['resultados'] = {**linea_base, **resultados}
+        with open(ruta_linea_base, 'w', encoding='utf-8') as archivo:
+            json.dump(salida, archivo, ensure_ascii=False, indent=2)
+        print(f"Línea base guardada en {ruta_linea_base}")
+        return 0
+    if not linea_base:
+        print(f"No hay línea base para {args.pedidos} pedidos: no se comparó nada (guardar una con --guardar-linea-base).")
+        return 2
+    return 1 if regresion else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,117 @@
+# casa_comida_web/benchmarks/bench_modelos.py
+"""
+Mide tiempo y memoria de hidratar pedidos desde sqlite3.Row: el modelo anterior (atributos
+en __dict__ y strptime inmediato de las tres fechas) contra models.Pedido (__slots__ y
+fechas que se convierten al primer acceso).
+
+Uso (desde la raíz del proyecto):
+    python benchmarks/bench_modelos.py --pedidos 100000
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models  # noqa: E402
+
+
+class PedidoAnterior:
+    """Copia del modelo previo a __slots__, como referencia."""
+
+    def __init__(self, id_pedido, cliente_nombre, cliente_apellido, direccion_entrega, es_envio,
+                 horario_entrega, costo_envio, costo_total, forma_pago, estado_pago, fecha_creacion,
+                 lat_cliente, lon_cliente, fecha_pago=None, id_repartidor=None, id_empresa=None, version_ticket=0):
+        self.id_pedido = id_pedido
+        self.cliente_nombre = cliente_nombre
+        self.cliente_apellido = cliente_apellido
+        self.direccion_entrega = direccion_entrega
+        self.es_envio = bool(es_envio)
+        self.horario_entrega = datetime.strptime(horario_entrega, '%Y-%m-%d %H:%M:%S') if isinstance(horario_entrega, str) else horario_entrega
+        self.costo_envio = costo_envio
+        self.costo_total = costo_total
+        self.forma_pago = forma_pago
+        self.estado_pago = estado_pago
+        self.fecha_creacion = datetime.strptime(fecha_creacion, '%Y-%m-%d %H:%M:%S') if isinstance(fecha_creacion, str) else fecha_creacion
+        self.fecha_pago = datetime.strptime(fecha_pago, '%Y-%m-%d %H:%M:%S') if fecha_pago else None
+        self.lat_cliente = lat_cliente
+        self.lon_cliente = lon_cliente
+        self.id_repartidor = id_repartidor
+        self.id_empresa = id_empresa
+        self.version_ticket = version_ticket
+        self.repartidor = None
+        self.items = []
+
+    @classmethod
+    def desde_fila(cls, row):
+        return cls(row['id_pedido'], row['cliente_nombre'], row['cliente_apellido'], row['direccion_entrega'],
+                   row['es_envio'], row['horario_entrega'], row['costo_envio'], row['costo_total'],
+                   row['forma_pago'], row['estado_pago'], row['fecha_creacion'], row['lat_cliente'],
+                   row['lon_cliente'], row['fecha_pago'], row['id_repartidor'], row['id_empresa'],
+                   row['version_ticket'])
+
+
+def crear_filas(cantidad):
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    conn.execute("""
+        CREATE TABLE pedidos (
+            id_pedido INTEGER PRIMARY KEY, cliente_nombre TEXT, cliente_apellido TEXT, direccion_entrega TEXT,
+            es_envio INTEGER, horario_entrega TEXT, costo_envio REAL, costo_total REAL, forma_pago TEXT,
+            estado_pago TEXT, fecha_creacion TEXT, lat_cliente REAL, lon_cliente REAL, fecha_pago TEXT,
+            id_repartidor INTEGER, id_empresa INTEGER, version_ticket INTEGER
+        )
+    """)
+    base = datetime(2026, 1, 1, 10, 0)
+    formato = '%Y-%m-%d %H:%M:%S'
+    conn.executemany("INSERT INTO pedidos VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (
+        (i, "Cliente", f"Prueba {i}", f"Calle Falsa {i}", i % 2, (base + timedelta(minutes=15 * (i % 52))).strftime(formato),
+         500.0, 4500.0, 'Efectivo', 'Pagado' if i % 3 == 0 else 'Pendiente', (base - timedelta(minutes=i % 90)).strftime(formato),
+         -34.6, -58.38, (base + timedelta(hours=1)).strftime(formato) if i % 3 == 0 else None, None, 1, 0)
+        for i in range(1, cantidad + 1)))
+    filas = conn.execute("SELECT * FROM pedidos").fetchall()
+    conn.close()
+    return filas
+
+
+def hidratar(filas, clase, leer_fechas):
+    pedidos = [clase.desde_fila(row) for row in filas]
+    if leer_fechas:
+        for pedido in pedidos:
+            pedido.horario_entrega, pedido.fecha_creacion, pedido.fecha_pago
+    return pedidos
+
+
+def medir(descripcion, filas, clase, leer_fechas):
+    # El tiempo se toma sin tracemalloc (que enlentece mucho a strptime); la memoria, en una segunda pasada.
+    inicio = time.perf_counter()
+    hidratar(filas, clase, leer_fechas)
+    duracion = time.perf_counter() - inicio
+
+    tracemalloc.start()
+    pedidos = hidratar(filas, clase, leer_fechas)
+    memoria = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del pedidos
+    print(f"{descripcion:<30} {duracion:8.3f}s {len(filas) / duracion:10.0f} pedidos/s {memoria / 1024 / 1024:8.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pedidos', type=int, default=100000)
+    args = parser.parse_args()
+
+    filas = crear_filas(args.pedidos)
+    print(f"{args.pedidos} pedidos hidratados")
+    medir("anterior (dict + strptime)", filas, PedidoAnterior, leer_fechas=False)
+    medir("slots, sin leer fechas", filas, models.Pedido, leer_fechas=False)
+    medir("slots, leyendo las fechas", filas, models.Pedido, leer_fechas=True)
+
+
+if __name__ == '__main__':
+    main()
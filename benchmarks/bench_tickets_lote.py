@@ -0,0 +1,73 @@
+# casa_comida_web/benchmarks/bench_tickets_lote.py
+"""
+Mide el rendimiento (tickets/s) del renderizado de tickets por lote: en serie dentro
+del proceso versus en el pool de procesos de impresion_lote con distinta cantidad de procesos.
+
+Uso (desde la raíz del proyecto):
+    python benchmarks/bench_tickets_lote.py --pedidos 2000 --procesos 1 2 4
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import impresion_lote  # noqa: E402
+from app import app, Pedido, _cache_tickets  # noqa: E402
+from config import TICKET_ANCHO_COLUMNAS  # noqa: E402
+
+
+def crear_pedidos(cantidad, items_por_pedido=4):
+    """Pedidos sintéticos en memoria (no tocan la base de datos)."""
+    pedidos = []
+    ahora = datetime(2026, 1, 1, 12, 30)
+    for i in range(1, cantidad + 1):
+        es_envio = bool(i % 2)
+        pedido = Pedido(i, "Cliente", f"Prueba {i}", f"Calle Falsa {i}", es_envio, ahora,
+                        500.0 if es_envio else 0.0, 0.0, 'Efectivo', 'Pendiente', ahora, None, None)
+        for j in range(items_por_pedido):
+            pedido.agregar_item(f"Plato de prueba {j}", j % 3 + 1, 1500.0 + j * 250)
+        pedido.costo_total = pedido.costo_envio + sum(item['cantidad'] * item['precio_unitario'] for item in pedido.items)
+        pedidos.append(pedido)
+    return pedidos
+
+
+def medir(descripcion, cantidad, funcion):
+    _cache_tickets.clear()
+    inicio = time.perf_counter()
+    funcion()
+    duracion = time.perf_counter() - inicio
+    print(f"{descripcion:<28} {duracion:8.3f}s {cantidad / duracion:10.0f} tickets/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pedidos', type=int, default=2000)
+    parser.add_argument('--procesos', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--tamano-lote', type=int, default=25)
+    parser.add_argument('--formato', choices=['html', 'escpos'], default='html')
+    args = parser.parse_args()
+
+    pedidos = crear_pedidos(args.pedidos)
+    print(f"{args.pedidos} pedidos, formato {args.formato}, lotes de {args.tamano_lote}")
+
+    with app.app_context():
+        medir("serie (1 proceso)", args.pedidos,
+              lambda: impresion_lote._renderizar_tickets(pedidos, args.formato, TICKET_ANCHO_COLUMNAS))
+
+    for procesos in args.procesos:
+        # Un pool nuevo por medición; se descarta la primera tanda para no medir el arranque de los procesos.
+        impresion_lote._pool = None
+        impresion_lote.recolectar(impresion_lote.renderizar_en_pool(
+            pedidos[:args.tamano_lote], args.formato, procesos, args.tamano_lote, TICKET_ANCHO_COLUMNAS))
+        medir(f"pool ({procesos} procesos)", args.pedidos,
+              lambda: impresion_lote.recolectar(impresion_lote.renderizar_en_pool(
+                  pedidos, args.formato, procesos, args.tamano_lote, TICKET_ANCHO_COLUMNAS)))
+        impresion_lote._pool.shutdown()
+
+
+if __name__ == '__main__':
+    main()
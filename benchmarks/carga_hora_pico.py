@@ -0,0 +1,378 @@
+# casa_comida_web/benchmarks/carga_hora_pico.py
+"""
+Prueba de carga de la hora pico del mediodía.
+
+Clientes concurrentes recorren el flujo completo de compra:
+- abren /hacer_pedido;
+- usan la API del carrito (agregar, cambiar cantidades, consultar, quitar);
+- confirman el pedido en una de las primeras franjas libres, así compiten por los mismos cupos.
+
+En paralelo, el personal del local refresca el tablero de pedidos y marca pedidos como pagados.
+
+Por defecto la prueba levanta todo lo que necesita:
+- un servidor de Google Maps falso (benchmarks/maps_falso.py);
+- una base de datos temporal;
+- gunicorn con la aplicación.
+Con --url se usa una instancia ya levantada; debe apuntar al Maps falso con
+GOOGLE_MAPS_URL_BASE (ver --maps-puerto).
+
+El resultado es un archivo JSON con:
+- el throughput;
+- p50/p95/p99 por endpoint;
+- las tasas de error y de bloqueo de la base ('database is locked');
+- las franjas sobrevendidas: momentos con más de MAX_PEDIDOS_POR_FRANJA_HORARIA pedidos pendientes en una franja.
+
+Uso (desde la raíz del proyecto):
+    python benchmarks/carga_hora_pico.py --clientes 40 --personal 3 --duracion 60 --workers 4
+    python benchmarks/carga_hora_pico.py --url http://127.0.0.1:8000 --db restaurante.db
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from config import MAX_PEDIDOS_POR_FRANJA_HORARIA  # noqa: E402
+from maps_falso import ServidorMapsFalso  # noqa: E402
+
+_FRANJA = re.compile(r'<option value="(\d{2}:\d{2})"')
+_PLATO = re.compile(r'btn-plus" type="button" data-plato-id="(\d+)"')
+_PEDIDO_PENDIENTE = re.compile(r'/gestion/pedido/(\d+)/marcar_pagado')
+_BLOQUEOS_METRICA = re.compile(r'^casasdecomida_db_bloqueos_total\{[^}]*\} (\S+)$', re.M)
+
+NOMBRES = ("Ana", "Luis", "Marta", "Jorge", "Sofía", "Pedro", "Lucía", "Diego")
+APELLIDOS = ("López", "García", "Pérez", "Gómez", "Díaz", "Romero", "Sosa", "Torres")
+CALLES = ("Av. Corrientes", "Florida", "Lavalle", "Tucumán", "Viamonte", "Av. Córdoba", "Paraguay")
+
+
+class Medidor:
+    """Latencias y resultados por paso ('GET /hacer_pedido', ...), compartido por todos los usuarios virtuales."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencias = defaultdict(list)
+        self.resultados = defaultdict(lambda: defaultdict(int))
+
+    def registrar(self, paso, duracion, resultado='ok'):
+        with self._lock:
+            self.latencias[paso].append(duracion)
+            self.resultados[paso][resultado] += 1
+
+
+def percentil(valores_ordenados, p):
+    """Percentil por rango más cercano de una lista ya ordenada."""
+    if not valores_ordenados:
+        return None
+    indice = max(0, min(len(valores_ordenados) - 1, round(p / 100 * len(valores_ordenados) + 0.5) - 1))
+    return valores_ordenados[indice]
+
+
+def _nueva_sesion():
+    """
+    Sesión HTTP como la de un navegador: un GET sobre una conexión keep-alive que el servidor
+    acaba de cerrar por inactividad se reintenta una vez (los POST no se reintentan).
+    """
+    sesion = requests.Session()
+    adaptador = HTTPAdapter(max_retries=Retry(total=1, connect=1, read=1, status=0, allowed_methods=['GET']))
+    sesion.mount('http://', adaptador)
+    return sesion
+
+
+def _pedir(sesion, medidor, paso, metodo, url, clasificar=None, **kwargs):
+    """Hace la petición y registra su latencia. 'clasificar(respuesta)' devuelve el resultado a registrar."""
+    inicio = time.perf_counter()
+    try:
+        respuesta = sesion.request(metodo, url, timeout=30, allow_redirects=False, **kwargs)
+    except requests.RequestException:
+        medidor.registrar(paso, time.perf_counter() - inicio, 'error')
+        return None
+    duracion = time.perf_counter() - inicio
+    if respuesta.status_code >= 500:
+        resultado = 'error'
+    elif 'database is locked' in respuesta.text:
+        resultado = 'bloqueo'
+    else:
+        resultado = clasificar(respuesta) if clasificar else 'ok'
+    medidor.registrar(paso, duracion, resultado)
+    return respuesta
+
+
+def _resultado_pedido(respuesta):
+    if respuesta.status_code == 302 and '/pedido_confirmacion/' in respuesta.headers.get('Location', ''):
+        return 'ok'
+    if 'se ha completado' in respuesta.text:
+        return 'franja_completa'
+    return 'rechazado'
+
+
+def cliente(url, medidor, fin, pausa, franjas_en_disputa):
+    """Un cliente por iteración (sesión nueva): carta, carrito, pedido."""
+    while time.monotonic() < fin:
+        sesion = _nueva_sesion()
+        respuesta = _pedir(sesion, medidor, 'GET /hacer_pedido', 'GET', f"{url}/hacer_pedido")
+        if respuesta is None or respuesta.status_code != 200:
+            time.sleep(pausa)
+            continue
+        franjas = _FRANJA.findall(respuesta.text)
+        platos = sorted(set(_PLATO.findall(respuesta.text)))
+        if not platos:
+            time.sleep(pausa)
+            continue
+
+        elegidos = random.sample(platos, min(len(platos), random.randint(2, 4)))
+        for id_plato in elegidos:
+            _pedir(sesion, medidor, 'POST /api/add_to_cart', 'POST', f"{url}/api/add_to_cart/{id_plato}",
+                   data={'cantidad': random.randint(1, 3)})
+            time.sleep(random.uniform(0, pausa / 2))
+        _pedir(sesion, medidor, 'POST /api/update_cart_quantity', 'POST',
+               f"{url}/api/update_cart_quantity/{elegidos[0]}", data={'cantidad': random.randint(1, 4)})
+        if len(elegidos) > 2 and random.random() < 0.3:
+            _pedir(sesion, medidor, 'POST /api/remove_from_cart', 'POST', f"{url}/api/remove_from_cart/{elegidos[-1]}")
+        _pedir(sesion, medidor, 'GET /api/get_cart_status', 'GET', f"{url}/api/get_cart_status")
+        time.sleep(random.uniform(0, pausa))
+
+        if not franjas:
+            medidor.registrar('POST /hacer_pedido', 0.0, 'sin_franjas')
+            time.sleep(pausa)
+            continue
+        datos = {
+            'nombre': random.choice(NOMBRES),
+            'apellido': random.choice(APELLIDOS),
+            'direccion': f"{random.choice(CALLES)} {random.randint(100, 4000)}",
+            'forma_pago': random.choice(('Efectivo', 'Tarjeta', 'Transferencia')),
+            # Todos apuntan a las primeras franjas libres, como en la hora pico
+            'horario_entrega': random.choice(franjas[:franjas_en_disputa]),
+        }
+        if random.random() < 0.6:
+            datos['es_envio_solicitado'] = 'on'
+        _pedir(sesion, medidor, 'POST /hacer_pedido', 'POST', f"{url}/hacer_pedido", _resultado_pedido, data=datos)
+        time.sleep(random.uniform(0, pausa))
+
+
+def _iniciar_sesion_personal(url, email, clave):
+    sesion = _nueva_sesion()
+    respuesta = sesion.post(f"{url}/login", data={'email': email, 'password': clave}, allow_redirects=False, timeout=30)
+    if respuesta.status_code != 302:
+        raise RuntimeError(f"No se pudo iniciar sesión como {email} (HTTP {respuesta.status_code}).")
+    if '/cambiar_clave_inicial' in respuesta.headers.get('Location', ''):
+        # Primer ingreso: se "cambia" por la misma clave para poder seguir
+        sesion.post(f"{url}/cambiar_clave_inicial", data={'nueva_clave': clave, 'confirmar_clave': clave}, timeout=30)
+    return sesion
+
+
+def personal(url, medidor, fin, sesion, refresco, cobros_por_refresco):
+    """Refresca el tablero de pedidos pendientes y cobra algunos de los pedidos visibles."""
+    while time.monotonic() < fin:
+        respuesta = _pedir(sesion, medidor, 'GET /gestion/pedidos', 'GET', f"{url}/gestion/pedidos")
+        if respuesta is not None and respuesta.status_code == 200:
+            pendientes = list(dict.fromkeys(_PEDIDO_PENDIENTE.findall(respuesta.text)))
+            for id_pedido in random.sample(pendientes, min(len(pendientes), cobros_por_refresco)):
+                _pedir(sesion, medidor, 'POST /gestion/pedido/marcar_pagado', 'POST',
+                       f"{url}/gestion/pedido/{id_pedido}/marcar_pagado")
+        time.sleep(refresco)
+
+
+def _bloqueos_db(url):
+    """Total de 'database is locked' según /metrics, o None si no está disponible."""
+    try:
+        texto = requests.get(f"{url}/metrics", timeout=10).text
+    except requests.RequestException:
+        return None
+    return sum(float(valor) for valor in _BLOQUEOS_METRICA.findall(texto))
+
+
+def franjas_sobrevendidas(db_path, desde):
+    """
+    Reconstruye, por empresa y franja, la cantidad de pedidos pendientes en cada momento (alta en
+    fecha_creacion, baja en fecha_pago) y retorna las franjas que superaron el cupo. En el mismo
+    segundo se aplican primero los pagos, para no contar falsos positivos.
+    """
+    conn = sqlite3.connect(db_path)
+    filas = conn.execute("""
+        SELECT id_empresa, horario_entrega, fecha_creacion, fecha_pago
+        FROM pedidos WHERE fecha_creacion >= ?
+    """, (desde.strftime('%Y-%m-%d %H:%M:%S'),)).fetchall()
+    conn.close()
+
+    eventos = defaultdict(list)
+    for id_empresa, horario, creacion, pago in filas:
+        eventos[(id_empresa, horario)].append((creacion, 1))
+        if pago:
+            eventos[(id_empresa, horario)].append((pago, -1))
+
+    violaciones = []
+    for (id_empresa, horario), eventos_franja in eventos.items():
+        pendientes = maximo = 0
+        for _, cambio in sorted(eventos_franja):
+            pendientes += cambio
+            maximo = max(maximo, pendientes)
+        if maximo > MAX_PEDIDOS_POR_FRANJA_HORARIA:
+            violaciones.append({'id_empresa': id_empresa, 'horario_entrega': horario,
+                                'maximo_pendientes': maximo, 'cupo': MAX_PEDIDOS_POR_FRANJA_HORARIA})
+    return sorted(violaciones, key=lambda v: v['horario_entrega'])
+
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def iniciar_servidor(directorio, maps, workers, hilos):
+    """Base temporal inicializada con init_app() y gunicorn apuntando al Maps falso. Retorna (proceso, url, db)."""
+    db_path = os.path.join(directorio, 'restaurante.db')
+    entorno = dict(os.environ,
+                   DB_NAME=db_path,
+                   GOOGLE_MAPS_URL_BASE=maps.url_base,
+                   GOOGLE_MAPS_API_KEY='clave-de-prueba',
+                   METRICAS_DIRECTORIO=os.path.join(directorio, 'metricas'),
+                   PERFILADO_DIRECTORIO=os.path.join(directorio, 'perfiles'),
+                   HORA_APERTURA='00:00', HORA_CIERRE='23:59')
+    subprocess.run([sys.executable, '-c', 'import app; app.init_app()'], cwd=RAIZ, env=entorno, check=True,
+                   stdout=subprocess.DEVNULL)
+
+    puerto = _puerto_libre()
+    url = f"http://127.0.0.1:{puerto}"
+    registro = open(os.path.join(directorio, 'servidor.log'), 'wb')
+    proceso = subprocess.Popen([sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--threads', str(hilos),
+                                '--bind', f"127.0.0.1:{puerto}", 'app:app'],
+                               cwd=RAIZ, env=entorno, stdout=registro, stderr=subprocess.STDOUT)
+    limite = time.monotonic() + 30
+    while time.monotonic() < limite:
+        if proceso.poll() is not None:
+            raise RuntimeError(f"gunicorn terminó al arrancar; ver {registro.name}")
+        try:
+            requests.get(f"{url}/login", timeout=1)
+            return proceso, url, db_path
+        except requests.RequestException:
+            time.sleep(0.2)
+    proceso.terminate()
+    raise RuntimeError("gunicorn no respondió en 30 s")
+
+
+def resumir(medidor, duracion_total):
+    endpoints = {}
+    total = errores = bloqueos = 0
+    for paso in sorted(medidor.latencias):
+        latencias = sorted(medidor.latencias[paso])
+        resultados = dict(medidor.resultados[paso])
+        cantidad = len(latencias)
+        total += cantidad
+        errores += resultados.get('error', 0)
+        bloqueos += resultados.get('bloqueo', 0)
+        endpoints[paso] = {
+            'peticiones': cantidad,
+            'por_segundo': round(cantidad / duracion_total, 2),
+            'p50_ms': round(percentil(latencias, 50) * 1000, 2),
+            'p95_ms': round(percentil(latencias, 95) * 1000, 2),
+            'p99_ms': round(percentil(latencias, 99) * 1000, 2),
+            'resultados': resultados,
+        }
+    return {
+        'peticiones': total,
+        'throughput_rps': round(total / duracion_total, 2),
+        'tasa_error': round(errores / total, 4) if total else 0.0,
+        'tasa_bloqueo': round(bloqueos / total, 4) if total else 0.0,
+        'endpoints': endpoints,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help="Instancia ya levantada. Sin --url se levanta gunicorn con una base temporal.")
+    parser.add_argument('--db', help="Base de la instancia de --url, para verificar la sobreventa de franjas.")
+    parser.add_argument('--clientes', type=int, default=20, help="Clientes concurrentes.")
+    parser.add_argument('--personal', type=int, default=2, help="Usuarios del local concurrentes.")
+    parser.add_argument('--duracion', type=float, default=60, help="Segundos de carga.")
+    parser.add_argument('--pausa', type=float, default=0.5, help="Tiempo de 'pensar' máximo entre pasos (s).")
+    parser.add_argument('--refresco-tablero', type=float, default=2.0, help="Segundos entre refrescos del tablero.")
+    parser.add_argument('--cobros-por-refresco', type=int, default=2, help="Pedidos que cobra el personal por refresco.")
+    parser.add_argument('--franjas-en-disputa', type=int, default=2, help="Primeras franjas libres entre las que eligen los clientes.")
+    parser.add_argument('--email', default='admin_empresa@empresa.com', help="Usuario del personal.")
+    parser.add_argument('--clave', default='empresa_password_segura')
+    parser.add_argument('--workers', type=int, default=4, help="Workers de gunicorn (sin --url).")
+    parser.add_argument('--hilos', type=int, default=4, help="Hilos por worker de gunicorn (sin --url).")
+    parser.add_argument('--maps-puerto', type=int, default=0, help="Puerto del Maps falso (0: uno libre).")
+    parser.add_argument('--maps-latencia-ms', type=float, default=80)
+    parser.add_argument('--resultado', default='resultado_carga.json')
+    args = parser.parse_args()
+
+    maps = ServidorMapsFalso(puerto=args.maps_puerto, latencia_ms=args.maps_latencia_ms).iniciar()
+    proceso = None
+    directorio = tempfile.TemporaryDirectory(prefix='carga_hora_pico_')
+    try:
+        if args.url:
+            url, db_path = args.url.rstrip('/'), args.db
+            print(f"Maps falso en {maps.url_base}: la instancia debe usar GOOGLE_MAPS_URL_BASE={maps.url_base}")
+        else:
+            proceso, url, db_path = iniciar_servidor(directorio.name, maps, args.workers, args.hilos)
+            print(f"Aplicación en {url} ({args.workers} workers x {args.hilos} hilos), base {db_path}")
+
+        sesiones_personal = [_iniciar_sesion_personal(url, args.email, args.clave) for _ in range(args.personal)]
+        bloqueos_antes = _bloqueos_db(url)
+        medidor = Medidor()
+        inicio_carga = datetime.now().replace(microsecond=0)
+        inicio = time.monotonic()
+        fin = inicio + args.duracion
+        hilos = [threading.Thread(target=cliente, args=(url, medidor, fin, args.pausa, args.franjas_en_disputa), daemon=True)
+                 for _ in range(args.clientes)]
+        hilos += [threading.Thread(target=personal, args=(url, medidor, fin, sesion, args.refresco_tablero,
+                                                          args.cobros_por_refresco), daemon=True)
+                  for sesion in sesiones_personal]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        duracion_total = time.monotonic() - inicio
+
+        resultado = {
+            'fecha': inicio_carga.isoformat(),
+            'parametros': {clave: valor for clave, valor in vars(args).items() if clave not in ('clave',)},
+            'duracion_s': round(duracion_total, 2),
+            **resumir(medidor, duracion_total),
+            'llamadas_maps': maps.llamadas,
+        }
+        bloqueos_despues = _bloqueos_db(url)
+        if bloqueos_antes is not None and bloqueos_despues is not None:
+            resultado['bloqueos_db_servidor'] = bloqueos_despues - bloqueos_antes
+        if db_path:
+            resultado['franjas_sobrevendidas'] = franjas_sobrevendidas(db_path, inicio_carga)
+    finally:
+        if proceso is not None:
+            proceso.terminate()
+            proceso.wait(timeout=30)
+        maps.detener()
+        directorio.cleanup()
+
+    with open(args.resultado, 'w', encoding='utf-8') as archivo:
+        json.dump(resultado, archivo, ensure_ascii=False, indent=2)
+
+    print(f"{'Endpoint':<36} {'n':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}  resultados")
+    for paso, datos in resultado['endpoints'].items():
+        print(f"{paso:<36} {datos['peticiones']:>7} {datos['p50_ms']:>9} {datos['p95_ms']:>9} {datos['p99_ms']:>9}  "
+              f"{datos['resultados']}")
+    print(f"{resultado['throughput_rps']} peticiones/s, error {resultado['tasa_error']:.2%}, "
+          f"bloqueo {resultado['tasa_bloqueo']:.2%}, "
+          f"franjas sobrevendidas: {len(resultado.get('franjas_sobrevendidas', [])) if db_path else 'sin verificar'}")
+    print(f"Resultado en {args.resultado}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,316 @@
+# casa_comida_web/benchmarks/generar_db.py
+"""
+Generador de bases restaurante.db sintéticas con volúmenes de producción, para desarrollo y
+benchmarks: N empresas con su carta (rubros y precios), repartidores y usuarios, y millones de
+pedidos repartidos en varios años con sus ítems y sus movimientos de caja.
+
+Distribuciones:
+- Volumen diario con tendencia creciente y más pedidos el fin de semana.
+- Horarios concentrados en los picos de almuerzo (13:00) y cena (21:00).
+- Popularidad de platos Zipf por empresa: unos pocos platos se llevan la mayoría de las ventas.
+- 1 a 5 platos por pedido, mayormente 1-2 unidades de cada uno.
+- Pedidos de días anteriores pagados, con su 'Ingreso' y, si fueron envíos, su 'Pago a Repartidor';
+  más compras diarias de insumos ('Egreso'). Los de hoy en franjas futuras quedan pendientes sin
+  superar el cupo por franja.
+
+La carga usa executemany en transacciones grandes, sin journal ni fsync y con los índices de
+pedidos, items_pedido e ingresos_egresos eliminados durante la carga; al final se recrean, se
+reconstruyen los cierres de caja y se corre ANALYZE.
+
+Uso (desde la raíz del proyecto):
+    python benchmarks/generar_db.py --salida /tmp/restaurante_10M.db --pedidos 10000000 --empresas 5 --anios 3
+"""
+
+import argparse
+import itertools
+import math
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Rubros de la carta: (rubro, platos base, rango de precios)
+RUBROS = (
+    ("Comidas", ("Milanesa", "Hamburguesa", "Suprema", "Bife de Chorizo", "Tortilla", "Wok de Pollo"), (3500, 7500)),
+    ("Pizzas", ("Pizza Muzzarella", "Pizza Napolitana", "Pizza Fugazzeta", "Pizza Especial"), (4000, 7000)),
+    ("Pastas", ("Ravioles", "Sorrentinos", "Ñoquis", "Tallarines", "Lasagna"), (3800, 6500)),
+    ("Entradas", ("Empanada de Carne", "Empanada de Pollo", "Provoleta", "Rabas"), (600, 4500)),
+    ("Ensaladas", ("Ensalada César", "Ensalada Mixta", "Ensalada Caprese"), (2800, 4500)),
+    ("Postres", ("Flan Casero", "Tiramisú", "Helado", "Panqueques"), (1800, 3200)),
+    ("Bebidas", ("Gaseosa", "Agua Mineral", "Cerveza Artesanal", "Limonada", "Vino Tinto"), (700, 5000)),
+)
+NOMBRES = ("Ana", "Luis", "Marta", "Jorge", "Sofía", "Pedro", "Lucía", "Diego", "Carla", "Martín", "Paula", "Tomás")
+APELLIDOS = ("López", "García", "Pérez", "Gómez", "Díaz", "Romero", "Sosa", "Torres", "Ruiz", "Álvarez", "Benítez")
+CALLES = ("Av. Corrientes", "Florida", "Lavalle", "Tucumán", "Viamonte", "Av. Córdoba", "Paraguay", "Av. Santa Fe")
+FORMAS_PAGO = ("Efectivo", "Tarjeta", "Transferencia")
+PESOS_FORMAS_PAGO = (45, 35, 20)
+PESOS_CANTIDAD_PLATOS = (35, 30, 20, 10, 5)       # 1..5 platos distintos por pedido
+PESOS_UNIDADES = (70, 20, 7, 3)                   # 1..4 unidades de cada plato
+PESOS_DIA_SEMANA = (0.85, 0.9, 0.95, 1.0, 1.25, 1.4, 1.1)  # lunes..domingo
+PROPORCION_ENVIOS = 0.55
+PEDIDOS_POR_LOTE = 100_000
+
+_TABLAS_CARGADAS = ('pedidos', 'items_pedido', 'ingresos_egresos')
+
+
+def _acumulados(pesos):
+    return list(itertools.accumulate(pesos))
+
+
+def _pesos_franjas(franjas_minutos):
+    """Mezcla de dos picos (almuerzo 13:00, cena 21:00) sobre un piso bajo."""
+    def campana(minuto, centro, desvio):
+        return math.exp(-0.5 * ((minuto - centro) / desvio) ** 2)
+    return [0.05 + campana(m, 13 * 60, 50) + 1.3 * campana(m, 21 * 60, 60) for m in franjas_minutos]
+
+
+def _franjas_del_dia(app_mod):
+    inicio_h, inicio_m = map(int, app_mod.HORA_APERTURA.split(':'))
+    fin_h, fin_m = map(int, app_mod.HORA_CIERRE.split(':'))
+    return list(range(inicio_h * 60 + inicio_m, fin_h * 60 + fin_m + 1, app_mod.INTERVALO_FRANJAS_MINUTOS))
+
+
+def _crear_empresas(cursor, app_mod, empresas, platos_por_empresa, repartidores_por_empresa, aleatorio):
+    """Empresas (la primera es la por defecto de init_app), su carta, sus repartidores y un admin por empresa."""
+    from werkzeug.security import generate_password_hash
+    clave = generate_password_hash("empresa_password_segura", method='pbkdf2:sha256')
+    ids_empresas = [app_mod.DEFAULT_COMPANY_FOR_ORDERS]
+    for numero in range(2, empresas + 1):
+        cursor.execute("INSERT INTO empresas (nombre, telefono, direccion, activo) VALUES (?, ?, ?, 1)",
+                       (f"Casa de Comida Sintética {numero}", f"11{aleatorio.randint(10000000, 99999999)}",
+                        f"{aleatorio.choice(CALLES)} {aleatorio.randint(100, 5000)}"))
+        id_empresa = cursor.lastrowid
+        ids_empresas.append(id_empresa)
+        cursor.execute("""
+            INSERT INTO usuarios (email, password, nombre, apellido, id_rol, id_empresa, activo, primer_login_requerido)
+            VALUES (?, ?, 'Admin', ?, (SELECT id_rol FROM roles WHERE nombre_rol = 'admin_empresa'), ?, 1, 0)
+        """, (f"admin_empresa{numero}@sintetica.com", clave, f"Empresa {numero}", id_empresa))
+
+    cartas, repartidores = {}, {}
+    for id_empresa in ids_empresas:
+        existentes = cursor.execute("SELECT COUNT(*) FROM platos WHERE id_empresa = ?", (id_empresa,)).fetchone()[0]
+        nuevos = []
+        for indice in range(existentes, platos_por_empresa):
+            rubro, bases, (minimo, maximo) = RUBROS[indice % len(RUBROS)]
+            nombre = f"{bases[(indice // len(RUBROS)) % len(bases)]} {indice // (len(RUBROS) * len(bases)) + 1}"
+            nuevos.append((nombre, f"{nombre} de la casa.", float(round(aleatorio.uniform(minimo, maximo), -1)), id_empresa, rubro))
+        cursor.executemany("INSERT INTO platos (nombre, descripcion, precio, activo, id_empresa, rubro) VALUES (?, ?, ?, 1, ?, ?)", nuevos)
+        carta = cursor.execute("SELECT id_plato, precio FROM platos WHERE id_empresa = ? AND activo = 1", (id_empresa,)).fetchall()
+        # Ranking de popularidad propio de cada empresa
+        aleatorio.shuffle(carta)
+        cartas[id_empresa] = carta
+
+        existentes = cursor.execute("SELECT COUNT(*) FROM repartidores WHERE id_empresa = ?", (id_empresa,)).fetchone()[0]
+        cursor.executemany("INSERT INTO repartidores (nombre, apellido, telefono, activo, id_empresa) VALUES (?, ?, ?, 1, ?)", [
+            (aleatorio.choice(NOMBRES), aleatorio.choice(APELLIDOS), f"11{aleatorio.randint(10000000, 99999999)}", id_empresa)
+            for _ in range(existentes, repartidores_por_empresa)])
+        repartidores[id_empresa] = [fila[0] for fila in cursor.execute(
+            "SELECT id_repartidor FROM repartidores WHERE id_empresa = ? AND activo = 1", (id_empresa,))]
+    return ids_empresas, cartas, repartidores
+
+
+def _reparto_por_dia(total, dias, aleatorio):
+    """Reparte 'total' pedidos entre los días (del más antiguo al más reciente) según tendencia y día de la semana."""
+    pesos = [(0.6 + 0.4 * indice / max(1, len(dias) - 1)) * PESOS_DIA_SEMANA[dia.weekday()] * aleatorio.uniform(0.9, 1.1)
+             for indice, dia in enumerate(dias)]
+    suma = sum(pesos)
+    cantidades = [int(total * peso / suma) for peso in pesos]
+    for indice in aleatorio.sample(range(len(dias)), total - sum(cantidades)):
+        cantidades[indice] += 1
+    return cantidades
+
+
+def generar(app_mod, pedidos, empresas=3, anios=2, platos_por_empresa=40, repartidores_por_empresa=8,
+            zipf_s=1.1, semilla=1234, informar=print):
+    """Carga la base app_mod.DB_NAME (se crea con init_app si hace falta). Retorna la cantidad de pedidos cargados."""
+    aleatorio = random.Random(semilla)
+    inicio = time.perf_counter()
+    app_mod.init_app()
+
+    conn = sqlite3.connect(app_mod.DB_NAME, isolation_level=None)
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA journal_mode = OFF")
+    cursor.execute("PRAGMA synchronous = OFF")
+    cursor.execute("PRAGMA cache_size = -262144")  # 256 MiB
+    cursor.execute("PRAGMA temp_store = MEMORY")
+
+    cursor.execute("BEGIN")
+    ids_empresas, cartas, repartidores = _crear_empresas(cursor, app_mod, empresas, platos_por_empresa,
+                                                         repartidores_por_empresa, aleatorio)
+    cursor.execute("COMMIT")
+
+    # Índices diferidos: se recrean una vez cargados los datos
+    indices = cursor.execute(f"""
+        SELECT name, sql FROM sqlite_master
+        WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN ({', '.join('?' * len(_TABLAS_CARGADAS))})
+    """, _TABLAS_CARGADAS).fetchall()
+    for nombre, _ in indices:
+        cursor.execute(f"DROP INDEX {nombre}")
+
+    franjas = _franjas_del_dia(app_mod)
+    acumulado_franjas = _acumulados(_pesos_franjas(franjas))
+    acumulado_empresas = _acumulados(1 / (rango + 1) ** 0.5 for rango in range(len(ids_empresas)))
+    acumulado_platos = {id_empresa: _acumulados(1 / (rango + 1) ** zipf_s for rango in range(len(carta)))
+                        for id_empresa, carta in cartas.items()}
+    acumulado_cantidad_platos = _acumulados(PESOS_CANTIDAD_PLATOS)
+    acumulado_unidades = _acumulados(PESOS_UNIDADES)
+    acumulado_formas_pago = _acumulados(PESOS_FORMAS_PAGO)
+    costo_envio = float(app_mod.DEFAULT_ENVIO_COSTO)
+    pago_repartidor = float(app_mod.DEFAULT_PAGO_REPARTIDOR_POR_ENVIO)
+    cupo = app_mod.MAX_PEDIDOS_POR_FRANJA_HORARIA
+
+    # Textos precalculados: formatear fechas fila por fila es lo más caro de la generación
+    horas = [f"{segundo // 3600:02d}:{segundo // 60 % 60:02d}:{segundo % 60:02d}" for segundo in range(86400)]
+    radio_grados = app_mod.RADIO_ENVIO_CUADRAS * app_mod.CUADRA_METROS / 111_320
+    coordenadas = [(app_mod.SUCURSAL_LAT + radio_grados * aleatorio.uniform(-0.7, 0.7),
+                    app_mod.SUCURSAL_LON + radio_grados * aleatorio.uniform(-0.7, 0.7)) for _ in range(1000)]
+    clientes = [(nombre, apellido) for nombre in NOMBRES for apellido in APELLIDOS]
+    direcciones = [f"{calle} {numero}" for calle in CALLES for numero in range(100, 5000, 37)]
+
+    # Hoy: pendientes en las franjas que faltan, hasta la mitad del cupo; el resto se reparte en los días anteriores
+    ahora = datetime.now()
+    minuto_actual = ahora.hour * 60 + ahora.minute
+    franjas_pendientes = [m for m in franjas if m > minuto_actual]
+    pendientes_hoy = min(pedidos // 10, len(franjas_pendientes) * len(ids_empresas) * max(1, cupo // 2))
+    hoy = ahora.date()
+    dias = [hoy - timedelta(days=d) for d in range(int(anios * 365), 0, -1)]
+    por_dia = _reparto_por_dia(pedidos - pendientes_hoy, dias, aleatorio)
+
+    sql_pedido = """
+        INSERT INTO pedidos (id_pedido, cliente_nombre, cliente_apellido, direccion_entrega, es_envio, horario_entrega,
+                             costo_envio, costo_total, forma_pago, estado_pago, fecha_creacion, fecha_pago,
+                             lat_cliente, lon_cliente, id_repartidor, id_empresa)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """
+    sql_item = "INSERT INTO items_pedido (id_pedido, id_plato, cantidad, precio_unitario) VALUES (?, ?, ?, ?)"
+    sql_caja = """
+        INSERT INTO ingresos_egresos (tipo, monto, descripcion, fecha_hora, id_pedido_origen, id_repartidor_origen, id_empresa)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """
+    filas_pedidos, filas_items, filas_caja = [], [], []
+    cargados = 0
+    id_pedido = (cursor.execute("SELECT MAX(id_pedido) FROM pedidos").fetchone()[0] or 0) + 1
+
+    def volcar():
+        cursor.execute("BEGIN")
+        cursor.executemany(sql_pedido, filas_pedidos)
+        cursor.executemany(sql_item, filas_items)
+        cursor.executemany(sql_caja, filas_caja)
+        cursor.execute("COMMIT")
+        filas_pedidos.clear()
+        filas_items.clear()
+        filas_caja.clear()
+
+    choices, randint, rand = aleatorio.choices, aleatorio.randint, aleatorio.random
+    for dia, cantidad in itertools.chain(zip(dias, por_dia), [(hoy, pendientes_hoy)]):
+        es_hoy = dia == hoy
+        texto_dia = dia.isoformat()
+        if es_hoy:
+            # Franjas futuras al azar, sin pasar de la mitad del cupo por empresa y franja
+            lugares = [(franja, id_empresa) for franja in franjas_pendientes for id_empresa in ids_empresas
+                       for _ in range(max(1, cupo // 2))]
+            asignados = aleatorio.sample(lugares, cantidad)
+        else:
+            asignados = list(zip(choices(franjas, cum_weights=acumulado_franjas, k=cantidad),
+                                 choices(ids_empresas, cum_weights=acumulado_empresas, k=cantidad)))
+        asignados.sort()
+        cantidades_platos = choices(range(1, 6), cum_weights=acumulado_cantidad_platos, k=len(asignados))
+        formas_pago = choices(FORMAS_PAGO, cum_weights=acumulado_formas_pago, k=len(asignados))
+
+        for (franja, id_empresa), n_platos, forma_pago in zip(asignados, cantidades_platos, formas_pago):
+            carta = cartas[id_empresa]
+            elegidos = choices(carta, cum_weights=acumulado_platos[id_empresa], k=n_platos)
+            unidades = choices((1, 2, 3, 4), cum_weights=acumulado_unidades, k=n_platos)
+            es_envio = rand() < PROPORCION_ENVIOS
+            total = costo_envio if es_envio else 0.0
+            for (id_plato, precio), cantidad_plato in zip(elegidos, unidades):
+                filas_items.append((id_pedido, id_plato, cantidad_plato, precio))
+                total += precio * cantidad_plato
+
+            segundo_franja = franja * 60
+            horario = f"{texto_dia} {horas[segundo_franja]}"
+            creacion = f"{texto_dia} {horas[max(0, segundo_franja - randint(600, 5400))]}"
+            nombre, apellido = clientes[randint(0, len(clientes) - 1)]
+            id_repartidor = None
+            lat = lon = None
+            direccion = ""
+            if es_envio:
+                id_repartidor = repartidores[id_empresa][randint(0, len(repartidores[id_empresa]) - 1)] if repartidores[id_empresa] else None
+                lat, lon = coordenadas[randint(0, 999)]
+                direccion = direcciones[randint(0, len(direcciones) - 1)]
+            if es_hoy:
+                estado, pago = 'Pendiente', None
+            else:
+                estado = 'Pagado'
+                pago = f"{texto_dia} {horas[min(86399, segundo_franja + randint(300, 2400))]}"
+                filas_caja.append(('Ingreso', total, f"Pago de Pedido #{id_pedido} ({forma_pago})", pago,
+                                   id_pedido, None, id_empresa))
+                if es_envio and id_repartidor:
+                    filas_caja.append(('Pago a Repartidor', pago_repartidor, f"Pago por envío Pedido #{id_pedido}", pago,
+                                       id_pedido, id_repartidor, id_empresa))
+            filas_pedidos.append((id_pedido, nombre, apellido, direccion, int(es_envio), horario,
+                                  costo_envio if es_envio else 0.0, total, forma_pago, estado, creacion, pago,
+                                  lat, lon, id_repartidor, id_empresa))
+            id_pedido += 1
+
+        if not es_hoy:
+            for id_empresa in ids_empresas:
+                for _ in range(randint(0, 2)):
+                    filas_caja.append(('Egreso', float(randint(5, 80) * 1000), "Compra de insumos",
+                                       f"{texto_dia} {horas[randint(8 * 3600, 11 * 3600)]}", None, None, id_empresa))
+
+        cargados += len(asignados)
+        if len(filas_pedidos) >= PEDIDOS_POR_LOTE:
+            volcar()
+            if cargados // 1_000_000 != (cargados - len(asignados)) // 1_000_000:
+                informar(f"  {cargados:,} pedidos ({cargados / (time.perf_counter() - inicio):,.0f}/s)")
+    volcar()
+
+    informar(f"  Datos cargados en {time.perf_counter() - inicio:.1f} s; recreando {len(indices)} índices...")
+    for _, sql in indices:
+        cursor.execute(sql)
+    app_mod._adjuntar_archivo(conn)
+    cursor.execute("BEGIN")
+    app_mod._reconstruir_cierres_caja(cursor)
+    cursor.execute("COMMIT")
+    cursor.execute("ANALYZE")
+    cursor.execute("PRAGMA journal_mode = DELETE")
+    conn.close()
+    informar(f"{cargados:,} pedidos en {len(ids_empresas)} empresas generados en {time.perf_counter() - inicio:.1f} s")
+    return cargados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--salida', default='restaurante_sintetica.db', help="Base a generar.")
+    parser.add_argument('--pedidos', type=int, default=1_000_000)
+    parser.add_argument('--empresas', type=int, default=3)
+    parser.add_argument('--anios', type=float, default=2, help="Años de historia hacia atrás desde hoy.")
+    parser.add_argument('--platos', type=int, default=40, help="Platos por empresa.")
+    parser.add_argument('--repartidores', type=int, default=8, help="Repartidores por empresa.")
+    parser.add_argument('--zipf', type=float, default=1.1, help="Exponente de la popularidad de los platos.")
+    parser.add_argument('--semilla', type=int, default=1234)
+    parser.add_argument('--sobrescribir', action='store_true', help="Reemplaza la base de salida si existe.")
+    args = parser.parse_args()
+
+    # La app toma DB_NAME (y de ahí el nombre de su base de archivo) del entorno al importarse
+    os.environ['DB_NAME'] = os.path.abspath(args.salida)
+    os.environ.setdefault('LOG_NIVEL', 'WARNING')
+    import app as app_mod
+
+    for ruta in (args.salida, app_mod.ARCHIVO_DB_NAME):
+        if os.path.exists(ruta):
+            if not args.sobrescribir:
+                parser.error(f"{ruta} ya existe (usar --sobrescribir para reemplazarla)")
+            os.remove(ruta)
+
+    print(f"Generando {args.pedidos:,} pedidos en {args.salida}...")
+    generar(app_mod, args.pedidos, args.empresas, args.anios, args.platos, args.repartidores, args.zipf, args.semilla)
+
+
+if __name__ == '__main__':
+    main()
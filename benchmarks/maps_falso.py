@@ -0,0 +1,138 @@
+# casa_comida_web/benchmarks/maps_falso.py
+"""
+Servidor HTTP local que imita las APIs de Google Maps que usa la aplicación (Place Search,
+Place Details y Geocoding), con una latencia configurable, para las pruebas de carga.
+
+La geocodificación es determinística: cada dirección cae en un punto fijo alrededor de la
+sucursal, y una fracción configurable de las direcciones queda fuera del radio de envío.
+
+Uso (desde la raíz del proyecto):
+    python benchmarks/maps_falso.py --puerto 8765 --latencia-ms 80
+    GOOGLE_MAPS_URL_BASE=http://127.0.0.1:8765 GOOGLE_MAPS_API_KEY=clave-falsa gunicorn app:app
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import SUCURSAL_LAT, SUCURSAL_LON, RADIO_ENVIO_CUADRAS, CUADRA_METROS  # noqa: E402
+
+# Metros por grado de latitud
+_METROS_POR_GRADO = 111_320
+
+
+def coordenadas_de(direccion, fuera_de_radio):
+    """Punto fijo para la dirección: dentro del radio de envío salvo para la fracción 'fuera_de_radio'."""
+    resumen = hashlib.sha256(direccion.strip().lower().encode('utf-8')).digest()
+    angulo = resumen[0] / 255 * 2 * math.pi
+    fraccion = int.from_bytes(resumen[1:3], 'big') / 65535
+    radio_metros = RADIO_ENVIO_CUADRAS * CUADRA_METROS
+    if int.from_bytes(resumen[3:5], 'big') / 65535 < fuera_de_radio:
+        distancia = radio_metros * (1.2 + fraccion)
+    else:
+        distancia = radio_metros * 0.9 * fraccion
+    lat = SUCURSAL_LAT + distancia * math.cos(angulo) / _METROS_POR_GRADO
+    lon = SUCURSAL_LON + distancia * math.sin(angulo) / (_METROS_POR_GRADO * math.cos(math.radians(SUCURSAL_LAT)))
+    return lat, lon
+
+
+class _ManejadorMaps(BaseHTTPRequestHandler):
+    def do_GET(self):
+        servidor = self.server
+        url = urlparse(self.path)
+        params = {clave: valores[0] for clave, valores in parse_qs(url.query).items()}
+        with servidor.lock_conteo:
+            servidor.llamadas[url.path] = servidor.llamadas.get(url.path, 0) + 1
+        if servidor.latencia:
+            time.sleep(servidor.latencia)
+
+        if url.path == '/maps/api/geocode/json':
+            lat, lng = coordenadas_de(params.get('address', ''), servidor.fuera_de_radio)
+            cuerpo = {"status": "OK", "results": [{"geometry": {"location": {"lat": lat, "lng": lng}},
+                                                  "formatted_address": params.get('address', '')}]}
+        elif url.path == '/maps/api/place/findplacefromtext/json':
+            cuerpo = {"status": "OK", "candidates": [{"place_id": "lugar-falso"}]}
+        elif url.path == '/maps/api/place/details/json':
+            cuerpo = {"status": "OK", "result": {
+                "name": params.get('place_id', 'lugar-falso'),
+                "formatted_address": "Dirección de prueba 100, Ciudad de Prueba",
+                "geometry": {"location": {"lat": SUCURSAL_LAT, "lng": SUCURSAL_LON}},
+                "opening_hours": {"weekday_text": ["Lunes a Domingo: 10:00 - 23:00"]},
+                "url": "https://maps.google.com/?q=prueba",
+            }}
+        else:
+            self.send_error(404)
+            return
+
+        datos = json.dumps(cuerpo).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def log_message(self, formato, *args):
+        pass
+
+
+class ServidorMapsFalso:
+    """Servidor en un hilo de fondo. 'llamadas' cuenta las peticiones por ruta de la API."""
+
+    def __init__(self, host='127.0.0.1', puerto=0, latencia_ms=50, fuera_de_radio=0.1):
+        self._http = ThreadingHTTPServer((host, puerto), _ManejadorMaps)
+        self._http.daemon_threads = True
+        self._http.latencia = latencia_ms / 1000
+        self._http.fuera_de_radio = fuera_de_radio
+        self._http.llamadas = {}
+        self._http.lock_conteo = threading.Lock()
+        self._hilo = None
+
+    @property
+    def url_base(self):
+        host, puerto = self._http.server_address[:2]
+        return f"http://{host}:{puerto}"
+
+    @property
+    def llamadas(self):
+        with self._http.lock_conteo:
+            return dict(self._http.llamadas)
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._http.serve_forever, name='maps-falso', daemon=True)
+        self._hilo.start()
+        return self
+
+    def detener(self):
+        self._http.shutdown()
+        self._http.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--puerto', type=int, default=8765)
+    parser.add_argument('--latencia-ms', type=float, default=50, help="Demora de cada respuesta.")
+    parser.add_argument('--fuera-de-radio', type=float, default=0.1,
+                        help="Fracción de direcciones fuera del radio de envío.")
+    args = parser.parse_args()
+
+    servidor = ServidorMapsFalso(args.host, args.puerto, args.latencia_ms, args.fuera_de_radio).iniciar()
+    print(f"Google Maps falso escuchando en {servidor.url_base} (Ctrl+C para terminar)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        servidor.detener()
+
+
+if __name__ == '__main__':
+    main()
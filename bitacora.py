@@ -0,0 +1,136 @@
+# casa_comida_web/bitacora.py
+"""
+Logging estructurado y no bloqueante.
+
+Los registros se formatean como una línea JSON en el hilo que los emite (donde todavía está el
+contexto de la petición) y se encolan con un QueueHandler; un QueueListener en un hilo aparte
+hace la escritura en stdout, así la petición nunca espera por la E/S. Los registros ruidosos se
+pueden muestrear por logger (módulo): de los que están por debajo de ERROR se conserva sólo una
+fracción configurable.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import traceback
+from datetime import datetime, timezone
+
+from por_proceso import PorProceso
+
+# Atributos propios de LogRecord: lo que no está aquí llegó por extra={...} y se incluye en el JSON
+_ATRIBUTOS_ESTANDAR = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+
+class FormateadorJson(logging.Formatter):
+    """Una línea JSON por registro, con el endpoint y la ruta si se emitió durante una petición."""
+
+    def format(self, record):
+        datos = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'nivel': record.levelname,
+            'logger': record.name,
+            'mensaje': record.getMessage(),
+            'pid': record.process,
+            'hilo': record.threadName,
+        }
+        datos.update(_contexto_peticion())
+        for clave, valor in vars(record).items():
+            if clave not in _ATRIBUTOS_ESTANDAR:
+                datos[clave] = valor
+        if record.exc_info:
+            datos['excepcion'] = ''.join(traceback.format_exception(*record.exc_info)).rstrip()
+        return json.dumps(datos, ensure_ascii=False, default=str)
+
+
+def _contexto_peticion():
+    # Import diferido: bitacora se configura antes de crear la app
+    from flask import has_request_context, request
+    if not has_request_context():
+        return {}
+    return {'endpoint': request.endpoint, 'metodo': request.method, 'ruta': request.path}
+
+
+class FiltroMuestreo(logging.Filter):
+    """
+    Conserva sólo una fracción de los registros por debajo de ERROR de los loggers configurados.
+    'tasas' es {nombre de logger: fracción}; se aplica la del ancestro más cercano ('app' cubre 'app.x').
+    """
+
+    def __init__(self, tasas):
+        super().__init__()
+        self.tasas = dict(tasas)
+
+    def _tasa(self, nombre):
+        while nombre:
+            if nombre in self.tasas:
+                return self.tasas[nombre]
+            nombre = nombre.rpartition('.')[0]
+        return None
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR:
+            return True
+        tasa = self._tasa(record.name)
+        return tasa is None or random.random() < tasa
+
+
+class _ManejadorCola(logging.handlers.QueueHandler):
+    """
+    QueueHandler que encola la línea JSON ya formateada. Tras un fork (workers de gunicorn con
+    --preload) el hilo del listener no existe en el proceso hijo: se crea otra cola y otro listener.
+    """
+
+    def __init__(self, destino):
+        super().__init__(queue.SimpleQueue())
+        self.destino = destino
+        self._listener = PorProceso(self._arrancar_listener)
+
+    def _arrancar_listener(self):
+        self.queue = queue.SimpleQueue()
+        salida = logging.StreamHandler(self.destino)
+        salida.setFormatter(logging.Formatter('%(message)s'))
+        listener = logging.handlers.QueueListener(self.queue, salida)
+        listener.start()
+        return listener
+
+    def prepare(self, record):
+        # Sólo viaja el texto: la línea JSON ya incluye la excepción
+        linea = self.format(record)
+        record = logging.makeLogRecord({'msg': linea, 'levelno': record.levelno, 'levelname': record.levelname})
+        return record
+
+    def emit(self, record):
+        self._listener.obtener()
+        super().emit(record)
+
+    def detener(self):
+        """Vacía la cola y detiene el listener (al terminar el proceso)."""
+        listener = self._listener.actual()
+        if listener is not None:
+            listener.stop()
+        self._listener.olvidar()
+
+
+def configurar(nivel, niveles_por_modulo=None, muestreo=None, destino=None):
+    """
+    Reemplaza los handlers del logger raíz por el de la cola JSON. Debe llamarse antes de crear la
+    app de Flask para que app.logger no agregue su propio handler a stderr.
+    """
+    manejador = _ManejadorCola(destino or sys.stdout)
+    manejador.setFormatter(FormateadorJson())
+    if muestreo:
+        manejador.addFilter(FiltroMuestreo(muestreo))
+
+    raiz = logging.getLogger()
+    for anterior in list(raiz.handlers):
+        raiz.removeHandler(anterior)
+    raiz.addHandler(manejador)
+    raiz.setLevel(nivel)
+    for nombre, nivel_modulo in (niveles_por_modulo or {}).items():
+        logging.getLogger(nombre).setLevel(nivel_modulo)
+    atexit.register(manejador.detener)
+    return manejador
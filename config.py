@@ -1,22 +1,198 @@
 # config.py
 
+import os
+import tempfile
 
-GOOGLE_MAPS_API_KEY = "YOUR_GOOGLE_MAPS_API_KEY" # ¡REEMPLAZA CON TU API KEY REAL!
+GOOGLE_MAPS_API_KEY = os.environ.get('GOOGLE_MAPS_API_KEY', "YOUR_GOOGLE_MAPS_API_KEY") # ¡REEMPLAZA CON TU API KEY REAL!
+# Base de las APIs de Google Maps; las pruebas de carga la apuntan a un servidor falso local (benchmarks/maps_falso.py)
+GOOGLE_MAPS_URL_BASE = os.environ.get('GOOGLE_MAPS_URL_BASE', 'https://maps.googleapis.com')
 # ENVIO_COSTO = 10000.0 # Esta línea se ha eliminado/comentado, ahora se gestiona desde la DB
 MAX_PEDIDOS_POR_FRANJA_HORARIA = 5
 RADIO_ENVIO_CUADRAS = 30
 CUADRA_METROS = 80
 
-DB_NAME = 'restaurante.db' # ASEGÚRATE DE QUE ESTE NOMBRE ES CORRECTO Y CONSISTENTE
+DB_NAME = os.environ.get('DB_NAME', 'restaurante.db') # ASEGÚRATE DE QUE ESTE NOMBRE ES CORRECTO Y CONSISTENTE
 
 # Coordenadas de la sucursal (ejemplo: Buenos Aires). Se actualizarán si Google Maps las encuentra.
 SUCURSAL_LAT = -34.6037
 SUCURSAL_LON = -58.3816
 
 # Horario de operación por defecto (si no se carga de Google Maps)
-HORA_APERTURA = "10:00"
-HORA_CIERRE = "23:00"
+HORA_APERTURA = os.environ.get('HORA_APERTURA', "10:00")
+HORA_CIERRE = os.environ.get('HORA_CIERRE', "23:00")
 INTERVALO_FRANJAS_MINUTOS = 15
 
 # Nueva configuración para la empresa por defecto a la que los clientes hacen pedidos
-DEFAULT_COMPANY_FOR_ORDERS = 2 # ID de la empresa por defecto para pedidos de clientes
\ No newline at end of file
+DEFAULT_COMPANY_FOR_ORDERS = 2 # ID de la empresa por defecto para pedidos de clientes
+
+# Cantidad máxima de movimientos que se listan en el detalle del arqueo (los totales siempre son completos)
+ARQUEO_MAX_MOVIMIENTOS_DETALLE = 200
+
+# Tablero de pedidos (/gestion/pedidos): tamaño de página, vigencia y cantidad de conteos totales cacheados. Un conteo
+# se descarta antes si la base cambió (commit de cualquier worker), así que nunca se muestra uno desactualizado.
+PEDIDOS_POR_PAGINA = 50
+CONTEO_PEDIDOS_CACHE_SEGUNDOS = 30
+CONTEO_PEDIDOS_CACHE_MAX = 256
+
+# Actualizaciones en vivo del tablero (SSE): latido para mantener viva la conexión, duración máxima de cada stream y
+# cada cuánto lee el registro de eventos (los cambios hechos en el mismo proceso llegan enseguida)
+SSE_INTERVALO_LATIDO_SEGUNDOS = 15
+SSE_DURACION_MAXIMA_SEGUNDOS = 300
+SSE_SONDEO_SEGUNDOS = 1.0
+
+# Tickets: cantidad de tickets renderizados que se mantienen en memoria y ancho (en caracteres) de la impresora térmica
+TICKETS_CACHE_MAX = 500
+TICKET_ANCHO_COLUMNAS = 42
+# Impresora térmica de cocina en red (ESC/POS por el puerto RAW 9100). None desactiva la impresión directa.
+IMPRESORA_COCINA_HOST = None
+IMPRESORA_COCINA_PUERTO = 9100
+
+# Impresión por lote de los tickets de una franja: procesos del pool y pedidos por tarea. El estado y el documento de
+# cada trabajo se guardan en IMPRESION_TRABAJOS_DIRECTORIO, que leen todos los workers de gunicorn (el avance de un
+# trabajo puede consultarse en un worker distinto del que lo lanzó), y se borran tras IMPRESION_TRABAJOS_CONSERVAR_SEGUNDOS.
+# Un trabajo que sigue en proceso tras IMPRESION_TRABAJOS_VENCIMIENTO_SEGUNDOS (murió el worker que lo lanzó) se da por fallido.
+IMPRESION_LOTE_PROCESOS = 2
+IMPRESION_LOTE_TAMANO = 25
+IMPRESION_TRABAJOS_DIRECTORIO = os.environ.get('IMPRESION_TRABAJOS_DIRECTORIO') or os.path.join(os.path.dirname(os.path.abspath(DB_NAME)), 'impresion')
+IMPRESION_TRABAJOS_CONSERVAR_SEGUNDOS = 3600
+IMPRESION_TRABAJOS_VENCIMIENTO_SEGUNDOS = 600
+
+# Sentencias preparadas que sqlite3 conserva por conexión (una conexión por hilo, reutilizada entre peticiones)
+SQLITE_SENTENCIAS_CACHEADAS = 256
+
+# Trazas de SQL por petición: umbral (ms) para registrar una consulta lenta con su EXPLAIN QUERY PLAN y,
+# en modo debug, cantidad de ejecuciones de la misma sentencia en una petición que se avisa como posible N+1
+SQL_TRAZAS_ACTIVAS = True
+SQL_CONSULTA_LENTA_MS = 50
+SQL_REPETICIONES_N_MAS_1 = 10
+
+# Métricas de Prometheus (/metrics): directorio compartido por los workers, un archivo mmap por proceso.
+# Debe vaciarse antes de arrancar el servidor (flask --app app limpiar-metricas).
+METRICAS_DIRECTORIO = os.environ.get('METRICAS_DIRECTORIO') or os.path.join(tempfile.gettempdir(), 'casasdecomida_metricas')
+# /metrics sólo responde al super_admin logueado, a las IPs de METRICAS_IPS_PERMITIDAS (separadas por comas; detrás de un
+# proxy la IP es la del proxy salvo con ADMISION_PROXIES) y a quien mande 'Authorization: Bearer <METRICAS_TOKEN>'
+# (bearer_token en la configuración de Prometheus). Las métricas de la cola de trabajos se leen de la base a lo sumo
+# una vez cada METRICAS_COLA_CACHE_SEGUNDOS.
+METRICAS_TOKEN = os.environ.get('METRICAS_TOKEN')
+METRICAS_IPS_PERMITIDAS = tuple(ip.strip() for ip in os.environ.get('METRICAS_IPS_PERMITIDAS', '').split(',') if ip.strip())
+METRICAS_COLA_CACHE_SEGUNDOS = 15
+
+# Perfilado de peticiones con cProfile (ver perfilado.py): fracción de las peticiones de PERFILADO_ENDPOINTS que se
+# perfila por muestreo (0 lo desactiva). Cualquier petición se perfila además si trae la cabecera PERFILADO_CABECERA
+# con un token firmado de la página de diagnóstico. Se conservan los últimos PERFILADO_MAX_ARCHIVOS perfiles.
+PERFILADO_TASA_MUESTREO = 0.0
+PERFILADO_ENDPOINTS = ('reportes_ventas', 'hacer_pedido')
+PERFILADO_CABECERA = 'X-Perfilar'
+PERFILADO_TOKEN_VALIDEZ_SEGUNDOS = 3600
+PERFILADO_DIRECTORIO = os.environ.get('PERFILADO_DIRECTORIO') or os.path.join(tempfile.gettempdir(), 'casasdecomida_perfiles')
+PERFILADO_MAX_ARCHIVOS = 200
+
+# Logging: una línea JSON por registro, escrita en stdout desde un hilo aparte (ver bitacora.py).
+# LOG_MUESTREO conserva sólo esa fracción de los registros por debajo de ERROR de cada logger ruidoso.
+LOG_NIVEL = os.environ.get('LOG_NIVEL', 'INFO')
+LOG_NIVELES_POR_MODULO = {'urllib3': 'WARNING'}
+LOG_MUESTREO = {'app.google_maps': 0.1, 'services': 0.1}
+
+# Archivo histórico: los pedidos pagados antes de la medianoche de hace ARCHIVO_DIAS_ANTIGUEDAD días se mueven, con sus
+# ítems y movimientos de caja, a una base aparte adjunta con ATTACH (flask --app app archivar-pedidos), en lotes de
+# ARCHIVO_LOTE_PEDIDOS. Reportes y arqueo leen activas + archivo sólo cuando el rango llega a lo archivado.
+ARCHIVO_DB_NAME = os.environ.get('ARCHIVO_DB_NAME') or f"{os.path.splitext(DB_NAME)[0]}_archivo.db"
+ARCHIVO_DIAS_ANTIGUEDAD = 180
+ARCHIVO_LOTE_PEDIDOS = 2000
+
+# Modo opcional de una base por empresa: DB_NAME queda como base general (usuarios, roles, empresas y configuración)
+# y los datos de cada empresa (carta, repartidores, pedidos, caja) van a BASES_EMPRESAS_DIRECTORIO/empresa_<id>.db,
+# cada una con su propio bloqueo de escritura y su archivo histórico. Los reportes de super_admin de todas las
+# empresas consultan las bases en paralelo con BASES_EMPRESAS_HILOS hilos.
+BASE_POR_EMPRESA = os.environ.get('BASE_POR_EMPRESA', '0') == '1'
+BASES_EMPRESAS_DIRECTORIO = os.environ.get('BASES_EMPRESAS_DIRECTORIO') or os.path.join(os.path.dirname(os.path.abspath(DB_NAME)), 'empresas')
+BASES_EMPRESAS_HILOS = 4
+
+# Snapshot de reportes: con REPORTES_SNAPSHOT=1 los reportes de ventas, el arqueo y el reporte de repartidores leen una
+# copia de la base (<base>_reportes.db) hecha con la API de backup de SQLite de a REPORTES_SNAPSHOT_PAGINAS_POR_PASO
+# páginas, y nunca compiten con las escrituras de pedidos. Cada proceso la refresca cada REPORTES_SNAPSHOT_INTERVALO_SEGUNDOS
+# (o flask --app app refrescar-reportes); si tiene más de REPORTES_SNAPSHOT_MAX_ANTIGUEDAD_SEGUNDOS se lee la base en vivo.
+REPORTES_SNAPSHOT = os.environ.get('REPORTES_SNAPSHOT', '0') == '1'
+REPORTES_SNAPSHOT_INTERVALO_SEGUNDOS = 60
+REPORTES_SNAPSHOT_MAX_ANTIGUEDAD_SEGUNDOS = 300
+REPORTES_SNAPSHOT_PAGINAS_POR_PASO = 256
+REPORTES_SNAPSHOT_PAUSA_SEGUNDOS = 0.005
+# Cada commit en la base hace volver a empezar una copia por pasos (snapshot o backup): tras COPIA_MAX_REINICIOS
+# reinicios se copia en un solo paso, que retiene el bloqueo de lectura hasta terminar pero termina.
+COPIA_MAX_REINICIOS = 3
+
+# Escritor único de pedidos: con PEDIDOS_ESCRITOR_UNICO=1 los pedidos nuevos se entregan a un hilo por proceso que junta
+# los que llegan a la vez (hasta PEDIDOS_GRUPO_MAX) y los guarda en una sola transacción: un commit por grupo en lugar de
+# uno por pedido (ver escritura_agrupada.py). Con PEDIDOS_GRUPO_ESPERA_SEGUNDOS en 0 no se espera a que lleguen más: el
+# grupo son los pedidos que se encolaron mientras se confirmaba el anterior (benchmarks/bench_escritura_pedidos.py).
+# Un pedido que no se confirmó en PEDIDOS_ESPERA_MAXIMA_SEGUNDOS se responde con 503 (menos que el timeout de gunicorn)
+# y se retira de la cola si todavía no se estaba escribiendo.
+PEDIDOS_ESCRITOR_UNICO = os.environ.get('PEDIDOS_ESCRITOR_UNICO', '0') == '1'
+PEDIDOS_GRUPO_MAX = 64
+PEDIDOS_GRUPO_ESPERA_SEGUNDOS = 0.0
+PEDIDOS_ESPERA_MAXIMA_SEGUNDOS = 10
+
+# Mantenimiento (flask --app app mantenimiento desde cron, o con MANTENIMIENTO_AUTOMATICO=1 un hilo en la app): backups en
+# línea con la API de backup de SQLite en BACKUP_DIRECTORIO/<fecha-hora>/ cada BACKUP_INTERVALO_HORAS, de a
+# BACKUP_PAGINAS_POR_PASO páginas con BACKUP_PAUSA_SEGUNDOS entre pasos para no frenar los pedidos, conservando los últimos
+# BACKUP_CONSERVAR; un backup que lleva más de BACKUP_LIMITE_SEGUNDOS se abandona y se reintenta en la próxima revisión.
+# Una vez por noche, desde HORA_CIERRE + MANTENIMIENTO_MARGEN_MINUTOS hasta HORA_APERTURA: ANALYZE acotado a
+# MANTENIMIENTO_ANALISIS_LIMITE filas por índice y vacuum incremental de a MANTENIMIENTO_VACUUM_PAGINAS_POR_PASO.
+MANTENIMIENTO_AUTOMATICO = os.environ.get('MANTENIMIENTO_AUTOMATICO', '0') == '1'
+BACKUP_DIRECTORIO = os.environ.get('BACKUP_DIRECTORIO') or os.path.join(os.path.dirname(os.path.abspath(DB_NAME)), 'backups')
+BACKUP_INTERVALO_HORAS = 24
+BACKUP_CONSERVAR = 7
+BACKUP_PAGINAS_POR_PASO = 256
+BACKUP_PAUSA_SEGUNDOS = 0.01
+BACKUP_LIMITE_SEGUNDOS = 3600
+MANTENIMIENTO_MARGEN_MINUTOS = 30
+MANTENIMIENTO_ANALISIS_LIMITE = 1000
+MANTENIMIENTO_VACUUM_PAGINAS_POR_PASO = 500
+
+# Registro de eventos de pedidos (outbox): cada alta, asignación de repartidor, cobro y movimiento de caja agrega, en la
+# misma transacción, una fila a pedido_eventos. Los consumidores la leen por id_evento de a EVENTOS_PEDIDO_LOTE_LECTURA y
+# guardan hasta dónde llegaron (ver app.leer_eventos_pedido). El mantenimiento borra los eventos con más de
+# EVENTOS_PEDIDO_RETENCION_DIAS que todos los consumidores ya confirmaron.
+EVENTOS_PEDIDO_LOTE_LECTURA = 500
+EVENTOS_PEDIDO_RETENCION_DIAS = 7
+
+# Cola de trabajos en segundo plano: una tabla de la base general, sin broker externo. Con COLA_TRABAJOS='app' cada worker
+# de la app corre TRABAJOS_HILOS hilos trabajadores; con 'externa' los trabajos quedan para procesos aparte (flask --app app
+# trabajador); vacío, las tareas se hacen dentro de la petición. Un trabajo tomado queda arrendado por
+# TRABAJOS_ARRIENDO_SEGUNDOS: si su trabajador muere, otro lo retoma al vencer. Los fallos se reintentan con espera
+# exponencial desde TRABAJOS_REINTENTO_BASE_SEGUNDOS hasta TRABAJOS_REINTENTO_MAX_SEGUNDOS y, tras TRABAJOS_MAX_INTENTOS,
+# el trabajo queda 'fallido' (flask --app app trabajos --reintentar-fallidos). Sin trabajos, cada hilo vuelve a mirar la
+# tabla cada TRABAJOS_ESPERA_SEGUNDOS.
+COLA_TRABAJOS = os.environ.get('COLA_TRABAJOS', '')
+TRABAJOS_HILOS = 2
+TRABAJOS_ESPERA_SEGUNDOS = 1.0
+TRABAJOS_ARRIENDO_SEGUNDOS = 60
+TRABAJOS_MAX_INTENTOS = 5
+TRABAJOS_REINTENTO_BASE_SEGUNDOS = 5
+TRABAJOS_REINTENTO_MAX_SEGUNDOS = 600
+
+# Control de admisión de los endpoints públicos (ver admision.py). Con ADMISION_ACTIVA=1 cada clase de ADMISION_ENDPOINTS
+# admite, en cada proceso, hasta 'concurrencia' peticiones a la vez (la suma debe quedar por debajo de los hilos del worker,
+# para que siempre haya lugar para /gestion) y, por cliente, 'tasa_por_segundo' peticiones con ráfagas de hasta 'rafaga'.
+# Lo que excede se rechaza sin esperar: 503 si la clase está llena, 429 si el cliente superó su tasa, con Retry-After. El
+# personal logueado no pasa por el control, y si la clase tiene 'metodos' sólo se controlan esos (así ver el menú de
+# /hacer_pedido no gasta la cubeta de pedidos). El cliente es la IP de la conexión: detrás de un proxy (nginx, un
+# balanceador) ADMISION_PROXIES indica cuántos agregan X-Forwarded-For, y se toma la IP que vio el primero (ProxyFix de
+# Werkzeug); si no, todos los clientes compartirían la cubeta del proxy. Con ADMISION_ACTIVA=1 hay que definirla (0 si
+# la app recibe las conexiones directamente): sin ella la app no arranca.
+ADMISION_ACTIVA = os.environ.get('ADMISION_ACTIVA', '0') == '1'
+ADMISION_CLASES = {
+    'pedido': {'concurrencia': 4, 'tasa_por_segundo': 0.5, 'rafaga': 10, 'metodos': ('POST',)},
+    'carrito': {'concurrencia': 8, 'tasa_por_segundo': 5, 'rafaga': 30},
+}
+ADMISION_ENDPOINTS = {
+    'hacer_pedido': 'pedido',
+    'add_to_cart': 'carrito',
+    'remove_from_cart': 'carrito',
+    'update_cart_quantity': 'carrito',
+    'get_cart_status': 'carrito',
+    'clear_cart': 'carrito',
+}
+ADMISION_REINTENTAR_SEGUNDOS = 5
+ADMISION_MAX_CLIENTES = 10000
+ADMISION_PROXIES = int(os.environ['ADMISION_PROXIES']) if os.environ.get('ADMISION_PROXIES') else None
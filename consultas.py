@@ -0,0 +1,630 @@
+# casa_comida_web/consultas.py
+"""
+Repositorio central de consultas SQL de la aplicación.
+
+Cada consulta se declara una sola vez, con parámetros con nombre (:parametro) y el marcador
+{filtros} donde van el filtro de empresa y los filtros opcionales. Para cada alcance (todas
+las empresas o una empresa) y cada combinación de filtros opcionales se arma una única vez
+un texto SQL fijo: la misma operación envía siempre la misma sentencia, y sqlite3 la toma de
+la caché de sentencias preparadas de la conexión en lugar de volver a compilarla.
+
+Las consultas de reportes y de caja tienen además una variante '<nombre>.historico' que lee las
+vistas temporales *_historico (tablas activas + base de archivo adjunta, ver app._adjuntar_archivo);
+se usa sólo cuando el rango consultado empieza antes del límite de lo archivado.
+
+El repositorio también acumula, por consulta, la cantidad de ejecuciones y el tiempo total
+y máximo (ejecución y lectura de las filas).
+"""
+
+import json
+import re
+import threading
+import time
+
+# Alcance de super_admin y de los procesos sin usuario (comandos, tareas): sin filtro de empresa.
+# Cualquier otro valor de alcance es un id_empresa; None no coincide con ninguna fila (usuario sin empresa).
+TODAS_LAS_EMPRESAS = object()
+
+
+class Consulta:
+    __slots__ = ('nombre', 'sql', 'columna_empresa', 'opcionales', '_textos')
+
+    def __init__(self, nombre, sql, columna_empresa=None, opcionales=None):
+        self.nombre = nombre
+        self.sql = sql
+        self.columna_empresa = columna_empresa
+        self.opcionales = opcionales or {}
+        self._textos = {}
+
+    def texto(self, por_empresa, filtros):
+        """Texto SQL fijo para el alcance y los filtros opcionales activos (se arma una vez y se reutiliza)."""
+        clave = (por_empresa, filtros)
+        texto = self._textos.get(clave)
+        if texto is None:
+            condiciones = [f"{self.columna_empresa} = :id_empresa"] if por_empresa else []
+            condiciones += [self.opcionales[filtro] for filtro in filtros]
+            texto = self.sql.replace('{filtros}', ' AND '.join(condiciones) or '1 = 1')
+            self._textos[clave] = texto
+        return texto
+
+
+class RepositorioConsultas:
+    def __init__(self):
+        self._consultas = {}
+        self._estadisticas = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, nombre, sql, columna_empresa=None, opcionales=None):
+        """
+        Declara una consulta. columna_empresa (p. ej. 'p.id_empresa') habilita el filtro por empresa;
+        opcionales es un dict {nombre_filtro: condición} que se agrega al activar ese filtro.
+        """
+        if nombre in self._consultas:
+            raise ValueError(f"La consulta '{nombre}' ya está registrada.")
+        if '{filtros}' not in sql and (columna_empresa or opcionales):
+            raise ValueError(f"La consulta '{nombre}' filtra por empresa u opcionales pero no tiene el marcador {{filtros}}.")
+        self._consultas[nombre] = Consulta(nombre, sql, columna_empresa, opcionales)
+
+    def _preparar(self, nombre, alcance, filtros, params):
+        consulta = self._consultas[nombre]
+        por_empresa = consulta.columna_empresa is not None and alcance is not TODAS_LAS_EMPRESAS
+        if por_empresa:
+            params['id_empresa'] = alcance
+        # Los filtros se ordenan como fueron declarados, para que cada combinación tenga un solo texto
+        filtros = tuple(filtro for filtro in consulta.opcionales if filtro in filtros)
+        return consulta.texto(por_empresa, filtros)
+
+    def _medir(self, nombre, inicio):
+        duracion = time.perf_counter() - inicio
+        with self._lock:
+            estadistica = self._estadisticas.setdefault(nombre, [0, 0.0, 0.0])
+            estadistica[0] += 1
+            estadistica[1] += duracion
+            if duracion > estadistica[2]:
+                estadistica[2] = duracion
+
+    def ejecutar(self, cursor, nombre, alcance=TODAS_LAS_EMPRESAS, filtros=(), /, **params):
+        """
+        Ejecuta la consulta en el cursor y lo retorna (para INSERT/UPDATE: rowcount, lastrowid).
+        Los argumentos propios son sólo posicionales: los parámetros SQL pueden llamarse 'nombre'.
+        """
+        sql = self._preparar(nombre, alcance, filtros, params)
+        inicio = time.perf_counter()
+        cursor.execute(sql, params)
+        self._medir(nombre, inicio)
+        return cursor
+
+    def uno(self, cursor, nombre, alcance=TODAS_LAS_EMPRESAS, filtros=(), /, **params):
+        sql = self._preparar(nombre, alcance, filtros, params)
+        inicio = time.perf_counter()
+        fila = cursor.execute(sql, params).fetchone()
+        self._medir(nombre, inicio)
+        return fila
+
+    def todos(self, cursor, nombre, alcance=TODAS_LAS_EMPRESAS, filtros=(), /, **params):
+        sql = self._preparar(nombre, alcance, filtros, params)
+        inicio = time.perf_counter()
+        filas = cursor.execute(sql, params).fetchall()
+        self._medir(nombre, inicio)
+        return filas
+
+    def ejecutar_muchos(self, cursor, nombre, filas_params, alcance=TODAS_LAS_EMPRESAS):
+        """executemany con una lista de dicts de parámetros."""
+        filas_params = list(filas_params)
+        if not filas_params:
+            return cursor
+        sql = self._preparar(nombre, alcance, (), {})
+        if alcance is not TODAS_LAS_EMPRESAS and self._consultas[nombre].columna_empresa:
+            filas_params = [dict(params, id_empresa=alcance) for params in filas_params]
+        inicio = time.perf_counter()
+        cursor.executemany(sql, filas_params)
+        self._medir(nombre, inicio)
+        return cursor
+
+    def estadisticas(self):
+        """[(nombre, ejecuciones, segundos_total, segundos_maximo)] ordenado por tiempo total, de mayor a menor."""
+        with self._lock:
+            filas = [(nombre, cantidad, total, maximo) for nombre, (cantidad, total, maximo) in self._estadisticas.items()]
+        return sorted(filas, key=lambda fila: fila[2], reverse=True)
+
+    def reiniciar_estadisticas(self):
+        with self._lock:
+            self._estadisticas.clear()
+
+
+def lista_json(valores):
+    """Parámetro para 'IN (SELECT value FROM json_each(:ids))': una sola sentencia para cualquier cantidad de ids."""
+    return json.dumps(list(valores))
+
+
+repositorio = RepositorioConsultas()
+registrar = repositorio.registrar
+
+
+def registrar_con_historico(nombre, sql, columna_empresa=None, opcionales=None, tablas=()):
+    """Registra la consulta y su variante '<nombre>.historico', que lee <tabla>_historico en lugar de cada tabla de 'tablas'."""
+    registrar(nombre, sql, columna_empresa, opcionales)
+    for tabla in tablas:
+        sql = re.sub(rf'\b(FROM|JOIN)\s+{tabla}\b', rf'\1 {tabla}_historico', sql)
+    registrar(f"{nombre}.historico", sql, columna_empresa, opcionales)
+
+
+# --- Configuración ---
+
+registrar('configuracion.valor_global', "SELECT valor FROM configuracion WHERE clave = :clave AND id_empresa IS NULL")
+registrar('configuracion.valor_empresa', "SELECT valor FROM configuracion WHERE clave = :clave AND {filtros}",
+          columna_empresa='id_empresa')
+registrar('configuracion.guardar', "REPLACE INTO configuracion (clave, valor, id_empresa) VALUES (:clave, :valor, :id_empresa)")
+
+
+# --- Usuarios, roles y empresas ---
+
+_SQL_USUARIO_SESION = """
+    SELECT u.id_usuario, u.email, u.password, u.nombre, u.apellido,
+           u.id_rol, u.id_empresa, u.activo, u.primer_login_requerido,
+           r.nombre_rol
+    FROM usuarios u
+    JOIN roles r ON u.id_rol = r.id_rol
+"""
+registrar('usuarios.sesion_por_id', _SQL_USUARIO_SESION + "WHERE u.id_usuario = :id_usuario")
+registrar('usuarios.sesion_por_email', _SQL_USUARIO_SESION + "WHERE u.email = :email")
+registrar('usuarios.cambiar_clave_inicial', """
+    UPDATE usuarios SET password = :password, primer_login_requerido = 0
+    WHERE id_usuario = :id_usuario
+""")
+registrar('usuarios.listado', """
+    SELECT u.id_usuario, u.email, u.nombre, u.apellido, u.activo, u.primer_login_requerido,
+           r.nombre_rol, e.nombre AS nombre_empresa
+    FROM usuarios u
+    JOIN roles r ON u.id_rol = r.id_rol
+    LEFT JOIN empresas e ON u.id_empresa = e.id_empresa
+    ORDER BY u.apellido, u.nombre
+""")
+registrar('usuarios.por_id', """
+    SELECT u.id_usuario, u.email, u.nombre, u.apellido, u.activo, u.primer_login_requerido,
+           u.id_rol, u.id_empresa
+    FROM usuarios u
+    WHERE u.id_usuario = :id_usuario
+""")
+registrar('usuarios.insertar', """
+    INSERT INTO usuarios (email, password, nombre, apellido, id_rol, id_empresa, activo, primer_login_requerido)
+    VALUES (:email, :password, :nombre, :apellido, :id_rol, :id_empresa, 1, :primer_login_requerido)
+""")
+registrar('usuarios.actualizar', """
+    UPDATE usuarios SET email = :email, nombre = :nombre, apellido = :apellido, id_rol = :id_rol,
+    id_empresa = :id_empresa, activo = :activo, primer_login_requerido = :primer_login_requerido
+    WHERE id_usuario = :id_usuario
+""")
+registrar('usuarios.actualizar_con_clave', """
+    UPDATE usuarios SET email = :email, nombre = :nombre, apellido = :apellido, id_rol = :id_rol,
+    id_empresa = :id_empresa, activo = :activo, primer_login_requerido = :primer_login_requerido,
+    password = :password
+    WHERE id_usuario = :id_usuario
+""")
+registrar('usuarios.inactivar', "UPDATE usuarios SET activo = 0 WHERE id_usuario = :id_usuario")
+registrar('usuarios.inactivar_de_empresa', "UPDATE usuarios SET activo = 0 WHERE id_empresa = :id_empresa_inactivar")
+
+registrar('roles.listado', "SELECT id_rol, nombre_rol FROM roles ORDER BY nombre_rol")
+
+registrar('empresas.activas', "SELECT id_empresa, nombre FROM empresas WHERE activo = 1 ORDER BY nombre")
+registrar('empresas.listado', "SELECT id_empresa, nombre, telefono, direccion, activo FROM empresas ORDER BY nombre")
+registrar('empresas.por_id', "SELECT id_empresa, nombre, telefono, direccion, activo FROM empresas WHERE id_empresa = :id_empresa_buscada")
+registrar('empresas.insertar', "INSERT INTO empresas (nombre, telefono, direccion, activo) VALUES (:nombre, :telefono, :direccion, 1)")
+registrar('empresas.actualizar', """
+    UPDATE empresas SET nombre = :nombre, telefono = :telefono, direccion = :direccion, activo = :activo
+    WHERE id_empresa = :id_empresa_buscada
+""")
+registrar('empresas.inactivar', "UPDATE empresas SET activo = 0 WHERE id_empresa = :id_empresa_buscada")
+
+
+# --- Catálogo ---
+
+registrar('platos.carta', """
+    SELECT id_plato, nombre, descripcion, precio, rubro FROM platos
+    WHERE activo = 1 AND {filtros}
+    ORDER BY id_plato ASC
+""", columna_empresa='id_empresa')
+registrar('platos.activo_por_id', """
+    SELECT id_plato, nombre, precio, rubro FROM platos
+    WHERE id_plato = :id_plato AND activo = 1 AND {filtros}
+""", columna_empresa='id_empresa')
+registrar('platos.listado', """
+    SELECT id_plato, nombre, descripcion, precio, activo, id_empresa, rubro FROM platos
+    WHERE {filtros}
+    ORDER BY id_plato ASC
+""", columna_empresa='id_empresa')
+registrar('platos.por_id', """
+    SELECT id_plato, nombre, descripcion, precio, activo, id_empresa, rubro FROM platos
+    WHERE id_plato = :id_plato AND {filtros}
+""", columna_empresa='id_empresa')
+registrar('platos.insertar', """
+    INSERT INTO platos (nombre, descripcion, precio, activo, id_empresa, rubro)
+    VALUES (:nombre, :descripcion, :precio, 1, :id_empresa_plato, :rubro)
+""")
+registrar('platos.actualizar', """
+    UPDATE platos SET nombre = :nombre, descripcion = :descripcion, precio = :precio, activo = :activo, rubro = :rubro
+    WHERE id_plato = :id_plato AND {filtros}
+""", columna_empresa='id_empresa')
+registrar('platos.inactivar', "UPDATE platos SET activo = 0 WHERE id_plato = :id_plato AND {filtros}",
+          columna_empresa='id_empresa')
+
+
+# --- Repartidores ---
+
+registrar('repartidores.listado', """
+    SELECT id_repartidor, nombre, apellido, telefono, activo, id_empresa FROM repartidores
+    WHERE {filtros}
+    ORDER BY apellido, nombre
+""", columna_empresa='id_empresa')
+registrar('repartidores.tablero', """
+    SELECT id_repartidor, nombre, apellido, activo FROM repartidores
+    WHERE {filtros}
+    ORDER BY nombre, apellido
+""", columna_empresa='id_empresa')
+registrar('repartidores.activos', """
+    SELECT id_repartidor, nombre, apellido, id_empresa FROM repartidores
+    WHERE activo = 1 AND {filtros}
+    ORDER BY apellido, nombre
+""", columna_empresa='id_empresa')
+registrar('repartidores.por_id', """
+    SELECT id_repartidor, nombre, apellido, telefono, activo, id_empresa FROM repartidores
+    WHERE id_repartidor = :id_repartidor AND {filtros}
+""", columna_empresa='id_empresa')
+registrar('repartidores.empresa_si_activo', """
+    SELECT id_empresa FROM repartidores
+    WHERE id_repartidor = :id_repartidor AND activo = 1 AND {filtros}
+""", columna_empresa='id_empresa')
+registrar('repartidores.insertar', """
+    INSERT INTO repartidores (nombre, apellido, telefono, activo, id_empresa)
+    VALUES (:nombre, :apellido, :telefono, 1, :id_empresa_repartidor)
+""")
+registrar('repartidores.actualizar', """
+    UPDATE repartidores SET nombre = :nombre, apellido = :apellido, telefono = :telefono, activo = :activo
+    WHERE id_repartidor = :id_repartidor AND {filtros}
+""", columna_empresa='id_empresa')
+registrar('repartidores.inactivar', "UPDATE repartidores SET activo = 0 WHERE id_repartidor = :id_repartidor AND {filtros}",
+          columna_empresa='id_empresa')
+
+
+# --- Pedidos ---
+
+registrar('pedidos.franjas_ocupadas', """
+    SELECT horario_entrega_epoch, COUNT(*) AS num_pedidos
+    FROM pedidos p
+    WHERE estado_pago = 'Pendiente' AND horario_entrega_epoch >= :desde AND {filtros}
+    GROUP BY horario_entrega_epoch
+""", columna_empresa='p.id_empresa')
+registrar('pedidos.completos', """
+    SELECT p.id_pedido, p.cliente_nombre, p.cliente_apellido, p.direccion_entrega, p.es_envio,
+           p.horario_entrega, p.costo_envio, p.costo_total, p.forma_pago, p.estado_pago,
+           p.fecha_creacion, p.fecha_pago, p.lat_cliente, p.lon_cliente, p.id_repartidor,
+           p.id_empresa, p.version_ticket,
+           r.nombre AS repartidor_nombre, r.apellido AS repartidor_apellido, r.telefono AS repartidor_telefono
+    FROM pedidos p
+    LEFT JOIN repartidores r ON p.id_repartidor = r.id_repartidor
+    WHERE p.id_pedido IN (SELECT value FROM json_each(:ids)) AND {filtros}
+""", columna_empresa='p.id_empresa')
+registrar('pedidos.items', """
+    SELECT ip.id_pedido, ip.cantidad, ip.precio_unitario, p.id_plato, p.nombre, p.descripcion, p.rubro
+    FROM items_pedido ip
+    JOIN platos p ON ip.id_plato = p.id_plato
+    WHERE ip.id_pedido IN (SELECT value FROM json_each(:ids))
+    ORDER BY ip.id_pedido, ip.id
+""")
+registrar('pedidos.ids_de_franja', """
+    SELECT p.id_pedido FROM pedidos p
+    WHERE p.horario_entrega_epoch >= :desde AND p.horario_entrega_epoch < :hasta AND {filtros}
+    ORDER BY p.horario_entrega_epoch, p.id_pedido
+""", columna_empresa='p.id_empresa')
+registrar('pedidos.cabeceras', """
+    SELECT id_pedido, costo_total, forma_pago, estado_pago, es_envio, id_repartidor, id_empresa
+    FROM pedidos
+    WHERE id_pedido IN (SELECT value FROM json_each(:ids)) AND {filtros}
+""", columna_empresa='id_empresa')
+registrar('pedidos.empresa', "SELECT id_empresa FROM pedidos WHERE id_pedido = :id_pedido")
+registrar('pedidos.insertar', """
+    INSERT INTO pedidos (
+        cliente_nombre, cliente_apellido, direccion_entrega, es_envio,
+        horario_entrega, costo_envio, costo_total, forma_pago, estado_pago,
+        fecha_creacion, lat_cliente, lon_cliente, id_repartidor, id_empresa
+    ) VALUES (
+        :cliente_nombre, :cliente_apellido, :direccion_entrega, :es_envio,
+        :horario_entrega, :costo_envio, :costo_total, :forma_pago, 'Pendiente',
+        :fecha_creacion, :lat_cliente, :lon_cliente, NULL, :id_empresa_pedido
+    )
+""")
+registrar('pedidos.insertar_item', """
+    INSERT INTO items_pedido (id_pedido, id_plato, cantidad, precio_unitario)
+    VALUES (:id_pedido, :id_plato, :cantidad, :precio_unitario)
+""")
+registrar('pedidos.asignar_repartidor', """
+    UPDATE pedidos SET id_repartidor = :id_repartidor, version_ticket = version_ticket + 1
+    WHERE id_pedido = :id_pedido AND {filtros}
+""", columna_empresa='id_empresa')
+registrar('pedidos.marcar_pagado', """
+    UPDATE pedidos SET estado_pago = 'Pagado', fecha_pago = :fecha_pago, version_ticket = version_ticket + 1
+    WHERE id_pedido = :id_pedido AND {filtros}
+""", columna_empresa='id_empresa')
+
+# Tablero: mismos filtros opcionales para el conteo y para la página (paginación por clave con 'despues')
+_FILTROS_TABLERO = {
+    'estado_pago': "p.estado_pago = :estado_pago",
+    'fecha': "p.horario_entrega_epoch BETWEEN :desde AND :hasta",
+    'es_envio': "p.es_envio = :es_envio",
+    'sin_repartidor': "p.id_repartidor IS NULL",
+    'id_repartidor': "p.id_repartidor = :id_repartidor",
+    'despues': "(p.horario_entrega_epoch, p.id_pedido) < (:cursor_horario, :cursor_id)",
+}
+_SQL_TABLERO = """
+    SELECT p.id_pedido, p.id_empresa, p.cliente_nombre, p.cliente_apellido, p.direccion_entrega, p.horario_entrega,
+           p.forma_pago, p.costo_total, p.estado_pago, p.es_envio,
+           r.nombre AS repartidor_nombre, r.apellido AS repartidor_apellido,
+           e.nombre AS nombre_empresa
+    FROM pedidos p
+    LEFT JOIN repartidores r ON p.id_repartidor = r.id_repartidor
+    LEFT JOIN empresas e ON p.id_empresa = e.id_empresa
+"""
+registrar('pedidos.tablero_conteo', "SELECT COUNT(*) FROM pedidos p WHERE {filtros}",
+          columna_empresa='p.id_empresa', opcionales=_FILTROS_TABLERO)
+registrar('pedidos.tablero_pagina', _SQL_TABLERO + """
+    WHERE {filtros}
+    ORDER BY p.horario_entrega_epoch DESC, p.id_pedido DESC
+    LIMIT :limite
+""", columna_empresa='p.id_empresa', opcionales=_FILTROS_TABLERO)
+registrar('pedidos.tablero_fila', _SQL_TABLERO + "WHERE p.id_pedido = :id_pedido AND {filtros}",
+          columna_empresa='p.id_empresa')
+
+# Por lote: el filtro de empresa ya se aplicó al leer las cabeceras dentro de la misma transacción
+registrar('pedidos.asignar_repartidor_por_id', """
+    UPDATE pedidos SET id_repartidor = :id_repartidor, version_ticket = version_ticket + 1
+    WHERE id_pedido = :id_pedido
+""")
+registrar('pedidos.marcar_pagado_por_id', """
+    UPDATE pedidos SET estado_pago = 'Pagado', fecha_pago = :fecha_pago, version_ticket = version_ticket + 1
+    WHERE id_pedido = :id_pedido
+""")
+
+
+# --- Caja ---
+
+registrar('caja.insertar_movimiento', """
+    INSERT INTO ingresos_egresos (tipo, monto, descripcion, fecha_hora, id_pedido_origen, id_repartidor_origen, id_empresa)
+    VALUES (:tipo, :monto, :descripcion, :fecha_hora, :id_pedido_origen, :id_repartidor_origen, :id_empresa_movimiento)
+""")
+registrar('caja.acumular_cierre', """
+    INSERT INTO cierres_caja_diarios (id_empresa, fecha, total_ingresos, total_egresos, total_pagos_repartidor, cantidad_movimientos)
+    VALUES (:id_empresa_cierre, :fecha, :ingresos, :egresos, :pagos_repartidor, 1)
+    ON CONFLICT (id_empresa, fecha) DO UPDATE SET
+        total_ingresos = total_ingresos + excluded.total_ingresos,
+        total_egresos = total_egresos + excluded.total_egresos,
+        total_pagos_repartidor = total_pagos_repartidor + excluded.total_pagos_repartidor,
+        cantidad_movimientos = cantidad_movimientos + 1
+""")
+registrar_con_historico('caja.totales_movimientos', """
+    SELECT tipo, SUM(monto) AS total FROM ingresos_egresos
+    WHERE fecha_hora_epoch >= :desde AND fecha_hora_epoch < :hasta AND {filtros}
+    GROUP BY tipo
+""", columna_empresa='id_empresa', tablas=('ingresos_egresos',))
+registrar('caja.totales_cierres', """
+    SELECT SUM(total_ingresos) AS ingresos, SUM(total_egresos) AS egresos, SUM(total_pagos_repartidor) AS pagos
+    FROM cierres_caja_diarios
+    WHERE fecha BETWEEN :desde AND :hasta AND {filtros}
+""", columna_empresa='id_empresa')
+registrar_con_historico('caja.movimientos_detalle', """
+    SELECT ie.tipo, ie.monto, ie.descripcion, ie.fecha_hora, ie.fecha_hora_epoch, ie.id_pedido_origen,
+           r.nombre AS repartidor_nombre, r.apellido AS repartidor_apellido,
+           e.nombre AS nombre_empresa
+    FROM ingresos_egresos ie
+    LEFT JOIN repartidores r ON ie.id_repartidor_origen = r.id_repartidor
+    LEFT JOIN empresas e ON ie.id_empresa = e.id_empresa
+    WHERE ie.fecha_hora_epoch BETWEEN :desde AND :hasta AND {filtros}
+    ORDER BY ie.fecha_hora_epoch ASC
+    LIMIT :limite
+""", columna_empresa='ie.id_empresa', tablas=('ingresos_egresos',))
+registrar_con_historico('caja.pagos_repartidor', """
+    SELECT ie.fecha_hora, ie.fecha_hora_epoch, ie.monto, ie.id_pedido_origen,
+           r.nombre AS repartidor_nombre, r.apellido AS repartidor_apellido,
+           e.nombre AS nombre_empresa
+    FROM ingresos_egresos ie
+    JOIN repartidores r ON ie.id_repartidor_origen = r.id_repartidor
+    LEFT JOIN empresas e ON ie.id_empresa = e.id_empresa
+    WHERE ie.tipo = 'Pago a Repartidor' AND ie.fecha_hora_epoch BETWEEN :desde AND :hasta AND {filtros}
+    ORDER BY ie.fecha_hora_epoch ASC
+""", columna_empresa='ie.id_empresa', opcionales={'id_repartidor': "ie.id_repartidor_origen = :id_repartidor"}, tablas=('ingresos_egresos',))
+
+
+# --- Registro de eventos de pedidos (ver app.leer_eventos_pedido) ---
+
+registrar('eventos.insertar', """
+    INSERT INTO pedido_eventos (tipo, id_pedido, id_empresa, datos, fecha_hora)
+    VALUES (:tipo, :id_pedido, :id_empresa_evento, :datos, :fecha_hora)
+""")
+# Rango de rowid: lee sólo las filas nuevas, sin importar cuántas haya detrás de la posición
+registrar('eventos.desde', """
+    SELECT id_evento, tipo, id_pedido, id_empresa, datos, fecha_hora FROM pedido_eventos
+    WHERE id_evento > :desde
+    ORDER BY id_evento
+    LIMIT :limite
+""")
+registrar('eventos.ultimo', "SELECT COALESCE(MAX(id_evento), 0) AS ultimo FROM pedido_eventos")
+registrar('eventos.posicion', "SELECT ultimo_id_evento FROM consumidores_eventos WHERE consumidor = :consumidor")
+# La posición nunca retrocede: confirmar un lote viejo después de uno nuevo no vuelve a entregar eventos
+registrar('eventos.confirmar', """
+    INSERT INTO consumidores_eventos (consumidor, ultimo_id_evento, actualizado_en)
+    VALUES (:consumidor, :id_evento, :actualizado_en)
+    ON CONFLICT (consumidor) DO UPDATE SET
+        ultimo_id_evento = MAX(ultimo_id_evento, excluded.ultimo_id_evento),
+        actualizado_en = excluded.actualizado_en
+""")
+registrar('eventos.consumidores', """
+    SELECT c.consumidor, c.ultimo_id_evento, c.actualizado_en,
+           (SELECT COUNT(*) FROM pedido_eventos e WHERE e.id_evento > c.ultimo_id_evento) AS pendientes
+    FROM consumidores_eventos c
+    ORDER BY c.consumidor
+""")
+# Sólo lo que todos los consumidores ya confirmaron (sin consumidores, todo lo anterior al corte)
+registrar('eventos.purgar', """
+    DELETE FROM pedido_eventos
+    WHERE id_evento <= IFNULL((SELECT MIN(ultimo_id_evento) FROM consumidores_eventos),
+                              (SELECT MAX(id_evento) FROM pedido_eventos))
+      AND fecha_hora < :corte
+""")
+
+
+# --- Cola de trabajos (ver app.encolar_trabajo) ---
+# Un trabajo está disponible si está pendiente y llegó su hora, o en curso con el arriendo vencido.
+# 'intentos' sirve de testigo: terminar o fallar sólo afecta al trabajo si nadie lo retomó mientras tanto.
+
+registrar('trabajos.insertar', """
+    INSERT INTO trabajos (tarea, argumentos, max_intentos, disponible_desde, creado_en)
+    VALUES (:tarea, :argumentos, :max_intentos, :disponible_desde, :creado_en)
+""")
+registrar('trabajos.hay_disponibles', """
+    SELECT EXISTS (SELECT 1 FROM trabajos
+                   WHERE estado IN ('pendiente', 'en_curso') AND disponible_desde <= :ahora)
+""")
+# Arriendo vencido en el último intento: el trabajador murió con él, no se vuelve a correr
+registrar('trabajos.vencer_agotados', """
+    UPDATE trabajos SET estado = 'fallido', trabajador = NULL,
+        ultimo_error = 'Arriendo vencido en el último intento (' || IFNULL(trabajador, '?') || ')'
+    WHERE estado = 'en_curso' AND disponible_desde <= :ahora AND intentos >= max_intentos
+""")
+registrar('trabajos.tomar', """
+    UPDATE trabajos SET estado = 'en_curso', intentos = intentos + 1, disponible_desde = :arriendo_hasta,
+        trabajador = :trabajador
+    WHERE id_trabajo = (SELECT id_trabajo FROM trabajos
+                        WHERE estado IN ('pendiente', 'en_curso') AND disponible_desde <= :ahora
+                        ORDER BY disponible_desde
+                        LIMIT 1)
+    RETURNING id_trabajo, tarea, argumentos, intentos, max_intentos, creado_en
+""")
+registrar('trabajos.terminar', """
+    DELETE FROM trabajos WHERE id_trabajo = :id_trabajo AND intentos = :intentos AND estado = 'en_curso'
+""")
+registrar('trabajos.fallar', """
+    UPDATE trabajos SET estado = CASE WHEN intentos >= max_intentos THEN 'fallido' ELSE 'pendiente' END,
+        disponible_desde = :reintentar_desde, trabajador = NULL, ultimo_error = :error
+    WHERE id_trabajo = :id_trabajo AND intentos = :intentos AND estado = 'en_curso'
+""")
+registrar('trabajos.resumen', """
+    SELECT tarea, estado, COUNT(*) AS cantidad, MIN(creado_en) AS creado_mas_antiguo
+    FROM trabajos
+    GROUP BY tarea, estado
+    ORDER BY tarea, estado
+""")
+registrar('trabajos.fallidos', """
+    SELECT id_trabajo, tarea, argumentos, intentos, ultimo_error FROM trabajos
+    WHERE estado = 'fallido'
+    ORDER BY id_trabajo
+    LIMIT :limite
+""")
+registrar('trabajos.reintentar_fallidos', """
+    UPDATE trabajos SET estado = 'pendiente', intentos = 0, disponible_desde = :ahora
+    WHERE estado = 'fallido'
+""")
+
+
+# --- Reportes de ventas (por fecha de creación del pedido) ---
+
+registrar('reportes.ventas_por_rubro', """
+    SELECT pl.rubro, SUM(ip.cantidad) AS total_cantidad_vendida
+    FROM items_pedido ip
+    JOIN platos pl ON ip.id_plato = pl.id_plato
+    JOIN pedidos p ON ip.id_pedido = p.id_pedido
+    WHERE p.fecha_creacion_epoch BETWEEN :desde AND :hasta AND {filtros}
+    GROUP BY pl.rubro
+    ORDER BY total_cantidad_vendida DESC
+""", columna_empresa='p.id_empresa')
+registrar('reportes.productos_mas_vendidos', """
+    SELECT pl.nombre, pl.rubro, SUM(ip.cantidad) AS total_cantidad_vendida
+    FROM items_pedido ip
+    JOIN platos pl ON ip.id_plato = pl.id_plato
+    JOIN pedidos p ON ip.id_pedido = p.id_pedido
+    WHERE p.fecha_creacion_epoch BETWEEN :desde AND :hasta AND {filtros}
+    GROUP BY pl.id_plato, pl.nombre, pl.rubro
+    ORDER BY total_cantidad_vendida DESC
+""", columna_empresa='p.id_empresa')
+registrar_con_historico('reportes.medios_de_pago', """
+    SELECT forma_pago, COUNT(*) AS total_usos, SUM(costo_total) AS total_monto
+    FROM pedidos p
+    WHERE p.fecha_creacion_epoch BETWEEN :desde AND :hasta AND {filtros}
+    GROUP BY forma_pago
+    ORDER BY total_usos DESC
+""", columna_empresa='p.id_empresa', tablas=('pedidos',))
+
+# Sobre lo archivado, cada ítem se lee junto con su pedido: items_pedido_historico ya trae id_empresa y
+# fecha_creacion_epoch del pedido (un pedido y sus ítems están siempre en la misma base), así el filtro
+# por empresa y fecha llega a los índices de cada base en lugar de unir dos vistas completas.
+registrar('reportes.ventas_por_rubro.historico', """
+    SELECT pl.rubro, SUM(ip.cantidad) AS total_cantidad_vendida
+    FROM items_pedido_historico ip
+    JOIN platos pl ON ip.id_plato = pl.id_plato
+    WHERE ip.fecha_creacion_epoch BETWEEN :desde AND :hasta AND {filtros}
+    GROUP BY pl.rubro
+    ORDER BY total_cantidad_vendida DESC
+""", columna_empresa='ip.id_empresa')
+registrar('reportes.productos_mas_vendidos.historico', """
+    SELECT pl.nombre, pl.rubro, SUM(ip.cantidad) AS total_cantidad_vendida
+    FROM items_pedido_historico ip
+    JOIN platos pl ON ip.id_plato = pl.id_plato
+    WHERE ip.fecha_creacion_epoch BETWEEN :desde AND :hasta AND {filtros}
+    GROUP BY pl.id_plato, pl.nombre, pl.rubro
+    ORDER BY total_cantidad_vendida DESC
+""", columna_empresa='ip.id_empresa')
+
+
+# --- Archivo histórico (ver app.archivar_pedidos) ---
+# Tablas calificadas con main./archivo.: las del archivo tienen los mismos nombres. Las listas de columnas
+# son explícitas porque las columnas *_epoch son generadas y no admiten INSERT.
+
+_COLUMNAS_PEDIDOS = """id_pedido, cliente_nombre, cliente_apellido, direccion_entrega, es_envio, horario_entrega,
+        costo_envio, costo_total, forma_pago, estado_pago, fecha_creacion, fecha_pago, lat_cliente, lon_cliente,
+        id_repartidor, id_empresa, version_ticket"""
+_COLUMNAS_ITEMS = "id, id_pedido, id_plato, cantidad, precio_unitario"
+_COLUMNAS_MOVIMIENTOS = "id, tipo, monto, descripcion, fecha_hora, id_pedido_origen, id_repartidor_origen, id_empresa"
+
+# Pagados antes del corte y sin movimientos de caja posteriores: todo lo archivado queda antes del límite
+registrar('archivo.pedidos_a_archivar', """
+    SELECT p.id_pedido FROM main.pedidos p
+    WHERE p.id_pedido > :ultimo_id AND p.estado_pago = 'Pagado'
+      AND p.fecha_pago_epoch < :corte AND p.fecha_creacion_epoch < :corte
+      AND NOT EXISTS (SELECT 1 FROM main.ingresos_egresos ie
+                      WHERE ie.id_pedido_origen = p.id_pedido AND ie.fecha_hora_epoch >= :corte)
+    ORDER BY p.id_pedido
+    LIMIT :lote
+""")
+registrar('archivo.copiar_pedidos', f"""
+    INSERT INTO archivo.pedidos ({_COLUMNAS_PEDIDOS})
+    SELECT {_COLUMNAS_PEDIDOS} FROM main.pedidos
+    WHERE id_pedido IN (SELECT value FROM json_each(:ids))
+""")
+registrar('archivo.copiar_items', f"""
+    INSERT INTO archivo.items_pedido ({_COLUMNAS_ITEMS})
+    SELECT {_COLUMNAS_ITEMS} FROM main.items_pedido
+    WHERE id_pedido IN (SELECT value FROM json_each(:ids))
+""")
+registrar('archivo.copiar_movimientos_de_pedidos', f"""
+    INSERT INTO archivo.ingresos_egresos ({_COLUMNAS_MOVIMIENTOS})
+    SELECT {_COLUMNAS_MOVIMIENTOS} FROM main.ingresos_egresos
+    WHERE id_pedido_origen IN (SELECT value FROM json_each(:ids))
+""")
+registrar('archivo.borrar_items', "DELETE FROM main.items_pedido WHERE id_pedido IN (SELECT value FROM json_each(:ids))")
+registrar('archivo.borrar_movimientos_de_pedidos',
+          "DELETE FROM main.ingresos_egresos WHERE id_pedido_origen IN (SELECT value FROM json_each(:ids))")
+registrar('archivo.borrar_pedidos', "DELETE FROM main.pedidos WHERE id_pedido IN (SELECT value FROM json_each(:ids))")
+
+# Movimientos anteriores al corte que no pertenecen a un pedido activo (egresos manuales, por ejemplo)
+registrar('archivo.movimientos_sueltos_a_archivar', """
+    SELECT ie.id FROM main.ingresos_egresos ie
+    WHERE ie.id > :ultimo_id AND ie.fecha_hora_epoch < :corte
+      AND (ie.id_pedido_origen IS NULL
+           OR NOT EXISTS (SELECT 1 FROM main.pedidos p WHERE p.id_pedido = ie.id_pedido_origen))
+    ORDER BY ie.id
+    LIMIT :lote
+""")
+registrar('archivo.copiar_movimientos', f"""
+    INSERT INTO archivo.ingresos_egresos ({_COLUMNAS_MOVIMIENTOS})
+    SELECT {_COLUMNAS_MOVIMIENTOS} FROM main.ingresos_egresos
+    WHERE id IN (SELECT value FROM json_each(:ids))
+""")
+registrar('archivo.borrar_movimientos', "DELETE FROM main.ingresos_egresos WHERE id IN (SELECT value FROM json_each(:ids))")
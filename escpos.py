@@ -0,0 +1,98 @@
+# casa_comida_web/escpos.py
+
+import socket
+import textwrap
+
+ESC = b'\x1b'
+GS = b'\x1d'
+
+
+class TicketEscPos:
+    """
+    Arma un ticket como bytes ESC/POS para impresoras térmicas (comandos básicos
+    compatibles con Epson TM y la mayoría de sus clones).
+    El texto se codifica en la página de códigos PC850 para conservar acentos y eñes.
+    """
+
+    def __init__(self, ancho=42, codificacion='cp850'):
+        self.ancho = ancho
+        self.codificacion = codificacion
+        # ESC @ inicializa la impresora; ESC t 2 selecciona la página de códigos PC850
+        self._partes = [ESC + b'@', ESC + b't\x02']
+
+    def _codificar(self, texto):
+        return texto.encode(self.codificacion, errors='replace')
+
+    def linea(self, texto='', centrado=False, negrita=False, doble=False):
+        self._partes.append(ESC + b'a' + (b'\x01' if centrado else b'\x00'))
+        if negrita:
+            self._partes.append(ESC + b'E\x01')
+        if doble:
+            self._partes.append(GS + b'!\x11')
+        ancho = self.ancho // 2 if doble else self.ancho
+        for renglon in textwrap.wrap(texto, ancho) or ['']:
+            self._partes.append(self._codificar(renglon) + b'\n')
+        if doble:
+            self._partes.append(GS + b'!\x00')
+        if negrita:
+            self._partes.append(ESC + b'E\x00')
+        return self
+
+    def columnas(self, izquierda, derecha, negrita=False):
+        """Imprime 'izquierda' alineado a la izquierda y 'derecha' al margen derecho del mismo renglón."""
+        self._partes.append(ESC + b'a\x00')
+        if negrita:
+            self._partes.append(ESC + b'E\x01')
+        ancho_izquierda = max(self.ancho - len(derecha) - 1, 1)
+        renglones = textwrap.wrap(izquierda, ancho_izquierda) or ['']
+        for renglon in renglones[:-1]:
+            self._partes.append(self._codificar(renglon) + b'\n')
+        ultimo = renglones[-1].ljust(ancho_izquierda) + ' ' + derecha
+        self._partes.append(self._codificar(ultimo) + b'\n')
+        if negrita:
+            self._partes.append(ESC + b'E\x00')
+        return self
+
+    def separador(self, caracter='-'):
+        return self.linea(caracter * self.ancho)
+
+    def cortar(self):
+        # ESC d 4 avanza cuatro renglones; GS V 1 hace un corte parcial
+        self._partes.append(ESC + b'd\x04' + GS + b'V\x01')
+        return self
+
+    def a_bytes(self):
+        return b''.join(self._partes)
+
+
+def ticket_de_pedido(pedido, ancho=42):
+    """Ticket ESC/POS de un pedido (models.Pedido o subclase): sólo usa sus datos, así corre en cualquier proceso."""
+    ticket = TicketEscPos(ancho=ancho)
+    ticket.linea(f"PEDIDO #{pedido.id_pedido}", centrado=True, negrita=True, doble=True)
+    ticket.separador()
+    ticket.linea(f"Cliente: {pedido.cliente_nombre} {pedido.cliente_apellido}")
+    ticket.linea(f"Dirección: {pedido.direccion_entrega}")
+    ticket.linea(f"Tipo: {'Envío' if pedido.es_envio else 'Retiro en Sucursal'}")
+    ticket.linea(f"Horario: {pedido.horario_entrega.strftime('%H:%M')} ({pedido.horario_entrega.strftime('%d/%m')})", negrita=True)
+    if pedido.es_envio and pedido.repartidor:
+        ticket.linea(f"Repartidor: {pedido.repartidor.nombre_completo}")
+    ticket.separador()
+    for linea in pedido._lineas_ticket():
+        ticket.columnas(f"{linea['cantidad']} x {linea['nombre']}", f"${linea['subtotal']:,.2f}")
+    if pedido.es_envio:
+        ticket.columnas("Costo de Envío", f"${pedido.costo_envio:,.2f}")
+    ticket.separador()
+    ticket.columnas("TOTAL", f"${pedido.costo_total:,.2f}", negrita=True)
+    ticket.linea(f"Forma de Pago: {pedido.forma_pago}")
+    ticket.linea(f"Estado del Pago: {pedido.estado_pago}")
+    if pedido.fecha_pago:
+        ticket.linea(f"Fecha de Pago: {pedido.fecha_pago.strftime('%d/%m/%Y %H:%M')}")
+    ticket.separador()
+    ticket.linea("¡Gracias por su compra!", centrado=True)
+    return ticket.cortar().a_bytes()
+
+
+def enviar_a_impresora(datos, host, puerto=9100, timeout=5):
+    """Envía bytes ESC/POS a una impresora de red por socket crudo (puerto 9100, 'RAW'/JetDirect)."""
+    with socket.create_connection((host, puerto), timeout=timeout) as conexion:
+        conexion.sendall(datos)
@@ -0,0 +1,92 @@
+# casa_comida_web/escritura_agrupada.py
+"""
+Escritor único con commit agrupado (group commit).
+
+Las peticiones entregan su escritura a una cola y esperan el resultado en un Future. Un solo hilo por
+proceso toma las que se juntaron (hasta max_grupo, esperando como mucho espera_maxima desde la primera)
+y las aplica todas en una transacción: un commit, y un fsync, por grupo en lugar de uno por petición.
+Mientras un grupo hace su commit, las peticiones que llegan forman el siguiente.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from por_proceso import PorProceso
+
+
+class EscrituraDemorada(Exception):
+    """La solicitud no se confirmó a tiempo (ver EscritorAgrupado.escribir)."""
+
+
+class EscritorAgrupado:
+    """
+    aplicar_grupo(solicitudes) escribe el grupo y retorna una lista con el resultado de cada solicitud, en
+    el mismo orden; un elemento que sea una excepción rechaza sólo esa solicitud. Si aplicar_grupo lanza,
+    la excepción rechaza a todo el grupo.
+    """
+
+    def __init__(self, aplicar_grupo, max_grupo=50, espera_maxima=0.0, nombre='escritor-agrupado'):
+        self.aplicar_grupo = aplicar_grupo
+        self.max_grupo = max_grupo
+        self.espera_maxima = espera_maxima
+        self.nombre = nombre
+        # La cola y el hilo que la atiende, uno por proceso (ver por_proceso.py)
+        self._cola = PorProceso(self._arrancar_hilo)
+
+    def _arrancar_hilo(self):
+        cola = queue.SimpleQueue()
+        threading.Thread(target=self._trabajar, args=(cola,), name=self.nombre, daemon=True).start()
+        return cola
+
+    def enviar(self, solicitud):
+        """Encola la solicitud; el Future se resuelve con su resultado cuando se confirma el grupo."""
+        futuro = Future()
+        self._cola.obtener().put((solicitud, futuro))
+        return futuro
+
+    def escribir(self, solicitud, espera_maxima=None):
+        """
+        Envía la solicitud y retorna su resultado. Si no llega en espera_maxima segundos lanza EscrituraDemorada
+        y retira la solicitud si seguía en la cola; si su grupo ya se estaba escribiendo, puede confirmarse igual.
+        """
+        futuro = self.enviar(solicitud)
+        try:
+            return futuro.result(timeout=espera_maxima)
+        except FutureTimeoutError:
+            if futuro.done():
+                raise  # El TimeoutError es el resultado de la escritura, no de la espera
+            retirada = futuro.cancel()
+            raise EscrituraDemorada(f"sin confirmar tras {espera_maxima}s"
+                                    + (" (retirada de la cola)" if retirada else " (en escritura)")) from None
+
+    def _tomar_grupo(self, cola):
+        grupo = [cola.get()]
+        limite = time.monotonic() + self.espera_maxima
+        while len(grupo) < self.max_grupo:
+            restante = limite - time.monotonic()
+            try:
+                grupo.append(cola.get(timeout=restante) if restante > 0 else cola.get_nowait())
+            except queue.Empty:
+                break
+        return grupo
+
+    def _trabajar(self, cola):
+        while True:
+            # Las solicitudes que su petición ya abandonó (Future cancelado) no se escriben
+            grupo = [(solicitud, futuro) for solicitud, futuro in self._tomar_grupo(cola) if futuro.set_running_or_notify_cancel()]
+            if not grupo:
+                continue
+            try:
+                resultados = self.aplicar_grupo([solicitud for solicitud, _ in grupo])
+                if len(resultados) != len(grupo):
+                    # Con zip sobrarían Futures sin resolver y sus peticiones esperarían para siempre
+                    raise RuntimeError(f"aplicar_grupo retornó {len(resultados)} resultado(s) para {len(grupo)} solicitud(es)")
+            except Exception as e:
+                resultados = [e] * len(grupo)
+            for (_, futuro), resultado in zip(grupo, resultados):
+                if isinstance(resultado, Exception):
+                    futuro.set_exception(resultado)
+                else:
+                    futuro.set_result(resultado)
@@ -0,0 +1,66 @@
+# casa_comida_web/eventos.py
+
+import json
+import threading
+import time
+
+
+class DifusorEventos:
+    """
+    Streams Server-Sent Events de los cambios de pedidos para los tableros, filtrando por empresa.
+
+    Los eventos no viajan por memoria: cada stream lee el registro pedido_eventos de la base
+    (ver app._leer_eventos_tablero), que comparten todos los procesos de gunicorn, de a
+    intervalo_sondeo segundos. Este difusor sólo despierta antes a los streams del mismo proceso
+    en que se hizo el cambio. Los streams SSE son conexiones largas, por lo que conviene usar
+    workers con hilos (gunicorn -k gthread) para no bloquear workers sync.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._suscripciones = set()
+
+    def suscribir(self, id_empresa):
+        """Registra un oyente. id_empresa=None se despierta con los cambios de todas las empresas (super_admin)."""
+        suscripcion = (id_empresa, threading.Event())
+        with self._lock:
+            self._suscripciones.add(suscripcion)
+        return suscripcion
+
+    def desuscribir(self, suscripcion):
+        with self._lock:
+            self._suscripciones.discard(suscripcion)
+
+    def avisar(self, id_empresa):
+        """Despierta a los oyentes de la empresa: hay eventos nuevos en el registro."""
+        with self._lock:
+            for empresa, aviso in self._suscripciones:
+                if empresa is None or empresa == id_empresa:
+                    aviso.set()
+
+    def escuchar(self, suscripcion, leer, posicion, intervalo_sondeo=1, intervalo_latido=15, duracion_maxima=300):
+        """
+        Generador de texto SSE para una suscripción. leer(posicion) retorna ([(id, tipo, datos)], posición nueva)
+        con los eventos posteriores a 'posicion'; el id de cada evento es lo que el navegador manda como
+        Last-Event-ID al reconectar. Envía un comentario de latido cada intervalo_latido segundos sin eventos
+        y corta tras duracion_maxima (el navegador reconecta solo).
+        """
+        _, aviso = suscripcion
+        fin = time.monotonic() + duracion_maxima
+        ultimo_envio = time.monotonic()
+        try:
+            yield "retry: 3000\n\n"
+            while time.monotonic() < fin:
+                # Un aviso que llega mientras se lee no se pierde: se borra antes de leer
+                aviso.clear()
+                eventos, posicion = leer(posicion)
+                for id_evento, tipo, datos in eventos:
+                    yield f"id: {id_evento}\nevent: {tipo}\ndata: {json.dumps(datos)}\n\n"
+                if eventos:
+                    ultimo_envio = time.monotonic()
+                elif time.monotonic() - ultimo_envio >= intervalo_latido:
+                    yield ": latido\n\n"
+                    ultimo_envio = time.monotonic()
+                aviso.wait(intervalo_sondeo)
+        finally:
+            self.desuscribir(suscripcion)
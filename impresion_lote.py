@@ -0,0 +1,188 @@
+# casa_comida_web/impresion_lote.py
+
+import json
+import multiprocessing
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+from escpos import ticket_de_pedido
+
+# Pool de procesos compartido por el proceso web (se crea al primer uso).
+_pool = None
+_pool_lock = threading.Lock()
+
+# Los procesos del pool no salen de un fork del proceso web: con sus hilos (SSE, cola de trabajos, escritor de
+# pedidos) un fork puede copiar un lock tomado, como el de la caché de tickets o el de las métricas, y el hijo se
+# cuelga al usarlo. Arrancan desde el servidor de procesos (forkserver) o, donde no lo hay, de cero (spawn), y
+# reciben sólo datos. Ojo: multiprocessing vuelve a importar en cada hijo el módulo principal del proceso que
+# los lanza (como __mp_main__), así que con "python app.py" los hijos importan app.py de nuevo. El renderizador
+# no usa nada de ese módulo: todo lo que necesita está aquí, en escpos y en las plantillas.
+_METODO_INICIO = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+_DIRECTORIO_PLANTILLAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+# Plantillas de cada proceso del pool (se cargan al primer lote HTML)
+_plantillas = None
+
+
+def _obtener_pool(procesos):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            contexto = multiprocessing.get_context(_METODO_INICIO)
+            if _METODO_INICIO == 'forkserver':
+                # El servidor de procesos precarga este módulo: los hijos nacen con el renderizador ya importado
+                contexto.set_forkserver_preload([__name__])
+            _pool = ProcessPoolExecutor(max_workers=procesos, mp_context=contexto)
+        return _pool
+
+
+def _plantilla_ticket():
+    global _plantillas
+    if _plantillas is None:
+        _plantillas = Environment(loader=FileSystemLoader(_DIRECTORIO_PLANTILLAS), autoescape=select_autoescape(['html']))
+    return _plantillas.get_template('_ticket.html')
+
+
+def _renderizar_tickets(pedidos, formato, ancho):
+    """Se ejecuta dentro de un proceso del pool: renderiza los tickets de un lote de pedidos (models.Pedido)."""
+    if formato == 'escpos':
+        return [ticket_de_pedido(pedido, ancho) for pedido in pedidos]
+    plantilla = _plantilla_ticket()
+    return [plantilla.render(pedido=pedido, lineas=pedido._lineas_ticket()) for pedido in pedidos]
+
+
+def renderizar_en_pool(pedidos, formato='html', procesos=2, tamano_lote=25, ancho=42):
+    """
+    Reparte los pedidos en lotes y los envía al pool de procesos; 'ancho' es el de los tickets ESC/POS.
+    Retorna la lista de futures en el mismo orden que los pedidos.
+    """
+    pool = _obtener_pool(procesos)
+    datos = [pedido.como_datos() for pedido in pedidos]
+    return [pool.submit(_renderizar_tickets, datos[i:i + tamano_lote], formato, ancho)
+            for i in range(0, len(datos), tamano_lote)]
+
+
+def recolectar(futures):
+    """Espera los lotes y retorna los tickets aplanados, en orden."""
+    return [ticket for future in futures for ticket in future.result()]
+
+
+# --- Trabajos en segundo plano ---
+# Cada trabajo es un par de archivos en el directorio de trabajos: <id>.json con su estado y, cuando termina,
+# <id>.tickets con el resultado (la lista de tickets HTML en JSON o el documento ESC/POS). Así cualquier
+# worker de gunicorn puede responder por un trabajo lanzado en otro.
+
+_ID_TRABAJO = re.compile(r'[0-9a-f]{32}')
+
+
+def _ruta_trabajo(directorio, id_trabajo, extension):
+    return os.path.join(directorio, f"{id_trabajo}{extension}")
+
+
+def _escribir(ruta, contenido):
+    """Escribe el archivo de una vez: quien lo lee nunca ve uno a medias."""
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    with open(temporal, 'wb') as archivo:
+        archivo.write(contenido)
+    os.replace(temporal, ruta)
+
+
+def _guardar_estado(directorio, trabajo):
+    _escribir(_ruta_trabajo(directorio, trabajo['id'], '.json'), json.dumps(trabajo).encode('utf-8'))
+
+
+def _guardar_resultado(directorio, trabajo, futures):
+    """Con todos los lotes terminados, guarda los tickets y luego el estado (en ese orden)."""
+    try:
+        tickets = recolectar(futures)
+        if trabajo['formato'] == 'escpos':
+            contenido = b''.join(tickets)
+        else:
+            contenido = json.dumps(tickets).encode('utf-8')
+        _escribir(_ruta_trabajo(directorio, trabajo['id'], '.tickets'), contenido)
+        trabajo['estado'] = 'listo'
+    except Exception as e:
+        trabajo['estado'] = 'error'
+        trabajo['error'] = str(e)
+    _guardar_estado(directorio, trabajo)
+
+
+def _borrar_trabajos_viejos(directorio, conservar_segundos):
+    limite = time.time() - conservar_segundos
+    for nombre in os.listdir(directorio):
+        ruta = os.path.join(directorio, nombre)
+        try:
+            if os.path.getmtime(ruta) < limite:
+                os.remove(ruta)
+        except FileNotFoundError:
+            pass  # Lo borró otro worker
+
+
+def iniciar_trabajo(pedidos, formato, descripcion, id_usuario, directorio, procesos=2, tamano_lote=25, ancho=42,
+                    conservar_segundos=3600):
+    """
+    Lanza el renderizado en segundo plano sin bloquear la petición y guarda el trabajo en 'directorio'.
+    Borra los trabajos de más de conservar_segundos. Retorna el id del trabajo.
+    """
+    os.makedirs(directorio, exist_ok=True)
+    _borrar_trabajos_viejos(directorio, conservar_segundos)
+    trabajo = {
+        'id': uuid.uuid4().hex,
+        'descripcion': descripcion,
+        'formato': formato,
+        'id_usuario': id_usuario,
+        'cantidad': len(pedidos),
+        'inicio': time.time(),
+        'estado': 'en_proceso',
+    }
+    _guardar_estado(directorio, trabajo)
+
+    futures = renderizar_en_pool(pedidos, formato, procesos, tamano_lote, ancho)
+    pendientes = len(futures)
+    lock = threading.Lock()
+
+    def al_terminar_lote(_future):
+        # Corre en el hilo del pool que recibe los resultados; el último lote guarda el trabajo
+        nonlocal pendientes
+        with lock:
+            pendientes -= 1
+            if pendientes:
+                return
+        _guardar_resultado(directorio, trabajo, futures)
+
+    if not futures:
+        _guardar_resultado(directorio, trabajo, futures)
+    for future in futures:
+        future.add_done_callback(al_terminar_lote)
+    return trabajo['id']
+
+
+def estado_trabajo(id_trabajo, directorio, vencimiento_segundos=600):
+    """
+    Retorna None si el trabajo no existe; si existe, un dict con 'estado' ('en_proceso', 'listo' o 'error')
+    y, cuando está listo, los 'tickets' renderizados (en ESC/POS, el documento entero como único elemento).
+    Un trabajo en proceso desde hace más de vencimiento_segundos se informa como error: el proceso que lo
+    lanzó ya no está para guardarlo.
+    """
+    if not _ID_TRABAJO.fullmatch(id_trabajo):
+        return None
+    try:
+        with open(_ruta_trabajo(directorio, id_trabajo, '.json'), 'rb') as archivo:
+            trabajo = json.load(archivo)
+    except FileNotFoundError:
+        return None
+
+    if trabajo['estado'] == 'en_proceso' and time.time() - trabajo['inicio'] > vencimiento_segundos:
+        trabajo['estado'] = 'error'
+        trabajo['error'] = "el trabajo no terminó; se reinició el proceso que lo lanzó"
+    elif trabajo['estado'] == 'listo':
+        with open(_ruta_trabajo(directorio, id_trabajo, '.tickets'), 'rb') as archivo:
+            contenido = archivo.read()
+        trabajo['tickets'] = [contenido] if trabajo['formato'] == 'escpos' else json.loads(contenido)
+    return trabajo
@@ -0,0 +1,215 @@
+# casa_comida_web/metricas.py
+"""
+Métricas en formato de texto de Prometheus que se suman entre procesos.
+
+Con gunicorn cada worker es un proceso distinto: cada uno escribe sus valores en su propio
+archivo mmap dentro de un directorio compartido (<directorio>/<pid>.db), y /metrics lee y suma
+los archivos de todos los procesos. Los archivos de workers que terminaron se siguen sumando,
+así los contadores no retroceden al reciclarse un worker; el directorio debe vaciarse antes de
+arrancar el servidor (flask --app app limpiar-metricas).
+
+Formato del archivo: 8 bytes con el largo usado y luego entradas
+[largo de la clave (4 bytes)][clave UTF-8 rellena a múltiplo de 8][valor double (8 bytes)].
+"""
+
+import glob
+import json
+import mmap
+import os
+import struct
+import threading
+
+from por_proceso import PorProceso
+
+_TAMANO_INICIAL = 1 << 16
+_CABECERA = struct.Struct('i')
+_VALOR = struct.Struct('d')
+
+# Límites (segundos) de los buckets de latencia
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _entradas(datos, usado):
+    """Recorre un archivo de valores: (clave, valor, posición del valor)."""
+    posicion = 8
+    while posicion < usado:
+        largo = _CABECERA.unpack_from(datos, posicion)[0]
+        inicio_clave = posicion + 4
+        fin_relleno = inicio_clave + largo + (-(largo + 4) % 8)
+        clave = bytes(datos[inicio_clave:inicio_clave + largo]).decode('utf-8')
+        yield clave, _VALOR.unpack_from(datos, fin_relleno)[0], fin_relleno
+        posicion = fin_relleno + 8
+
+
+class _ArchivoValores:
+    """Diccionario clave -> double respaldado por un archivo mmap. Sólo lo escribe el proceso dueño."""
+
+    def __init__(self, ruta):
+        self._archivo = open(ruta, 'a+b')
+        if os.fstat(self._archivo.fileno()).st_size == 0:
+            self._archivo.truncate(_TAMANO_INICIAL)
+        self._tamano = os.fstat(self._archivo.fileno()).st_size
+        self._mmap = mmap.mmap(self._archivo.fileno(), self._tamano)
+        self._usado = _CABECERA.unpack_from(self._mmap, 0)[0] or 8
+        self._posiciones = {clave: posicion for clave, _, posicion in _entradas(self._mmap, self._usado)}
+
+    def _agregar_clave(self, clave):
+        codificada = clave.encode('utf-8')
+        relleno = -(len(codificada) + 4) % 8
+        entrada = _CABECERA.pack(len(codificada)) + codificada + b' ' * relleno + _VALOR.pack(0.0)
+        while self._usado + len(entrada) > self._tamano:
+            self._tamano *= 2
+            self._archivo.truncate(self._tamano)
+            self._mmap.close()
+            self._mmap = mmap.mmap(self._archivo.fileno(), self._tamano)
+        self._mmap[self._usado:self._usado + len(entrada)] = entrada
+        self._posiciones[clave] = self._usado + len(entrada) - 8
+        self._usado += len(entrada)
+        _CABECERA.pack_into(self._mmap, 0, self._usado)
+
+    def sumar(self, clave, cantidad):
+        if clave not in self._posiciones:
+            self._agregar_clave(clave)
+        posicion = self._posiciones[clave]
+        _VALOR.pack_into(self._mmap, posicion, _VALOR.unpack_from(self._mmap, posicion)[0] + cantidad)
+
+
+def _leer_archivo(ruta):
+    with open(ruta, 'rb') as archivo:
+        datos = archivo.read()
+    if len(datos) < 8:
+        return []
+    usado = min(_CABECERA.unpack_from(datos, 0)[0], len(datos))
+    return [(clave, valor) for clave, valor, _ in _entradas(datos, usado)]
+
+
+class RegistroMetricas:
+    def __init__(self, directorio):
+        self.directorio = directorio
+        self._metricas = {}
+        self._lock = threading.Lock()
+        # Tras un fork (workers de gunicorn) cada proceso abre su propio archivo
+        self._archivo = PorProceso(self._abrir_archivo)
+
+    def _abrir_archivo(self):
+        os.makedirs(self.directorio, exist_ok=True)
+        return _ArchivoValores(os.path.join(self.directorio, f"{os.getpid()}.db"))
+
+    def _sumar(self, clave, cantidad):
+        with self._lock:
+            self._archivo.obtener().sumar(clave, cantidad)
+
+    def contador(self, nombre, ayuda, etiquetas=()):
+        metrica = Contador(self, nombre, ayuda, etiquetas)
+        self._metricas[nombre] = metrica
+        return metrica
+
+    def histograma(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_LATENCIA):
+        metrica = Histograma(self, nombre, ayuda, etiquetas, buckets)
+        self._metricas[nombre] = metrica
+        return metrica
+
+    def exportar(self):
+        """Texto de exposición de Prometheus con los valores sumados de todos los procesos."""
+        totales = {}
+        for ruta in glob.glob(os.path.join(self.directorio, '*.db')):
+            try:
+                valores = _leer_archivo(ruta)
+            except OSError:
+                continue
+            for clave, valor in valores:
+                totales[clave] = totales.get(clave, 0.0) + valor
+
+        muestras_por_metrica = {}
+        for clave, valor in totales.items():
+            nombre_metrica, muestra, etiquetas = json.loads(clave)
+            muestras_por_metrica.setdefault(nombre_metrica, []).append((muestra, etiquetas, valor))
+
+        lineas = []
+        for nombre, metrica in sorted(self._metricas.items()):
+            lineas.append(f"# HELP {nombre} {metrica.ayuda}")
+            lineas.append(f"# TYPE {nombre} {metrica.tipo}")
+            for muestra, etiquetas, valor in sorted(muestras_por_metrica.get(nombre, []), key=_orden_muestra):
+                lineas.append(f"{muestra}{_formatear_etiquetas(etiquetas)} {_formatear_valor(valor)}")
+        return "\n".join(lineas) + "\n"
+
+
+def _orden_muestra(muestra):
+    nombre, etiquetas, _ = muestra
+    sin_le = [par for par in etiquetas if par[0] != 'le']
+    le = next((float(v) for k, v in etiquetas if k == 'le'), 0.0)
+    return sin_le, nombre, le
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _formatear_etiquetas(etiquetas):
+    if not etiquetas:
+        return ""
+    return "{" + ",".join(f'{k}="{_escapar(v)}"' for k, v in etiquetas) + "}"
+
+
+def _formatear_valor(valor):
+    if valor == float('inf'):
+        return "+Inf"
+    return repr(float(valor)) if valor != int(valor) else f"{int(valor)}"
+
+
+class _Metrica:
+    def __init__(self, registro, nombre, ayuda, etiquetas):
+        self.registro = registro
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+
+    def _pares(self, valores):
+        if set(valores) != set(self.etiquetas):
+            raise ValueError(f"La métrica {self.nombre} espera las etiquetas {self.etiquetas}.")
+        return [[k, str(valores[k])] for k in self.etiquetas]
+
+    def _clave(self, muestra, pares):
+        return json.dumps([self.nombre, muestra, pares])
+
+
+class Contador(_Metrica):
+    tipo = 'counter'
+
+    def inc(self, cantidad=1, **etiquetas):
+        self.registro._sumar(self._clave(f"{self.nombre}_total", self._pares(etiquetas)), cantidad)
+
+
+class Histograma(_Metrica):
+    tipo = 'histogram'
+
+    def __init__(self, registro, nombre, ayuda, etiquetas, buckets):
+        super().__init__(registro, nombre, ayuda, etiquetas)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observar(self, valor, **etiquetas):
+        pares = self._pares(etiquetas)
+        # Buckets acumulativos, como los espera Prometheus
+        for limite in self.buckets:
+            if valor <= limite:
+                le = "+Inf" if limite == float('inf') else repr(limite)
+                self.registro._sumar(self._clave(f"{self.nombre}_bucket", pares + [['le', le]]), 1)
+        self.registro._sumar(self._clave(f"{self.nombre}_sum", pares), valor)
+        self.registro._sumar(self._clave(f"{self.nombre}_count", pares), 1)
+
+
+def exportar_medidor(nombre, ayuda, muestras):
+    """
+    Texto de exposición de un medidor (gauge) que se calcula al exportar, por ejemplo desde la base: no pasa por
+    los archivos de los procesos porque un valor actual no se suma entre workers. muestras: [(etiquetas, valor)].
+    """
+    lineas = [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} gauge"]
+    for etiquetas, valor in muestras:
+        lineas.append(f"{nombre}{_formatear_etiquetas(sorted(etiquetas.items()))} {_formatear_valor(valor)}")
+    return "\n".join(lineas) + "\n"
+
+
+def limpiar_directorio(directorio):
+    """Borra los archivos de valores de ejecuciones anteriores (antes de arrancar el servidor)."""
+    for ruta in glob.glob(os.path.join(directorio, '*.db')):
+        os.remove(ruta)
@@ -1,51 +1,210 @@
 # casa_comida_web/models.py
+"""
+Clases de modelo compartidas por la aplicación web (app.py) y el script de consola (tu_script.py).
+
+Usan __slots__ para ocupar menos memoria por instancia (el tablero y la impresión por lote
+hidratan miles de pedidos) y se construyen directamente desde un sqlite3.Row con desde_fila().
+Las fechas se guardan tal como vienen de SQLite y se convierten a datetime recién la primera
+vez que se leen.
+"""
 
 from datetime import datetime
 
+
+def parsear_fecha_hora(valor):
+    """Convierte 'AAAA-MM-DD HH:MM:SS' (formato ISO de SQLite) a datetime. Deja pasar None y datetime."""
+    if valor is None or isinstance(valor, datetime):
+        return valor
+    return datetime.fromisoformat(valor)
+
+
+class FechaHoraPerezosa:
+    """
+    Descriptor para campos de fecha con __slots__: guarda el texto crudo en el slot '_<nombre>'
+    y lo convierte con parsear_fecha_hora en el primer acceso, reemplazándolo por el datetime.
+    """
+
+    def __set_name__(self, owner, nombre):
+        self.slot = f"_{nombre}"
+
+    def __get__(self, instancia, owner=None):
+        if instancia is None:
+            return self
+        valor = getattr(instancia, self.slot)
+        if isinstance(valor, str):
+            valor = parsear_fecha_hora(valor)
+            setattr(instancia, self.slot, valor)
+        return valor
+
+    def __set__(self, instancia, valor):
+        setattr(instancia, self.slot, valor or None)
+
+
 class Plato:
-    def __init__(self, id_plato, nombre, descripcion, precio):
-        self.id_plato = str(id_plato) # Asegurar que sea string para las claves de dict
+    __slots__ = ('id_plato', 'nombre', 'descripcion', 'precio', 'activo', 'id_empresa', 'rubro')
+
+    def __init__(self, id_plato, nombre, descripcion, precio, activo=1, id_empresa=None, rubro=None):
+        self.id_plato = id_plato
         self.nombre = nombre
         self.descripcion = descripcion
         self.precio = precio
+        self.activo = activo
+        self.id_empresa = id_empresa
+        self.rubro = rubro
+
+    @classmethod
+    def desde_fila(cls, row):
+        return cls(row['id_plato'], row['nombre'], row['descripcion'], row['precio'],
+                   row['activo'], row['id_empresa'], row['rubro'])
+
+    def __str__(self):
+        return f"{self.id_plato}. {self.nombre} - ${self.precio:,.2f}\n   Descripción: {self.descripcion}"
+
+
+class Repartidor:
+    __slots__ = ('id_repartidor', 'nombre', 'apellido', 'telefono', 'activo', 'id_empresa')
+
+    def __init__(self, id_repartidor, nombre, apellido, telefono, activo=1, id_empresa=None):
+        self.id_repartidor = id_repartidor
+        self.nombre = nombre
+        self.apellido = apellido
+        self.telefono = telefono
+        self.activo = activo
+        self.id_empresa = id_empresa
+
+    @classmethod
+    def desde_fila(cls, row):
+        return cls(row['id_repartidor'], row['nombre'], row['apellido'], row['telefono'],
+                   row['activo'], row['id_empresa'])
+
+    @property
+    def nombre_completo(self):
+        return f"{self.nombre} {self.apellido}"
 
-    def to_dict(self):
-        return {
-            "id_plato": self.id_plato,
-            "nombre": self.nombre,
-            "descripcion": self.descripcion,
-            "precio": self.precio
-        }
 
 class Pedido:
-    def __init__(self, id_pedido, cliente_nombre, cliente_apellido, direccion_entrega, es_envio, horario_entrega_str):
+    __slots__ = ('id_pedido', 'cliente_nombre', 'cliente_apellido', 'direccion_entrega', 'es_envio',
+                 '_horario_entrega', 'costo_envio', 'costo_total', 'forma_pago', 'estado_pago',
+                 '_fecha_creacion', '_fecha_pago', 'lat_cliente', 'lon_cliente', 'id_repartidor',
+                 'id_empresa', 'version_ticket', 'repartidor', 'items')
+
+    horario_entrega = FechaHoraPerezosa()
+    fecha_creacion = FechaHoraPerezosa()
+    fecha_pago = FechaHoraPerezosa()
+
+    def __init__(self, id_pedido, cliente_nombre, cliente_apellido, direccion_entrega, es_envio,
+                 horario_entrega, costo_envio=0.0, costo_total=0.0, forma_pago=None, estado_pago='Pendiente',
+                 fecha_creacion=None, lat_cliente=None, lon_cliente=None, fecha_pago=None,
+                 id_repartidor=None, id_empresa=None, version_ticket=0):
         self.id_pedido = id_pedido
         self.cliente_nombre = cliente_nombre
         self.cliente_apellido = cliente_apellido
         self.direccion_entrega = direccion_entrega
-        self.es_envio = es_envio
-        # Almacenar como string y convertir a datetime al usar si es necesario
-        self.horario_entrega_str = horario_entrega_str 
-        self.items = []  # Lista de tuplas: (Plato, cantidad)
-        self.costo_total = 0 # Se calcula al agregar items y finalizar
-
-    def agregar_item(self, plato, cantidad):
-        self.items.append({"plato": plato.to_dict(), "cantidad": cantidad}) # Almacenar como dict del plato
-        
-    def _calcular_costo_total(self, envio_costo):
-        total = sum(item["plato"]["precio"] * item["cantidad"] for item in self.items)
+        self.es_envio = bool(es_envio)
+        self.horario_entrega = horario_entrega
+        self.costo_envio = costo_envio
+        self.costo_total = costo_total
+        self.forma_pago = forma_pago
+        self.estado_pago = estado_pago
+        self.fecha_creacion = fecha_creacion
+        self.fecha_pago = fecha_pago
+        self.lat_cliente = lat_cliente
+        self.lon_cliente = lon_cliente
+        self.id_repartidor = id_repartidor
+        self.id_empresa = id_empresa
+        self.version_ticket = version_ticket # Se incrementa al pagar o cambiar el repartidor; invalida el ticket cacheado
+        self.repartidor = None
+        self.items = []
+
+    @classmethod
+    def desde_fila(cls, row):
+        """
+        Construye el Pedido desde una fila de 'pedidos'. Si la fila trae las columnas
+        repartidor_nombre/apellido/telefono (LEFT JOIN con repartidores), también arma su Repartidor.
+        """
+        pedido = cls(
+            row['id_pedido'], row['cliente_nombre'], row['cliente_apellido'], row['direccion_entrega'],
+            row['es_envio'], row['horario_entrega'], row['costo_envio'], row['costo_total'],
+            row['forma_pago'], row['estado_pago'], row['fecha_creacion'], row['lat_cliente'],
+            row['lon_cliente'], row['fecha_pago'], row['id_repartidor'], row['id_empresa'],
+            row['version_ticket']
+        )
+        if row['id_repartidor'] and 'repartidor_nombre' in row.keys():
+            pedido.repartidor = Repartidor(row['id_repartidor'], row['repartidor_nombre'],
+                                           row['repartidor_apellido'], row['repartidor_telefono'])
+        return pedido
+
+    def como_datos(self):
+        """
+        Copia como models.Pedido, sin la subclase de la app: se puede enviar a otro proceso (impresion_lote.py)
+        sin que este tenga que importar app.py. Las fechas se copian tal como estén, en texto o ya convertidas.
+        """
+        copia = Pedido.__new__(Pedido)
+        for slot in Pedido.__slots__:
+            setattr(copia, slot, getattr(self, slot))
+        return copia
+
+    def agregar_item(self, plato, cantidad, precio_unitario=None):
+        if precio_unitario is None:
+            precio_unitario = plato.precio
+        self.items.append({"plato": plato, "cantidad": cantidad, "precio_unitario": precio_unitario})
+
+    def calcular_costo_total(self):
+        """Recalcula costo_total a partir de los ítems y el costo de envío (para pedidos armados en memoria)."""
+        total = sum(item["cantidad"] * item["precio_unitario"] for item in self.items)
         if self.es_envio:
-            total += envio_costo
+            total += self.costo_envio
         self.costo_total = total
+        return total
+
+    def _lineas_ticket(self):
+        """Líneas de detalle del ticket, compartidas por la salida HTML, la ESC/POS y la de consola."""
+        lineas = []
+        for item in self.items:
+            plato_nombre = item["plato"].nombre if isinstance(item["plato"], Plato) else item["plato"]
+            lineas.append({
+                "cantidad": item["cantidad"],
+                "nombre": plato_nombre,
+                "precio_unitario": item["precio_unitario"],
+                "subtotal": item["cantidad"] * item["precio_unitario"],
+            })
+        return lineas
+
+    def __str__(self):
+        detalle = f"--- Pedido #{self.id_pedido} ---\n"
+        detalle += f"Cliente: {self.cliente_nombre} {self.cliente_apellido}\n"
+        detalle += f"Dirección de Entrega: {self.direccion_entrega}\n"
+        detalle += f"Tipo: {'Envío' if self.es_envio else 'Retiro en Sucursal'}\n"
+        if self.horario_entrega:
+            detalle += f"Horario de Entrega/Retiro: {self.horario_entrega.strftime('%H:%M')}\n"
+        detalle += "Detalle del Pedido:\n"
+        for linea in self._lineas_ticket():
+            detalle += f"  - {linea['cantidad']} x {linea['nombre']} (${linea['precio_unitario']:,.2f} c/u) = ${linea['subtotal']:,.2f}\n"
+        if self.es_envio:
+            detalle += f"Costo de Envío: ${self.costo_envio:,.2f}\n"
+        detalle += f"Costo Total: ${self.costo_total:,.2f}\n"
+        detalle += "------------------------\n"
+        return detalle
+
+
+class Empresa:
+    __slots__ = ('id_empresa', 'nombre', 'telefono', 'direccion', 'activo')
+
+    def __init__(self, id_empresa, nombre, telefono=None, direccion=None, activo=1):
+        self.id_empresa = id_empresa
+        self.nombre = nombre
+        self.telefono = telefono
+        self.direccion = direccion
+        self.activo = activo
+
+    @classmethod
+    def desde_fila(cls, row):
+        return cls(row['id_empresa'], row['nombre'], row['telefono'], row['direccion'], row['activo'])
+
+
+class Rol:
+    __slots__ = ('id_rol', 'nombre_rol')
 
-    def to_dict(self):
-        return {
-            "id_pedido": self.id_pedido,
-            "cliente_nombre": self.cliente_nombre,
-            "cliente_apellido": self.cliente_apellido,
-            "direccion_entrega": self.direccion_entrega,
-            "es_envio": self.es_envio,
-            "horario_entrega_str": self.horario_entrega_str,
-            "items": self.items,
-            "costo_total": self.costo_total
-        }
\ No newline at end of file
+    def __init__(self, id_rol, nombre_rol):
+        self.id_rol = id_rol
+        self.nombre_rol = nombre_rol
@@ -0,0 +1,105 @@
+# casa_comida_web/perfilado.py
+"""
+Perfilado de peticiones con cProfile, bajo demanda.
+
+Una petición se perfila por muestreo (una fracción configurable de las peticiones de los
+endpoints elegidos) o cuando trae la cabecera de perfilado con un token firmado que genera
+la página de diagnóstico para el super_admin. Cada perfil se guarda como un archivo .pstats
+cuyo nombre lleva la duración, el endpoint, la fecha y el pid; el directorio conserva sólo
+los últimos N archivos.
+"""
+
+import cProfile
+import glob
+import io
+import os
+import pstats
+import random
+import re
+from datetime import datetime
+
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+
+_SAL_TOKEN = 'perfilado-peticiones'
+
+# <duración en ms>ms_<endpoint>_<AAAAmmdd-HHMMSS>_<pid>.pstats
+_NOMBRE_PERFIL = re.compile(r'^(\d+)ms_(.+)_(\d{8}-\d{6})_(\d+)\.pstats$')
+
+
+def generar_token(secreto):
+    """Token firmado para la cabecera de perfilado (se valida con su antigüedad máxima)."""
+    return URLSafeTimedSerializer(secreto, salt=_SAL_TOKEN).dumps('perfilar')
+
+
+def token_valido(secreto, token, max_segundos):
+    try:
+        return URLSafeTimedSerializer(secreto, salt=_SAL_TOKEN).loads(token, max_age=max_segundos) == 'perfilar'
+    except BadSignature:
+        return False
+
+
+def debe_muestrear(tasa):
+    return tasa > 0 and random.random() < tasa
+
+
+def iniciar():
+    """Perfil activo para el hilo actual, o None si ya hay otro profiler activo."""
+    perfil = cProfile.Profile()
+    try:
+        perfil.enable()
+    except ValueError:
+        return None
+    return perfil
+
+
+def guardar(perfil, directorio, endpoint, duracion, maximo_archivos):
+    """Detiene el perfil, lo guarda en el directorio y borra los más antiguos por encima del máximo."""
+    perfil.disable()
+    os.makedirs(directorio, exist_ok=True)
+    endpoint_archivo = re.sub(r'[^\w.-]', '-', endpoint)
+    nombre = f"{round(duracion * 1000)}ms_{endpoint_archivo}_{datetime.now().strftime('%Y%m%d-%H%M%S')}_{os.getpid()}.pstats"
+    perfil.dump_stats(os.path.join(directorio, nombre))
+
+    archivos = sorted(glob.glob(os.path.join(directorio, '*.pstats')), key=os.path.getmtime)
+    for ruta in archivos[:max(len(archivos) - maximo_archivos, 0)]:
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass  # Otro worker ya lo borró
+    return nombre
+
+
+def listar(directorio):
+    """Perfiles guardados, del más lento al más rápido."""
+    perfiles = []
+    for ruta in glob.glob(os.path.join(directorio, '*.pstats')):
+        nombre = os.path.basename(ruta)
+        coincidencia = _NOMBRE_PERFIL.match(nombre)
+        if not coincidencia:
+            continue
+        duracion_ms, endpoint, fecha, pid = coincidencia.groups()
+        perfiles.append({
+            'archivo': nombre,
+            'duracion_ms': int(duracion_ms),
+            'endpoint': endpoint,
+            'fecha': datetime.strptime(fecha, '%Y%m%d-%H%M%S'),
+            'pid': int(pid),
+        })
+    perfiles.sort(key=lambda perfil: perfil['duracion_ms'], reverse=True)
+    return perfiles
+
+
+def ruta_de(directorio, archivo):
+    """Ruta de un perfil del directorio, o None si el nombre no corresponde a un perfil existente."""
+    if not _NOMBRE_PERFIL.match(archivo):
+        return None
+    ruta = os.path.join(directorio, archivo)
+    return ruta if os.path.isfile(ruta) else None
+
+
+def resumen(ruta, orden='cumulative', limite=40):
+    """Texto de pstats con las funciones más costosas del perfil."""
+    salida = io.StringIO()
+    estadisticas = pstats.Stats(ruta, stream=salida)
+    estadisticas.strip_dirs().sort_stats(orden).print_stats(limite)
+    return salida.getvalue()
@@ -0,0 +1,57 @@
+# casa_comida_web/por_proceso.py
+"""
+Recursos que no sobreviven a un fork: hilos, pools, colas atendidas por un hilo, archivos abiertos por
+proceso. Con gunicorn --preload los workers nacen de un fork del proceso maestro y heredan los objetos
+pero no los hilos; PorProceso crea el recurso la primera vez que se pide en cada proceso.
+
+El descarte tras un fork lo hace os.register_at_fork en el hijo (que además reemplaza el lock, por si
+el fork ocurrió mientras otro hilo lo tenía tomado), así pedir el recurso no cuesta más que leer un atributo.
+"""
+
+import os
+import threading
+import weakref
+
+_instancias = weakref.WeakSet()
+
+
+class PorProceso:
+    """El resultado de crear(), uno por proceso. crear() corre con el lock tomado: una sola vez aunque haya carrera."""
+
+    def __init__(self, crear):
+        self._crear = crear
+        self._valor = None
+        self._creado = False
+        self._lock = threading.Lock()
+        _instancias.add(self)
+
+    def obtener(self):
+        if not self._creado:
+            with self._lock:
+                if not self._creado:
+                    self._valor = self._crear()
+                    self._creado = True
+        return self._valor
+
+    def actual(self):
+        """El recurso de este proceso sin crearlo: None si todavía no se pidió."""
+        return self._valor if self._creado else None
+
+    def olvidar(self):
+        """Descarta el recurso: el próximo obtener() crea otro (el llamador se encarga de cerrar el anterior)."""
+        with self._lock:
+            self._valor = None
+            self._creado = False
+
+    def _tras_fork(self):
+        self._valor = None
+        self._creado = False
+        self._lock = threading.Lock()
+
+
+def _olvidar_todo_en_el_hijo():
+    for instancia in list(_instancias):
+        instancia._tras_fork()
+
+
+os.register_at_fork(after_in_child=_olvidar_todo_en_el_hijo)
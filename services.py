@@ -1,17 +1,20 @@
 # casa_comida_web/services.py
 
+import logging
 import requests
 import math
 from datetime import datetime, timedelta
 from config import GOOGLE_MAPS_API_KEY, SUCURSAL_LAT, SUCURSAL_LON, NOMBRE_CASA_COMIDA
 
+logger = logging.getLogger(__name__)
+
 def obtener_info_restaurante_google_maps(nombre_restaurante, api_key):
     """
     Busca información de un restaurante en Google Maps (Place Search y Place Details).
     Retorna un diccionario con nombre, dirección, coordenadas y horarios.
     """
     if not api_key or api_key == "YOUR_GOOGLE_MAPS_API_KEY":
-        print("Advertencia: API Key de Google Maps no configurada. No se obtendrá información real.")
+        logger.warning("API Key de Google Maps no configurada. No se obtendrá información real.")
         return {
             "nombre": nombre_restaurante,
             "direccion": "Dirección de ejemplo (API Key no configurada).",
@@ -37,10 +40,10 @@ def obtener_info_restaurante_google_maps(nombre_restaurante, api_key):
         if data_search["status"] == "OK" and data_search["candidates"]:
             place_id = data_search["candidates"][0]["place_id"]
         else:
-            print(f"No se encontró Place ID para '{nombre_restaurante}'. Status: {data_search.get('status')}")
+            logger.warning("No se encontró Place ID para '%s'. Status: %s", nombre_restaurante, data_search.get('status'))
             return None
     except requests.exceptions.RequestException as e:
-        print(f"Error al conectar con la API de Google Places (Search): {e}")
+        logger.error("Error al conectar con la API de Google Places (Search): %s", e)
         return None
 
     # 2. Place Details para obtener la información completa
@@ -68,10 +71,10 @@ def obtener_info_restaurante_google_maps(nombre_restaurante, api_key):
                 "url_mapa": result.get("url")
             }
         else:
-            print(f"No se encontraron detalles para el Place ID {place_id}. Status: {data_details.get('status')}")
+            logger.warning("No se encontraron detalles para el Place ID %s. Status: %s", place_id, data_details.get('status'))
             return None
     except requests.exceptions.RequestException as e:
-        print(f"Error al conectar con la API de Google Places (Details): {e}")
+        logger.error("Error al conectar con la API de Google Places (Details): %s", e)
         return None
 
 def obtener_coordenadas_desde_direccion(direccion, api_key):
@@ -80,7 +83,7 @@ def obtener_coordenadas_desde_direccion(direccion, api_key):
     Retorna una tupla (lat, lon) o None si falla.
     """
     if not api_key or api_key == "YOUR_GOOGLE_MAPS_API_KEY":
-        print("Advertencia: API Key de Google Maps no configurada. Usando coordenadas de ejemplo.")
+        logger.warning("API Key de Google Maps no configurada. Usando coordenadas de ejemplo.")
         # Simula un resultado para una dirección de ejemplo
         if "calle falsa 123" in direccion.lower():
             return -34.6000, -58.4000 # Un punto cercano a la sucursal de ejemplo
@@ -101,10 +104,10 @@ def obtener_coordenadas_desde_direccion(direccion, api_key):
             location = data["results"][0]["geometry"]["location"]
             return location["lat"], location["lng"]
         else:
-            print(f"No se pudieron obtener coordenadas para la dirección: '{direccion}'. Status: {data.get('status')}")
+            logger.warning("No se pudieron obtener coordenadas para la dirección: '%s'. Status: %s", direccion, data.get('status'))
             return None
     except requests.exceptions.RequestException as e:
-        print(f"Error al conectar con la API de Google Geocoding: {e}")
+        logger.error("Error al conectar con la API de Google Geocoding: %s", e)
         return None
 
 def calcular_distancia_cuadras(lat1, lon1, lat2, lon2):
@@ -137,7 +140,7 @@ def generar_franjas_horarias(inicio_str="10:00", fin_str="23:00", intervalo_minu
         inicio_hora, inicio_min = map(int, inicio_str.split(':'))
         fin_hora, fin_min = map(int, fin_str.split(':'))
     except ValueError:
-        print("Error: Formato de hora inválido para generar franjas.")
+        logger.error("Formato de hora inválido para generar franjas.")
         return []
 
     hora_actual_dt = datetime.now()
@@ -0,0 +1,134 @@
+# casa_comida_web/trazas_sql.py
+"""
+Instrumentación de SQL por petición.
+
+Cada conexión de conectar_db() tiene un trace callback (sqlite3.Connection.set_trace_callback)
+que cuenta todas las sentencias que llegan a SQLite, incluidas las implícitas (BEGIN, COMMIT) y
+las de conn.execute(); y sus cursores son CursorMedido, que miden cuánto tarda cada ejecución
+(execute más la lectura de sus filas). Mientras hay un registro activo en el hilo (entre
+iniciar_registro() y terminar_registro()), todo se acumula en él.
+"""
+
+import re
+import threading
+import time
+import sqlite3
+
+_hilo = threading.local()
+
+# 'SCAN pedidos' (o 'SCAN p' con alias) sin índice: SQLite recorre la tabla completa
+_RECORRIDO_COMPLETO = re.compile(r'^SCAN (\w+)$')
+
+
+class Ejecucion:
+    # La conexión en que corrió: el plan se pide ahí (otra base puede no tener esas tablas o esos índices)
+    __slots__ = ('sql', 'params', 'conexion', 'duracion')
+
+    def __init__(self, sql, params, conexion):
+        self.sql = sql
+        self.params = params
+        self.conexion = conexion
+        self.duracion = 0.0
+
+
+class RegistroSql:
+    """Sentencias de una petición: las vistas por el trace callback y las ejecuciones medidas."""
+
+    __slots__ = ('sentencias', 'ejecuciones')
+
+    def __init__(self):
+        self.sentencias = 0
+        self.ejecuciones = []
+
+    @property
+    def tiempo_total(self):
+        return sum(ejecucion.duracion for ejecucion in self.ejecuciones)
+
+    @property
+    def mas_lenta(self):
+        return max(self.ejecuciones, key=lambda ejecucion: ejecucion.duracion, default=None)
+
+    def repetidas(self, umbral):
+        """[(sql, veces)] de las sentencias ejecutadas al menos 'umbral' veces (patrón N+1)."""
+        conteo = {}
+        for ejecucion in self.ejecuciones:
+            conteo[ejecucion.sql] = conteo.get(ejecucion.sql, 0) + 1
+        return [(sql, veces) for sql, veces in conteo.items() if veces >= umbral]
+
+
+def iniciar_registro():
+    _hilo.registro = RegistroSql()
+
+
+def registro_actual():
+    return getattr(_hilo, 'registro', None)
+
+
+def terminar_registro():
+    """Desactiva el registro del hilo y lo retorna (None si no había uno activo)."""
+    registro = getattr(_hilo, 'registro', None)
+    _hilo.registro = None
+    return registro
+
+
+def trazar_sentencia(sql):
+    """Trace callback de las conexiones: cuenta cada sentencia que ejecuta SQLite."""
+    registro = getattr(_hilo, 'registro', None)
+    if registro is not None:
+        registro.sentencias += 1
+
+
+class CursorMedido(sqlite3.Cursor):
+    """Cursor que suma a la ejecución en curso el tiempo de execute y de cada fetch."""
+
+    _ejecucion = None
+
+    def _medir(self, ejecucion, metodo, *args):
+        inicio = time.perf_counter()
+        try:
+            return metodo(*args)
+        finally:
+            if ejecucion is not None:
+                ejecucion.duracion += time.perf_counter() - inicio
+
+    def _nueva_ejecucion(self, sql, params):
+        registro = getattr(_hilo, 'registro', None)
+        if registro is None:
+            self._ejecucion = None
+        else:
+            self._ejecucion = Ejecucion(sql, params, self.connection)
+            registro.ejecuciones.append(self._ejecucion)
+        return self._ejecucion
+
+    def execute(self, sql, params=()):
+        return self._medir(self._nueva_ejecucion(sql, params), super().execute, sql, params)
+
+    def executemany(self, sql, filas_params):
+        filas_params = list(filas_params)
+        ejecucion = self._nueva_ejecucion(sql, filas_params[0] if filas_params else ())
+        return self._medir(ejecucion, super().executemany, sql, filas_params)
+
+    def fetchone(self):
+        return self._medir(self._ejecucion, super().fetchone)
+
+    def fetchmany(self, size=None):
+        if size is None:
+            return self._medir(self._ejecucion, super().fetchmany)
+        return self._medir(self._ejecucion, super().fetchmany, size)
+
+    def fetchall(self):
+        return self._medir(self._ejecucion, super().fetchall)
+
+
+def plan_de_consulta(conn, sql, params):
+    """Líneas de EXPLAIN QUERY PLAN de la sentencia, o [] si no se puede explicar (p. ej. BEGIN)."""
+    try:
+        filas = conn.cursor(sqlite3.Cursor).execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    except sqlite3.Error:
+        return []
+    return [fila[3] for fila in filas]
+
+
+def tablas_recorridas_completas(plan):
+    """Tablas que el plan recorre completas (sin índice)."""
+    return [coincidencia.group(1) for coincidencia in map(_RECORRIDO_COMPLETO.match, plan) if coincidencia]
@@ -3,6 +3,8 @@ import json
 from datetime import datetime, timedelta
 import math
 
+from models import Plato, Pedido
+
 # --- 1. Configuración ---
 GOOGLE_MAPS_API_KEY = "YOUR_GOOGLE_MAPS_API_KEY"  # ¡REEMPLAZA CON TU PROPIA API KEY!
 ENVIO_COSTO = 10000
@@ -14,54 +16,7 @@ SUCURSAL_LAT = -34.6037  # Latitud de Buenos Aires, por ejemplo
 SUCURSAL_LON = -58.3816  # Longitud de Buenos Aires, por ejemplo
 
 # --- 2. Clases Base ---
-
-class Plato:
-    def __init__(self, id_plato, nombre, descripcion, precio):
-        self.id_plato = id_plato
-        self.nombre = nombre
-        self.descripcion = descripcion
-        self.precio = precio
-
-    def __str__(self):
-        return f"{self.id_plato}. {self.nombre} - ${self.precio:,.2f}\n   Descripción: {self.descripcion}"
-
-class Pedido:
-    def __init__(self, id_pedido, cliente_nombre, cliente_apellido, direccion_entrega, es_envio, horario_entrega):
-        self.id_pedido = id_pedido
-        self.cliente_nombre = cliente_nombre
-        self.cliente_apellido = cliente_apellido
-        self.direccion_entrega = direccion_entrega
-        self.es_envio = es_envio
-        self.horario_entrega = horario_entrega
-        self.items = []  # Lista de tuplas: (Plato, cantidad)
-        self.costo_total = 0
-
-    def agregar_item(self, plato, cantidad):
-        self.items.append({"plato": plato, "cantidad": cantidad})
-        self._calcular_costo_total()
-
-    def _calcular_costo_total(self):
-        total = sum(item["plato"].precio * item["cantidad"] for item in self.items)
-        if self.es_envio:
-            total += ENVIO_COSTO
-        self.costo_total = total
-
-    def __str__(self):
-        detalle = f"--- Pedido #{self.id_pedido} ---\n"
-        detalle += f"Cliente: {self.cliente_nombre} {self.cliente_apellido}\n"
-        detalle += f"Dirección de Entrega: {self.direccion_entrega}\n"
-        detalle += f"Tipo: {'Envío' if self.es_envio else 'Retiro en Sucursal'}\n"
-        detalle += f"Horario de Entrega/Retiro: {self.horario_entrega.strftime('%H:%M')}\n"
-        detalle += "Detalle del Pedido:\n"
-        for item in self.items:
-            plato = item["plato"]
-            cantidad = item["cantidad"]
-            detalle += f"  - {cantidad} x {plato.nombre} (${plato.precio:,.2f} c/u) = ${plato.precio * cantidad:,.2f}\n"
-        if self.es_envio:
-            detalle += f"Costo de Envío: ${ENVIO_COSTO:,.2f}\n"
-        detalle += f"Costo Total: ${self.costo_total:,.2f}\n"
-        detalle += "------------------------\n"
-        return detalle
+# Plato y Pedido son los mismos modelos que usa la aplicación web (models.py).
 
 # --- 3. Funciones de Google Maps ---
 
@@ -284,7 +239,8 @@ class SistemaCasaComida:
             print("No se pudo validar la dirección del cliente. Por seguridad, el retiro será por sucursal.")
 
         # Cargar ítems del catálogo
-        pedido_actual = Pedido(self.proximo_id_pedido, cliente_nombre, cliente_apellido, direccion_entrega, es_envio, None)
+        pedido_actual = Pedido(self.proximo_id_pedido, cliente_nombre, cliente_apellido, direccion_entrega, es_envio, None,
+                               costo_envio=ENVIO_COSTO if es_envio else 0)
         
         while True:
             self.mostrar_carta()
@@ -299,6 +255,7 @@ class SistemaCasaComida:
                         cantidad = int(input(f"Cantidad de '{plato_seleccionado.nombre}': "))
                         if cantidad > 0:
                             pedido_actual.agregar_item(plato_seleccionado, cantidad)
+                            pedido_actual.calcular_costo_total()
                             print(f"{cantidad} x '{plato_seleccionado.nombre}' agregados al pedido.")
                             break
                         else: